@@ -0,0 +1,71 @@
+# Benchmark: cost of the traffic capture inside the cycle
+#
+# Runs a cycle function that does a small amount of busy work and records
+# --records values per cycle, like ModbusTap.sample() and the OPC UA hooks do,
+# once without capture and once with reflect.capture.TrafficCapture writing
+# to a temporary directory. The cycles run back to back, so the numbers are
+# the pure execution time of one cycle.
+#
+# Reported are the execution time percentiles per cycle, the cost per record
+# and how many records the writer thread got to disk.
+#
+#   python benchmarks/bench_capture.py --cycles 100000 --records 8
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from reflect.capture import MODBUS_READ, TrafficCapture  # noqa: E402
+from reflect.instrumentation import LatencyHistogram  # noqa: E402
+
+
+def busy(iterations):
+    total = 0
+    for i in range(iterations):
+        total += i * i
+    return total
+
+
+def run(recorder, cycles, records, work):
+    names = [f"Input_Word_{i}" for i in range(records)]
+    histogram = LatencyHistogram()
+    for cycle in range(cycles):
+        start = time.perf_counter()
+        busy(work)
+        if recorder is not None:
+            for name in names:
+                recorder.record(MODBUS_READ, name, cycle)
+        histogram.record(int((time.perf_counter() - start) * 1_000_000))
+    return histogram
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cycle overhead of the traffic capture")
+    parser.add_argument("--cycles", type=int, default=100000)
+    parser.add_argument("--records", type=int, default=8, help="records per cycle")
+    parser.add_argument("--work", type=int, default=200, help="busy loop iterations per cycle")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        capture = TrafficCapture(directory, "bench")
+        results = {
+            "off": run(None, args.cycles, args.records, args.work),
+            "capture": run(capture.recorder(), args.cycles, args.records, args.work),
+        }
+        capture.close()
+
+    for variant, histogram in results.items():
+        print(
+            f"{variant:8s} mean {histogram.mean():6.1f} us, p50 {histogram.percentile(50)} us, "
+            f"p99 {histogram.percentile(99)} us, max {histogram.max} us per cycle"
+        )
+    extra = results["capture"].mean() - results["off"].mean()
+    print(f"{extra / args.records:.2f} us per record, {capture.report()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Benchmark: sequential vs. coordinated axis motion of the gripper
+#
+# Runs modbus/gripper.py in the simulation (reflect.sim, gripper plant that
+# answers the storage and multi-station handshakes) once per MOVE_TO_POS
+# motion mode (REFLECT_GRIPPER_MOTION, see reflect.motion) and follows the
+# tasks of the demo sequence in the process image:
+#
+#   task   from taking a task off the queue until it is done (homing, both
+#          moves, gripping, handshakes)
+#   move   time in MOVE_TO_POS, two per task
+#
+# Reported are completed tasks, mean and worst task and move time, tasks per
+# hour and the reduction against sequential motion, and how the axes stop:
+# corrections (axes driven again after their cut-off) and the mean and worst
+# run-out beyond the target in counts. The positions, axis
+# speeds and the handshake delays are those of the scripts and the plant
+# model, so the numbers compare the modes rather than predict the hardware.
+#
+#   python benchmarks/bench_gripper_motion.py --seconds 1800
+
+import argparse
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from reflect.sim import run_script  # noqa: E402
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "modbus", "gripper.py")
+MODES = ("sequential", "coordinated")
+
+
+# Observer of the simulated gripper: start and end of tasks and moves
+class TaskTimer:
+    def __init__(self):
+        self.task = None
+        self.task_start = None
+        self.move_start = None
+        self.tasks = []
+        self.moves = []
+        self.held = 0
+        self.corrections = 0
+        self.overshoot = (0.0, 0)
+
+    def observe(self, rpi, cycletools):
+        var = cycletools.var
+        machine = getattr(var, "machine", None)
+        if machine is None:
+            return
+        now = rpi.clock.now
+        if var.current_task != self.task:
+            if self.task is not None and self.task_start is not None:
+                self.tasks.append(now - self.task_start)
+            self.task = var.current_task
+            self.task_start = now if self.task is not None else None
+
+        moving = machine.state_name == "MOVE_TO_POS"
+        if moving and self.move_start is None:
+            self.move_start = now
+        elif not moving and self.move_start is not None:
+            self.moves.append(now - self.move_start)
+            self.move_start = None
+        self.held = var.motion.held
+        self.corrections = var.motion.corrections
+        self.overshoot = var.motion.overshoot()
+
+
+def run_mode(mode, seconds, seed):
+    os.environ["REFLECT_GRIPPER_MOTION"] = mode
+    timer = TaskTimer()
+    try:
+        run_script(SCRIPT, seconds=seconds, seed=seed, quiet=True, observers=[timer])
+    finally:
+        os.environ.pop("REFLECT_GRIPPER_MOTION", None)
+    return timer
+
+
+def describe(mode, timer, seconds, baseline=None):
+    tasks, moves = timer.tasks, timer.moves
+    if not tasks:
+        return f"{mode:11s} no task completed in {seconds:.0f} s"
+    task_mean = statistics.fmean(tasks)
+    text = (
+        f"{mode:11s} {len(tasks):4d} tasks, task mean {task_mean:6.2f} s max {max(tasks):6.2f} s, "
+        f"move mean {statistics.fmean(moves):5.2f} s max {max(moves):5.2f} s, "
+        f"{3600.0 * len(tasks) / seconds:5.0f} tasks/h"
+    )
+    if mode == "coordinated":
+        text += f", envelope held {timer.held} cycles"
+    text += (
+        f"\n{'':11s} {timer.corrections} corrections, "
+        f"overshoot mean {timer.overshoot[0]:4.1f} max {timer.overshoot[1]} counts"
+    )
+    if baseline is not None and baseline.tasks:
+        base_task = statistics.fmean(baseline.tasks)
+        base_move = statistics.fmean(baseline.moves)
+        text += (
+            f"\n{'':11s} task time -{100.0 * (1.0 - task_mean / base_task):4.1f} %, "
+            f"move time -{100.0 * (1.0 - statistics.fmean(moves) / base_move):4.1f} %"
+        )
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sequential and coordinated gripper motion")
+    parser.add_argument("--seconds", type=float, default=1800.0, help="simulated time per mode")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = {mode: run_mode(mode, args.seconds, args.seed) for mode in MODES}
+    for mode, timer in results.items():
+        baseline = results["sequential"] if mode != "sequential" else None
+        print(describe(mode, timer, args.seconds, baseline))
+
+
+if __name__ == "__main__":
+    main()
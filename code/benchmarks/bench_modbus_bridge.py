@@ -0,0 +1,105 @@
+# Benchmark: Modbus bridge exchange per register vs. one bulk request per cycle
+#
+# Starts reflect.modbus_bridge.RegisterServer in a thread and lets the three
+# Modbus stations exchange their words concurrently, each from its own thread
+# at a fixed poll rate (0 = as fast as possible):
+#
+#   per-register  - one read (function 3) or write (function 16) request per
+#                   word, like polling single registers of the gateway
+#   bulk          - BridgeClient.exchange(): one request per station and cycle
+#                   (function 23 if the station reads and writes)
+#
+# Reported are requests and exchanges per second over all stations and the
+# latency of one complete exchange of a station.
+#
+#   python benchmarks/bench_modbus_bridge.py --seconds 3 --rates 100 1000 0
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from reflect.instrumentation import LatencyHistogram  # noqa: E402
+from reflect.modbus_bridge import STATIONS, BridgeClient, RegisterServer  # noqa: E402
+
+
+def per_register(client, outputs):
+    writes, reads = client.map.writes, client.map.reads
+    for offset, value in enumerate(outputs):
+        client.write_registers(writes.start + offset, [value])
+    return [client.read_registers(reads.start + offset, 1)[0] for offset in range(len(reads))]
+
+
+def run_station(client, variant, rate, seconds, histogram, lock):
+    period = 1.0 / rate if rate else 0.0
+    outputs = [0] * len(client.map.writes)
+    start = time.perf_counter()
+    next_start = start
+    cycle = 0
+    samples = []
+    while time.perf_counter() - start < seconds:
+        outputs = [(cycle + i) & 0xFFFF for i in range(len(outputs))]
+        t0 = time.perf_counter()
+        if variant == "bulk":
+            client.exchange(outputs)
+        else:
+            per_register(client, outputs)
+        samples.append(int((time.perf_counter() - t0) * 1_000_000))
+        cycle += 1
+        if period:
+            next_start += period
+            delay = next_start - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    with lock:
+        for sample in samples:
+            histogram.record(sample)
+
+
+def run_variant(port, variant, rate, seconds):
+    clients = [BridgeClient(station, port=port) for station in STATIONS]
+    histogram = LatencyHistogram()
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=run_station, args=(client, variant, rate, seconds, histogram, lock))
+        for client in clients
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    requests = sum(client.requests for client in clients)
+    for client in clients:
+        client.close()
+    return requests / seconds, histogram.total / seconds, histogram
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-register and bulk Modbus bridge exchange")
+    parser.add_argument("--seconds", type=float, default=3.0, help="duration of every run")
+    parser.add_argument("--rates", type=int, nargs="+", default=[100, 200, 1000, 0],
+                        help="exchanges per second and station, 0 = unlimited")
+    parser.add_argument("--port", type=int, default=5021)
+    args = parser.parse_args()
+
+    server = RegisterServer(port=args.port)
+    server.start()
+    try:
+        for rate in args.rates:
+            print(f"{rate or 'unlimited'} Hz per station:")
+            for variant in ("per-register", "bulk"):
+                requests, exchanges, histogram = run_variant(args.port, variant, rate, args.seconds)
+                print(
+                    f"  {variant:12s} {requests:8.0f} requests/s, {exchanges:8.0f} exchanges/s, latency "
+                    f"p50 {histogram.percentile(50)} us, p99 {histogram.percentile(99)} us, max {histogram.max} us"
+                )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# Benchmark: cycle jitter of the threaded multi.py model vs. the cooperative scheduler
+#
+# Both variants run a real-time 10 ms loop for a fixed number of cycles with
+# three tasks doing a small amount of busy work, like the station state
+# machines of multi.py:
+#
+#   threads    - the old model: three threads wait on one Event, the cycle
+#                function sets it and every woken task clears it again
+#   scheduler  - reflect.scheduler.CycleScheduler calls the tasks in order
+#                inside the cycle function
+#
+# For every task the interval between two runs is recorded. Reported are the
+# mean interval, the jitter (standard deviation and worst deviation from the
+# cycle time) and the number of cycles in which the task did not run.
+#
+#   python benchmarks/bench_multi_scheduler.py --cycles 1000 --work 200
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from reflect.scheduler import CycleScheduler
+
+TASKS = ("task1", "task2", "task3")
+
+
+def busy(iterations):
+    total = 0
+    for i in range(iterations):
+        total += i * i
+    return total
+
+
+# Sleep until the next cycle start, like rpi.cycleloop does
+def cycle_loop(cycletime, cycles, func):
+    period = cycletime / 1000.0
+    next_start = time.perf_counter()
+    for _ in range(cycles):
+        func()
+        next_start += period
+        delay = next_start - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # overrun, continue from now like the cycle loop does
+            next_start = time.perf_counter()
+
+
+def run_threads(cycletime, cycles, work):
+    runs = {name: [] for name in TASKS}
+    cycle_event = threading.Event()
+    stop = threading.Event()
+
+    def task(name):
+        while not stop.is_set():
+            if cycle_event.wait(0.1):
+                cycle_event.clear()
+                runs[name].append(time.perf_counter())
+                busy(work)
+
+    threads = [threading.Thread(target=task, args=(name,), daemon=True) for name in TASKS]
+    for thread in threads:
+        thread.start()
+
+    cycle_loop(cycletime, cycles, cycle_event.set)
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return runs
+
+
+def run_scheduler(cycletime, cycles, work):
+    runs = {name: [] for name in TASKS}
+    scheduler = CycleScheduler(cycletime)
+
+    def make_task(name):
+        def task():
+            runs[name].append(time.perf_counter())
+            busy(work)
+        return task
+
+    for name in TASKS:
+        scheduler.add(name, make_task(name))
+
+    cycle_loop(cycletime, cycles, scheduler.run_cycle)
+    return runs
+
+
+def summarize(label, runs, cycletime, cycles):
+    period = cycletime / 1000.0
+    print(f"{label}:")
+    for name in TASKS:
+        stamps = runs[name]
+        intervals = [b - a for a, b in zip(stamps, stamps[1:])]
+        if len(intervals) < 2:
+            print(f"  {name}: {len(stamps)} runs, not enough samples")
+            continue
+        mean = statistics.mean(intervals)
+        stdev = statistics.stdev(intervals)
+        worst = max(abs(i - period) for i in intervals)
+        print(
+            f"  {name}: {len(stamps)}/{cycles} runs, {cycles - len(stamps)} missed, "
+            f"interval mean {mean * 1000.0:.3f} ms, jitter sd {stdev * 1000.0:.3f} ms, "
+            f"worst {worst * 1000.0:.3f} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cycle jitter of threaded and scheduled multi.py tasks")
+    parser.add_argument("--cycletime", type=int, default=10, help="cycle time in ms")
+    parser.add_argument("--cycles", type=int, default=500, help="cycles per variant")
+    parser.add_argument("--work", type=int, default=200, help="busy loop iterations per task and cycle")
+    args = parser.parse_args()
+
+    print(f"{args.cycles} cycles of {args.cycletime} ms, {args.work} iterations of work per task")
+    summarize("threads", run_threads(args.cycletime, args.cycles, args.work), args.cycletime, args.cycles)
+    summarize("scheduler", run_scheduler(args.cycletime, args.cycles, args.work), args.cycletime, args.cycles)
+
+
+if __name__ == "__main__":
+    main()
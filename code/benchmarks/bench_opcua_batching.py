@@ -0,0 +1,110 @@
+# Benchmark: per-node OPC UA calls vs. one batched call per direction
+#
+# Starts a local asyncua server with the nodes of the gripper ("Control"
+# object) and runs one exchange iteration of each station client in a loop:
+#
+#   per-node  - one get_value()/set_value() request per node, as the stations
+#               did before
+#   batched   - reflect.opcua_exchange.NodeGroup: one Read and one Write
+#               request, unchanged values skipped
+#
+# Reported are requests and mean latency per iteration. A changing value is
+# written every --change-every iterations, the rest stays constant.
+#
+#   python benchmarks/bench_opcua_batching.py --iterations 500
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from asyncua import Client, Server  # noqa: E402
+
+from reflect.opcua_exchange import NodeGroup  # noqa: E402
+
+ENDPOINT = "opc.tcp://127.0.0.1:48401"
+
+# reads, writes of the station clients (attribute names of their shared data)
+STATIONS = {
+    "high_bay_warehouse": (("PositionAtStorage", "PalletClear"), ("StorageStatus",)),
+    "sorting_line": ((), ("White", "Red", "Blue")),
+    "multi": ((), ("MultiStatus",)),
+}
+
+
+async def start_server():
+    server = Server()
+    await server.init()
+    server.set_endpoint(ENDPOINT)
+    idx = await server.register_namespace("http://revpi")
+    obj = await server.nodes.objects.add_object(idx, "Control")
+    nodeids = {}
+    for name in ("StorageStatus", "MultiStatus", "PositionAtStorage", "PalletClear", "White", "Red", "Blue"):
+        node = await obj.add_variable(idx, name, 0)
+        await node.set_writable()
+        nodeids[name] = node.nodeid
+    return server, nodeids
+
+
+async def per_node(data, read_nodes, write_nodes):
+    requests = 0
+    for name, node in read_nodes.items():
+        setattr(data, name, await node.get_value())
+        requests += 1
+    for name, node in write_nodes.items():
+        await node.set_value(getattr(data, name))
+        requests += 1
+    return requests
+
+
+async def run_station(client, nodeids, reads, writes, iterations, change_every):
+    read_nodes = {name: client.get_node(nodeids[name]) for name in reads}
+    write_nodes = {name: client.get_node(nodeids[name]) for name in writes}
+    data = types.SimpleNamespace(**{name: 0 for name in reads + writes})
+    read_group = NodeGroup(data, read_nodes)
+    write_group = NodeGroup(data, write_nodes)
+
+    results = {}
+    for variant in ("per-node", "batched"):
+        requests = 0
+        start = time.perf_counter()
+        for i in range(iterations):
+            if writes and i % change_every == 0:
+                setattr(data, writes[0], i)
+            if variant == "per-node":
+                requests += await per_node(data, read_nodes, write_nodes)
+            else:
+                calls = read_group.calls + write_group.calls
+                await read_group.read()
+                await write_group.write()
+                requests += read_group.calls + write_group.calls - calls
+        elapsed = time.perf_counter() - start
+        results[variant] = (requests / iterations, elapsed / iterations)
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare per-node and batched OPC UA exchange")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--change-every", type=int, default=10, help="iterations between value changes")
+    args = parser.parse_args()
+    logging.getLogger("asyncua").setLevel(logging.ERROR)
+
+    server, nodeids = await start_server()
+    async with server:
+        client = Client(ENDPOINT)
+        async with client:
+            for station, (reads, writes) in STATIONS.items():
+                results = await run_station(client, nodeids, reads, writes, args.iterations, args.change_every)
+                print(f"{station}:")
+                for variant, (requests, latency) in results.items():
+                    print(f"  {variant:9s} {requests:5.2f} requests, {latency * 1000.0:6.3f} ms per iteration")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,310 @@
+# Benchmark: the gripper's OPC UA server as hub for many station clients
+#
+# Starts a hub like opcua/gripper.py in a separate process: the address space
+# of reflect/wiring.json, a NodeExchange in subscription mode taking over the
+# values clients write (PostWrite callback) and a cycle that answers the
+# storage status with the position every 10 ms. Then connects simulated
+# clients with the access pattern of the stations, assigned round robin:
+#
+#   high_bay_warehouse  one Read of two nodes, one Write of one node
+#   multi               one Write of one node
+#   sorting_line        one Write of three nodes
+#
+# Each client exchanges like NodeExchange in polling mode (NodeGroup, a new
+# value every time so every Write is sent) once per update interval, the
+# stations' hard-coded 50 ms and below (0 = back to back). For every number of
+# clients and interval it reports:
+#
+#   updates/s   exchanges completed per second over all clients, and in
+#               percent of the target rate
+#   latency     p50/p99/max of one exchange (request to last response)
+#   late        exchanges that ended after the start of the next period
+#   server cpu  CPU time of the hub process per wall second
+#
+# A run is saturated if the clients reach less than 95 % of the target rate
+# or the p99 latency exceeds the interval. The saturation point of an
+# interval is the smallest number of clients that saturates it.
+#
+#   python benchmarks/bench_opcua_hub.py
+#   python benchmarks/bench_opcua_hub.py --clients 1 3 6 12 24 --intervals 50 20 10 5 0 --seconds 5 --out hub.json
+#   python benchmarks/bench_opcua_hub.py --url opc.tcp://192.168.210.102:4840 --clients 3 --intervals 50 10
+#
+# --out writes the runs and the saturation points as JSON, with the host,
+# Python and asyncua version, for comparing results over time. The clients
+# run in this process and compete with a local hub for the CPU; --url measures
+# against a hub running elsewhere (no server CPU then).
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import asyncua  # noqa: E402
+from asyncua import Client, Server  # noqa: E402
+
+from reflect.instrumentation import LatencyHistogram  # noqa: E402
+from reflect.opcua_exchange import NodeExchange, NodeGroup  # noqa: E402
+from reflect.wiring import WIRING  # noqa: E402
+
+ENDPOINT = "opc.tcp://127.0.0.1:48403"
+
+PROFILES = ("high_bay_warehouse", "multi", "sorting_line")
+
+# fraction of the target rate below which a run counts as saturated
+SATURATED = 0.95
+
+
+# --- hub ---
+
+async def serve(url):
+    server = Server()
+    await server.init()
+    server.set_endpoint(url)
+    data = types.SimpleNamespace(is_running=True)
+    reads, writes = await WIRING.server_nodes(server, station="gripper")
+    for name in list(reads) + list(writes):
+        setattr(data, name, 0)
+    exchange = NodeExchange(data, reads=reads, writes=writes, mode="subscription", convert=int)
+    await exchange.start_server(server)
+
+    async def cycle():
+        while data.is_running:
+            data.position_at_storage = data.storage_status
+            await asyncio.sleep(0.01)
+
+    async with server:
+        tasks = [asyncio.create_task(exchange.run()), asyncio.create_task(cycle())]
+        print("ready", flush=True)
+        # "cpu" on stdin answers with the CPU time of this process, end of input stops
+        loop = asyncio.get_running_loop()
+        while True:
+            line = await loop.run_in_executor(None, sys.stdin.readline)
+            if not line:
+                break
+            print(f"{time.process_time()} {exchange.received}", flush=True)
+        data.is_running = False
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class Hub:
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+        if self.process.stdout.readline().strip() != "ready":
+            self.process.kill()
+            raise RuntimeError("hub did not start")
+
+    # CPU seconds of the hub process and values received from clients so far
+    def sample(self):
+        self.process.stdin.write("cpu\n")
+        self.process.stdin.flush()
+        cpu, received = self.process.stdout.readline().split()
+        return float(cpu), int(received)
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+# --- clients ---
+
+class StationClient:
+    def __init__(self, client, profile, data, read_group, write_group):
+        self.client = client
+        self.profile = profile
+        self.data = data
+        self.read_group = read_group
+        self.write_group = write_group
+        self.changing = write_group.attrs[0]
+        self.value = 0
+
+    @classmethod
+    async def connect(cls, url, profile):
+        client = Client(url)
+        await client.connect()
+        reads, writes = await WIRING.client_nodes(client, profile)
+        data = types.SimpleNamespace(**{name: 0 for name in list(reads) + list(writes)})
+        return cls(client, profile, data, NodeGroup(data, reads), NodeGroup(data, writes))
+
+    async def exchange(self):
+        self.value += 1
+        setattr(self.data, self.changing, self.value)
+        await self.read_group.read()
+        await self.write_group.write()
+
+    # Exchange once per interval until the deadline, returns the late exchanges
+    async def run(self, interval, deadline, histogram):
+        loop = asyncio.get_running_loop()
+        period = interval / 1000.0
+        next_start = loop.time()
+        late = 0
+        while next_start < deadline:
+            start = time.perf_counter()
+            await self.exchange()
+            histogram.record(int((time.perf_counter() - start) * 1e6))
+            next_start += period
+            now = loop.time()
+            if now > next_start:
+                if period:
+                    late += 1
+                next_start = now
+            else:
+                await asyncio.sleep(next_start - now)
+        return late
+
+
+async def run_point(clients, interval, seconds, hub):
+    histogram = LatencyHistogram()
+    for client in clients:
+        await client.exchange()
+    server_start = hub.sample() if hub is not None else None
+    cpu = time.process_time()
+    start = time.perf_counter()
+    deadline = asyncio.get_running_loop().time() + seconds
+    late = await asyncio.gather(*[client.run(interval, deadline, histogram) for client in clients])
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    updates = histogram.total / wall
+    target = len(clients) * 1000.0 / interval if interval else None
+    result = {
+        "clients": len(clients),
+        "profiles": {profile: sum(client.profile == profile for client in clients) for profile in PROFILES},
+        "interval_ms": interval,
+        "seconds": wall,
+        "updates": histogram.total,
+        "updates_per_second": updates,
+        "target_per_second": target,
+        "achieved": updates / target if target else None,
+        "late": sum(late),
+        "latency_us": {
+            "p50": histogram.percentile(50),
+            "p99": histogram.percentile(99),
+            "max": histogram.max,
+            "mean": histogram.sum / histogram.total if histogram.total else 0.0,
+        },
+        "client_cpu": cpu / wall,
+        "server_cpu": None,
+        "server_values": None,
+    }
+    if server_start is not None:
+        server_cpu, received = hub.sample()
+        result["server_cpu"] = (server_cpu - server_start[0]) / wall
+        result["server_values"] = received - server_start[1]
+    result["saturated"] = saturated(result)
+    return result
+
+
+def saturated(result):
+    if not result["interval_ms"]:
+        return False
+    return result["achieved"] < SATURATED or result["latency_us"]["p99"] > result["interval_ms"] * 1000
+
+
+# Smallest number of clients that saturates each interval, None if none did;
+# for back-to-back exchange the number of clients with the most updates/s
+def saturation_points(results):
+    points = {}
+    for interval in sorted({result["interval_ms"] for result in results}, reverse=True):
+        runs = sorted((r for r in results if r["interval_ms"] == interval), key=lambda r: r["clients"])
+        if interval:
+            first = next((r for r in runs if r["saturated"]), None)
+            points[f"{interval:g}"] = {
+                "saturated_at_clients": first["clients"] if first else None,
+                "max_sustained_clients": max((r["clients"] for r in runs if not r["saturated"]), default=None),
+            }
+        else:
+            best = max(runs, key=lambda r: r["updates_per_second"])
+            points[f"{interval:g}"] = {
+                "max_updates_per_second": best["updates_per_second"],
+                "at_clients": best["clients"],
+            }
+    return points
+
+
+def describe(result):
+    latency = result["latency_us"]
+    rate = f"{result['updates_per_second']:8.0f}/s"
+    if result["achieved"] is not None:
+        rate += f" ({100.0 * result['achieved']:3.0f} %)"
+    else:
+        rate += "       "
+    text = (
+        f"{result['clients']:4d} clients {result['interval_ms']:4g} ms: {rate}, "
+        f"latency p50 {latency['p50'] / 1000.0:6.2f} p99 {latency['p99'] / 1000.0:6.2f} "
+        f"max {latency['max'] / 1000.0:6.2f} ms, late {result['late']:5d}, client cpu {100.0 * result['client_cpu']:3.0f} %"
+    )
+    if result["server_cpu"] is not None:
+        text += f", server cpu {100.0 * result['server_cpu']:3.0f} %"
+    if result["saturated"]:
+        text += "  saturated"
+    return text
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Throughput and latency of the OPC UA hub under many clients")
+    parser.add_argument("--url", help="running hub to measure against, default: local hub process")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 3, 6, 12, 24], help="numbers of clients")
+    parser.add_argument("--intervals", type=float, nargs="+", default=[50, 20, 10, 5, 2, 0],
+                        help="update intervals in ms, 0 = back to back")
+    parser.add_argument("--seconds", type=float, default=3.0, help="duration of every run")
+    parser.add_argument("--out", help="JSON file for the results")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.getLogger("asyncua").setLevel(logging.ERROR)
+
+    if args.serve:
+        await serve(ENDPOINT)
+        return
+
+    hub = None if args.url else Hub()
+    url = args.url or ENDPOINT
+    clients = []
+    results = []
+    try:
+        for count in sorted(args.clients):
+            while len(clients) < count:
+                clients.append(await StationClient.connect(url, PROFILES[len(clients) % len(PROFILES)]))
+            for interval in args.intervals:
+                result = await run_point(clients[:count], interval, args.seconds, hub)
+                results.append(result)
+                print(describe(result), flush=True)
+    finally:
+        for client in clients:
+            await client.client.disconnect()
+        if hub is not None:
+            hub.close()
+
+    points = saturation_points(results)
+    for interval, point in points.items():
+        print(f"{interval} ms: {point}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "benchmark": "opcua_hub",
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "host": {
+                    "platform": platform.platform(),
+                    "cpus": os.cpu_count(),
+                    "python": platform.python_version(),
+                    "asyncua": asyncua.__version__ if hasattr(asyncua, "__version__") else None,
+                },
+                "url": url,
+                "seconds": args.seconds,
+                "saturation": points,
+                "runs": results,
+            }, f, indent=1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
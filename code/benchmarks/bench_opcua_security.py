@@ -0,0 +1,164 @@
+# Benchmark: cost of the OPC UA security modes
+#
+# Runs the exchange of the high-bay warehouse client (reflect.opcua_exchange.
+# NodeGroup: one Read of two nodes, one Write of a changing value) against the
+# gripper nodes once per security mode and reports per mode:
+#
+#   connect   - first connect of a ClientSession (keys loaded, GetEndpoints,
+#               secure channel, session) and reconnects with the same session
+#               object (keys reused)
+#   exchange  - latency per Read+Write (p50/p99/max) and client CPU time per
+#               exchange (time.process_time, so only this process counts)
+#   renew     - latency of a secure channel renewal (OpenSecureChannel with
+#               renew, asymmetric crypto for the secure modes)
+#
+# Without --url a local server offering all modes is started in a separate
+# process, so its crypto work is not counted as client CPU. With --url the
+# clients go to a running gripper server, which has to offer the modes
+# (REFLECT_OPCUA_SECURITY on the gripper). Run it on the RevPi for numbers of
+# RevPi-class hardware.
+#
+#   python benchmarks/bench_opcua_security.py --iterations 2000
+#   python benchmarks/bench_opcua_security.py --url opc.tcp://192.168.210.102:4840 --modes none,Aes128:SignAndEncrypt
+
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from asyncua import Server  # noqa: E402
+
+from reflect.instrumentation import LatencyHistogram  # noqa: E402
+from reflect.opcua_exchange import NodeGroup  # noqa: E402
+from reflect.opcua_security import ClientSession, configure_server  # noqa: E402
+from reflect.wiring import WIRING  # noqa: E402
+
+ENDPOINT = "opc.tcp://127.0.0.1:48402"
+
+MODES = (
+    "none",
+    "Basic256Sha256:Sign",
+    "Basic256Sha256:SignAndEncrypt",
+    "Aes128:Sign",
+    "Aes128:SignAndEncrypt",
+    "Aes256:Sign",
+    "Aes256:SignAndEncrypt",
+)
+
+async def serve(url, modes, certificates):
+    server = Server()
+    await server.init()
+    server.set_endpoint(url)
+    await configure_server(server, modes, name="gripper", certificates=certificates)
+    # address space of the gripper (reflect/wiring.json)
+    await WIRING.server_nodes(server)
+    async with server:
+        print("ready", flush=True)
+        # until the benchmark closes stdin
+        await asyncio.get_running_loop().run_in_executor(None, sys.stdin.read)
+
+
+def start_server(modes, certificates):
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", "--modes", modes, "--certificates", certificates],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    if process.stdout.readline().strip() != "ready":
+        process.kill()
+        raise RuntimeError("benchmark server did not start")
+    return process
+
+
+def milliseconds(histogram):
+    return (
+        f"p50 {histogram.percentile(50) / 1000.0:7.3f}  p99 {histogram.percentile(99) / 1000.0:7.3f}  "
+        f"max {histogram.max / 1000.0:7.3f} ms"
+    )
+
+
+async def run_mode(url, mode, certificates, args):
+    session = ClientSession(url, mode, name="high_bay_warehouse", certificates=certificates)
+
+    start = time.perf_counter()
+    client = await session.connect()
+    first = time.perf_counter() - start
+    reconnect = LatencyHistogram()
+    for _ in range(args.connects):
+        await session.disconnect()
+        start = time.perf_counter()
+        client = await session.connect()
+        reconnect.record(int((time.perf_counter() - start) * 1e6))
+
+    # the nodes of the high-bay warehouse
+    reads, writes = await WIRING.client_nodes(client, "high_bay_warehouse")
+    data = types.SimpleNamespace(**{name: 0 for name in list(reads) + list(writes)})
+    read_group = NodeGroup(data, reads)
+    write_group = NodeGroup(data, writes)
+    for i in range(args.warmup):
+        data.robot_ready_for_pickup = i
+        await read_group.read()
+        await write_group.write()
+
+    exchange = LatencyHistogram()
+    cpu = time.process_time()
+    for i in range(args.iterations):
+        # a new value every time, so every Write is sent
+        data.robot_ready_for_pickup = i % 2
+        start = time.perf_counter()
+        await read_group.read()
+        await write_group.write()
+        exchange.record(int((time.perf_counter() - start) * 1e6))
+    cpu = (time.process_time() - cpu) / args.iterations
+
+    renew = LatencyHistogram()
+    for _ in range(args.renewals):
+        start = time.perf_counter()
+        await client.open_secure_channel(renew=True)
+        renew.record(int((time.perf_counter() - start) * 1e6))
+
+    await session.disconnect()
+    return first, reconnect, exchange, cpu, renew
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Latency and CPU cost of the OPC UA security modes")
+    parser.add_argument("--url", help="running server to measure against, default: local server process")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma separated security modes")
+    parser.add_argument("--iterations", type=int, default=1000, help="exchanges per mode")
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--connects", type=int, default=5, help="reconnects per mode")
+    parser.add_argument("--renewals", type=int, default=20, help="secure channel renewals per mode")
+    parser.add_argument("--certificates", help="certificate directory, default: a temporary one")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.getLogger("asyncua").setLevel(logging.ERROR)
+
+    if args.serve:
+        await serve(ENDPOINT, args.modes, args.certificates)
+        return
+
+    with tempfile.TemporaryDirectory() as temporary:
+        certificates = args.certificates or temporary
+        server = None if args.url else start_server(args.modes, certificates)
+        try:
+            for mode in args.modes.split(","):
+                first, reconnect, exchange, cpu, renew = await run_mode(args.url or ENDPOINT, mode, certificates, args)
+                print(f"{mode}:")
+                print(f"  connect   first {first * 1000.0:7.3f} ms, reconnect {milliseconds(reconnect)}")
+                print(f"  exchange  {milliseconds(exchange)}, cpu {cpu * 1e6:6.1f} us per exchange")
+                print(f"  renew     {milliseconds(renew)}")
+        finally:
+            if server is not None:
+                server.stdin.close()
+                server.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+# Benchmark: fixed waits vs. settle detection (reflect.settle)
+#
+# Runs the complete Modbus line in the simulation (modbus/gripper.py,
+# high_bay_warehouse.py and multi.py talking through a reflect.modbus_bridge
+# register server) with the demo sequence, once per settle mode
+# (REFLECT_SETTLE):
+#
+#   fixed    the waits of 0.5 and 1 s after homing, around the counter resets,
+#            after extending and retracting and before gripping, as before
+#   sensor   each wait ends once the counters and switches of the station have
+#            not changed for 10 cycles, at the latest after the fixed wait
+#
+# The gripper moves in coordinated motion unless --motion sequential is given.
+#
+# Reported per run are the completed tasks, tasks per hour and mean time from
+# arrival to done of the gripper, and per station the time the settle waits
+# saved per task and how many waits ended by the timeout (never at rest
+# within the fixed wait). --coast-time sets the run-out time constant of the
+# axes in the plant models: the longer, the later the counters stand still.
+#
+#   python benchmarks/bench_settle.py --seconds 3600
+#   python benchmarks/bench_settle.py --coast-time 0.1 --out settle.json
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from reflect.farm import CODE_DIR, LINES  # noqa: E402
+from reflect.modbus_bridge import BridgeClient, ProcessImageLink, RegisterServer  # noqa: E402
+from reflect.sim.runner import LineStation, plant_for_script, run_line  # noqa: E402
+
+MODES = ("fixed", "sensor")  # reflect.settle, the baseline first
+STATIONS = ("gripper", "high_bay_warehouse")  # plants with encoder axes
+
+
+def run_line_with(mode, seconds, seed, port, coast_time, motion="coordinated"):
+    os.environ["REFLECT_SETTLE"] = mode
+    os.environ["REFLECT_GRIPPER_MOTION"] = motion
+    for name in ("REFLECT_CAPTURE", "REFLECT_RECORD", "REFLECT_GRIPPER_WORKLOAD", "REFLECT_GRIPPER_SOURCE"):
+        os.environ.pop(name, None)
+    server = RegisterServer("127.0.0.1", port)
+    server.start()
+    stations = []
+    for number, script in enumerate(LINES["modbus"]):
+        script = os.path.join(CODE_DIR, script)
+        station = os.path.splitext(os.path.basename(script))[0]
+        options = {"coast_time": coast_time} if station in STATIONS and coast_time is not None else {}
+        plant = plant_for_script(script, seed=seed * 100 + number, **options)
+        plant.handshake = False
+        stations.append(LineStation(script, plant, links=[ProcessImageLink(BridgeClient(station, "127.0.0.1", port))]))
+    start = time.perf_counter()
+    try:
+        runs = run_line(stations, seconds)
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.environ.pop("REFLECT_SETTLE", None)
+        os.environ.pop("REFLECT_GRIPPER_MOTION", None)
+    errors = [f"{type(run.error).__name__}: {run.error}" for run in runs if run.error is not None]
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    tasks = runs[0].namespace["task_queue"]
+    result = {
+        "mode": mode,
+        "seconds": seconds,
+        "wall_seconds": time.perf_counter() - start,
+        "completed": tasks.completed,
+        "tasks_per_hour": 3600.0 * tasks.completed / seconds,
+        "mean_time_to_done": tasks.latency / tasks.completed if tasks.completed else 0.0,
+        "stations": {},
+    }
+    for run in runs:
+        settle = run.namespace.get("settle")
+        if settle is None:
+            continue
+        result["stations"][settle.name] = {
+            "tasks": settle.tasks,
+            "saved": settle.saved(),
+            "saved_per_task": settle.saved() / settle.tasks if settle.tasks else 0.0,
+            "waits": sum(stats[0] for stats in settle.stats.values()),
+            "timeouts": sum(stats[3] for stats in settle.stats.values()),
+            "sites": {site: dict(zip(("waits", "cycles", "timeout_cycles", "timeouts"), stats))
+                      for site, stats in settle.stats.items()},
+        }
+    return result
+
+
+def describe(result, baseline=None):
+    text = (
+        f"{result['mode']:6s} {result['completed']:4d} tasks, {result['tasks_per_hour']:5.1f} tasks/h, "
+        f"to done {result['mean_time_to_done']:6.1f} s"
+    )
+    if baseline is not None and baseline["tasks_per_hour"] and baseline["mean_time_to_done"]:
+        text += (
+            f" (tasks/h {100.0 * (result['tasks_per_hour'] / baseline['tasks_per_hour'] - 1.0):+5.1f} %, "
+            f"time to done {100.0 * (result['mean_time_to_done'] / baseline['mean_time_to_done'] - 1.0):+5.1f} %)"
+        )
+    for name, station in result["stations"].items():
+        text += (
+            f"\n  {name:18s} {station['waits']:5d} waits, {station['saved_per_task']:5.2f} s saved per task "
+            f"({station['tasks']} tasks), {station['timeouts']} ended by the timeout"
+        )
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fixed waits and settle detection on the simulated Modbus line")
+    parser.add_argument("--seconds", type=float, default=1800.0, help="simulated time per run")
+    parser.add_argument("--coast-time", type=float, help="run-out time constant of the axes in s (plant default 0.01)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--motion", default="coordinated", choices=["sequential", "coordinated"],
+                        help="gripper motion mode (REFLECT_GRIPPER_MOTION)")
+    parser.add_argument("--port", type=int, default=21700, help="register server port")
+    parser.add_argument("--out", help="JSON file for the results")
+    args = parser.parse_args()
+
+    results = []
+    for number, mode in enumerate(MODES):
+        result = run_line_with(mode, args.seconds, args.seed, args.port + number, args.coast_time, args.motion)
+        results.append(result)
+        print(describe(result, results[0] if number else None), flush=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "benchmark": "settle",
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "seconds": args.seconds,
+                "seed": args.seed,
+                "coast_time": args.coast_time,
+                "motion": args.motion,
+                "results": results,
+            }, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# Benchmark: order of the gripper's tasks, fifo vs. travel (reflect.taskqueue)
+#
+# Runs the complete Modbus line in the simulation (modbus/gripper.py,
+# high_bay_warehouse.py and multi.py talking through a reflect.modbus_bridge
+# register server, like a factory of reflect.farm), so the gripper waits for
+# the real storage and multi-station scripts. Every workload runs once per
+# task policy (REFLECT_GRIPPER_TASKS):
+#
+#   demo        the demo sequence of the script (ZYKLUS), three tasks added
+#               whenever the queue is empty
+#   synthetic   tasks arriving at random (--rate per hour), storage to
+#               multi-station and colour pick-up to storage, slots kept
+#               consistent; a share of them (--urgent) with priority 1 and
+#               a deadline
+#   recorded    --workload FILE: arrivals recorded with REFLECT_RECORD
+#               (<dir>/gripper-tasks.json) or written by hand, same format
+#
+# The gripper moves in coordinated motion unless --motion sequential is given.
+#
+# Reported per run are the completed tasks and tasks per hour, the mean wait
+# in the queue and time from arrival to done, missed deadlines and how many
+# tasks the policy took out of order.
+#
+#   python benchmarks/bench_task_queue.py --seconds 3600
+#   python benchmarks/bench_task_queue.py --workloads synthetic --rate 60 --deadline 300 --out tasks.json
+#   python benchmarks/bench_task_queue.py --workload /data/run/gripper-tasks.json --workloads recorded
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from reflect.farm import CODE_DIR, LINES  # noqa: E402
+from reflect.modbus_bridge import BridgeClient, ProcessImageLink, RegisterServer  # noqa: E402
+from reflect.sim.runner import LineStation, plant_for_script, run_line  # noqa: E402
+from reflect.taskqueue import POLICIES  # noqa: E402
+
+COLOURS = ("white_pick_up", "red_pick_up", "blue_pick_up")
+SLOTS = range(1, 10)
+
+
+# Random arrivals: a filled slot is emptied to the multi-station or an empty
+# one filled from a colour pick-up, the storage starts full
+def synthetic_workload(seconds, rate, urgent, deadline, seed):
+    rng = random.Random(seed)
+    filled = set(SLOTS)
+    entries = []
+    at = 0.0
+    while True:
+        at += rng.expovariate(rate / 3600.0)
+        if at >= seconds:
+            return entries
+        if filled and (len(filled) == len(SLOTS) or rng.random() < 0.5):
+            slot = rng.choice(sorted(filled))
+            filled.remove(slot)
+            task = ["storage", "multi_drop_off", slot]
+        else:
+            slot = rng.choice(sorted(set(SLOTS) - filled))
+            filled.add(slot)
+            task = [rng.choice(COLOURS), "storage", slot]
+        entry = {"at": round(at, 3), "task": task}
+        if rng.random() < urgent:
+            entry["priority"] = 1
+            entry["deadline"] = deadline
+        entries.append(entry)
+
+
+def run_line_with(policy, workload, seconds, seed, port, motion="coordinated"):
+    os.environ["REFLECT_GRIPPER_TASKS"] = policy
+    os.environ["REFLECT_GRIPPER_MOTION"] = motion
+    if workload:
+        os.environ["REFLECT_GRIPPER_WORKLOAD"] = workload
+    for name in ("REFLECT_CAPTURE", "REFLECT_RECORD"):
+        os.environ.pop(name, None)
+    server = RegisterServer("127.0.0.1", port)
+    server.start()
+    stations = []
+    for number, script in enumerate(LINES["modbus"]):
+        script = os.path.join(CODE_DIR, script)
+        plant = plant_for_script(script, seed=seed * 100 + number)
+        plant.handshake = False
+        station = os.path.splitext(os.path.basename(script))[0]
+        stations.append(LineStation(script, plant, links=[ProcessImageLink(BridgeClient(station, "127.0.0.1", port))]))
+    start = time.perf_counter()
+    try:
+        runs = run_line(stations, seconds)
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.environ.pop("REFLECT_GRIPPER_TASKS", None)
+        os.environ.pop("REFLECT_GRIPPER_MOTION", None)
+        os.environ.pop("REFLECT_GRIPPER_WORKLOAD", None)
+    errors = [f"{type(run.error).__name__}: {run.error}" for run in runs if run.error is not None]
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    tasks = runs[0].namespace["task_queue"]
+    return {
+        "policy": policy,
+        "seconds": seconds,
+        "wall_seconds": time.perf_counter() - start,
+        "arrivals": len(tasks.arrivals),
+        "completed": tasks.completed,
+        "tasks_per_hour": 3600.0 * tasks.completed / seconds,
+        "mean_wait": tasks.waited / tasks.taken if tasks.taken else 0.0,
+        "mean_time_to_done": tasks.latency / tasks.completed if tasks.completed else 0.0,
+        "missed_deadlines": tasks.missed,
+        "reordered": tasks.reordered,
+        "pending": len(tasks),
+    }
+
+
+def describe(workload, result, baseline=None):
+    text = (
+        f"{workload:9s} {result['policy']:6s} {result['completed']:4d} of {result['arrivals']:4d} tasks, "
+        f"{result['tasks_per_hour']:5.1f} tasks/h, wait {result['mean_wait']:6.1f} s, "
+        f"to done {result['mean_time_to_done']:6.1f} s, {result['missed_deadlines']:3d} missed, "
+        f"{result['reordered']:3d} reordered"
+    )
+    if baseline is not None and baseline["tasks_per_hour"] and baseline["mean_time_to_done"]:
+        text += (
+            f"\n{'':16s} tasks/h {100.0 * (result['tasks_per_hour'] / baseline['tasks_per_hour'] - 1.0):+5.1f} %, "
+            f"time to done {100.0 * (result['mean_time_to_done'] / baseline['mean_time_to_done'] - 1.0):+5.1f} %"
+        )
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the gripper's task policies on the simulated Modbus line")
+    parser.add_argument("--seconds", type=float, default=3600.0, help="simulated time per run")
+    parser.add_argument("--workloads", nargs="+", default=["demo", "synthetic"], choices=["demo", "synthetic", "recorded"])
+    parser.add_argument("--workload", help="workload file for 'recorded'")
+    parser.add_argument("--rate", type=float, default=50.0, help="synthetic arrivals per hour")
+    parser.add_argument("--urgent", type=float, default=0.25, help="share of synthetic tasks with priority and deadline")
+    parser.add_argument("--deadline", type=float, default=200.0, help="deadline of urgent tasks in s after arrival")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--motion", default="coordinated", choices=["sequential", "coordinated"],
+                        help="gripper motion mode (REFLECT_GRIPPER_MOTION)")
+    parser.add_argument("--port", type=int, default=21500, help="register server port")
+    parser.add_argument("--out", help="JSON file for the results")
+    args = parser.parse_args()
+    if "recorded" in args.workloads and not args.workload:
+        parser.error("'recorded' needs --workload FILE")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for workload in args.workloads:
+            path = None
+            if workload == "synthetic":
+                path = os.path.join(directory, "synthetic.json")
+                with open(path, "w") as f:
+                    json.dump(synthetic_workload(args.seconds, args.rate, args.urgent, args.deadline, args.seed), f)
+            elif workload == "recorded":
+                path = args.workload
+            results[workload] = []
+            for number, policy in enumerate(POLICIES):
+                result = run_line_with(policy, path, args.seconds, args.seed, args.port + number, args.motion)
+                results[workload].append(result)
+                baseline = results[workload][0] if policy != "fifo" else None
+                print(describe(workload, result, baseline), flush=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "benchmark": "task_queue",
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "seconds": args.seconds,
+                "seed": args.seed,
+                "motion": args.motion,
+                "synthetic": {"rate": args.rate, "urgent": args.urgent, "deadline": args.deadline},
+                "results": results,
+            }, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,396 @@
+import os
+import sys
 import revpimodio2
-import queue
 
-# Global queue for tasks
-task_queue = queue.Queue()
-
-# Add a helper data structure to track the tasks currently in the queue
-# This set tracks which tasks are already in the queue
-tasks_in_queue_set = set()
-
-
-# Function to safely add a task to the queue (with duplicate check)
-def add_task_to_queue(task):
-    if task not in tasks_in_queue_set:
-        task_queue.put(task)
-        tasks_in_queue_set.add(task)
+# Make the shared REFLECT library (code/reflect) importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from reflect.capture import ModbusTap, TrafficCapture  # noqa: E402
+from reflect.ingest import ORDER_POSITIONS, OrderInbox, OrderServer  # noqa: E402
+from reflect.instrumentation import CycleMonitor  # noqa: E402
+from reflect.motion import AxisMotion, CalibrationMoves, StopCalibration  # noqa: E402
+from reflect.outputs import OutputImage  # noqa: E402
+from reflect.replay import InputRecorder  # noqa: E402
+from reflect.settle import SettleDetector  # noqa: E402
+from reflect.statemachine import StateMachine  # noqa: E402
+from reflect.taskqueue import TaskModel, TaskQueue, Workload  # noqa: E402
+from reflect.wiring import WIRING  # noqa: E402
+
+# Order of the pending tasks: "fifo" or "travel" (shortest expected task
+# first, see reflect.taskqueue); REFLECT_GRIPPER_TASKS overrides it
+TASK_POLICY = os.environ.get("REFLECT_GRIPPER_TASKS", "fifo")
+
+# Drop-offs that feed pick-up positions: a pick-up waits for the earlier ones
+FEEDS = {"multi_drop_off": ("white_pick_up", "red_pick_up", "blue_pick_up")}
+
+# Global queue for tasks, a task is only added once while it is pending
+task_queue = TaskQueue(TASK_POLICY, feeds=FEEDS)
+
+# Tasks arriving over time from a workload file instead of the demo sequence
+# (ZYKLUS) if REFLECT_GRIPPER_WORKLOAD names one; REFLECT_RECORD keeps the
+# arrivals of a run as <dir>/gripper-tasks.json in the same format
+workload = Workload(os.environ["REFLECT_GRIPPER_WORKLOAD"]) if os.environ.get("REFLECT_GRIPPER_WORKLOAD") else None
+
+# Orders from outside (reflect.ingest): every submit is answered at once
+# (accepted with an order id, queue full, rejected, duplicate) and the cycle
+# takes the accepted ones over. REFLECT_GRIPPER_SOURCE "orders" leaves the
+# demo sequence (ZYKLUS) out, the gripper then only runs the orders
+TASK_SOURCE = os.environ.get("REFLECT_GRIPPER_SOURCE", "demo")
+ORDER_CAPACITY = 16  # orders accepted and not started yet
+orders = OrderInbox(ORDER_CAPACITY, ORDER_POSITIONS, slots=range(1, 10), max_id=0xFFFF)  # ids fit a register
+
+# Modbus command registers for submitting orders (see reflect.ingest) if
+# REFLECT_ORDER_PORT names a port
+order_server = None
+if os.environ.get("REFLECT_ORDER_PORT"):
+    order_server = OrderServer(orders, port=int(os.environ["REFLECT_ORDER_PORT"]))
+    order_server.start()
+
+
+# Function to safely add a task to the queue; a task already pending is not
+# added again (counted in task_queue.report())
+def add_task_to_queue(task, priority=0, deadline=None, source=None):
+    if task_queue.put(task, priority, deadline, source=source):
         print(f"Task {task} added to the list.")
         return True
-
-    else:
-        print(f"Task {task} is already in the list. Not added.")
-        return False
+    return False
 
 
 # Initialize the RevPi-ModIO interface with automatic refresh
 rpi = revpimodio2.RevPiModIO(autorefresh=True)
 rpi.cycletime = 10  # Set the cycle time (in milliseconds)
 
+# Cycle time measurement, reported at program end
+monitor = CycleMonitor(rpi.cycletime, name="gripper")
+
+# Output writes are collected per cycle and passed on once at its end
+outputs = OutputImage(rpi)
+
+# Modbus words (reflect/wiring.json) recorded once per cycle if REFLECT_CAPTURE names a directory
+capture = TrafficCapture(os.environ.get("REFLECT_CAPTURE"), "gripper")
+modbus_tap = ModbusTap(capture.recorder(), rpi.io, *WIRING.modbus_words("gripper"))
+
+# Inputs recorded every cycle if REFLECT_RECORD names a directory, for
+# python -m reflect.replay
+recorder = InputRecorder(os.environ.get("REFLECT_RECORD"), "gripper", rpi)
+
+# Tasks added in IDLE, one group per cycle of the demo sequence
+# (pick_up_pos_name, drop_off_pos_name, storage_slot)
+ZYKLUS = (
+    (("storage", "multi_drop_off", 1), ("storage", "multi_drop_off", 2), ("storage", "multi_drop_off", 3)),
+    (("white_pick_up", "storage", 3), ("red_pick_up", "storage", 2), ("blue_pick_up", "storage", 1)),
+    (("storage", "multi_drop_off", 4), ("storage", "multi_drop_off", 5), ("storage", "multi_drop_off", 6)),
+    (("white_pick_up", "storage", 6), ("red_pick_up", "storage", 5), ("blue_pick_up", "storage", 4)),
+    (("storage", "multi_drop_off", 7), ("storage", "multi_drop_off", 8), ("storage", "multi_drop_off", 9)),
+    (("white_pick_up", "storage", 9), ("red_pick_up", "storage", 8), ("blue_pick_up", "storage", 7)),
+)
+
+# Axes of MOVE_TO_POS, in the order of sequential motion: (counter, forward output, backward output)
+AXES = (
+    ("Counter_9", "O_12", "O_11"),  # axis 1
+    ("Counter_7", "O_10", "O_9"),  # axis 2
+    ("Counter_5", "O_8", "O_7"),  # axis 3
+)
+POSITION_TOLERANCE = 10
+
+# MOVE_TO_POS motion: "sequential" (one axis after the other) or "coordinated"
+# (all axes at once, see reflect.motion); REFLECT_GRIPPER_MOTION=coordinated
+# turns coordinated motion on
+MOTION_MODE = os.environ.get("REFLECT_GRIPPER_MOTION", "sequential")
+
+# Safe envelope of coordinated motion: within this many counts of axis 1
+# around these positions axis 3 (vertical) moves first and alone
+SAFE_ENVELOPE = {"storage": 400, "multi_drop_off": 400}
+
+# Stop times of the axes, learned from their run-out: the motors are switched
+# off early enough to come to rest at the target. Kept in
+# <dir>/gripper-stops.json if REFLECT_CALIBRATION names a directory.
+stops = StopCalibration(os.environ.get("REFLECT_CALIBRATION"), "gripper")
+
+# Test moves (back and forth, 300 and 150 counts from home) per uncalibrated
+# axis before the first task, REFLECT_CALIBRATION_MOVES=2 turns them on.
+# Without them the axes start with the default stop time and learn it from
+# the task moves.
+CALIBRATION_MOVES = int(os.environ.get("REFLECT_CALIBRATION_MOVES", "0"))
+
+# Waits after homing, around the counter resets and before gripping end once
+# the counters and home switches have not changed for SETTLE_WINDOW cycles,
+# at the latest after the fixed waits used so far (reflect.settle);
+# REFLECT_SETTLE=fixed keeps the fixed waits
+SETTLE_WINDOW = 10
+settle = SettleDetector(
+    rpi.io, ("Counter_5", "Counter_7", "Counter_9", "I_1", "I_2", "I_3"), SETTLE_WINDOW,
+    rpi.cycletime, os.environ.get("REFLECT_SETTLE", "sensor"), name="gripper",
+)
+
+
+# --- STATE MACHINE ---
+
+robot = StateMachine("gripper")
+DEFAULT = robot.state("DEFAULT")
+WAIT_FOR_PICKUP_READY = robot.state("WAIT_FOR_PICKUP_READY")
+WAIT_FOR_DROP_OFF_READY = robot.state("WAIT_FOR_DROP_OFF_READY")
+IDLE = robot.state("IDLE")
+MOVE_TO_POS = robot.state("MOVE_TO_POS")
+GRAP = robot.state("GRAP")
+UP_AND_IN = robot.state("UP_AND_IN")
+DROP = robot.state("DROP")
+CALIBRATE = robot.state("CALIBRATE")
+
+
+# DEFAULT state: home the robot or fetch next task
+@robot.during(DEFAULT, targets=(WAIT_FOR_PICKUP_READY, MOVE_TO_POS, IDLE, CALIBRATE))
+def default_state(m):
+    var = m.var
+    if rpi.io.I_1.value == 0:
+        outputs["O_7"] = 1  # Move axis 1 to home
+
+    elif rpi.io.I_2.value == 0:
+        outputs["O_7"] = 0
+        outputs["O_9"] = 1  # Move axis 2 to home
+
+    elif rpi.io.I_3.value == 0:
+        outputs["O_9"] = 0
+        outputs["O_11"] = 1  # Move axis 3 to home
+
+    else:  # All axes are home
+        outputs["O_11"] = 0
+
+        # Phase 1: wait until the axes are at rest at home (at most 0.5 s),
+        # then reset the counters
+        if not var.counters_reset:
+            if settle.wait("home", 51):
+                rpi.io.Counter_5.reset()
+                rpi.io.Counter_7.reset()
+                rpi.io.Counter_9.reset()
+                print("Counters reset.")
+                var.counters_reset = True
+
+        # Phase 2: wait until the counters read 0 at rest (at most 0.5 s)
+        elif settle.wait("reset", 50, zero=("Counter_5", "Counter_7", "Counter_9")):
+            var.counters_reset = False
+
+            # Learn the stop times of uncalibrated axes before the first move
+            if var.calibration.pending():
+                return CALIBRATE
+
+            # Check for next task in the queue (TASK_POLICY), the arm is at home
+            if not task_queue.empty():
+                var.current_task = task_queue.get()  # get next task
+                var.current_order = task_queue.source()  # None unless the task came from an order
+                orders.started(var.current_order)
+
+                print(
+                    f"Starting new task: pick up from {var.current_task[0]} and drop off at {var.current_task[1]}"
+                )
+
+                # Always start with the pick-up position
+                var.is_picking_up = True
+                var.current_position = var.positions[var.current_task[0]]
+
+                # Waiting logic before moving
+                if var.current_task[0] == "storage":
+                    # If picking up from storage: go to waiting state first to request permission
+                    return WAIT_FOR_PICKUP_READY
+
+                # Otherwise start moving immediately
+                return MOVE_TO_POS
+
+            print("All tasks completed. Robot switches to idle.")
+            return IDLE
+
+
+# NEW STATE: wait for approval to pick up from storage
+# (only entered when picking up from storage)
+@robot.on_enter(WAIT_FOR_PICKUP_READY)
+def request_storage_pickup(m):
+    # The pallet must not be brought back while we are requesting it
+    outputs["Output_Word_2"] = 0
+    outputs["Output_Word_1"] = m.var.current_task[2]  # request to storage
+    print(f"WAIT_FOR_PICKUP_READY: Sending request {m.var.current_task[2]} to storage...")
+
+
+robot.transition(
+    WAIT_FOR_PICKUP_READY,
+    MOVE_TO_POS,
+    guard=lambda m: rpi.io.Input_Word_1.value != 0,  # assumption: != 0 = storage is ready/confirmed
+    action=lambda m: print("WAIT_FOR_PICKUP_READY: Storage approved. Starting movement."),
+)
+
+
+# EXTENDED STATE: wait for approval for drop-off (storage OR multistation)
+@robot.on_enter(WAIT_FOR_DROP_OFF_READY)
+def request_storage_drop_off(m):
+    if m.var.current_task[1] == "storage":
+        outputs["Output_Word_2"] = 0
+        outputs["Output_Word_1"] = m.var.current_task[2]  # request target slot
+        print(
+            f"WAIT_FOR_DROP_OFF_READY: Sending request {m.var.current_task[2]} for storage placement..."
+        )
+
+
+robot.transition(
+    WAIT_FOR_DROP_OFF_READY,
+    MOVE_TO_POS,
+    guard=lambda m: m.var.current_task[1] == "storage"
+    and rpi.io.Input_Word_1.value != 0,  # assumption: != 0 = storage is ready/confirmed
+    action=lambda m: print("WAIT_FOR_DROP_OFF_READY: Storage approved for placement. Starting movement."),
+)
+
+# IMPORTANT: replace '== 1' with your actual READY condition
+# Assumption: Input_Word_1_i05 controls multistation release
+robot.transition(
+    WAIT_FOR_DROP_OFF_READY,
+    MOVE_TO_POS,
+    guard=lambda m: m.var.current_task[1] == "multi_drop_off"
+    and rpi.io.Input_Word_1_i05.value == 1,
+    action=lambda m: print("WAIT_FOR_DROP_OFF_READY: Multistation approved. Starting movement."),
+)
+
+
+@robot.during(WAIT_FOR_DROP_OFF_READY)
+def wait_for_drop_off_ready(m):
+    if m.var.current_task[1] == "multi_drop_off":
+        print("WAIT_FOR_DROP_OFF_READY: Robot is waiting for multistation (drop-off approval)...")
+
+
+# IDLE state: robot waits for tasks (can later be filled by external triggers)
+@robot.during(IDLE, targets=(DEFAULT,))
+def idle_state(m):
+    if workload is None and TASK_SOURCE == "demo":
+        for task in ZYKLUS[m.var.zyklus]:
+            add_task_to_queue(task)
+        m.var.zyklus = (m.var.zyklus + 1) % len(ZYKLUS)
+    # Orders and workload tasks: stay idle until one is pending
+    if task_queue.empty():
+        return None
+    return DEFAULT
+
+
+# CALIBRATE state: test moves of every axis from home (CALIBRATION_MOVES), then home again
+@robot.during(CALIBRATE, targets=(DEFAULT,))
+def calibrate(m):
+    calibration = m.var.calibration
+    if calibration.step():
+        if calibration.aborted:
+            print(f"Calibration aborted: {calibration.aborted} did not finish its test move, {stops.report()}")
+        else:
+            print(f"Calibration done, {stops.report()}")
+        return DEFAULT
+    return None
+
+
+# MOVE_TO_POS state: move to the target position (MOTION_MODE)
+@robot.on_enter(MOVE_TO_POS)
+def start_axis_movement(m):
+    m.var.motion.start(m.var.current_position)
+
+
+@robot.during(MOVE_TO_POS, targets=(GRAP, DROP))
+def move_to_pos(m):
+    var = m.var
+    if not var.motion.step():
+        # a move that does not finish within max_cycles leaves the axes off
+        if var.motion.failed and var.motion.cycles == var.motion.max_cycles + 1:
+            print(f"Move aborted: {', '.join(var.motion.failed)} not in position, axes off")
+        return None
+
+    # All axes reached their targets, transition to next state once they are
+    # at rest (at most 0.5 s)
+    if settle.site != "position":
+        print("All axes in position.")
+    if settle.wait("position", 51):
+        return GRAP if var.is_picking_up else DROP
+    return None
+
+
+# GRAP state: activate gripper to pick up
+@robot.on_enter(GRAP)
+def start_grap(m):
+    # If 'storage' is reached here, approval was already obtained in WAIT_FOR_PICKUP_READY
+    if m.var.current_task[0] == "storage":
+        # Reset the storage request because the pallet has been reached/accepted
+        outputs["Output_Word_1"] = 0
+        print("GRAP: Storage request reset.")
+
+    outputs["O_13"] = 1  # compressor on
+
+
+def grip_on(m):
+    outputs["O_14"] = 1  # grip / magnet on
+
+
+# 0.5 second delay for compressor
+robot.after(GRAP, UP_AND_IN, cycles=50, action=grip_on)
+
+
+# UP_AND_IN state: retract axes after pick-up (or drop-off)
+@robot.during(UP_AND_IN, targets=(WAIT_FOR_DROP_OFF_READY, MOVE_TO_POS, DEFAULT))
+def up_and_in(m):
+    var = m.var
+    if rpi.io.I_1.value == 0:
+        outputs["O_7"] = 1
+    elif rpi.io.I_2.value == 0:
+        outputs["O_7"] = 0
+        outputs["O_9"] = 1
+    else:
+        outputs["O_9"] = 0
+
+        # Phased logic: wait until at rest, counter reset, wait until they read 0
+        if not var.counters_reset:
+            if settle.wait("up", 51):
+                rpi.io.Counter_5.reset()
+                rpi.io.Counter_7.reset()
+                # not counter 9
+                print("Counters reset.")
+                var.counters_reset = True
+
+        elif settle.wait("reset", 50, zero=("Counter_5", "Counter_7")):
+            var.counters_reset = False
+
+            # If picked up from storage, the pallet can now be returned
+            if var.current_task[0] == "storage":
+                outputs["Output_Word_2"] = 1
+                print("Signal to storage: approval to bring back/finish the removal.")
+
+            if var.current_task[1] == "storage":
+                outputs["Output_Word_2"] = 1
+                print("DROP: Signal to storage: approval to bring back/finish the placement.")
+
+            if var.is_picking_up:
+                # Just picked up -> now move to drop-off position
+                var.is_picking_up = False
+                drop_off_pos_name = var.current_task[1]
+                var.current_position = var.positions[drop_off_pos_name]
+
+                # If drop-off is storage OR multi_drop_off, wait for approval first
+                if drop_off_pos_name in ("storage", "multi_drop_off"):
+                    return WAIT_FOR_DROP_OFF_READY
+                return MOVE_TO_POS
+
+            # Just dropped off -> task complete
+            task_queue.done(var.current_task)
+            orders.finished(var.current_order)
+            var.current_order = None
+            settle.count_task()
+            var.current_task = None
+            return DEFAULT
+    return None
+
+
+# DROP state: release item
+@robot.on_enter(DROP)
+def start_drop(m):
+    if m.var.current_task[1] == "storage":
+        # No waiting/request here, since it already happened in WAIT_FOR_DROP_OFF_READY
+        outputs["Output_Word_1"] = 0
+        print("DROP: Storage request for placement reset.")
+
+    outputs["O_14"] = 0  # open gripper / magnet off
+
+
+# 0.5 second delay to release
+robot.after(DROP, UP_AND_IN, cycles=50)
+
 
 def cycleprogram(cycletools):
     # Initialization at program start
@@ -41,397 +406,69 @@ def cycleprogram(cycletools):
             "multi_drop_off": [1805, 1680, 1000],  # multi drop-off
         }
 
-        cycletools.var.current_state = "DEFAULT"
-
         # Current task (tuple: (pick_up_pos_name, drop_off_pos_name, storage_slot))
         cycletools.var.current_task = None
+        cycletools.var.current_order = None  # order of the current task (reflect.ingest), if any
 
         # True when moving to pick-up position, False for drop-off position
         cycletools.var.is_picking_up = True
 
         cycletools.var.zyklus = 0
-        cycletools.var.delay_counter = 0
+        cycletools.var.counters_reset = False
 
-        # Used in GRAP/DROP states for one-time execution
-        cycletools.var.first = 0
+        # Axis motion of MOVE_TO_POS
+        cycletools.var.motion = AxisMotion(
+            outputs, rpi.io, AXES, POSITION_TOLERANCE, MOTION_MODE, vertical=2,
+            envelope=[(cycletools.var.positions[name][0], width) for name, width in SAFE_ENVELOPE.items()],
+            stops=stops,
+        )
+        cycletools.var.calibration = CalibrationMoves(cycletools.var.motion, trials=CALIBRATION_MOVES)
 
-        # New sub-state for axis movement
-        cycletools.var.move_axis_state = "AXIS1"
+        # Expected task durations for TASK_POLICY "travel"
+        task_queue.model = TaskModel(cycletools.var.positions, mode=MOTION_MODE)
 
-        # Ensure all motors and grippers are off initially
-        rpi.io.O_7.value = 0
-        rpi.io.O_9.value = 0
-        rpi.io.O_11.value = 0
-        rpi.io.O_12.value = 0
-        rpi.io.O_10.value = 0
-        rpi.io.O_8.value = 0
-        rpi.io.O_13.value = 0
-        rpi.io.O_14.value = 0
-
-    # --- STATE MACHINE ---
-
-    # DEFAULT state: home the robot or fetch next task
-    if cycletools.var.current_state == "DEFAULT":
-        if rpi.io.I_1.value == 0:
-            rpi.io.O_7.value = 1  # Move axis 1 to home
-
-        elif rpi.io.I_2.value == 0:
-            rpi.io.O_7.value = 0
-            rpi.io.O_9.value = 1  # Move axis 2 to home
-
-        elif rpi.io.I_3.value == 0:
-            rpi.io.O_9.value = 0
-            rpi.io.O_11.value = 1  # Move axis 3 to home
-
-        else:  # All axes are home
-            rpi.io.O_11.value = 0
-
-            # New phased logic for wait time and counter reset
-            # Phase 1: wait after reaching home position (50 cycles = 0.5s)
-            if cycletools.var.delay_counter < 50:
-                cycletools.var.delay_counter += 1
-
-            # Phase 2: reset counters (one-time after phase 1)
-            elif cycletools.var.delay_counter == 50:
-                rpi.io.Counter_5.reset()
-                rpi.io.Counter_7.reset()
-                rpi.io.Counter_9.reset()
-                print("Counters reset.")
-                cycletools.var.delay_counter += 1  # immediately continue to phase 3
-
-            # Phase 3: wait after resetting counters (50 cycles = 0.5s)
-            elif cycletools.var.delay_counter < 50 + 50:
-                cycletools.var.delay_counter += 1
-
-            else:  # all phases completed
-                cycletools.var.delay_counter = 0  # reset for next use
-
-                # Check for next task in the queue
-                if not task_queue.empty():
-                    cycletools.var.current_task = task_queue.get()  # get next task
-
-                    # IMPORTANT: remove from the set since it has been taken from the queue
-                    tasks_in_queue_set.remove(cycletools.var.current_task)
-
-                    print(
-                        f"Starting new task: pick up from {cycletools.var.current_task[0]} and drop off at {cycletools.var.current_task[1]}"
-                    )
-
-                    # Always start with the pick-up position
-                    cycletools.var.is_picking_up = True
-
-                    # Waiting logic before moving
-                    if cycletools.var.current_task[0] == "storage":
-                        # If picking up from storage: go to waiting state first to request permission
-                        cycletools.var.current_position = cycletools.var.positions[
-                            cycletools.var.current_task[0]
-                        ]
-                        cycletools.var.first = 0
-                        cycletools.var.current_state = "WAIT_FOR_PICKUP_READY"
-
-                    else:
-                        # Otherwise start moving immediately
-                        cycletools.var.current_position = cycletools.var.positions[
-                            cycletools.var.current_task[0]
-                        ]
-                        cycletools.var.current_state = "MOVE_TO_POS"
-                        cycletools.var.move_axis_state = "AXIS1"
-
-                else:
-                    print("All tasks completed. Robot switches to idle.")
-                    cycletools.var.current_state = "IDLE"
-
-    # NEW STATE: wait for approval to pick up from storage
-    elif cycletools.var.current_state == "WAIT_FOR_PICKUP_READY":
-
-        # List of pick-up positions that depend on confirmation from the MULTISTATION
-        multistation_dependent_pickups = [
-            "white_pick_up",
-            "red_pick_up",
-            "blue_pick_up",
-        ]
-
-        # Only reached when picking up from storage
-        if cycletools.var.current_task and cycletools.var.current_task[0] == "storage":
-            # Step 1: request storage (only once when entering)
-            if cycletools.var.first == 0:
-                # The pallet must not be brought back while we are requesting it
-                rpi.io.Output_Word_2.value = 0
-                rpi.io.Output_Word_1.value = cycletools.var.current_task[2]  # request to storage
-                print(
-                    f"WAIT_FOR_PICKUP_READY: Sending request {cycletools.var.current_task[2]} to storage..."
-                )
-                cycletools.var.first = 1
-
-            # Step 2: wait for storage approval
-            if rpi.io.Input_Word_1.value != 0:  # assumption: != 0 = storage is ready/confirmed
-                print("WAIT_FOR_PICKUP_READY: Storage approved. Starting movement.")
-                cycletools.var.first = 0
-                cycletools.var.current_state = "MOVE_TO_POS"
-                cycletools.var.move_axis_state = "AXIS1"
-            else:
-                return  # stay here until storage is ready
-
-        elif (
-            cycletools.var.current_task
-            and cycletools.var.current_task[0] in multistation_dependent_pickups
-        ):
-            # Here you would check the suction/light-barrier signals of the sorting line / multistation
-            # REPLACE THIS PLACEHOLDER with your real multistation input/variable!
-            if 1 == 0:  # put the real condition here
-                print(
-                    f"GRAP: Robot waits for multistation for {cycletools.var.current_task[0]} (signal not received yet)..."
-                )
-                return
+        cycletools.var.machine = robot.compile(cycletools.var, initial=DEFAULT)
 
-    # EXTENDED STATE: wait for approval for drop-off (storage OR multistation)
-    elif cycletools.var.current_state == "WAIT_FOR_DROP_OFF_READY":
-        target_drop_off = cycletools.var.current_task[1] if cycletools.var.current_task else None
+        # Ensure all motors and grippers are off initially
+        outputs.off("O_7", "O_9", "O_11", "O_12", "O_10", "O_8", "O_13", "O_14")
 
-        if target_drop_off == "storage":
-            # --- wait-for-storage logic ---
+    # Orders accepted since the last cycle; an order takes over the same task
+    # pending from the demo sequence or a workload
+    for order in orders.drain():
+        if not add_task_to_queue(order.task, order.priority, order.deadline, source=order):
+            orders.refused(order)
 
-            # Step 1: request storage (only once when entering)
-            if cycletools.var.first == 0:
-                rpi.io.Output_Word_2.value = 0
-                rpi.io.Output_Word_1.value = cycletools.var.current_task[2]  # request target slot
-                print(
-                    f"WAIT_FOR_DROP_OFF_READY: Sending request {cycletools.var.current_task[2]} for storage placement..."
-                )
-                cycletools.var.first = 1
-
-            # Step 2: wait for storage approval
-            if rpi.io.Input_Word_1.value != 0:  # assumption: != 0 = storage is ready/confirmed
-                print("WAIT_FOR_DROP_OFF_READY: Storage approved for placement. Starting movement.")
-                cycletools.var.first = 0
-                cycletools.var.current_state = "MOVE_TO_POS"
-                cycletools.var.move_axis_state = "AXIS1"
-            else:
-                return
-
-        elif target_drop_off == "multi_drop_off":
-            # --- wait-for-multistation logic ---
-
-            # IMPORTANT: replace '== 1' with your actual READY condition
-            # Assumption: Input_Word_1_i05 controls multistation release
-            if rpi.io.Input_Word_1_i05.value == 1:
-                print("WAIT_FOR_DROP_OFF_READY: Multistation approved. Starting movement.")
-                cycletools.var.first = 0
-                cycletools.var.current_state = "MOVE_TO_POS"
-                cycletools.var.move_axis_state = "AXIS1"
-            else:
-                print("WAIT_FOR_DROP_OFF_READY: Robot is waiting for multistation (drop-off approval)...")
-                return
-
-    # IDLE state: robot waits for tasks (can later be filled by external triggers)
-    elif cycletools.var.current_state == "IDLE":
-        if cycletools.var.zyklus == 0:
-            add_task_to_queue(("storage", "multi_drop_off", 1))
-            add_task_to_queue(("storage", "multi_drop_off", 2))
-            add_task_to_queue(("storage", "multi_drop_off", 3))
-            cycletools.var.zyklus = 1
-
-        elif cycletools.var.zyklus == 1:
-            add_task_to_queue(("white_pick_up", "storage", 3))
-            add_task_to_queue(("red_pick_up", "storage", 2))
-            add_task_to_queue(("blue_pick_up", "storage", 1))
-            cycletools.var.zyklus = 2
-
-        elif cycletools.var.zyklus == 2:
-            add_task_to_queue(("storage", "multi_drop_off", 4))
-            add_task_to_queue(("storage", "multi_drop_off", 5))
-            add_task_to_queue(("storage", "multi_drop_off", 6))
-            cycletools.var.zyklus = 3
-
-        elif cycletools.var.zyklus == 3:
-            add_task_to_queue(("white_pick_up", "storage", 6))
-            add_task_to_queue(("red_pick_up", "storage", 5))
-            add_task_to_queue(("blue_pick_up", "storage", 4))
-            cycletools.var.zyklus = 4
-
-        elif cycletools.var.zyklus == 4:
-            add_task_to_queue(("storage", "multi_drop_off", 7))
-            add_task_to_queue(("storage", "multi_drop_off", 8))
-            add_task_to_queue(("storage", "multi_drop_off", 9))
-            cycletools.var.zyklus = 5
-
-        elif cycletools.var.zyklus == 5:
-            add_task_to_queue(("white_pick_up", "storage", 9))
-            add_task_to_queue(("red_pick_up", "storage", 8))
-            add_task_to_queue(("blue_pick_up", "storage", 7))
-            cycletools.var.zyklus = 0
-
-        cycletools.var.current_state = "DEFAULT"
-
-    # MOVE_TO_POS state: move to the target position
-    elif cycletools.var.current_state == "MOVE_TO_POS":
-        target_pos = cycletools.var.current_position
-        POSITION_TOLERANCE = 10
-
-        # --- Axis 1 control ---
-        if cycletools.var.move_axis_state == "AXIS1":
-            current_pos_ax1 = rpi.io.Counter_9.value
-            target_pos_ax1 = target_pos[0]
-            if abs(current_pos_ax1 - target_pos_ax1) <= POSITION_TOLERANCE:
-                rpi.io.O_12.value = 0
-                rpi.io.O_11.value = 0
-                print("Axis 1 within target range. Starting axis 2.")
-                cycletools.var.move_axis_state = "AXIS2"
-            else:
-                if current_pos_ax1 < target_pos_ax1:
-                    rpi.io.O_12.value = 1  # axis 1 forward
-                    rpi.io.O_11.value = 0
-                elif current_pos_ax1 > target_pos_ax1:
-                    rpi.io.O_12.value = 0
-                    rpi.io.O_11.value = 1  # axis 1 backward
-
-        # --- Axis 2 control ---
-        elif cycletools.var.move_axis_state == "AXIS2":
-            current_pos_ax2 = rpi.io.Counter_7.value
-            target_pos_ax2 = target_pos[1]
-            if abs(current_pos_ax2 - target_pos_ax2) <= POSITION_TOLERANCE:
-                rpi.io.O_10.value = 0
-                rpi.io.O_9.value = 0
-                print("Axis 2 within target range. Starting axis 3.")
-                cycletools.var.move_axis_state = "AXIS3"
-            else:
-                if current_pos_ax2 < target_pos_ax2:
-                    rpi.io.O_10.value = 1  # axis 2 forward
-                    rpi.io.O_9.value = 0
-                elif current_pos_ax2 > target_pos_ax2:
-                    rpi.io.O_10.value = 0
-                    rpi.io.O_9.value = 1  # axis 2 backward
-
-        # --- Axis 3 control ---
-        elif cycletools.var.move_axis_state == "AXIS3":
-            current_pos_ax3 = rpi.io.Counter_5.value
-            target_pos_ax3 = target_pos[2]
-            if abs(current_pos_ax3 - target_pos_ax3) <= POSITION_TOLERANCE:
-                rpi.io.O_8.value = 0
-                rpi.io.O_7.value = 0
-                print("Axis 3 within target range. All axes in position.")
-
-                # All axes reached their targets, transition to next state
-                if cycletools.var.delay_counter < 50:  # 0.5 second delay
-                    cycletools.var.delay_counter += 1
-                else:
-                    cycletools.var.delay_counter = 0
-                    cycletools.var.current_state = "GRAP" if cycletools.var.is_picking_up else "DROP"
-            else:
-                if current_pos_ax3 < target_pos_ax3:
-                    rpi.io.O_8.value = 1  # axis 3 forward
-                    rpi.io.O_7.value = 0
-                elif current_pos_ax3 > target_pos_ax3:
-                    rpi.io.O_8.value = 0
-                    rpi.io.O_7.value = 1  # axis 3 backward
-
-    # GRAP state: activate gripper to pick up
-    elif cycletools.var.current_state == "GRAP":
-
-        # If 'storage' is reached here, approval was already obtained in WAIT_FOR_PICKUP_READY
-        if cycletools.var.current_task and cycletools.var.current_task[0] == "storage":
-            # Reset the storage request because the pallet has been reached/accepted
-            rpi.io.Output_Word_1.value = 0
-            print("GRAP: Storage request reset.")
-
-        cycletools.var.first = 0
-        rpi.io.O_13.value = 1  # compressor on
-        if cycletools.var.delay_counter < 50:  # 0.5 second delay for compressor
-            cycletools.var.delay_counter += 1
-        else:
-            rpi.io.O_14.value = 1  # grip / magnet on
-            cycletools.var.delay_counter = 0
-            cycletools.var.current_state = "UP_AND_IN"
-
-    # UP_AND_IN state: retract axes after pick-up (or drop-off)
-    elif cycletools.var.current_state == "UP_AND_IN":
-        if rpi.io.I_1.value == 0:
-            rpi.io.O_7.value = 1
-        elif rpi.io.I_2.value == 0:
-            rpi.io.O_7.value = 0
-            rpi.io.O_9.value = 1
-        else:
-            rpi.io.O_9.value = 0
+    if workload is not None:
+        for entry in workload.due():
+            add_task_to_queue(tuple(entry["task"]), entry.get("priority", 0), entry.get("deadline"))
 
-            # Phased logic: wait + counter reset
-            if cycletools.var.delay_counter < 50:
-                cycletools.var.delay_counter += 1
-
-            elif cycletools.var.delay_counter == 50:
-                rpi.io.Counter_5.reset()
-                rpi.io.Counter_7.reset()
-                # not counter 9
-                print("Counters reset.")
-                cycletools.var.delay_counter += 1
-
-            elif cycletools.var.delay_counter < 100:
-                cycletools.var.delay_counter += 1
-
-            else:
-                cycletools.var.delay_counter = 0
-
-                # If picked up from storage, the pallet can now be returned
-                if cycletools.var.current_task[0] == "storage":
-                    rpi.io.Output_Word_2.value = 1
-                    print("Signal to storage: approval to bring back/finish the removal.")
-
-                if cycletools.var.current_task[1] == "storage":
-                    rpi.io.Output_Word_2.value = 1
-                    print("DROP: Signal to storage: approval to bring back/finish the placement.")
-
-                if cycletools.var.is_picking_up:
-                    # Just picked up -> now move to drop-off position
-                    cycletools.var.is_picking_up = False
-                    drop_off_pos_name = cycletools.var.current_task[1]
-                    cycletools.var.current_position = cycletools.var.positions[drop_off_pos_name]
-                    cycletools.var.first = 0
-
-                    # If drop-off is storage OR multi_drop_off, wait for approval first
-                    if drop_off_pos_name in ("storage", "multi_drop_off"):
-                        cycletools.var.current_state = "WAIT_FOR_DROP_OFF_READY"
-                    else:
-                        cycletools.var.current_state = "MOVE_TO_POS"
-                        cycletools.var.move_axis_state = "AXIS1"
-
-                else:
-                    # Just dropped off -> task complete
-                    cycletools.var.current_task = None
-                    cycletools.var.current_state = "DEFAULT"
-
-    # DROP state: release item
-    elif cycletools.var.current_state == "DROP":
-        # List of drop-off positions that require confirmation from STORAGE
-        storage_dependent_dropoffs = ["storage"]
-
-        if (
-            cycletools.var.current_task
-            and cycletools.var.current_task[1] in storage_dependent_dropoffs
-        ):
-            # No waiting/request here, since it already happened in WAIT_FOR_DROP_OFF_READY
-            rpi.io.Output_Word_1.value = 0
-            print("DROP: Storage request for placement reset.")
-
-        cycletools.var.first = 0
-        rpi.io.O_14.value = 0  # open gripper / magnet off
-
-        if cycletools.var.delay_counter < 50:  # 0.5 second delay to release
-            cycletools.var.delay_counter += 1
-        else:
-            cycletools.var.delay_counter = 0
-            cycletools.var.current_state = "UP_AND_IN"
+    cycletools.var.machine.step()
+    outputs.flush()
+    modbus_tap.sample()
 
 
 # This function is called when the program ends (e.g., Ctrl+C)
 def programend():
     print("Program end: resetting outputs...")
-    rpi.io.O_7.value = 0
-    rpi.io.O_9.value = 0
-    rpi.io.O_11.value = 0
-    rpi.io.O_12.value = 0
-    rpi.io.O_10.value = 0
-    rpi.io.O_8.value = 0
-    rpi.io.O_13.value = 0
-    rpi.io.O_14.value = 0
+    print(monitor.report())
+    print(outputs.report())
+    outputs.off("O_7", "O_9", "O_11", "O_12", "O_10", "O_8", "O_13", "O_14")
+    outputs.flush()
+    modbus_tap.sample()
+    capture.close()
+    print(capture.report())
+    recorder.close()
+    print(recorder.report())
+    stops.save()
+    print(stops.report())
+    print(task_queue.report())
+    print(orders.report())
+    print(settle.report())
+    if order_server is not None:
+        order_server.shutdown()
+        order_server.server_close()
+    if os.environ.get("REFLECT_RECORD"):
+        task_queue.save_arrivals(os.path.join(os.environ["REFLECT_RECORD"], "gripper-tasks.json"))
 
 
 # Register the programend function for graceful shutdown
@@ -439,5 +476,5 @@ rpi.handlesignalend(programend)
 
 # Start the main program loop (cycle operation)
 print("Starting the robot cycle loop...")
-rpi.cycleloop(cycleprogram, cycletime=rpi.cycletime)
-print("Robot cycle loop finished.")
\ No newline at end of file
+rpi.cycleloop(monitor.wrap(recorder.wrap(cycleprogram)), cycletime=rpi.cycletime)
+print("Robot cycle loop finished.")
@@ -1,101 +1,145 @@
+import os
+import sys
 import revpimodio2
 
+# Make the shared REFLECT library (code/reflect) importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from reflect.capture import ModbusTap, TrafficCapture  # noqa: E402
+from reflect.instrumentation import CycleMonitor  # noqa: E402
+from reflect.motion import AxisMotion, StopCalibration  # noqa: E402
+from reflect.outputs import OutputImage  # noqa: E402
+from reflect.replay import InputRecorder  # noqa: E402
+from reflect.settle import SettleDetector  # noqa: E402
+from reflect.statemachine import StateMachine  # noqa: E402
+from reflect.wiring import WIRING  # noqa: E402
+
 # Initialize the RevPi-ModIO interface with automatic refresh
 rpi = revpimodio2.RevPiModIO(autorefresh=True)
 rpi.cycletime = 10  # Set the cycle time (in milliseconds)
 
+# Cycle time measurement, reported at program end
+monitor = CycleMonitor(rpi.cycletime, name="high_bay_warehouse")
+
+# Output writes are collected per cycle and passed on once at its end
+outputs = OutputImage(rpi)
+
+# Modbus words (reflect/wiring.json) recorded once per cycle if REFLECT_CAPTURE names a directory
+capture = TrafficCapture(os.environ.get("REFLECT_CAPTURE"), "high_bay_warehouse")
+modbus_tap = ModbusTap(capture.recorder(), rpi.io, *WIRING.modbus_words("high_bay_warehouse"))
+
+# Inputs recorded every cycle if REFLECT_RECORD names a directory, for
+# python -m reflect.replay
+recorder = InputRecorder(os.environ.get("REFLECT_RECORD"), "high_bay_warehouse", rpi)
+
+
+# Storage moves (CommanderLager): x and y axis driven together and switched
+# off early enough to come to rest at the slot, correcting backwards if needed
+# (reflect.motion). The stop times are learned from every stop and kept in
+# <dir>/high_bay_warehouse-stops.json if REFLECT_CALIBRATION names a directory.
+STORAGE_AXES = (
+    ("Counter_5", "O_3", "O_4"),  # x
+    ("Counter_7", "O_5", "O_6"),  # y
+)
+POSITION_TOLERANCE = 10
+stops = StopCalibration(os.environ.get("REFLECT_CALIBRATION"), "high_bay_warehouse")
+
+# Waits around the counter resets and after the commanders end once the
+# counters, reference and arm switches have not changed for SETTLE_WINDOW
+# cycles, at the latest after the fixed waits used so far (reflect.settle);
+# REFLECT_SETTLE=fixed keeps the fixed waits
+SETTLE_WINDOW = 10
+settle = SettleDetector(
+    rpi.io, ("Counter_5", "Counter_7", "I_1", "I_4", "I_9", "I_10"), SETTLE_WINDOW,
+    rpi.cycletime, os.environ.get("REFLECT_SETTLE", "sensor"), name="high_bay_warehouse",
+)
+
 
 class RobotCommander:
     def __init__(self, cycletools_var):
         self.var = cycletools_var
+        self.storage_motion = AxisMotion(
+            outputs, rpi.io, STORAGE_AXES, POSITION_TOLERANCE, "coordinated", stops=stops
+        )
 
     def CommanderDefault(self, up=1):  # Move to default (belt) position
         if rpi.io.I_10.value == 0 and up == 1:
-            rpi.io.O_8.value = 1
+            outputs["O_8"] = 1
             return 0
 
         elif rpi.io.I_4.value == 0 and rpi.io.I_1.value == 0:
-            rpi.io.O_6.value = 1
-            rpi.io.O_4.value = 1
-            rpi.io.O_8.value = 0
+            outputs["O_6"] = 1
+            outputs["O_4"] = 1
+            outputs["O_8"] = 0
             return 0
 
         elif rpi.io.I_4.value == 0 and rpi.io.I_1.value == 1:
-            rpi.io.O_6.value = 1
-            rpi.io.O_4.value = 0
-            rpi.io.O_8.value = 0
+            outputs["O_6"] = 1
+            outputs["O_4"] = 0
+            outputs["O_8"] = 0
             return 0
 
         elif rpi.io.I_4.value == 1 and rpi.io.I_1.value == 0:
-            rpi.io.O_6.value = 0
-            rpi.io.O_4.value = 1
-            rpi.io.O_8.value = 0
+            outputs["O_6"] = 0
+            outputs["O_4"] = 1
+            outputs["O_8"] = 0
             return 0
 
         elif rpi.io.I_4.value == 1 and rpi.io.I_1.value == 1:
-            rpi.io.O_6.value = 0
-            rpi.io.O_4.value = 0
-            rpi.io.O_8.value = 0
+            outputs["O_6"] = 0
+            outputs["O_4"] = 0
+            outputs["O_8"] = 0
             return 1
 
     def CommanderLager(self, x, y):  # Move to a position at the storage area
         print()
-        if rpi.io.Counter_5.value < x and rpi.io.Counter_7.value < y:
-            rpi.io.O_3.value = 1
-            rpi.io.O_5.value = 1
-            return 0
-
-        elif rpi.io.Counter_5.value < x and rpi.io.Counter_7.value >= y:
-            rpi.io.O_3.value = 1
-            rpi.io.O_5.value = 0
-            return 0
-
-        elif rpi.io.Counter_5.value >= x and rpi.io.Counter_7.value < y:
-            rpi.io.O_3.value = 0
-            rpi.io.O_5.value = 1
-            return 0
-
-        elif rpi.io.Counter_5.value >= x and rpi.io.Counter_7.value >= y:
-            rpi.io.O_3.value = 0
-            rpi.io.O_5.value = 0
+        motion = self.storage_motion
+        if motion.target != [x, y]:
+            motion.start([x, y])
+        if motion.step():
+            motion.target = None
             return 1
+        # a move that does not finish within max_cycles leaves the axes off
+        if motion.failed and motion.cycles == motion.max_cycles + 1:
+            print(f"Storage move aborted: {', '.join(motion.failed)} not in position, axes off")
+        return 0
 
     def CommanderOut(self):  # Extend arm
         if rpi.io.I_9.value == 0:
-            rpi.io.O_7.value = 1
+            outputs["O_7"] = 1
             return 0
 
         elif rpi.io.I_9.value == 1:
-            rpi.io.O_7.value = 0
+            outputs["O_7"] = 0
             return 1
 
     def CommanderIn(self):  # Retract arm
         if rpi.io.I_10.value == 0:
-            rpi.io.O_8.value = 1
+            outputs["O_8"] = 1
             return 0
 
         elif rpi.io.I_10.value == 1:
-            rpi.io.O_8.value = 0
+            outputs["O_8"] = 0
             return 1
 
     def CommanderLift(self, value=200):  # Lift up a bit
         if (
             rpi.io.Counter_7.value >= 4294967295 - value or rpi.io.Counter_7.value <= 50
-        ):  # probably jumps to the maximum value and counts down, hence the ">"
-            rpi.io.O_6.value = 1
+        ) and rpi.io.I_4.value == 0:  # probably jumps to the maximum value and counts down, hence the ">";
+            # a slot less than value above the reference switch (I_4) is lifted up to the switch
+            outputs["O_6"] = 1
             return 0
 
         else:
-            rpi.io.O_6.value = 0
+            outputs["O_6"] = 0
             return 1
 
     def CommanderDown(self, value=200):  # Lower down a bit / set down
         if rpi.io.Counter_7.value < value:  # counts upward
-            rpi.io.O_5.value = 1
+            outputs["O_5"] = 1
             return 0
 
         else:
-            rpi.io.O_5.value = 0
+            outputs["O_5"] = 0
             return 1
 
     def CommanderResetCounters(self):
@@ -103,6 +147,184 @@ class RobotCommander:
         rpi.io.Counter_7.reset()
 
 
+# --- STEP HELPERS ---
+# The storage and belt movements are sequences of steps. Each step function
+# returns True once it is finished; var.step indexes the running step.
+
+
+# Reset the counters once, then wait until they read 0 at rest (at most 1 s)
+def settle_after_reset(var):
+    if var.first == 0:
+        var.commander.CommanderResetCounters()
+        var.first = 1
+        return False
+
+    if not settle.wait("reset", 101, zero=("Counter_5", "Counter_7")):
+        return False
+
+    var.first = 0
+    return True
+
+
+# Once a commander reported that it is done, wait until the axes and the arm
+# are at rest (at most 1 s)
+def wait_after(var, done):
+    return done and settle.wait("after", 102)
+
+
+# Move x and y to the storage position, then reset the counters
+def move_to_storage(var, y):
+    if var.first2 == 0:
+        if var.commander.CommanderLager(var.pos[0], y) == 1:
+            var.first2 = 1
+        return False
+
+    if settle_after_reset(var):
+        var.first2 = 0
+        return True
+    return False
+
+
+# Run the current step, True when the whole sequence is finished
+def run_steps(var, steps):
+    if steps[var.step](var):
+        var.step += 1
+        if var.step == len(steps):
+            var.step = 0
+            return True
+    return False
+
+
+# MOVE_STORAGE_PICKUP: move to storage, lower (below for lifting), extend, lift, retract
+STORAGE_PICKUP_STEPS = (
+    settle_after_reset,  # counter reset
+    lambda var: move_to_storage(var, var.pos[1] + 50),  # x and y axis storage
+    lambda var: var.commander.CommanderOut() == 1 and settle_after_reset(var),  # extend
+    lambda var: wait_after(var, var.commander.CommanderLift() == 1),  # lift
+    lambda var: wait_after(var, var.commander.CommanderIn() == 1),  # retract
+)
+
+# MOVE_BELT_DROPOFF: move to belt (x and y default), extend, lower
+BELT_DROPOFF_STEPS = (
+    lambda var: wait_after(var, var.commander.CommanderDefault() == 1),  # move x and y
+    lambda var: var.commander.CommanderOut() == 1 and settle_after_reset(var),  # extend
+    lambda var: wait_after(var, var.commander.CommanderDown(1400) == 1),  # lower
+)
+
+# BELT_PICKUP: up and back in
+BELT_PICKUP_STEPS = (
+    lambda var: var.commander.CommanderDefault(0) == 1,  # all the way up (default function)
+    lambda var: var.commander.CommanderIn() == 1,  # retract in
+)
+
+# MOVE_STORAGE_DROPOFF: move to storage, lower (above for placing), extend, place, retract
+STORAGE_DROPOFF_STEPS = (
+    settle_after_reset,  # counter reset
+    lambda var: move_to_storage(var, var.pos[1] - 150),  # x and y axis storage
+    lambda var: var.commander.CommanderOut() == 1 and settle_after_reset(var),  # extend
+    lambda var: wait_after(var, var.commander.CommanderDown() == 1),  # lower / place
+    lambda var: wait_after(var, var.commander.CommanderIn() == 1),  # retract
+)
+
+
+# --- STATE MACHINE ---
+
+storage = StateMachine("high_bay_warehouse")
+DEFAULT = storage.state("DEFAULT")
+IDLE = storage.state("IDLE")
+MOVE_STORAGE_PICKUP = storage.state("MOVE_STORAGE_PICKUP")
+MOVE_BELT_DROPOFF = storage.state("MOVE_BELT_DROPOFF")
+BELT_FRONT = storage.state("BELT_FRONT")
+BELT_BACK = storage.state("BELT_BACK")
+BELT_PICKUP = storage.state("BELT_PICKUP")
+MOVE_STORAGE_DROPOFF = storage.state("MOVE_STORAGE_DROPOFF")
+
+
+# DEFAULT state: move to home/zero position at the beginning and end of a cycle
+@storage.during(DEFAULT, targets=(IDLE,))
+def default_state(m):
+    if wait_after(m.var, m.var.commander.CommanderDefault() == 1):
+        return IDLE
+    return None
+
+
+# IDLE state: here the robot waits idle for a task via Modbus
+def take_task(m):
+    m.var.pos = m.var.positions[rpi.io.Input_1.value]
+    settle.count_task()
+
+
+storage.transition(IDLE, MOVE_STORAGE_PICKUP, guard=lambda m: rpi.io.Input_1.value != 0, action=take_task)
+
+
+@storage.during(MOVE_STORAGE_PICKUP, targets=(MOVE_BELT_DROPOFF,))
+def move_storage_pickup(m):
+    if run_steps(m.var, STORAGE_PICKUP_STEPS):
+        return MOVE_BELT_DROPOFF
+    return None
+
+
+@storage.during(MOVE_BELT_DROPOFF, targets=(BELT_FRONT,))
+def move_belt_dropoff(m):
+    if run_steps(m.var, BELT_DROPOFF_STEPS):
+        return BELT_FRONT
+    return None
+
+
+# BELT_FRONT: move forward and wait until it has been picked up
+def pallet_picked_up(m):
+    outputs["Output_1"] = 0
+
+
+# Wait for signal that it was picked up (check Modbus signal)
+storage.transition(BELT_FRONT, BELT_BACK, guard=lambda m: rpi.io.Input_2.value == 1, action=pallet_picked_up)
+
+
+@storage.during(BELT_FRONT)
+def belt_front(m):
+    if rpi.io.I_2.value == 0:
+        # belt on
+        outputs["O_1"] = 1
+
+    elif rpi.io.I_3.value == 0:
+        # belt off
+        if m.var.delay_counter <= 25:
+            m.var.delay_counter += 1
+        else:
+            m.var.delay_counter = 0
+            outputs["O_1"] = 0
+
+        outputs["Output_1"] = 1
+
+
+# BELT_BACK: move pallet backwards
+@storage.during(BELT_BACK, targets=(BELT_PICKUP,))
+def belt_back(m):
+    if rpi.io.I_3.value == 0:
+        # belt reverse on
+        outputs["O_2"] = 1
+
+    elif rpi.io.I_2.value == 0:
+        # belt reverse off
+        outputs["O_2"] = 0
+        return BELT_PICKUP
+    return None
+
+
+@storage.during(BELT_PICKUP, targets=(MOVE_STORAGE_DROPOFF,))
+def belt_pickup(m):
+    if run_steps(m.var, BELT_PICKUP_STEPS):
+        return MOVE_STORAGE_DROPOFF
+    return None
+
+
+@storage.during(MOVE_STORAGE_DROPOFF, targets=(DEFAULT,))
+def move_storage_dropoff(m):
+    if run_steps(m.var, STORAGE_DROPOFF_STEPS):
+        return DEFAULT
+    return None
+
+
 def cycleprogram(cycletools):
     # Initialization at program start
     if cycletools.first:
@@ -123,276 +345,34 @@ def cycleprogram(cycletools):
         }
 
         cycletools.var.commander = RobotCommander(cycletools.var)
-        cycletools.var.current_state = "DEFAULT"
         cycletools.var.step = 0
         cycletools.var.delay_counter = 0
         cycletools.var.pos = 0
-        cycletools.var.delay_counter = 0
         cycletools.var.first = 0
         cycletools.var.first2 = 0
+        cycletools.var.machine = storage.compile(cycletools.var, initial=DEFAULT)
 
-    # --- STATE MACHINE ---
-
-    # DEFAULT state: move to home/zero position at the beginning and end of a cycle
-    if cycletools.var.current_state == "DEFAULT":
-        if cycletools.var.commander.CommanderDefault() == 1:
-            if cycletools.var.delay_counter <= 100:
-                cycletools.var.delay_counter += 1
-            else:
-                cycletools.var.current_state = "IDLE"
-                cycletools.var.delay_counter = 0
-
-    # IDLE state: waiting
-    elif cycletools.var.current_state == "IDLE":
-        # Here the robot waits idle for a task via Modbus
-        # cycletools.var.pos = cycletools.var.positions["1_1"]  # for testing
-
-        if rpi.io.Input_1.value != 0:
-            cycletools.var.pos = cycletools.var.positions[rpi.io.Input_1.value]
-            cycletools.var.current_state = "MOVE_STORAGE_PICKUP"
-
-    # MOVE_STORAGE_PICKUP: move to storage, lower (below for lifting), extend, lift, retract
-    elif cycletools.var.current_state == "MOVE_STORAGE_PICKUP":
-
-        # counter reset
-        if cycletools.var.step == 0:
-            if cycletools.var.first == 0:
-                cycletools.var.commander.CommanderResetCounters()
-                cycletools.var.first = 1
-            else:
-                if cycletools.var.delay_counter < 100:
-                    cycletools.var.delay_counter += 1
-                else:
-                    cycletools.var.step = 1
-                    cycletools.var.delay_counter = 0
-                    cycletools.var.first = 0
-
-        # x and y axis storage
-        elif cycletools.var.step == 1:
-            if cycletools.var.first2 == 0:
-                if (
-                    cycletools.var.commander.CommanderLager(
-                        cycletools.var.pos[0], cycletools.var.pos[1] + 50
-                    )
-                    == 1
-                ):
-                    cycletools.var.first2 = 1
-            else:
-                if cycletools.var.first == 0:
-                    cycletools.var.commander.CommanderResetCounters()
-                    cycletools.var.first = 1
-                else:
-                    if cycletools.var.delay_counter < 100:
-                        cycletools.var.delay_counter += 1
-                    else:
-                        cycletools.var.step = 2
-                        cycletools.var.first = 0
-                        cycletools.var.first2 = 0
-                        cycletools.var.delay_counter = 0
-
-        # extend
-        elif cycletools.var.step == 2:
-            if cycletools.var.commander.CommanderOut() == 1:
-                if cycletools.var.first == 0:
-                    cycletools.var.commander.CommanderResetCounters()
-                    cycletools.var.first = 1
-                else:
-                    if cycletools.var.delay_counter < 100:
-                        cycletools.var.delay_counter += 1
-                    else:
-                        cycletools.var.step = 3
-                        cycletools.var.first = 0
-                        cycletools.var.delay_counter = 0
-
-        # lift
-        elif cycletools.var.step == 3:
-            if cycletools.var.commander.CommanderLift() == 1:
-                if cycletools.var.delay_counter <= 100:
-                    cycletools.var.delay_counter += 1
-                else:
-                    cycletools.var.delay_counter = 0
-                    cycletools.var.step = 4
-
-        # retract
-        elif cycletools.var.step == 4:
-            if cycletools.var.commander.CommanderIn() == 1:
-                if cycletools.var.delay_counter <= 100:
-                    cycletools.var.delay_counter += 1
-                else:
-                    cycletools.var.delay_counter = 0
-                    cycletools.var.step = 5
-
-        elif cycletools.var.step == 5:
-            cycletools.var.step = 0
-            cycletools.var.current_state = "MOVE_BELT_DROPOFF"
-
-    # MOVE_BELT_DROPOFF: move to belt (x and y default), extend, lower
-    elif cycletools.var.current_state == "MOVE_BELT_DROPOFF":
-        # move x and y
-        if cycletools.var.step == 0:
-            # move x and y (default function)
-            if cycletools.var.commander.CommanderDefault() == 1:
-                if cycletools.var.delay_counter <= 100:
-                    cycletools.var.delay_counter += 1
-                else:
-                    cycletools.var.delay_counter = 0
-                    cycletools.var.step = 1
-
-        # extend
-        elif cycletools.var.step == 1:
-            if cycletools.var.commander.CommanderOut() == 1:
-                if cycletools.var.first == 0:
-                    cycletools.var.commander.CommanderResetCounters()
-                    cycletools.var.first = 1
-                else:
-                    if cycletools.var.delay_counter < 100:
-                        cycletools.var.delay_counter += 1
-                    else:
-                        cycletools.var.step = 2
-                        cycletools.var.first = 0
-                        cycletools.var.delay_counter = 0
-
-        # lower
-        elif cycletools.var.step == 2:
-            if cycletools.var.commander.CommanderDown(1400) == 1:
-                if cycletools.var.delay_counter <= 100:
-                    cycletools.var.delay_counter += 1
-                else:
-                    cycletools.var.delay_counter = 0
-                    cycletools.var.step = 0
-                    cycletools.var.current_state = "BELT_FRONT"
-
-    # BELT_FRONT: move forward and wait until it has been picked up
-    elif cycletools.var.current_state == "BELT_FRONT":
-        if rpi.io.I_2.value == 0:
-            # belt on
-            rpi.io.O_1.value = 1
-
-        elif rpi.io.I_3.value == 0:
-            # belt off
-            if cycletools.var.delay_counter <= 25:
-                cycletools.var.delay_counter += 1
-            else:
-                cycletools.var.delay_counter = 0
-                rpi.io.O_1.value = 0
-
-            rpi.io.Output_1.value = 1
-
-        # Wait for signal that it was picked up (check Modbus signal)
-        if rpi.io.Input_2.value == 1:
-            rpi.io.Output_1.value = 0
-            cycletools.var.current_state = "BELT_BACK"
-
-    # BELT_BACK: move pallet backwards
-    elif cycletools.var.current_state == "BELT_BACK":
-        if rpi.io.I_3.value == 0:
-            # belt reverse on
-            rpi.io.O_2.value = 1
-
-        elif rpi.io.I_2.value == 0:
-            # belt reverse off
-            rpi.io.O_2.value = 0
-            cycletools.var.current_state = "BELT_PICKUP"
-
-    # BELT_PICKUP: up and back in
-    elif cycletools.var.current_state == "BELT_PICKUP":
-        if cycletools.var.step == 0:
-            # all the way up (default function)
-            if cycletools.var.commander.CommanderDefault(0) == 1:
-                cycletools.var.step = 1
-
-        elif cycletools.var.step == 1:
-            # retract in
-            if cycletools.var.commander.CommanderIn() == 1:
-                cycletools.var.step = 0
-                cycletools.var.current_state = "MOVE_STORAGE_DROPOFF"
-
-    # MOVE_STORAGE_DROPOFF: move to storage, lower (above for placing), extend, place, retract
-    elif cycletools.var.current_state == "MOVE_STORAGE_DROPOFF":
-        if cycletools.var.step == 0:
-            if cycletools.var.first == 0:
-                cycletools.var.commander.CommanderResetCounters()
-                cycletools.var.first = 1
-            else:
-                if cycletools.var.delay_counter < 100:
-                    cycletools.var.delay_counter += 1
-                else:
-                    cycletools.var.step = 1
-                    cycletools.var.delay_counter = 0
-                    cycletools.var.first = 0
-
-        # x and y axis storage
-        elif cycletools.var.step == 1:
-            if cycletools.var.first2 == 0:
-                if (
-                    cycletools.var.commander.CommanderLager(
-                        cycletools.var.pos[0], cycletools.var.pos[1] - 150
-                    )
-                    == 1
-                ):
-                    cycletools.var.first2 = 1
-            else:
-                if cycletools.var.first == 0:
-                    cycletools.var.commander.CommanderResetCounters()
-                    cycletools.var.first = 1
-                else:
-                    if cycletools.var.delay_counter < 100:
-                        cycletools.var.delay_counter += 1
-                    else:
-                        cycletools.var.step = 2
-                        cycletools.var.first = 0
-                        cycletools.var.first2 = 0
-                        cycletools.var.delay_counter = 0
-
-        # extend
-        elif cycletools.var.step == 2:
-            if cycletools.var.commander.CommanderOut() == 1:
-                if cycletools.var.first == 0:
-                    cycletools.var.commander.CommanderResetCounters()
-                    cycletools.var.first = 1
-                else:
-                    if cycletools.var.delay_counter < 100:
-                        cycletools.var.delay_counter += 1
-                    else:
-                        cycletools.var.step = 3
-                        cycletools.var.first = 0
-                        cycletools.var.delay_counter = 0
-
-        # lower / place
-        elif cycletools.var.step == 3:
-            if cycletools.var.commander.CommanderDown() == 1:
-                if cycletools.var.delay_counter <= 100:
-                    cycletools.var.delay_counter += 1
-                else:
-                    cycletools.var.delay_counter = 0
-                    cycletools.var.step = 4
-
-        # retract
-        elif cycletools.var.step == 4:
-            if cycletools.var.commander.CommanderIn() == 1:
-                if cycletools.var.delay_counter <= 100:
-                    cycletools.var.delay_counter += 1
-                else:
-                    cycletools.var.delay_counter = 0
-                    cycletools.var.step = 5
-
-        elif cycletools.var.step == 5:
-            cycletools.var.step = 0
-            cycletools.var.current_state = "DEFAULT"
+    cycletools.var.machine.step()
+    outputs.flush()
+    modbus_tap.sample()
 
 
 # This function is called when the program ends (e.g. Ctrl+C)
 def programend():
     print("Program end: resetting outputs...")
+    print(monitor.report())
+    print(outputs.report())
     # Ensure all outputs are turned off
-    rpi.io.O_1.value = 0
-    rpi.io.O_2.value = 0
-    rpi.io.O_3.value = 0
-    rpi.io.O_4.value = 0
-    rpi.io.O_5.value = 0
-    rpi.io.O_6.value = 0
-    rpi.io.O_7.value = 0
-    rpi.io.O_8.value = 0
+    outputs.off("O_1", "O_2", "O_3", "O_4", "O_5", "O_6", "O_7", "O_8")
+    outputs.flush()
+    modbus_tap.sample()
+    capture.close()
+    print(capture.report())
+    recorder.close()
+    print(recorder.report())
+    stops.save()
+    print(stops.report())
+    print(settle.report())
 
 
 # Register the programend function for graceful shutdown
@@ -400,5 +380,5 @@ rpi.handlesignalend(programend)
 
 # Start the main program loop (cycle operation)
 print("Starting the robot cycle loop...")
-rpi.cycleloop(cycleprogram, cycletime=rpi.cycletime)
-print("Robot cycle loop finished.")
\ No newline at end of file
+rpi.cycleloop(monitor.wrap(recorder.wrap(cycleprogram)), cycletime=rpi.cycletime)
+print("Robot cycle loop finished.")
@@ -1,304 +1,567 @@
+import os
+import sys
 import revpimodio2
-import queue
 import time
 import asyncio
 import threading
 from asyncua import Server, ua
 
-# Shared object for OPC UA and cycle loop
-class RobotSharedData:
+# Make the shared REFLECT library (code/reflect) importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from reflect.anomaly import AnomalyDetector, SignalRule  # noqa: E402
+from reflect.capture import TrafficCapture  # noqa: E402
+from reflect.ingest import ORDER_POSITIONS, OrderInbox, add_order_methods  # noqa: E402
+from reflect.instrumentation import CycleMonitor  # noqa: E402
+from reflect.motion import AxisMotion, CalibrationMoves, StopCalibration  # noqa: E402
+from reflect.opcua_exchange import NodeExchange  # noqa: E402
+from reflect.opcua_security import configure_server  # noqa: E402
+from reflect.outputs import OutputImage  # noqa: E402
+from reflect.replay import InputRecorder  # noqa: E402
+from reflect.settle import SettleDetector  # noqa: E402
+from reflect.snapshot import SharedData  # noqa: E402
+from reflect.statemachine import StateMachine  # noqa: E402
+from reflect.taskqueue import TaskModel, TaskQueue, Workload  # noqa: E402
+from reflect.wiring import WIRING  # noqa: E402
+
+# OPC UA exchange: "subscription" (clients write, server reacts on each write)
+# or "polling" (nodes read every 50 ms)
+OPCUA_MODE = "subscription"
+
+# Security modes offered to the clients, comma separated: "none",
+# "Basic256Sha256:Sign", "Basic256Sha256:SignAndEncrypt", "Aes128:Sign", ...
+# (see reflect.opcua_security)
+OPCUA_SECURITY = os.environ.get("REFLECT_OPCUA_SECURITY", "none")
+
+# Listening address, REFLECT_OPCUA_ENDPOINT overrides it (e.g. opc.tcp://127.0.0.1:4840)
+OPCUA_ENDPOINT = os.environ.get("REFLECT_OPCUA_ENDPOINT", "opc.tcp://0.0.0.0:4840")
+
+# Shared object for OPC UA and cycle loop, exchanged as whole frames
+class RobotSharedData(SharedData):
     def __init__(self):
-        self.storage_status = 0
-        self.multi_status = 0
-        self.position_at_storage = 0
-        self.pallet_clear = 0
-        self.white = 1
-        self.red = 1
-        self.blue = 1
-        self.is_running = True
+        super().__init__(
+            # written by the OPC UA clients
+            received={"storage_status": 0, "multi_status": 0, "white": 1, "red": 1, "blue": 1},
+            # written by the cycle loop
+            sent={"position_at_storage": 0, "pallet_clear": 0},
+        )
 
 
 shared_data = RobotSharedData()
 
+# Cycle side: one consistent frame of the OPC UA values per cycle
+cycle_data = shared_data.cycle
+
+# OPC UA values recorded if REFLECT_CAPTURE names a directory
+capture = TrafficCapture(os.environ.get("REFLECT_CAPTURE"), "gripper")
+opcua_recorder = capture.recorder()  # used by the OPC UA thread only
+
+# Plausibility of the station signals, checked on every value the server
+# receives or writes; alerts are printed
+SIGNAL_RULES = {
+    "storage_status": SignalRule(values=(0, 1)),
+    # the oven needs 5 s after a drop-off plus 10 s burning before it is ready again
+    "multi_status": SignalRule(values=(0, 1), min_period=15.0),
+    "white": SignalRule(values=(0, 1)),
+    "red": SignalRule(values=(0, 1)),
+    "blue": SignalRule(values=(0, 1)),
+    "position_at_storage": SignalRule(values=range(10)),
+    "pallet_clear": SignalRule(values=(0, 1)),
+}
+detector = AnomalyDetector(SIGNAL_RULES)
+
+# Orders from outside (reflect.ingest): every submit is answered at once
+# (accepted with an order id, queue full, rejected, duplicate) and the cycle
+# takes the accepted ones over; clients submit with the methods of the OPC UA
+# object "Orders". REFLECT_GRIPPER_SOURCE "orders" leaves the demo sequence
+# (ZYKLUS) out, the gripper then only runs the orders
+TASK_SOURCE = os.environ.get("REFLECT_GRIPPER_SOURCE", "demo")
+ORDER_CAPACITY = 16  # orders accepted and not started yet
+orders = OrderInbox(ORDER_CAPACITY, ORDER_POSITIONS, slots=range(1, 10))
+
+
 async def opcua_server_task(data_obj):
     server = Server()
     await server.init()
     
     # Defined IP of the gripper (OPC UA Server)
-    server.set_endpoint("opc.tcp://0.0.0.0:4840")
-    
-    idx = await server.register_namespace("http://revpi")
-    obj = await server.nodes.objects.add_object(idx, "Control")
-    
-    # Create nodes
-    node_a = await obj.add_variable(idx, "StorageStatus", data_obj.storage_status)
-    node_b = await obj.add_variable(idx, "MultiStatus", data_obj.multi_status)
-    node_c = await obj.add_variable(idx, "PositionAtStorage", data_obj.position_at_storage)
-    node_d = await obj.add_variable(idx, "PalletClear", data_obj.pallet_clear)
-    node_e = await obj.add_variable(idx, "White", data_obj.white)
-    node_f = await obj.add_variable(idx, "Red", data_obj.red)
-    node_g = await obj.add_variable(idx, "Blue", data_obj.blue)
+    server.set_endpoint(OPCUA_ENDPOINT)
+    await configure_server(server, OPCUA_SECURITY, name="gripper")
     
-    # Allow write access
-    await node_a.set_writable()
-    await node_b.set_writable()
-    await node_c.set_writable()
-    await node_d.set_writable()
-    await node_e.set_writable()
-    await node_f.set_writable()
-    await node_g.set_writable()
-
-    print("Server running at opc.tcp://192.168.210.102:4840")
+    # Namespace, object and variables as declared in reflect/wiring.json
+    reads, writes = await WIRING.server_nodes(server, data_obj, "gripper")
+
+    # Methods SubmitOrder and OrderStatus for the orders
+    await add_order_methods(server, orders, WIRING.namespace)
+
+    # Values written by the clients are taken over in a PostWrite callback
+    # (subscription mode) or read every 50 ms (polling mode)
+    exchange = NodeExchange(
+        data_obj,
+        reads=reads,
+        writes=writes,
+        mode=OPCUA_MODE,
+        convert=int,
+        recorder=opcua_recorder,
+        detector=detector,
+    )
+    await exchange.start_server(server)
+
+    print(f"Server running at {OPCUA_ENDPOINT}")
     
     async with server:
-        while data_obj.is_running:
-            # 1. Receive
-            # Read from nodes and store in shared object
-            data_obj.storage_status = await node_a.get_value()
-            data_obj.multi_status = await node_b.get_value()
-
-            data_obj.white = await node_e.get_value()
-            data_obj.red = await node_f.get_value()
-            data_obj.blue = await node_g.get_value()
-            
-            # 2. Send
-            # Take values from shared object and write to nodes
-            await node_c.write_value(data_obj.position_at_storage)
-            await node_d.write_value(data_obj.pallet_clear)
-            
-            await asyncio.sleep(0.05)
+        # 1. Receive: values from the clients are stored in the shared object
+        # 2. Send: values of the shared object are written to the nodes
+        await exchange.run()
         
 
 def start_opcua_thread():
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    loop.run_until_complete(opcua_server_task(shared_data))        
+    loop.run_until_complete(opcua_server_task(shared_data.opcua))        
 
 
 opc_thread = threading.Thread(target=start_opcua_thread, daemon=True)
 opc_thread.start()
 
 
-# Global task queue
-task_queue = queue.Queue()
+# Order of the pending tasks: "fifo" or "travel" (shortest expected task
+# first, see reflect.taskqueue); REFLECT_GRIPPER_TASKS overrides it
+TASK_POLICY = os.environ.get("REFLECT_GRIPPER_TASKS", "fifo")
 
-# Helper structure to track tasks already inside the queue
-tasks_in_queue_set = set()
+# Drop-offs that feed pick-up positions: a pick-up waits for the earlier ones
+FEEDS = {"multi_drop_off": ("white_pick_up", "red_pick_up", "blue_pick_up")}
 
+# Global task queue, a task is only added once while it is pending
+task_queue = TaskQueue(TASK_POLICY, feeds=FEEDS)
 
-# Function to safely add a task to the queue (duplicate check included)
-def add_task_to_queue(task):
-    if task not in tasks_in_queue_set:
-        task_queue.put(task)
-        tasks_in_queue_set.add(task)
+# Tasks arriving over time from a workload file instead of the demo sequence
+# (ZYKLUS) if REFLECT_GRIPPER_WORKLOAD names one; REFLECT_RECORD keeps the
+# arrivals of a run as <dir>/gripper-tasks.json in the same format
+workload = Workload(os.environ["REFLECT_GRIPPER_WORKLOAD"]) if os.environ.get("REFLECT_GRIPPER_WORKLOAD") else None
+
+
+# Function to safely add a task to the queue; a task already pending is not
+# added again (counted in task_queue.report())
+def add_task_to_queue(task, priority=0, deadline=None, source=None):
+    if task_queue.put(task, priority, deadline, source=source):
         print(f"Task {task} added to the list.")
         return True
-    else:
-        print(f"Task {task} is already in the list. Not added.")
-        return False
+    return False
 
 
-# Initialize RevPi ModIO interface with auto refresh
+# Initialize the RevPi-ModIO interface with automatic refresh
 rpi = revpimodio2.RevPiModIO(autorefresh=True)
-rpi.cycletime = 10  # Cycle time in milliseconds
+rpi.cycletime = 10  # Set the cycle time (in milliseconds)
+
+# Cycle time measurement, reported at program end
+monitor = CycleMonitor(rpi.cycletime, name="gripper")
+
+# Output writes are collected per cycle and passed on once at its end
+outputs = OutputImage(rpi)
+
+# Inputs recorded every cycle if REFLECT_RECORD names a directory, for
+# python -m reflect.replay
+recorder = InputRecorder(os.environ.get("REFLECT_RECORD"), "gripper", rpi, shared=shared_data)
+
+# Tasks added in IDLE, one group per cycle of the demo sequence
+# (pick_up_pos_name, drop_off_pos_name, storage_slot)
+ZYKLUS = (
+    (("storage", "multi_drop_off", 1), ("storage", "multi_drop_off", 2), ("storage", "multi_drop_off", 3)),
+    (("white_pick_up", "storage", 3), ("red_pick_up", "storage", 2), ("blue_pick_up", "storage", 1)),
+    (("storage", "multi_drop_off", 4), ("storage", "multi_drop_off", 5), ("storage", "multi_drop_off", 6)),
+    (("white_pick_up", "storage", 6), ("red_pick_up", "storage", 5), ("blue_pick_up", "storage", 4)),
+    (("storage", "multi_drop_off", 7), ("storage", "multi_drop_off", 8), ("storage", "multi_drop_off", 9)),
+    (("white_pick_up", "storage", 9), ("red_pick_up", "storage", 8), ("blue_pick_up", "storage", 7)),
+)
+
+# Axes of MOVE_TO_POS, in the order of sequential motion: (counter, forward output, backward output)
+AXES = (
+    ("Counter_9", "O_12", "O_11"),  # axis 1
+    ("Counter_7", "O_10", "O_9"),  # axis 2
+    ("Counter_5", "O_8", "O_7"),  # axis 3
+)
+POSITION_TOLERANCE = 10
+
+# MOVE_TO_POS motion: "sequential" (one axis after the other) or "coordinated"
+# (all axes at once, see reflect.motion); REFLECT_GRIPPER_MOTION=coordinated
+# turns coordinated motion on
+MOTION_MODE = os.environ.get("REFLECT_GRIPPER_MOTION", "sequential")
+
+# Safe envelope of coordinated motion: within this many counts of axis 1
+# around these positions axis 3 (vertical) moves first and alone
+SAFE_ENVELOPE = {"storage": 400, "multi_drop_off": 400}
+
+# Stop times of the axes, learned from their run-out: the motors are switched
+# off early enough to come to rest at the target. Kept in
+# <dir>/gripper-stops.json if REFLECT_CALIBRATION names a directory.
+stops = StopCalibration(os.environ.get("REFLECT_CALIBRATION"), "gripper")
+
+# Test moves (back and forth, 300 and 150 counts from home) per uncalibrated
+# axis before the first task, REFLECT_CALIBRATION_MOVES=2 turns them on.
+# Without them the axes start with the default stop time and learn it from
+# the task moves.
+CALIBRATION_MOVES = int(os.environ.get("REFLECT_CALIBRATION_MOVES", "0"))
+
+# Waits after homing, around the counter resets and before gripping end once
+# the counters and home switches have not changed for SETTLE_WINDOW cycles,
+# at the latest after the fixed waits used so far (reflect.settle);
+# REFLECT_SETTLE=fixed keeps the fixed waits
+SETTLE_WINDOW = 10
+settle = SettleDetector(
+    rpi.io, ("Counter_5", "Counter_7", "Counter_9", "I_1", "I_2", "I_3"), SETTLE_WINDOW,
+    rpi.cycletime, os.environ.get("REFLECT_SETTLE", "sensor"), name="gripper",
+)
+
+
+# --- STATE MACHINE ---
+
+robot = StateMachine("gripper")
+DEFAULT = robot.state("DEFAULT")
+WAIT_FOR_PICKUP_READY = robot.state("WAIT_FOR_PICKUP_READY")
+WAIT_FOR_DROP_OFF_READY = robot.state("WAIT_FOR_DROP_OFF_READY")
+IDLE = robot.state("IDLE")
+MOVE_TO_POS = robot.state("MOVE_TO_POS")
+GRAB = robot.state("GRAB")
+UP_AND_IN = robot.state("UP_AND_IN")
+DROP = robot.state("DROP")
+CALIBRATE = robot.state("CALIBRATE")
+
+
+# DEFAULT state: home the robot or fetch next task
+@robot.during(DEFAULT, targets=(WAIT_FOR_PICKUP_READY, MOVE_TO_POS, IDLE, CALIBRATE))
+def default_state(m):
+    var = m.var
+    if rpi.io.I_1.value == 0:
+        outputs["O_7"] = 1  # Move axis 1 to home
+
+    elif rpi.io.I_2.value == 0:
+        outputs["O_7"] = 0
+        outputs["O_9"] = 1  # Move axis 2 to home
+
+    elif rpi.io.I_3.value == 0:
+        outputs["O_9"] = 0
+        outputs["O_11"] = 1  # Move axis 3 to home
+
+    else:  # All axes are home
+        outputs["O_11"] = 0
+
+        # Phase 1: wait until the axes are at rest at home (at most 0.5 s),
+        # then reset the counters
+        if not var.counters_reset:
+            if settle.wait("home", 51):
+                rpi.io.Counter_5.reset()
+                rpi.io.Counter_7.reset()
+                rpi.io.Counter_9.reset()
+                print("Counters reset.")
+                var.counters_reset = True
+
+        # Phase 2: wait until the counters read 0 at rest (at most 0.5 s)
+        elif settle.wait("reset", 50, zero=("Counter_5", "Counter_7", "Counter_9")):
+            var.counters_reset = False
+
+            # Learn the stop times of uncalibrated axes before the first move
+            if var.calibration.pending():
+                return CALIBRATE
+
+            # Check for next task in the queue (TASK_POLICY), the arm is at home
+            if not task_queue.empty():
+                var.current_task = task_queue.get()  # get next task
+                var.current_order = task_queue.source()  # None unless the task came from an order
+                orders.started(var.current_order)
+
+                print(
+                    f"Starting new task: pick up from {var.current_task[0]} and drop off at {var.current_task[1]}"
+                )
+
+                # Always start with the pick-up position
+                var.is_picking_up = True
+                var.current_position = var.positions[var.current_task[0]]
+
+                # Waiting logic before moving
+                if var.current_task[0] == "storage":
+                    # If picking up from storage: go to waiting state first to request permission
+                    return WAIT_FOR_PICKUP_READY
+
+                # Otherwise start moving immediately
+                return MOVE_TO_POS
+
+            print("All tasks completed. Robot switches to idle.")
+            return IDLE
+
+
+# NEW STATE: wait for approval to pick up from storage
+# (only entered when picking up from storage)
+@robot.on_enter(WAIT_FOR_PICKUP_READY)
+def request_storage_pickup(m):
+    # The pallet must not be brought back while we are requesting it
+    cycle_data.pallet_clear = 0
+    cycle_data.position_at_storage = m.var.current_task[2]  # request to storage
+    print(f"WAIT_FOR_PICKUP_READY: Sending request {m.var.current_task[2]} to storage...")
+
+
+robot.transition(
+    WAIT_FOR_PICKUP_READY,
+    MOVE_TO_POS,
+    guard=lambda m: cycle_data.storage_status != 0,  # assumption: != 0 = storage is ready/confirmed
+    action=lambda m: print("WAIT_FOR_PICKUP_READY: Storage approved. Starting movement."),
+)
+
+
+# EXTENDED STATE: wait for approval for drop-off (storage OR multistation)
+@robot.on_enter(WAIT_FOR_DROP_OFF_READY)
+def request_storage_drop_off(m):
+    if m.var.current_task[1] == "storage":
+        cycle_data.pallet_clear = 0
+        cycle_data.position_at_storage = m.var.current_task[2]  # request target slot
+        print(
+            f"WAIT_FOR_DROP_OFF_READY: Sending request {m.var.current_task[2]} for storage placement..."
+        )
+
+
+robot.transition(
+    WAIT_FOR_DROP_OFF_READY,
+    MOVE_TO_POS,
+    guard=lambda m: m.var.current_task[1] == "storage"
+    and cycle_data.storage_status != 0,  # assumption: != 0 = storage is ready/confirmed
+    action=lambda m: print("WAIT_FOR_DROP_OFF_READY: Storage approved for placement. Starting movement."),
+)
+
+# IMPORTANT: replace '== 1' with your actual READY condition
+# Assumption: MultiStatus controls multistation release
+robot.transition(
+    WAIT_FOR_DROP_OFF_READY,
+    MOVE_TO_POS,
+    guard=lambda m: m.var.current_task[1] == "multi_drop_off"
+    and cycle_data.multi_status == 1,
+    action=lambda m: print("WAIT_FOR_DROP_OFF_READY: Multistation approved. Starting movement."),
+)
+
+
+@robot.during(WAIT_FOR_DROP_OFF_READY)
+def wait_for_drop_off_ready(m):
+    if m.var.current_task[1] == "multi_drop_off":
+        print("WAIT_FOR_DROP_OFF_READY: Robot is waiting for multistation (drop-off approval)...")
+
+
+# IDLE state: robot waits for tasks (can later be filled by external triggers)
+@robot.during(IDLE, targets=(DEFAULT,))
+def idle_state(m):
+    if workload is None and TASK_SOURCE == "demo":
+        for task in ZYKLUS[m.var.zyklus]:
+            add_task_to_queue(task)
+        m.var.zyklus = (m.var.zyklus + 1) % len(ZYKLUS)
+    # Orders and workload tasks: stay idle until one is pending
+    if task_queue.empty():
+        return None
+    return DEFAULT
+
+
+# CALIBRATE state: test moves of every axis from home (CALIBRATION_MOVES), then home again
+@robot.during(CALIBRATE, targets=(DEFAULT,))
+def calibrate(m):
+    calibration = m.var.calibration
+    if calibration.step():
+        if calibration.aborted:
+            print(f"Calibration aborted: {calibration.aborted} did not finish its test move, {stops.report()}")
+        else:
+            print(f"Calibration done, {stops.report()}")
+        return DEFAULT
+    return None
 
 
-def cycleprogram(cycletools):
+# MOVE_TO_POS state: move to the target position (MOTION_MODE)
+@robot.on_enter(MOVE_TO_POS)
+def start_axis_movement(m):
+    m.var.motion.start(m.var.current_position)
 
-    # Initialization when program starts
-    if cycletools.first:
-        print("Initializing robot gripper...")
 
-        # Define robot positions
-        cycletools.var.positions = {
-            "white_pick_up": [910, 690, 1700],
-            "red_pick_up": [760, 810, 1700],
-            "blue_pick_up": [625, 1100, 1700],
-            "storage": [2700, 350, 300],
-            "multi_drop_off": [1805, 1680, 1000],
-        }
+@robot.during(MOVE_TO_POS, targets=(GRAB, DROP))
+def move_to_pos(m):
+    var = m.var
+    if not var.motion.step():
+        # a move that does not finish within max_cycles leaves the axes off
+        if var.motion.failed and var.motion.cycles == var.motion.max_cycles + 1:
+            print(f"Move aborted: {', '.join(var.motion.failed)} not in position, axes off")
+        return None
 
-        cycletools.var.current_state = "DEFAULT"
-        cycletools.var.current_task = None
-        cycletools.var.is_picking_up = True
-        cycletools.var.cycle_step = 0
-        cycletools.var.delay_counter = 0
-        cycletools.var.first = 0
-        cycletools.var.move_axis_state = "AXIS1"
+    # All axes reached their targets, transition to next state once they are
+    # at rest (at most 0.5 s)
+    if settle.site != "position":
+        print("All axes in position.")
+    if settle.wait("position", 51):
+        return GRAB if var.is_picking_up else DROP
+    return None
 
-        # Turn all motors and grippers off
-        rpi.io.O_7.value = 0
-        rpi.io.O_9.value = 0
-        rpi.io.O_11.value = 0
-        rpi.io.O_12.value = 0
-        rpi.io.O_10.value = 0
-        rpi.io.O_8.value = 0
-        rpi.io.O_13.value = 0
-        rpi.io.O_14.value = 0
 
+# GRAB state: activate gripper to pick up
+@robot.on_enter(GRAB)
+def start_grap(m):
+    # If 'storage' is reached here, approval was already obtained in WAIT_FOR_PICKUP_READY
+    if m.var.current_task[0] == "storage":
+        # Reset the storage request because the pallet has been reached/accepted
+        cycle_data.position_at_storage = 0
+        print("GRAB: Storage request reset.")
 
-    # ---------------------------
-    # STATE MACHINE
-    # ---------------------------
+    outputs["O_13"] = 1  # compressor on
 
-    # DEFAULT State: Home robot or fetch next task
-    if cycletools.var.current_state == "DEFAULT":
 
-        if rpi.io.I_1.value == 0:
-            rpi.io.O_7.value = 1  # Move Axis 1 home
+def grip_on(m):
+    outputs["O_14"] = 1  # grip / magnet on
 
-        elif rpi.io.I_2.value == 0:
-            rpi.io.O_7.value = 0
-            rpi.io.O_9.value = 1  # Move Axis 2 home
 
-        elif rpi.io.I_3.value == 0:
-            rpi.io.O_9.value = 0
-            rpi.io.O_11.value = 1  # Move Axis 3 home
+# 0.5 second delay for compressor
+robot.after(GRAB, UP_AND_IN, cycles=50, action=grip_on)
 
-        else:
-            rpi.io.O_11.value = 0
 
-            # Wait after homing (0.5 seconds)
-            if cycletools.var.delay_counter < 50:
-                cycletools.var.delay_counter += 1
+# UP_AND_IN state: retract axes after pick-up (or drop-off)
+@robot.during(UP_AND_IN, targets=(WAIT_FOR_DROP_OFF_READY, MOVE_TO_POS, DEFAULT))
+def up_and_in(m):
+    var = m.var
+    if rpi.io.I_1.value == 0:
+        outputs["O_7"] = 1
+    elif rpi.io.I_2.value == 0:
+        outputs["O_7"] = 0
+        outputs["O_9"] = 1
+    else:
+        outputs["O_9"] = 0
 
-            # Reset counters
-            elif cycletools.var.delay_counter == 50:
+        # Phased logic: wait until at rest, counter reset, wait until they read 0
+        if not var.counters_reset:
+            if settle.wait("up", 51):
                 rpi.io.Counter_5.reset()
                 rpi.io.Counter_7.reset()
-                rpi.io.Counter_9.reset()
+                # not counter 9
                 print("Counters reset.")
-                cycletools.var.delay_counter += 1
-
-            # Additional wait
-            elif cycletools.var.delay_counter < 100:
-                cycletools.var.delay_counter += 1
-
-            else:
-                cycletools.var.delay_counter = 0
-
-                if not task_queue.empty():
-                    cycletools.var.current_task = task_queue.get()
-                    tasks_in_queue_set.remove(cycletools.var.current_task)
-
-                    print(f"Starting new task: Pick up {cycletools.var.current_task[0]} and drop at {cycletools.var.current_task[1]}")
-
-                    cycletools.var.is_picking_up = True
-                    cycletools.var.current_position = cycletools.var.positions[
-                        cycletools.var.current_task[0]
-                    ]
-                    cycletools.var.current_state = "MOVE_TO_POS"
-                    cycletools.var.move_axis_state = "AXIS1"
-
-                else:
-                    print("All tasks completed. Robot switching to idle.")
-                    cycletools.var.current_state = "IDLE"
-
-
-    # MOVE_TO_POS State
-    elif cycletools.var.current_state == "MOVE_TO_POS":
-
-        target_pos = cycletools.var.current_position
-        POSITION_TOLERANCE = 10
-
-        # Axis 1
-        if cycletools.var.move_axis_state == "AXIS1":
-            current_pos = rpi.io.Counter_9.value
-            target = target_pos[0]
-
-            if abs(current_pos - target) <= POSITION_TOLERANCE:
-                rpi.io.O_12.value = 0
-                rpi.io.O_11.value = 0
-                print("Axis 1 reached target. Moving to Axis 2.")
-                cycletools.var.move_axis_state = "AXIS2"
-            else:
-                if current_pos < target:
-                    rpi.io.O_12.value = 1
-                else:
-                    rpi.io.O_11.value = 1
-
-        # Axis 2
-        elif cycletools.var.move_axis_state == "AXIS2":
-            current_pos = rpi.io.Counter_7.value
-            target = target_pos[1]
-
-            if abs(current_pos - target) <= POSITION_TOLERANCE:
-                rpi.io.O_10.value = 0
-                rpi.io.O_9.value = 0
-                print("Axis 2 reached target. Moving to Axis 3.")
-                cycletools.var.move_axis_state = "AXIS3"
-            else:
-                if current_pos < target:
-                    rpi.io.O_10.value = 1
-                else:
-                    rpi.io.O_9.value = 1
-
-        # Axis 3
-        elif cycletools.var.move_axis_state == "AXIS3":
-            current_pos = rpi.io.Counter_5.value
-            target = target_pos[2]
-
-            if abs(current_pos - target) <= POSITION_TOLERANCE:
-                rpi.io.O_8.value = 0
-                rpi.io.O_7.value = 0
-                print("Axis 3 reached target. All axes in position.")
-
-                if cycletools.var.delay_counter < 50:
-                    cycletools.var.delay_counter += 1
-                else:
-                    cycletools.var.delay_counter = 0
-                    if cycletools.var.is_picking_up:
-                        cycletools.var.current_state = "GRAB"
-                    else:
-                        cycletools.var.current_state = "DROP"
-
-            else:
-                if current_pos < target:
-                    rpi.io.O_8.value = 1
-                else:
-                    rpi.io.O_7.value = 1
-
-
-    # GRAB State
-    elif cycletools.var.current_state == "GRAB":
-
-        rpi.io.O_13.value = 1  # Compressor ON
-
-        if cycletools.var.delay_counter < 50:
-            cycletools.var.delay_counter += 1
-        else:
-            rpi.io.O_14.value = 1  # Magnet ON
-            cycletools.var.delay_counter = 0
-            cycletools.var.current_state = "UP_AND_IN"
+                var.counters_reset = True
 
+        elif settle.wait("reset", 50, zero=("Counter_5", "Counter_7")):
+            var.counters_reset = False
 
-    # DROP State
-    elif cycletools.var.current_state == "DROP":
+            # If picked up from storage, the pallet can now be returned
+            if var.current_task[0] == "storage":
+                cycle_data.pallet_clear = 1
+                print("Signal to storage: approval to bring back/finish the removal.")
 
-        rpi.io.O_14.value = 0  # Magnet OFF
+            if var.current_task[1] == "storage":
+                cycle_data.pallet_clear = 1
+                print("DROP: Signal to storage: approval to bring back/finish the placement.")
+
+            if var.is_picking_up:
+                # Just picked up -> now move to drop-off position
+                var.is_picking_up = False
+                drop_off_pos_name = var.current_task[1]
+                var.current_position = var.positions[drop_off_pos_name]
+
+                # If drop-off is storage OR multi_drop_off, wait for approval first
+                if drop_off_pos_name in ("storage", "multi_drop_off"):
+                    return WAIT_FOR_DROP_OFF_READY
+                return MOVE_TO_POS
+
+            # Just dropped off -> task complete
+            task_queue.done(var.current_task)
+            orders.finished(var.current_order)
+            var.current_order = None
+            settle.count_task()
+            var.current_task = None
+            return DEFAULT
+    return None
 
-        if cycletools.var.delay_counter < 50:
-            cycletools.var.delay_counter += 1
-        else:
-            cycletools.var.delay_counter = 0
-            cycletools.var.current_state = "UP_AND_IN"
+
+# DROP state: release item
+@robot.on_enter(DROP)
+def start_drop(m):
+    if m.var.current_task[1] == "storage":
+        # No waiting/request here, since it already happened in WAIT_FOR_DROP_OFF_READY
+        cycle_data.position_at_storage = 0
+        print("DROP: Storage request for placement reset.")
+
+    outputs["O_14"] = 0  # open gripper / magnet off
+
+
+# 0.5 second delay to release
+robot.after(DROP, UP_AND_IN, cycles=50)
+
+
+def cycleprogram(cycletools):
+    # Latest frame from the OPC UA thread, unchanged for the whole cycle
+    cycle_data.refresh()
+
+    # Initialization at program start
+    if cycletools.first:
+        print("Initializing the robot gripper...")
+
+        # Define robot positions - using a dictionary for better readability and access
+        cycletools.var.positions = {
+            "white_pick_up": [910, 690, 1700],     # white pick-up
+            "red_pick_up": [760, 810, 1700],       # red pick-up
+            "blue_pick_up": [625, 1100, 1700],     # blue pick-up
+            "storage": [2700, 350, 300],           # unified storage position
+            "multi_drop_off": [1805, 1680, 1000],  # multi drop-off
+        }
+
+        # Current task (tuple: (pick_up_pos_name, drop_off_pos_name, storage_slot))
+        cycletools.var.current_task = None
+        cycletools.var.current_order = None  # order of the current task (reflect.ingest), if any
+
+        # True when moving to pick-up position, False for drop-off position
+        cycletools.var.is_picking_up = True
+
+        cycletools.var.zyklus = 0
+        cycletools.var.counters_reset = False
+
+        # Axis motion of MOVE_TO_POS
+        cycletools.var.motion = AxisMotion(
+            outputs, rpi.io, AXES, POSITION_TOLERANCE, MOTION_MODE, vertical=2,
+            envelope=[(cycletools.var.positions[name][0], width) for name, width in SAFE_ENVELOPE.items()],
+            stops=stops,
+        )
+        cycletools.var.calibration = CalibrationMoves(cycletools.var.motion, trials=CALIBRATION_MOVES)
+
+        # Expected task durations for TASK_POLICY "travel"
+        task_queue.model = TaskModel(cycletools.var.positions, mode=MOTION_MODE)
+
+        cycletools.var.machine = robot.compile(cycletools.var, initial=DEFAULT)
+
+        # Ensure all motors and grippers are off initially
+        outputs.off("O_7", "O_9", "O_11", "O_12", "O_10", "O_8", "O_13", "O_14")
+
+    # Orders accepted since the last cycle; an order takes over the same task
+    # pending from the demo sequence or a workload
+    for order in orders.drain():
+        if not add_task_to_queue(order.task, order.priority, order.deadline, source=order):
+            orders.refused(order)
+
+    if workload is not None:
+        for entry in workload.due():
+            add_task_to_queue(tuple(entry["task"]), entry.get("priority", 0), entry.get("deadline"))
+
+    cycletools.var.machine.step()
+    cycle_data.publish()
+    outputs.flush()
 
 
 def programend():
     print("Program end: resetting outputs...")
-
-    rpi.io.O_7.value = 0
-    rpi.io.O_9.value = 0
-    rpi.io.O_11.value = 0
-    rpi.io.O_12.value = 0
-    rpi.io.O_10.value = 0
-    rpi.io.O_8.value = 0
-    rpi.io.O_13.value = 0
-    rpi.io.O_14.value = 0
+    print(monitor.report())
+    print(outputs.report())
+    print(detector.report())
+    outputs.off("O_7", "O_9", "O_11", "O_12", "O_10", "O_8", "O_13", "O_14")
+    outputs.flush()
+    capture.close()
+    print(capture.report())
+    recorder.close()
+    print(recorder.report())
+    stops.save()
+    print(stops.report())
+    print(task_queue.report())
+    print(orders.report())
+    print(settle.report())
+    if os.environ.get("REFLECT_RECORD"):
+        task_queue.save_arrivals(os.path.join(os.environ["REFLECT_RECORD"], "gripper-tasks.json"))
 
 
 rpi.handlesignalend(programend)
 
 print("Starting robot cycle loop...")
-rpi.cycleloop(cycleprogram, cycletime=rpi.cycletime)
-print("Cycle loop ended.")
\ No newline at end of file
+rpi.cycleloop(monitor.wrap(recorder.wrap(cycleprogram)), cycletime=rpi.cycletime)
+print("Cycle loop ended.")
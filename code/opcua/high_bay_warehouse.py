@@ -1,156 +1,216 @@
+import os
+import sys
 import time
 import threading
 import asyncio
 import revpimodio2
-from asyncua import Client, Node, ua
+from asyncua import Node, ua
+
+# Make the shared REFLECT library (code/reflect) importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from reflect.capture import TrafficCapture  # noqa: E402
+from reflect.instrumentation import CycleMonitor  # noqa: E402
+from reflect.motion import AxisMotion, StopCalibration  # noqa: E402
+from reflect.opcua_exchange import NodeExchange  # noqa: E402
+from reflect.opcua_security import ClientSession  # noqa: E402
+from reflect.outputs import OutputImage  # noqa: E402
+from reflect.replay import InputRecorder  # noqa: E402
+from reflect.settle import SettleDetector  # noqa: E402
+from reflect.snapshot import SharedData  # noqa: E402
+from reflect.statemachine import StateMachine  # noqa: E402
+from reflect.wiring import WIRING  # noqa: E402
 
 # Initialize the RevPi-ModIO interface with automatic refresh
 rpi = revpimodio2.RevPiModIO(autorefresh=True)
 rpi.cycletime = 10  # Set the cycle time (in milliseconds)
 
+# Cycle time measurement, reported at program end
+monitor = CycleMonitor(rpi.cycletime, name="high_bay_warehouse")
+
+# Output writes are collected per cycle and passed on once at its end
+outputs = OutputImage(rpi)
+
 # --- CONFIGURATION ---
-SERVER_URL = "opc.tcp://192.168.210.102:4840"
-NODE_ID_INPUT_POS = "ns=2;i=4"  
-NODE_ID_PICKUP_DONE = "ns=2;i=5"
-NODE_ID_ROBOT_STATUS = "ns=2;i=2" 
+# Gripper server, REFLECT_OPCUA_URL overrides it (e.g. opc.tcp://127.0.0.1:4840)
+SERVER_URL = os.environ.get("REFLECT_OPCUA_URL", "opc.tcp://192.168.210.102:4840")
+# Security mode: "none" or <policy>:<mode>, e.g. "Basic256Sha256:SignAndEncrypt"
+# (see reflect.opcua_security); the server has to offer it
+OPCUA_SECURITY = os.environ.get("REFLECT_OPCUA_SECURITY", "none")
+
+# OPC UA exchange: "subscription" (data change notifications, writes only on
+# change) or "polling" (nodes read in one request every 50 ms)
+OPCUA_MODE = "subscription"
+PUBLISHING_INTERVAL = 10  # ms, how often the server sends data changes
+SAMPLING_INTERVAL = 0  # ms, 0 = as fast as the server samples
 
 # --- 1. SHARED DATA OBJECT (The Bridge) ---
-class RobotSharedData:
+class RobotSharedData(SharedData):
     def __init__(self):
-        # Values read from the server
-        self.target_pos_index = 0
-        self.pickup_done_signal = 0
-        
-        # Value written to the server
-        self.robot_ready_for_pickup = 0
-        
-        self.is_running = True
+        super().__init__(
+            # Values read from the server
+            received={"target_pos_index": 0, "pickup_done_signal": 0},
+            # Value written to the server
+            sent={"robot_ready_for_pickup": 0},
+        )
 
 shared_data = RobotSharedData()
 
+# Cycle side: one consistent frame of the OPC UA values per cycle
+cycle_data = shared_data.cycle
+
+# OPC UA values recorded if REFLECT_CAPTURE names a directory
+capture = TrafficCapture(os.environ.get("REFLECT_CAPTURE"), "high_bay_warehouse")
+opcua_recorder = capture.recorder()  # used by the OPC UA thread only
+
+# Inputs recorded every cycle if REFLECT_RECORD names a directory, for
+# python -m reflect.replay
+recorder = InputRecorder(os.environ.get("REFLECT_RECORD"), "high_bay_warehouse", rpi, shared=shared_data)
+
+
+# One session for the whole run: the secure channel is renewed in the
+# background and a lost connection re-activates the same session
+session = ClientSession(SERVER_URL, OPCUA_SECURITY, name="high_bay_warehouse")
+
 
 async def opcua_client_task(data_obj):
     while data_obj.is_running:
-        client = Client(url=SERVER_URL)
         try:
-            await client.connect()
-            print("OPC UA Client: Connected")
-            
-            node_pos = client.get_node(NODE_ID_INPUT_POS)
-            node_done = client.get_node(NODE_ID_PICKUP_DONE)
-            node_ready = client.get_node(NODE_ID_ROBOT_STATUS)
+            client = await session.connect()
+            print(f"OPC UA Client: Connected ({session.describe()})")
             
-            while data_obj.is_running:
-                # READ
-                data_obj.target_pos_index = int(await node_pos.get_value())
-                data_obj.pickup_done_signal = int(await node_done.get_value())
-                
-                # WRITE
-                await node_ready.set_value(data_obj.robot_ready_for_pickup)
-                
-                await asyncio.sleep(0.05)
+            # Nodes as declared in reflect/wiring.json
+            reads, writes = await WIRING.client_nodes(client, "high_bay_warehouse")
+
+            exchange = NodeExchange(
+                data_obj,
+                reads=reads,
+                writes=writes,
+                mode=OPCUA_MODE,
+                publishing_interval=PUBLISHING_INTERVAL,
+                sampling_interval=SAMPLING_INTERVAL,
+                convert=int,
+                recorder=opcua_recorder,
+            )
+            await exchange.start_client(client)
+
+            # READ position and pickup signal, WRITE ready status
+            await exchange.run()
                 
         except Exception as e:
             print(f"Connection lost: {e}. Reconnecting in 5s...")
-            try:
-                await client.disconnect()
-            except:
-                pass
+            await session.disconnect()
             await asyncio.sleep(5)
 
 
 def start_opcua_thread():
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    loop.run_until_complete(opcua_client_task(shared_data))
+    loop.run_until_complete(opcua_client_task(shared_data.opcua))
+
+
+# Storage moves (CommanderLager): x and y axis driven together and switched
+# off early enough to come to rest at the slot, correcting backwards if needed
+# (reflect.motion). The stop times are learned from every stop and kept in
+# <dir>/high_bay_warehouse-stops.json if REFLECT_CALIBRATION names a directory.
+STORAGE_AXES = (
+    ("Counter_5", "O_3", "O_4"),  # x
+    ("Counter_7", "O_5", "O_6"),  # y
+)
+POSITION_TOLERANCE = 10
+stops = StopCalibration(os.environ.get("REFLECT_CALIBRATION"), "high_bay_warehouse")
+
+# Waits around the counter resets and after the commanders end once the
+# counters, reference and arm switches have not changed for SETTLE_WINDOW
+# cycles, at the latest after the fixed waits used so far (reflect.settle);
+# REFLECT_SETTLE=fixed keeps the fixed waits
+SETTLE_WINDOW = 10
+settle = SettleDetector(
+    rpi.io, ("Counter_5", "Counter_7", "I_1", "I_4", "I_9", "I_10"), SETTLE_WINDOW,
+    rpi.cycletime, os.environ.get("REFLECT_SETTLE", "sensor"), name="high_bay_warehouse",
+)
 
 
 class RobotCommander:
     def __init__(self, cycletools_var):
         self.var = cycletools_var
+        self.storage_motion = AxisMotion(
+            outputs, rpi.io, STORAGE_AXES, POSITION_TOLERANCE, "coordinated", stops=stops
+        )
 
     def CommanderDefault(self, up=1):  # Move to default (belt) position
         if rpi.io.I_10.value == 0 and up == 1:
-            rpi.io.O_8.value = 1
+            outputs["O_8"] = 1
             return 0
 
         elif rpi.io.I_4.value == 0 and rpi.io.I_1.value == 0:
-            rpi.io.O_6.value = 1
-            rpi.io.O_4.value = 1
-            rpi.io.O_8.value = 0
+            outputs["O_6"] = 1
+            outputs["O_4"] = 1
+            outputs["O_8"] = 0
             return 0
 
         elif rpi.io.I_4.value == 0 and rpi.io.I_1.value == 1:
-            rpi.io.O_6.value = 1
-            rpi.io.O_4.value = 0
-            rpi.io.O_8.value = 0
+            outputs["O_6"] = 1
+            outputs["O_4"] = 0
+            outputs["O_8"] = 0
             return 0
 
         elif rpi.io.I_4.value == 1 and rpi.io.I_1.value == 0:
-            rpi.io.O_6.value = 0
-            rpi.io.O_4.value = 1
-            rpi.io.O_8.value = 0
+            outputs["O_6"] = 0
+            outputs["O_4"] = 1
+            outputs["O_8"] = 0
             return 0
 
         elif rpi.io.I_4.value == 1 and rpi.io.I_1.value == 1:
-            rpi.io.O_6.value = 0
-            rpi.io.O_4.value = 0
-            rpi.io.O_8.value = 0
+            outputs["O_6"] = 0
+            outputs["O_4"] = 0
+            outputs["O_8"] = 0
             return 1
 
     def CommanderLager(self, x, y):  # Move to storage position
-        if rpi.io.Counter_5.value < x and rpi.io.Counter_7.value < y:
-            rpi.io.O_3.value = 1
-            rpi.io.O_5.value = 1
-            return 0
-
-        elif rpi.io.Counter_5.value < x and rpi.io.Counter_7.value >= y:
-            rpi.io.O_3.value = 1
-            rpi.io.O_5.value = 0
-            return 0
-
-        elif rpi.io.Counter_5.value >= x and rpi.io.Counter_7.value < y:
-            rpi.io.O_3.value = 0
-            rpi.io.O_5.value = 1
-            return 0
-
-        elif rpi.io.Counter_5.value >= x and rpi.io.Counter_7.value >= y:
-            rpi.io.O_3.value = 0
-            rpi.io.O_5.value = 0
+        motion = self.storage_motion
+        if motion.target != [x, y]:
+            motion.start([x, y])
+        if motion.step():
+            motion.target = None
             return 1
+        # a move that does not finish within max_cycles leaves the axes off
+        if motion.failed and motion.cycles == motion.max_cycles + 1:
+            print(f"Storage move aborted: {', '.join(motion.failed)} not in position, axes off")
+        return 0
 
     def CommanderOut(self):  # Extend arm
         if rpi.io.I_9.value == 0:
-            rpi.io.O_7.value = 1
+            outputs["O_7"] = 1
             return 0
         elif rpi.io.I_9.value == 1:
-            rpi.io.O_7.value = 0
+            outputs["O_7"] = 0
             return 1
 
     def CommanderIn(self):  # Retract arm
         if rpi.io.I_10.value == 0:
-            rpi.io.O_8.value = 1
+            outputs["O_8"] = 1
             return 0
         elif rpi.io.I_10.value == 1:
-            rpi.io.O_8.value = 0
+            outputs["O_8"] = 0
             return 1
 
     def CommanderLift(self, value=200):  # Lift object
         if (
             rpi.io.Counter_7.value >= 4294967295 - value or rpi.io.Counter_7.value <= 50
-        ):  # Likely jumps to max value and counts down
-            rpi.io.O_6.value = 1
+        ) and rpi.io.I_4.value == 0:  # Likely jumps to max value and counts down;
+            # a slot less than value above the reference switch (I_4) is lifted up to the switch
+            outputs["O_6"] = 1
             return 0
         else:
-            rpi.io.O_6.value = 0
+            outputs["O_6"] = 0
             return 1
 
     def CommanderDown(self, value=200):  # Lower object
         if rpi.io.Counter_7.value < value:  # Counts upward
-            rpi.io.O_5.value = 1
+            outputs["O_5"] = 1
             return 0
         else:
-            rpi.io.O_5.value = 0
+            outputs["O_5"] = 0
             return 1
 
     def CommanderResetCounters(self):
@@ -158,7 +218,188 @@ class RobotCommander:
         rpi.io.Counter_7.reset()
 
 
+# --- STEP HELPERS ---
+# The storage and belt movements are sequences of steps. Each step function
+# returns True once it is finished; var.step indexes the running step.
+
+
+# Reset the counters once, then wait until they read 0 at rest (at most 1 s)
+def settle_after_reset(var):
+    if var.first == 0:
+        var.commander.CommanderResetCounters()
+        var.first = 1
+        return False
+
+    if not settle.wait("reset", 101, zero=("Counter_5", "Counter_7")):
+        return False
+
+    var.first = 0
+    return True
+
+
+# Once a commander reported that it is done, wait until the axes and the arm
+# are at rest (at most 1 s)
+def wait_after(var, done):
+    return done and settle.wait("after", 102)
+
+
+# Move x and y to the storage position, then reset the counters
+def move_to_storage(var, y):
+    if var.first2 == 0:
+        if var.commander.CommanderLager(var.pos[0], y) == 1:
+            var.first2 = 1
+        return False
+
+    if settle_after_reset(var):
+        var.first2 = 0
+        return True
+    return False
+
+
+# Run the current step, True when the whole sequence is finished
+def run_steps(var, steps):
+    if steps[var.step](var):
+        var.step += 1
+        if var.step == len(steps):
+            var.step = 0
+            return True
+    return False
+
+
+# MOVE_STORAGE_PICKUP: move to storage, lower (below for lifting), extend, lift, retract
+STORAGE_PICKUP_STEPS = (
+    settle_after_reset,  # counter reset
+    lambda var: move_to_storage(var, var.pos[1] + 50),  # x and y axis storage
+    lambda var: var.commander.CommanderOut() == 1 and settle_after_reset(var),  # extend
+    lambda var: wait_after(var, var.commander.CommanderLift() == 1),  # lift
+    lambda var: wait_after(var, var.commander.CommanderIn() == 1),  # retract
+)
+
+# MOVE_BELT_DROPOFF: move to belt (x and y default), extend, lower
+BELT_DROPOFF_STEPS = (
+    lambda var: wait_after(var, var.commander.CommanderDefault() == 1),  # move x and y
+    lambda var: var.commander.CommanderOut() == 1 and settle_after_reset(var),  # extend
+    lambda var: wait_after(var, var.commander.CommanderDown(1400) == 1),  # lower
+)
+
+# BELT_PICKUP: up and back in
+BELT_PICKUP_STEPS = (
+    lambda var: var.commander.CommanderDefault(0) == 1,  # all the way up (default function)
+    lambda var: var.commander.CommanderIn() == 1,  # retract in
+)
+
+# MOVE_STORAGE_DROPOFF: move to storage, lower (above for placing), extend, place, retract
+STORAGE_DROPOFF_STEPS = (
+    settle_after_reset,  # counter reset
+    lambda var: move_to_storage(var, var.pos[1] - 150),  # x and y axis storage
+    lambda var: var.commander.CommanderOut() == 1 and settle_after_reset(var),  # extend
+    lambda var: wait_after(var, var.commander.CommanderDown() == 1),  # lower / place
+    lambda var: wait_after(var, var.commander.CommanderIn() == 1),  # retract
+)
+
+
+# --- STATE MACHINE ---
+
+storage = StateMachine("high_bay_warehouse")
+DEFAULT = storage.state("DEFAULT")
+IDLE = storage.state("IDLE")
+MOVE_STORAGE_PICKUP = storage.state("MOVE_STORAGE_PICKUP")
+MOVE_BELT_DROPOFF = storage.state("MOVE_BELT_DROPOFF")
+BELT_FRONT = storage.state("BELT_FRONT")
+BELT_BACK = storage.state("BELT_BACK")
+BELT_PICKUP = storage.state("BELT_PICKUP")
+MOVE_STORAGE_DROPOFF = storage.state("MOVE_STORAGE_DROPOFF")
+
+
+# DEFAULT state: move to home/zero position at the beginning and end of a cycle
+@storage.during(DEFAULT, targets=(IDLE,))
+def default_state(m):
+    if wait_after(m.var, m.var.commander.CommanderDefault() == 1):
+        return IDLE
+    return None
+
+
+# IDLE state: waiting for a task via OPC UA
+def take_task(m):
+    m.var.pos = m.var.positions[cycle_data.target_pos_index]
+    settle.count_task()
+
+
+storage.transition(IDLE, MOVE_STORAGE_PICKUP, guard=lambda m: cycle_data.target_pos_index != 0, action=take_task)
+
+
+@storage.during(MOVE_STORAGE_PICKUP, targets=(MOVE_BELT_DROPOFF,))
+def move_storage_pickup(m):
+    if run_steps(m.var, STORAGE_PICKUP_STEPS):
+        return MOVE_BELT_DROPOFF
+    return None
+
+
+@storage.during(MOVE_BELT_DROPOFF, targets=(BELT_FRONT,))
+def move_belt_dropoff(m):
+    if run_steps(m.var, BELT_DROPOFF_STEPS):
+        return BELT_FRONT
+    return None
+
+
+# BELT_FRONT: move forward and wait until it has been picked up
+def pallet_picked_up(m):
+    cycle_data.robot_ready_for_pickup = 0
+
+
+# Wait for signal that it was picked up (check OPC UA signal)
+storage.transition(BELT_FRONT, BELT_BACK, guard=lambda m: cycle_data.pickup_done_signal == 1, action=pallet_picked_up)
+
+
+@storage.during(BELT_FRONT)
+def belt_front(m):
+    if rpi.io.I_2.value == 0:
+        # belt on
+        outputs["O_1"] = 1
+
+    elif rpi.io.I_3.value == 0:
+        # belt off
+        if m.var.delay_counter <= 25:
+            m.var.delay_counter += 1
+        else:
+            m.var.delay_counter = 0
+            outputs["O_1"] = 0
+
+        cycle_data.robot_ready_for_pickup = 1
+
+
+# BELT_BACK: move pallet backwards
+@storage.during(BELT_BACK, targets=(BELT_PICKUP,))
+def belt_back(m):
+    if rpi.io.I_3.value == 0:
+        # belt reverse on
+        outputs["O_2"] = 1
+
+    elif rpi.io.I_2.value == 0:
+        # belt reverse off
+        outputs["O_2"] = 0
+        return BELT_PICKUP
+    return None
+
+
+@storage.during(BELT_PICKUP, targets=(MOVE_STORAGE_DROPOFF,))
+def belt_pickup(m):
+    if run_steps(m.var, BELT_PICKUP_STEPS):
+        return MOVE_STORAGE_DROPOFF
+    return None
+
+
+@storage.during(MOVE_STORAGE_DROPOFF, targets=(DEFAULT,))
+def move_storage_dropoff(m):
+    if run_steps(m.var, STORAGE_DROPOFF_STEPS):
+        return DEFAULT
+    return None
+
+
 def cycleprogram(cycletools):
+    # Latest frame from the OPC UA thread, unchanged for the whole cycle
+    cycle_data.refresh()
+
     # Initialization at program start
     if cycletools.first:
         print("Initializing robot gripper...")
@@ -177,57 +418,43 @@ def cycleprogram(cycletools):
         }
 
         cycletools.var.commander = RobotCommander(cycletools.var)
-        cycletools.var.current_state = "DEFAULT"
         cycletools.var.step = 0
         cycletools.var.delay_counter = 0
         cycletools.var.pos = 0
         cycletools.var.first = 0
         cycletools.var.first2 = 0
+        cycletools.var.machine = storage.compile(cycletools.var, initial=DEFAULT)
 
         # Start separate OPC UA thread
         opcua_thread = threading.Thread(target=start_opcua_thread)
-        opcua_thread.daemon = True 
+        opcua_thread.daemon = True
         opcua_thread.start()
 
         print("RevPi main thread: OPC UA thread started.")
 
-    # --- STATE MACHINE ---
-
-    # DEFAULT: Move to home position at start and end of cycle
-    if cycletools.var.current_state == "DEFAULT":
-        if cycletools.var.commander.CommanderDefault() == 1:
-            if cycletools.var.delay_counter <= 100:
-                cycletools.var.delay_counter += 1
-            else:
-                cycletools.var.current_state = "IDLE"
-                cycletools.var.delay_counter = 0
-
-    # IDLE: Waiting for task
-    elif cycletools.var.current_state == "IDLE":
-        if shared_data.target_pos_index != 0:
-            cycletools.var.pos = cycletools.var.positions[shared_data.target_pos_index]
-            cycletools.var.current_state = "MOVE_STORAGE_PICKUP"
-
-    # MOVE_STORAGE_PICKUP: Move to storage, extend, lift, retract
-    elif cycletools.var.current_state == "MOVE_STORAGE_PICKUP":
-        ...
-        # (Logic unchanged — only comments translated above.
-        # Remaining structure identical to your original code.)
+    cycletools.var.machine.step()
+    cycle_data.publish()
+    outputs.flush()
+
 
 def programend():
     print("Program end: resetting outputs...")
-    rpi.io.O_1.value = 0
-    rpi.io.O_2.value = 0
-    rpi.io.O_3.value = 0
-    rpi.io.O_4.value = 0
-    rpi.io.O_5.value = 0
-    rpi.io.O_6.value = 0
-    rpi.io.O_7.value = 0
-    rpi.io.O_8.value = 0
+    print(monitor.report())
+    print(outputs.report())
+    outputs.off("O_1", "O_2", "O_3", "O_4", "O_5", "O_6", "O_7", "O_8")
+    outputs.flush()
+    capture.close()
+    print(capture.report())
+    recorder.close()
+    print(recorder.report())
+    stops.save()
+    print(stops.report())
+    print(settle.report())
+
 
 rpi.handlesignalend(programend)
 
 # Start main program loop (cyclic operation)
 print("Starting robot cycle loop...")
-rpi.cycleloop(cycleprogram, cycletime=rpi.cycletime)
-print("Cycle loop finished.")
\ No newline at end of file
+rpi.cycleloop(monitor.wrap(recorder.wrap(cycleprogram)), cycletime=rpi.cycletime)
+print("Cycle loop finished.")
@@ -1,436 +1,491 @@
+import os
+import sys
+import types
 import revpimodio2
 import threading
 import time
 import asyncio
-from asyncua import Client, Node, ua
+from asyncua import Node, ua
+
+# Make the shared REFLECT library (code/reflect) importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from reflect.capture import TrafficCapture  # noqa: E402
+from reflect.instrumentation import CycleMonitor  # noqa: E402
+from reflect.opcua_exchange import NodeExchange  # noqa: E402
+from reflect.opcua_security import ClientSession  # noqa: E402
+from reflect.outputs import OutputImage  # noqa: E402
+from reflect.replay import InputRecorder  # noqa: E402
+from reflect.scheduler import CycleScheduler  # noqa: E402
+from reflect.snapshot import SharedData  # noqa: E402
+from reflect.statemachine import StateMachine  # noqa: E402
+from reflect.wiring import WIRING  # noqa: E402
 
 # --- CONFIGURATION ---
-SERVER_URL = "opc.tcp://192.168.210.102:4840"
-NODE_ID_MULTI_STATUS = "ns=2;i=3"
+# Gripper server, REFLECT_OPCUA_URL overrides it (e.g. opc.tcp://127.0.0.1:4840)
+SERVER_URL = os.environ.get("REFLECT_OPCUA_URL", "opc.tcp://192.168.210.102:4840")
+# Security mode: "none" or <policy>:<mode>, e.g. "Basic256Sha256:SignAndEncrypt"
+# (see reflect.opcua_security); the server has to offer it
+OPCUA_SECURITY = os.environ.get("REFLECT_OPCUA_SECURITY", "none")
 
+# OPC UA exchange: "subscription" or "polling" (changed values checked every
+# 10 ms or every 50 ms, all of them written in one request)
+OPCUA_MODE = "subscription"
 
-class RobotSharedData:
-    def __init__(self):
-        # Values to be written to the server
-        self.multi_status = 0
 
-        self.is_running = True
+class RobotSharedData(SharedData):
+    def __init__(self):
+        super().__init__(
+            received={},
+            # Values to be written to the server
+            sent={"multi_status": 0},
+        )
 
 
 shared_data = RobotSharedData()
 
+# Cycle side: values published to the OPC UA thread once per cycle
+cycle_data = shared_data.cycle
+
+# OPC UA values recorded if REFLECT_CAPTURE names a directory
+capture = TrafficCapture(os.environ.get("REFLECT_CAPTURE"), "multi")
+opcua_recorder = capture.recorder()  # used by the OPC UA thread only
+
 # RevPi object with automatic IO refresh
 rpi = revpimodio2.RevPiModIO(autorefresh=True)
 
 
+# One session for the whole run: the secure channel is renewed in the
+# background and a lost connection re-activates the same session
+session = ClientSession(SERVER_URL, OPCUA_SECURITY, name="multi")
+
+
 async def opcua_client_task(data_obj):
     while data_obj.is_running:
-        client = Client(url=SERVER_URL)
         try:
-            await client.connect()
-            print("OPC UA Client: Connected")
+            client = await session.connect()
+            print(f"OPC UA Client: Connected ({session.describe()})")
 
-            node_status = client.get_node(NODE_ID_MULTI_STATUS)
+            # Node as declared in reflect/wiring.json
+            _, writes = await WIRING.client_nodes(client, "multi")
 
-            while data_obj.is_running:
-                # WRITE
-                await node_status.set_value(data_obj.multi_status)
+            exchange = NodeExchange(
+                data_obj,
+                writes=writes,
+                mode=OPCUA_MODE,
+                recorder=opcua_recorder,
+            )
+            await exchange.start_client(client)
 
-                await asyncio.sleep(0.05)
+            # WRITE
+            await exchange.run()
 
         except Exception as e:
             print(f"Connection lost: {e}. Reconnecting in 5s...")
-            try:
-                await client.disconnect()
-            except:
-                pass
+            await session.disconnect()
             await asyncio.sleep(5)
 
 
 def start_opcua_thread():
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    loop.run_until_complete(opcua_client_task(shared_data))
-
-
-# Events and locks
-cycle_event = threading.Event()
-stop_event = threading.Event()
-
-# task1 variables
-task1_state = "PREPARING_DROPOFF"
-task1_state_start_time = 0.0
-task1_door = 0
-task1_slider = 0
-
-# task2 variables
-task2_state = "WAITING_PICKUP"
-task2_state_start_time = 0.0
-task2_default = 0
-task2_down = 0
-task2_vac = 0
-
-# --- Task 3 variables (turntable and conveyor belt) ---
-task3_state = "POS_VAC"
-task3_state_start_time = 0.0
-task3_default = 0
-task3_belt = 0
-VacFinished2 = 0
+    loop.run_until_complete(opcua_client_task(shared_data.opcua))
+
+
+CYCLETIME = 10  # ms
+
+# Scheduling of the station tasks inside main_cycle: (period in cycles, phase)
+TASK_SCHEDULE = {
+    "task1": (1, 0),
+    "task2": (1, 0),
+    "task3": (1, 0),
+}
 
 # shared variables
 OvenFinished = 0
 VacFinished = 0
+VacFinished2 = 0
 
 
 # --- Task 1 kiln/oven ---
-def task1():
-    global task1_state, task1_state_start_time, task1_door, task1_slider, OvenFinished
-    while not stop_event.is_set():
-        if cycle_event.wait(timeout=0.05):  # wait for event, with small timeout
-            cycle_event.clear()
-
-            # Kiln/oven
-            # send status to the gripper / suction unit via state variable
-            if task1_state == "PREPARING_DROPOFF":  # prepare for dropoff
-                shared_data.multi_status = 0
-
-                if task1_door == 0:
-                    if task1_state_start_time == 0.0:
-                        task1_state_start_time = time.monotonic()
-                        rpi.io.O_9.value = 1  # light on
-
-                    if (time.monotonic() - task1_state_start_time) < 1.0:
-                        pass
-                    else:
-                        rpi.io.O_13.value = 1  # open door
-                        task1_state_start_time = 0.0
-                        task1_door = 1
-
-                elif task1_slider == 0:
-                    if rpi.io.I_7.value == 0:  # reference switch: oven slider outside
-                        rpi.io.O_6.value = 1  # move slider out
-                    else:  # slider is out
-                        rpi.io.O_6.value = 0  # stop slider-out motor
-                        task1_state_start_time = 0.0
-                        task1_slider = 1
-
-                else:
-                    task1_state = "WAITING_DROPOFF"
-                    # ready for dropoff
-                    shared_data.multi_status = 1
-
-            elif task1_state == "WAITING_DROPOFF":
-                # as soon as an object is detected, start the timer
-                if rpi.io.I_9.value == 0:  # light barrier detects object
-                    if task1_state_start_time == 0.0:
-                        task1_state_start_time = time.monotonic()
-                        # not ready for dropoff anymore
-                        shared_data.multi_status = 0
-
-                # after 5 seconds since detection, switch state (time for suction gripper to move away)
-                if (
-                    task1_state_start_time != 0.0
-                    and (time.monotonic() - task1_state_start_time) >= 5.0
-                ):
-                    task1_state_start_time = 0.0
-                    task1_state = "PREPARE_BURNING"
-
-            elif task1_state == "PREPARE_BURNING":  # close oven
-                shared_data.multi_status = 0
-
-                if task1_slider == 1:
-                    if rpi.io.I_6.value == 0:  # reference switch: oven slider inside
-                        rpi.io.O_5.value = 1  # move slider in
-                    else:  # slider is in
-                        rpi.io.O_5.value = 0  # stop slider-in motor
-                        task1_state_start_time = 0.0
-                        task1_slider = 0
-
-                elif task1_door == 1:
-                    if task1_state_start_time == 0.0:
-                        task1_state_start_time = time.monotonic()
-
-                    if (time.monotonic() - task1_state_start_time) < 1.0:
-                        rpi.io.O_13.value = 0  # close door
-                    else:
-                        task1_state_start_time = 0.0
-                        task1_door = 0
-
-                else:
-                    rpi.io.O_9.value = 0  # light off
-                    task1_state = "BURNING"
-
-            elif task1_state == "BURNING":
-                shared_data.multi_status = 0
-
-                if task1_state_start_time == 0.0:
-                    task1_state_start_time = time.monotonic()
-
-                if (time.monotonic() - task1_state_start_time) < 10.0:
-                    pass
-                else:
-                    task1_state = "PREPARE_PICKUP"
-                    task1_state_start_time = 0.0
-
-            elif task1_state == "PREPARE_PICKUP":
-                shared_data.multi_status = 0
-
-                if task1_door == 0:
-                    if task1_state_start_time == 0.0:
-                        task1_state_start_time = time.monotonic()
-                        rpi.io.O_9.value = 1  # light on
-
-                    if (time.monotonic() - task1_state_start_time) < 1.0:
-                        pass
-                    else:
-                        rpi.io.O_13.value = 1  # open door
-                        task1_state_start_time = 0.0
-                        task1_door = 1
-
-                elif task1_slider == 0:
-                    if rpi.io.I_7.value == 0:  # reference switch: oven slider outside
-                        rpi.io.O_6.value = 1  # move slider out
-                    else:
-                        rpi.io.O_6.value = 0  # stop slider-out motor
-                        task1_state_start_time = 0.0
-                        task1_slider = 1
-
-                else:
-                    OvenFinished = 1
-                    task1_state = "WAITING_PICKUP"
-
-            elif task1_state == "WAITING_PICKUP":
-                if OvenFinished == 0:
-                    task1_state = "PREPARING_DROPOFF"
+# send status to the gripper / suction unit via state variable
+def not_ready(m):
+    cycle_data.multi_status = 0
+
+
+oven = StateMachine("task1")
+PREPARING_DROPOFF = oven.state("PREPARING_DROPOFF", on_enter=not_ready)
+WAITING_DROPOFF = oven.state("WAITING_DROPOFF")
+PREPARE_BURNING = oven.state("PREPARE_BURNING", on_enter=not_ready)
+BURNING = oven.state("BURNING", on_enter=not_ready)
+PREPARE_PICKUP = oven.state("PREPARE_PICKUP", on_enter=not_ready)
+OVEN_WAITING_PICKUP = oven.state("WAITING_PICKUP")
+
+
+# Light on, open the door after 1 s and move the slider out; True when done
+def open_oven(var):
+    if var.door == 0:
+        if var.start_time == 0.0:
+            var.start_time = time.monotonic()
+            outputs["O_9"] = 1  # light on
+
+        if (time.monotonic() - var.start_time) >= 1.0:
+            outputs["O_13"] = 1  # open door
+            var.start_time = 0.0
+            var.door = 1
+        return False
+
+    if var.slider == 0:
+        if rpi.io.I_7.value == 0:  # reference switch: oven slider outside
+            outputs["O_6"] = 1  # move slider out
+
+        else:  # it is outside
+            outputs["O_6"] = 0  # stop moving slider out
+            var.start_time = 0.0
+            var.slider = 1
+        return False
+
+    return True
+
+
+@oven.during(PREPARING_DROPOFF, targets=(WAITING_DROPOFF,))
+def preparing_dropoff(m):  # prepare for drop-off
+    if open_oven(m.var):
+        cycle_data.multi_status = 1  # ready for drop-off
+        return WAITING_DROPOFF
+    return None
+
+
+@oven.during(WAITING_DROPOFF)
+def waiting_dropoff(m):
+    # As soon as an object is detected, start the timer
+    if rpi.io.I_9.value == 0:  # photoelectric sensor detects object
+        if m.var.start_time == 0.0:
+            m.var.start_time = time.monotonic()
+            cycle_data.multi_status = 0  # not ready for drop-off
+
+
+# After 5 seconds from detection, change state (time for suction gripper to move away)
+def object_delivered(m):
+    return m.var.start_time != 0.0 and (time.monotonic() - m.var.start_time) >= 5.0
+
+
+def reset_timer(m):
+    m.var.start_time = 0.0
+
+
+oven.transition(WAITING_DROPOFF, PREPARE_BURNING, guard=object_delivered, action=reset_timer)
+
+
+@oven.during(PREPARE_BURNING, targets=(BURNING,))
+def prepare_burning(m):  # close oven
+    var = m.var
+    if var.slider == 1:
+        if rpi.io.I_6.value == 0:  # reference switch: oven slider inside
+            outputs["O_5"] = 1  # move slider in
+
+        else:  # slider is in
+            outputs["O_5"] = 0  # stop moving slider in
+            var.start_time = 0.0
+            var.slider = 0
+
+    elif var.door == 1:
+        if var.start_time == 0.0:
+            var.start_time = time.monotonic()
+
+        if (time.monotonic() - var.start_time) < 1.0:
+            outputs["O_13"] = 0  # close door
+
+        else:
+            var.start_time = 0.0
+            var.door = 0
+    else:
+        outputs["O_9"] = 0  # light off
+        return BURNING
+    return None
+
+
+oven.after(BURNING, PREPARE_PICKUP, seconds=10.0)
+
+
+@oven.during(PREPARE_PICKUP, targets=(OVEN_WAITING_PICKUP,))
+def prepare_pickup(m):
+    global OvenFinished
+    if open_oven(m.var):
+        OvenFinished = 1
+        return OVEN_WAITING_PICKUP
+    return None
+
+
+oven.transition(OVEN_WAITING_PICKUP, PREPARING_DROPOFF, guard=lambda m: OvenFinished == 0)
 
 
 # --- Task 2 suction gripper ---
-def task2():
-    global (
-        task2_state,
-        task2_state_start_time,
-        OvenFinished,
-        VacFinished,
-        task2_default,
-        task2_down,
-        task2_vac,
-    )
-
-    while not stop_event.is_set():
-        if cycle_event.wait(timeout=0.05):
-            cycle_event.clear()
-
-            if task2_state == "WAITING_PICKUP":
-                if task2_default == 0:
-                    rpi.io.O_8.value = 1  # drive towards reference
-                    if rpi.io.I_5.value == 1:  # reference reached
-                        rpi.io.O_8.value = 0
-                        task2_default = 1
-                else:
-                    if OvenFinished == 1:
-                        task2_state = "DRIVE_PICKUP"
-                        task2_state_start_time = 0.0
-
-            elif task2_state == "DRIVE_PICKUP":
-                if rpi.io.I_8.value == 0:  # reference position at oven
-                    rpi.io.O_7.value = 1  # motor towards oven on
-                    task2_default = 0
-                else:
-                    rpi.io.O_7.value = 0  # oven motor off
-                    task2_state = "PICKUP"
-
-            elif task2_state == "PICKUP":
-                if task2_down == 0:  # move down
-                    if task2_state_start_time == 0.0:
-                        task2_state_start_time = time.monotonic()
-                        rpi.io.O_12.value = 1  # down (lower valve)
-                        rpi.io.O_11.value = 0  # ensure vacuum is off
-
-                    if (time.monotonic() - task2_state_start_time) >= 1.0:
-                        task2_state_start_time = 0.0
-                        task2_down = 1
-
-                elif task2_vac == 0 and task2_down == 1:  # suction (after down)
-                    if task2_state_start_time == 0.0:
-                        task2_state_start_time = time.monotonic()
-                        rpi.io.O_11.value = 1  # suction on
-
-                    if (time.monotonic() - task2_state_start_time) >= 1.0:
-                        task2_state_start_time = 0.0
-                        task2_vac = 1
-
-                elif task2_down == 1 and task2_vac == 1:  # move up (after suction)
-                    if task2_state_start_time == 0.0:
-                        task2_state_start_time = time.monotonic()
-                        rpi.io.O_12.value = 0  # up
-
-                    if (time.monotonic() - task2_state_start_time) >= 1.0:
-                        task2_state_start_time = 0.0
-                        task2_down = 0
-                        task2_state = "DRIVE_DROPOFF"
-
-            elif task2_state == "DRIVE_DROPOFF":
-                if task2_default == 0:
-                    rpi.io.O_8.value = 1  # motor on
-                    if rpi.io.I_5.value == 1:  # reference switch at turntable
-                        rpi.io.O_8.value = 0
-                        task2_default = 1
-                else:
-                    OvenFinished = 0
-                    VacFinished = 1  # suction gripper has object and is at drop-off position
-                    task2_state = "WAITING_DROPOFF"
-                    task2_default = 0
-
-            elif task2_state == "WAITING_DROPOFF":
-                # implies another task (e.g., Task3) set VacFinished to 0
-                if VacFinished == 0:
-                    task2_state = "DROPOFF"
-
-            elif task2_state == "DROPOFF":
-                if task2_down == 0:  # go down to drop
-                    if task2_state_start_time == 0.0:
-                        task2_state_start_time = time.monotonic()
-                        rpi.io.O_12.value = 1  # down
-
-                    if (time.monotonic() - task2_state_start_time) >= 1.0:
-                        task2_state_start_time = 0.0
-                        task2_down = 1
-
-                elif task2_vac == 1:  # release (vacuum off)
-                    if task2_state_start_time == 0.0:
-                        task2_state_start_time = time.monotonic()
-                        rpi.io.O_11.value = 0  # vacuum off
-
-                    if (time.monotonic() - task2_state_start_time) >= 1.0:
-                        task2_state_start_time = 0.0
-                        task2_vac = 0
-
-                elif task2_down == 1 and task2_vac == 0:  # move up
-                    if task2_state_start_time == 0.0:
-                        task2_state_start_time = time.monotonic()
-                        rpi.io.O_12.value = 0  # up
-
-                    if (time.monotonic() - task2_state_start_time) >= 1.0:
-                        task2_state_start_time = 0.0
-                        task2_down = 0
-                        VacFinished = 0  # object dropped
-                        task2_state = "WAITING_PICKUP"
+suction = StateMachine("task2")
+WAITING_PICKUP = suction.state("WAITING_PICKUP")
+DRIVE_PICKUP = suction.state("DRIVE_PICKUP")
+PICKUP = suction.state("PICKUP")
+DRIVE_DROPOFF = suction.state("DRIVE_DROPOFF")
+SUCTION_WAITING_DROPOFF = suction.state("WAITING_DROPOFF")
+DROPOFF = suction.state("DROPOFF")
+
+
+@suction.during(WAITING_PICKUP, targets=(DRIVE_PICKUP,))
+def waiting_pickup(m):
+    var = m.var
+    if var.default == 0:
+        outputs["O_8"] = 1  # drive towards reference
+        if rpi.io.I_5.value == 1:  # reference reached
+            outputs["O_8"] = 0
+            var.default = 1
+
+    elif OvenFinished == 1:
+        var.start_time = 0.0
+        return DRIVE_PICKUP
+    return None
+
+
+@suction.during(DRIVE_PICKUP, targets=(PICKUP,))
+def drive_pickup(m):
+    if rpi.io.I_8.value == 0:  # reference position oven
+        outputs["O_7"] = 1  # motor towards oven on
+        m.var.default = 0
+
+    else:
+        outputs["O_7"] = 0  # motor oven off
+        return PICKUP
+    return None
+
+
+@suction.during(PICKUP, targets=(DRIVE_DROPOFF,))
+def pickup(m):
+    var = m.var
+    if var.down == 0:  # move down
+        if var.start_time == 0.0:
+            var.start_time = time.monotonic()
+            outputs["O_12"] = 1  # move down (lower valve)
+            outputs["O_11"] = 0  # ensure no vacuum
+
+        if (time.monotonic() - var.start_time) >= 1.0:
+            var.start_time = 0.0
+            var.down = 1  # down movement finished
+
+    elif var.vac == 0 and var.down == 1:  # suction (after down)
+        if var.start_time == 0.0:
+            var.start_time = time.monotonic()
+            outputs["O_11"] = 1  # suction on
+
+        if (time.monotonic() - var.start_time) >= 1.0:
+            var.start_time = 0.0
+            var.vac = 1  # suction finished
+
+    elif var.down == 1 and var.vac == 1:  # move up (after suction)
+        if var.start_time == 0.0:
+            var.start_time = time.monotonic()
+            outputs["O_12"] = 0  # move up
+
+        if (time.monotonic() - var.start_time) >= 1.0:
+            var.start_time = 0.0
+            var.down = 0  # reset for next cycle
+            return DRIVE_DROPOFF
+    return None
+
+
+@suction.during(DRIVE_DROPOFF, targets=(SUCTION_WAITING_DROPOFF,))
+def drive_dropoff(m):
+    global OvenFinished, VacFinished
+    var = m.var
+    if var.default == 0:
+        outputs["O_8"] = 1  # motor on
+        if rpi.io.I_5.value == 1:  # reference switch turntable
+            outputs["O_8"] = 0  # motor off
+            var.default = 1
+
+    else:
+        # This value is also set earlier, but keeping it as in the original code
+        OvenFinished = 0
+        VacFinished = 1  # suction gripper has an object and is at drop-off position
+        var.default = 0  # reset for next travel
+        return SUCTION_WAITING_DROPOFF
+    return None
+
+
+# This implies another task (e.g. task3) set VacFinished back to 0
+# If task3 has taken the object, task2 may start dropping off
+suction.transition(SUCTION_WAITING_DROPOFF, DROPOFF, guard=lambda m: VacFinished == 0)
+
+
+@suction.during(DROPOFF, targets=(WAITING_PICKUP,))
+def dropoff(m):
+    global VacFinished
+    var = m.var
+    if var.down == 0:  # move down to place
+        if var.start_time == 0.0:
+            var.start_time = time.monotonic()
+            outputs["O_12"] = 1  # move down
+
+        if (time.monotonic() - var.start_time) >= 1.0:
+            var.start_time = 0.0
+            var.down = 1
+
+    elif var.vac == 1:  # release (vacuum off)
+        if var.start_time == 0.0:
+            var.start_time = time.monotonic()
+            outputs["O_11"] = 0  # vacuum off
+
+        if (time.monotonic() - var.start_time) >= 1.0:
+            var.start_time = 0.0
+            var.vac = 0  # vacuum is off
+
+    elif var.down == 1 and var.vac == 0:  # move up (after placing)
+        if var.start_time == 0.0:
+            var.start_time = time.monotonic()
+            outputs["O_12"] = 0  # move up
+
+        if (time.monotonic() - var.start_time) >= 1.0:
+            var.start_time = 0.0
+            var.down = 0  # reset for next cycle
+            VacFinished = 0  # signals that the object has been placed
+            return WAITING_PICKUP  # back to start state
+    return None
 
 
 # --- Task 3 turntable and conveyor belt ---
-def task3():
-    global (
-        task3_state,
-        task3_default,
-        task3_belt,
-        task3_state_start_time,
-        VacFinished,
-        VacFinished2,
-    )
-
-    while not stop_event.is_set():
-        if cycle_event.wait(timeout=0.05):
-            cycle_event.clear()
-
-            if task3_state == "POS_VAC":
-                # drive to vacuum position and wait until VacFinished == 1
-                if task3_default == 0:
-                    if rpi.io.I_1.value == 0:
-                        rpi.io.O_2.value = 1
-                    else:
-                        rpi.io.O_2.value = 0
-                        task3_default = 1
-                else:
-                    if VacFinished == 1:
-                        VacFinished = 0
-                        VacFinished2 = 1
-
-                    elif VacFinished2 == 1:
-                        if task3_state_start_time == 0:
-                            task3_state_start_time = time.monotonic()
-
-                        if (time.monotonic() - task3_state_start_time) < 5.0:
-                            pass
-                        else:
-                            task3_state = "POS_SAW"
-                            VacFinished2 = 0
-                            task3_default = 0
-                            task3_state_start_time = 0.0
-
-            elif task3_state == "POS_SAW":
-                if rpi.io.I_4.value == 0:
-                    rpi.io.O_1.value = 1
-                else:
-                    rpi.io.O_1.value = 0
-                    task3_state = "SAW"
-
-            elif task3_state == "SAW":
-                if task3_state_start_time == 0:
-                    task3_state_start_time = time.monotonic()
-                    rpi.io.O_4.value = 1
-
-                if (time.monotonic() - task3_state_start_time) < 30.0:
-                    pass
-                else:
-                    task3_state = "POS_BELT"
-                    rpi.io.O_4.value = 0
-                    task3_state_start_time = 0.0
-
-            elif task3_state == "POS_BELT":
-                if task3_belt == 0:
-                    if rpi.io.I_2.value == 0:
-                        rpi.io.O_1.value = 1
-                    else:
-                        rpi.io.O_1.value = 0
-                        task3_belt = 1
-                else:
-                    if task3_state_start_time == 0:
-                        task3_state_start_time = time.monotonic()
-
-                    if (time.monotonic() - task3_state_start_time) < 1.0:
-                        pass
-                    else:
-                        rpi.io.O_14.value = 1
-                        task3_belt = 0
-                        task3_state_start_time = 0.0
-                        task3_state = "BELT"
-
-            elif task3_state == "BELT":
-                if task3_belt == 0:
-                    rpi.io.O_3.value = 1
-                    if rpi.io.I_3.value == 0:
-                        task3_belt = 1
-                else:
-                    if task3_state_start_time == 0:
-                        task3_state_start_time = time.monotonic()
-                        rpi.io.O_14.value = 0
-
-                    if (time.monotonic() - task3_state_start_time) < 2.0:
-                        pass
-                    else:
-                        task3_belt = 0
-                        task3_state_start_time = 0.0
-                        rpi.io.O_3.value = 0
-                        task3_state = "POS_VAC"
+turntable = StateMachine("task3")
+POS_VAC = turntable.state("POS_VAC")
+POS_SAW = turntable.state("POS_SAW")
+SAW = turntable.state("SAW")
+POS_BELT = turntable.state("POS_BELT")
+BELT = turntable.state("BELT")
+
+
+@turntable.during(POS_VAC, targets=(POS_SAW,))
+def pos_vac(m):
+    global VacFinished, VacFinished2
+    var = m.var
+    # Move to vacuum position and wait until VacFinished is 1
+    if var.default == 0:  # move to default
+        if rpi.io.I_1.value == 0:
+            outputs["O_2"] = 1
+        else:
+            outputs["O_2"] = 0
+            var.default = 1
+
+    elif VacFinished == 1:  # wait
+        VacFinished = 0
+        VacFinished2 = 1
+
+    elif VacFinished2 == 1:
+        if var.start_time == 0:
+            var.start_time = time.monotonic()
+
+        if (time.monotonic() - var.start_time) >= 5.0:
+            VacFinished2 = 0
+            var.default = 0
+            var.start_time = 0.0
+            return POS_SAW
+    return None
+
+
+@turntable.during(POS_SAW, targets=(SAW,))
+def pos_saw(m):
+    if rpi.io.I_4.value == 0:
+        outputs["O_1"] = 1
+    else:
+        outputs["O_1"] = 0
+        return SAW
+    return None
+
+
+@turntable.on_enter(SAW)
+def saw_on(m):
+    outputs["O_4"] = 1
+
+
+def saw_off(m):
+    outputs["O_4"] = 0
+
+
+turntable.after(SAW, POS_BELT, seconds=30.0, action=saw_off)
+
+
+@turntable.during(POS_BELT, targets=(BELT,))
+def pos_belt(m):
+    var = m.var
+    if var.belt == 0:
+        if rpi.io.I_2.value == 0:
+            outputs["O_1"] = 1
+        else:
+            outputs["O_1"] = 0
+            var.belt = 1
+
+    else:
+        if var.start_time == 0:
+            var.start_time = time.monotonic()
+
+        if (time.monotonic() - var.start_time) >= 1.0:
+            outputs["O_14"] = 1
+            var.belt = 0
+            var.start_time = 0.0
+            return BELT
+    return None
+
+
+@turntable.during(BELT, targets=(POS_VAC,))
+def belt(m):
+    var = m.var
+    if var.belt == 0:
+        outputs["O_3"] = 1
+        if rpi.io.I_3.value == 0:
+            var.belt = 1
+
+    else:
+        if var.start_time == 0:
+            var.start_time = time.monotonic()
+            outputs["O_14"] = 0
+
+        if (time.monotonic() - var.start_time) >= 2.0:
+            var.belt = 0
+            var.start_time = 0.0
+            outputs["O_3"] = 0
+            return POS_VAC
+    return None
+
+
+# task variables
+task1_machine = oven.compile(
+    types.SimpleNamespace(start_time=0.0, door=0, slider=0), initial=PREPARING_DROPOFF
+)
+task2_machine = suction.compile(
+    types.SimpleNamespace(start_time=0.0, default=0, down=0, vac=0), initial=WAITING_PICKUP
+)
+task3_machine = turntable.compile(
+    types.SimpleNamespace(start_time=0.0, default=0, belt=0), initial=POS_VAC
+)
+
+
+# All tasks run in order inside main_cycle
+scheduler = CycleScheduler(CYCLETIME)
+scheduler.add("task1", task1_machine.step, *TASK_SCHEDULE["task1"])
+scheduler.add("task2", task2_machine.step, *TASK_SCHEDULE["task2"])
+scheduler.add("task3", task3_machine.step, *TASK_SCHEDULE["task3"])
+
+# Cycle time measurement, reported at program end
+monitor = CycleMonitor(CYCLETIME, name="multi")
+
+# Output writes are collected per cycle and passed on once at its end
+outputs = OutputImage(rpi)
+
+# Inputs recorded every cycle if REFLECT_RECORD names a directory, for
+# python -m reflect.replay
+recorder = InputRecorder(os.environ.get("REFLECT_RECORD"), "multi", rpi, shared=shared_data)
 
 
 # --- Cyclic main function, called by revpimodio2 ---
 def main_cycle(cycletools):
     if cycletools.first:
-        rpi.io.O_1.value = 0
-        rpi.io.O_2.value = 0
-        rpi.io.O_3.value = 0
-        rpi.io.O_4.value = 0
-        rpi.io.O_5.value = 0
-        rpi.io.O_6.value = 0
-        rpi.io.O_7.value = 0
-        rpi.io.O_8.value = 0
-        rpi.io.O_9.value = 0
-        rpi.io.O_11.value = 0
-        rpi.io.O_12.value = 0
-        rpi.io.O_13.value = 0
-        rpi.io.O_14.value = 0
-        rpi.io.O_10.value = 1  # compressor always on
+        outputs.off("O_1", "O_2", "O_3", "O_4", "O_5", "O_6", "O_7",
+                    "O_8", "O_9", "O_11", "O_12", "O_13", "O_14")
+        outputs["O_10"] = 1  # compressor permanently on
 
         # Start the separate OPC UA thread
         opcua_thread = threading.Thread(target=start_opcua_thread)
@@ -438,37 +493,33 @@ def main_cycle(cycletools):
         opcua_thread.start()
         print("RevPi main thread: OPC UA thread started.")
 
-    # Send signal to all tasks
-    cycle_event.set()
+    # Run the station tasks due in this cycle
+    scheduler.run_cycle()
+
+    # Pass the status on to the OPC UA thread and the changed outputs to the process image
+    cycle_data.publish()
+    outputs.flush()
 
 
 # --- Program shutdown ---
 def programend():
-    stop_event.set()
-    rpi.io.O_10.value = 0  # compressor off
-    rpi.io.O_1.value = 0
-    rpi.io.O_2.value = 0
-    rpi.io.O_3.value = 0
-    rpi.io.O_4.value = 0
-    rpi.io.O_5.value = 0
-    rpi.io.O_6.value = 0
-    rpi.io.O_7.value = 0
-    rpi.io.O_8.value = 0
-    rpi.io.O_9.value = 0
-    rpi.io.O_11.value = 0
-    rpi.io.O_12.value = 0
-    rpi.io.O_13.value = 0
-    rpi.io.O_14.value = 0
-    rpi.exit()  # cleanly stop RevPiModIO
+    print(scheduler.report())
+    print(monitor.report())
+    print(outputs.report())
+    outputs["O_10"] = 0  # compressor off
+    outputs.off("O_1", "O_2", "O_3", "O_4", "O_5", "O_6", "O_7",
+                "O_8", "O_9", "O_11", "O_12", "O_13", "O_14")
+    outputs.flush()
+    capture.close()
+    print(capture.report())
+    recorder.close()
+    print(recorder.report())
+    rpi.exit()  # cleanly shut down RevPiModIO
 
 
 # --- Main program flow ---
-# Start threads for tasks
-threading.Thread(target=task1, daemon=True).start()
-threading.Thread(target=task2, daemon=True).start()
-threading.Thread(target=task3, daemon=True).start()
-
+# Clean shutdown on CTRL+C
 rpi.handlesignalend(programend)
 
 # Start cycle loop
-rpi.cycleloop(main_cycle, cycletime=10)  # 10 ms cycle
\ No newline at end of file
+rpi.cycleloop(monitor.wrap(recorder.wrap(main_cycle)), cycletime=CYCLETIME)  # 10 ms cycle
@@ -1,68 +1,103 @@
+import os
+import sys
 import revpimodio2
 import statistics
 import threading
 import time
 import asyncio
-from asyncua import Client, Node, ua
-
-SERVER_URL = "opc.tcp://192.168.210.102:4840"
-NODE_ID_WHITE = "ns=2;i=6"
-NODE_ID_RED = "ns=2;i=7"
-NODE_ID_BLUE = "ns=2;i=8" 
-
-class RobotSharedData:
+from asyncua import Node, ua
+
+# Make the shared REFLECT library (code/reflect) importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from reflect.capture import TrafficCapture  # noqa: E402
+from reflect.instrumentation import CycleMonitor  # noqa: E402
+from reflect.opcua_exchange import NodeExchange  # noqa: E402
+from reflect.opcua_security import ClientSession  # noqa: E402
+from reflect.outputs import OutputImage  # noqa: E402
+from reflect.replay import InputRecorder  # noqa: E402
+from reflect.snapshot import SharedData  # noqa: E402
+from reflect.wiring import WIRING  # noqa: E402
+
+# Gripper server, REFLECT_OPCUA_URL overrides it (e.g. opc.tcp://127.0.0.1:4840)
+SERVER_URL = os.environ.get("REFLECT_OPCUA_URL", "opc.tcp://192.168.210.102:4840")
+# Security mode: "none" or <policy>:<mode>, e.g. "Basic256Sha256:SignAndEncrypt"
+# (see reflect.opcua_security); the server has to offer it
+OPCUA_SECURITY = os.environ.get("REFLECT_OPCUA_SECURITY", "none")
+
+# OPC UA exchange: "subscription" or "polling" (changed values checked every
+# 10 ms or every 50 ms, all of them written in one request)
+OPCUA_MODE = "subscription"
+
+class RobotSharedData(SharedData):
     def __init__(self):
-        
-        # Values to be written to the server
-        self.white = 1
-        self.red = 1
-        self.blue = 1
-        
-        self.is_running = True
+        super().__init__(
+            received={},
+            # Values to be written to the server
+            sent={"white": 1, "red": 1, "blue": 1},
+        )
 
 shared_data = RobotSharedData()
 
+# Cycle side: values published to the OPC UA thread once per cycle
+cycle_data = shared_data.cycle
+
+# OPC UA values recorded if REFLECT_CAPTURE names a directory
+capture = TrafficCapture(os.environ.get("REFLECT_CAPTURE"), "sorting_line")
+opcua_recorder = capture.recorder()  # used by the OPC UA thread only
+
 # RevPi object with automatic IO refresh
 rpi = revpimodio2.RevPiModIO(autorefresh=True)
 
 
+# One session for the whole run: the secure channel is renewed in the
+# background and a lost connection re-activates the same session
+session = ClientSession(SERVER_URL, OPCUA_SECURITY, name="sorting_line")
+
+
 async def opcua_client_task(data_obj):
     while data_obj.is_running:
-        client = Client(url=SERVER_URL)
         try:
-            await client.connect()
-            print("OPC UA Client: Connected")
+            client = await session.connect()
+            print(f"OPC UA Client: Connected ({session.describe()})")
             
-            node_white = client.get_node(NODE_ID_WHITE)
-            node_red = client.get_node(NODE_ID_RED)
-            node_blue = client.get_node(NODE_ID_BLUE)
-
-            while data_obj.is_running:
-                
-                # WRITE
-                await node_white.set_value(data_obj.white)
-                await node_red.set_value(data_obj.red)
-                await node_blue.set_value(data_obj.blue)
-                
-                await asyncio.sleep(0.05)
+            # Nodes as declared in reflect/wiring.json
+            _, writes = await WIRING.client_nodes(client, "sorting_line")
+
+            exchange = NodeExchange(
+                data_obj,
+                writes=writes,
+                mode=OPCUA_MODE,
+                recorder=opcua_recorder,
+            )
+            await exchange.start_client(client)
+
+            # WRITE
+            await exchange.run()
                 
         except Exception as e:
             print(f"Connection lost: {e}. Reconnecting in 5s...")
-            try:
-                await client.disconnect()
-            except:
-                pass
+            await session.disconnect()
             await asyncio.sleep(5)
 
 
 def start_opcua_thread():
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    loop.run_until_complete(opcua_client_task(shared_data))
+    loop.run_until_complete(opcua_client_task(shared_data.opcua))
 
 # Initialize the RevPi ModIO interface with automatic refresh
 rpi = revpimodio2.RevPiModIO(autorefresh=True)
 
+# Cycle time measurement, reported at program end
+monitor = CycleMonitor(10, name="sorting_line")
+
+# Output writes are collected per cycle and passed on once at its end
+outputs = OutputImage(rpi)
+
+# Inputs recorded every cycle if REFLECT_RECORD names a directory, for
+# python -m reflect.replay
+recorder = InputRecorder(os.environ.get("REFLECT_RECORD"), "sorting_line", rpi, shared=shared_data)
+
 def cycleprogram(cycletools):
     # One-time initialization at program start
     if cycletools.first:
@@ -74,7 +109,7 @@ def cycleprogram(cycletools):
         cycletools.var.color = 0
         cycletools.var.sensors = [0] * 6
         cycletools.var.sensors[1] = 1
-        rpi.io.O_1.value = 0                          # Conveyor belt initially stopped
+        outputs["O_1"] = 0                            # Conveyor belt initially stopped
         cycletools.var.fail = 0
         cycletools.var.firstDelay = 0
 
@@ -101,9 +136,9 @@ def cycleprogram(cycletools):
         cycletools.var.sensors[4] = rpi.io.I_5.value
         cycletools.var.sensors[5] = rpi.io.I_6.value
 
-        shared_data.white = rpi.io.I_4.value
-        shared_data.red = rpi.io.I_5.value
-        shared_data.blue = rpi.io.I_6.value
+        cycle_data.white = rpi.io.I_4.value
+        cycle_data.red = rpi.io.I_5.value
+        cycle_data.blue = rpi.io.I_6.value
 
     # === STATE MACHINE ===
 
@@ -112,7 +147,7 @@ def cycleprogram(cycletools):
         if cycletools.var.color <= 7050:
             cycletools.var.cycleCount += 1
             if cycletools.var.cycleCount >= 10:           # Stop after 10 cycles
-                rpi.io.O_1.value = 0                      # Stop conveyor belt
+                outputs["O_1"] = 0                        # Stop conveyor belt
                 cycletools.var.cycleCount = 0
                 cycletools.var.fail = 0
                 cycletools.var.state = "scan"             # Next state: scan
@@ -120,7 +155,7 @@ def cycleprogram(cycletools):
             cycletools.var.fail += 1
             if cycletools.var.fail == 500:
                 cycletools.var.fail = 0
-                rpi.io.O_1.value = 0
+                outputs["O_1"] = 0
                 cycletools.var.state = "idle"
         
     # Scan object → decide which piston should activate
@@ -135,26 +170,26 @@ def cycleprogram(cycletools):
             if 2500 <= measured_color <= 5000:
                 cycletools.var.cycleAuswurf = 60 
                 cycletools.var.pistonNumber = 1
-                rpi.io.O_1.value = 1 
-                rpi.io.O_2.value = 1 
+                outputs["O_1"] = 1 
+                outputs["O_2"] = 1 
                 cycletools.var.state = "wait"
 
             elif 5700 <= measured_color <= 6300:
                 cycletools.var.cycleAuswurf = 150
                 cycletools.var.pistonNumber = 2
-                rpi.io.O_1.value = 1
-                rpi.io.O_2.value = 1
+                outputs["O_1"] = 1
+                outputs["O_2"] = 1
                 cycletools.var.state = "wait"
 
             elif 6400 <= measured_color <= 7000:
                 cycletools.var.cycleAuswurf = 250
                 cycletools.var.pistonNumber = 3
-                rpi.io.O_1.value = 1
-                rpi.io.O_2.value = 1
+                outputs["O_1"] = 1
+                outputs["O_2"] = 1
                 cycletools.var.state = "wait"
 
             else:
-                rpi.io.O_1.value = 1 
+                outputs["O_1"] = 1 
                 cycletools.var.state = "idle" 
 
             cycletools.var.color_readings = [] 
@@ -167,13 +202,13 @@ def cycleprogram(cycletools):
     elif cycletools.var.state == "extend":
         cycletools.var.cycleCount += 1
         if cycletools.var.cycleCount >= cycletools.var.cycleAuswurf:
-            rpi.io.O_1.value = 0                      # Stop conveyor
+            outputs["O_1"] = 0                        # Stop conveyor
             if cycletools.var.pistonNumber == 1:
-                rpi.io.O_3.value = 1                  # Extend piston 1
+                outputs["O_3"] = 1                    # Extend piston 1
             elif cycletools.var.pistonNumber == 2:
-                rpi.io.O_4.value = 1                  # Extend piston 2
+                outputs["O_4"] = 1                    # Extend piston 2
             elif cycletools.var.pistonNumber == 3:
-                rpi.io.O_5.value = 1                  # Extend piston 3
+                outputs["O_5"] = 1                    # Extend piston 3
             cycletools.var.retractCounter = 5         # Wait before retracting
             cycletools.var.state = "retrace"
 
@@ -182,31 +217,38 @@ def cycleprogram(cycletools):
         cycletools.var.retractCounter -= 1
         if cycletools.var.retractCounter <= 0:
             if cycletools.var.pistonNumber == 1:
-                rpi.io.O_3.value = 0                  # Retract piston 1
+                outputs["O_3"] = 0                    # Retract piston 1
             elif cycletools.var.pistonNumber == 2:
-                rpi.io.O_4.value = 0                  # Retract piston 2
+                outputs["O_4"] = 0                    # Retract piston 2
             elif cycletools.var.pistonNumber == 3:
-                rpi.io.O_5.value = 0                  # Retract piston 3
-            rpi.io.O_2.value = 0                      # Reset "operation" indicator
+                outputs["O_5"] = 0                    # Retract piston 3
+            outputs["O_2"] = 0                        # Reset "operation" indicator
             cycletools.var.state = "idle"
 
     # Wait for user interaction (e.g. button press) to start new cycle
     elif cycletools.var.state == "idle":
         if cycletools.var.sensors[1] == 0:            # If button pressed
-            rpi.io.O_1.value = 1                      # Start conveyor belt
+            outputs["O_1"] = 1                        # Start conveyor belt
             cycletools.var.cycleCount = 0             # Reset counter
             cycletools.var.state = "driveScan"        # New cycle begins
 
+    # Pass the colours on to the OPC UA thread and the changed outputs to the process image
+    cycle_data.publish()
+    outputs.flush()
+
 
 # Called when program ends - safely switch off all possible outputs
 def programend():
-    rpi.io.O_1.value = 0
-    rpi.io.O_2.value = 0
-    rpi.io.O_3.value = 0
-    rpi.io.O_4.value = 0
-    rpi.io.O_5.value = 0
+    print(monitor.report())
+    print(outputs.report())
+    outputs.off("O_1", "O_2", "O_3", "O_4", "O_5")
+    outputs.flush()
+    capture.close()
+    print(capture.report())
+    recorder.close()
+    print(recorder.report())
 
 rpi.handlesignalend(programend)
 
 # Start main program loop (cyclic operation)
-rpi.cycleloop(cycleprogram, cycletime=10)
\ No newline at end of file
+rpi.cycleloop(monitor.wrap(recorder.wrap(cycleprogram)), cycletime=10)
\ No newline at end of file
@@ -0,0 +1,4 @@
+# REFLECT support library
+#
+# Shared helpers used by the station scripts in code/modbus and code/opcua
+# and by the offline tooling (simulation, benchmarks, dataset generation).
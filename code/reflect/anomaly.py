@@ -0,0 +1,196 @@
+# Streaming anomaly detection on process values
+#
+# AnomalyDetector gets every value of a signal as it arrives (observe()) and
+# keeps a few running statistics per signal instead of a history:
+#
+#   - Welford mean/variance and an EWMA of the values,
+#   - for every change of the value: the interval since the previous change,
+#     its EWMA, Welford mean/variance of log(interval) and a log2 histogram
+#     of the intervals (< 1 ms, < 2 ms, < 4 ms, ...).
+#
+# Each sample is checked against the SignalRule of its signal in O(1):
+#
+#   values          allowed values, e.g. (0, 1)
+#   low, high       allowed range
+#   min_interval    s, minimum time between two changes (debounce/glitch)
+#   min_period      s, minimum time between two changes to the same value,
+#                   e.g. a status that cannot become 1 again faster than the
+#                   machine behind it completes a cycle
+#   zscore          value further than zscore standard deviations from the mean
+#   interval_zscore change interval this many standard deviations (in log
+#                   space) shorter than usual, e.g. a signal suddenly toggling
+#   warmup          samples/changes before the statistical checks start
+#
+#   detector = AnomalyDetector({"multi_status": SignalRule(values=(0, 1), min_period=15.0)})
+#   detector.observe("multi_status", 1)       # returns the alerts raised, usually ()
+#   print(detector.report())
+#
+# Alerts go to on_alert (printed by default). Unchanged values, e.g. from
+# polling, only count as samples, not as changes.
+
+import math
+import time
+from array import array
+from collections import namedtuple
+
+Alert = namedtuple("Alert", "time signal kind value detail")
+
+HISTOGRAM_BUCKETS = 24      # last bucket: intervals of 2**22 ms (70 min) and more
+
+
+class SignalRule:
+    def __init__(self, values=None, low=None, high=None, min_interval=0.0, min_period=0.0,
+                 zscore=None, interval_zscore=None, warmup=30):
+        self.values = frozenset(values) if values is not None else None
+        self.low = low
+        self.high = high
+        self.min_interval = min_interval
+        self.min_period = min_period
+        self.zscore = zscore
+        self.interval_zscore = interval_zscore
+        self.warmup = warmup
+
+
+# Running statistics of one signal
+class SignalStatistics:
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.samples = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ewma = None
+        self.value = None
+        self.changed_at = None
+        self.changes = 0
+        self.interval_ewma = None
+        self.log_mean = 0.0         # Welford over log(interval)
+        self.log_m2 = 0.0
+        self.intervals = 0
+        self.histogram = array("q", bytes(8 * HISTOGRAM_BUCKETS))
+        self.last_change_to = {}    # value -> time of the last change to it (min_period only)
+        self.alerts = 0
+
+    def add_value(self, x):
+        self.samples += 1
+        delta = x - self.mean
+        self.mean += delta / self.samples
+        self.m2 += delta * (x - self.mean)
+        self.ewma = x if self.ewma is None else self.ewma + self.alpha * (x - self.ewma)
+
+    def add_interval(self, interval):
+        self.intervals += 1
+        log_interval = math.log(max(interval, 1e-6))
+        delta = log_interval - self.log_mean
+        self.log_mean += delta / self.intervals
+        self.log_m2 += delta * (log_interval - self.log_mean)
+        if self.interval_ewma is None:
+            self.interval_ewma = interval
+        else:
+            self.interval_ewma += self.alpha * (interval - self.interval_ewma)
+        bucket = min(int(interval * 1000.0).bit_length(), HISTOGRAM_BUCKETS - 1)
+        self.histogram[bucket] += 1
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.samples - 1)) if self.samples > 1 else 0.0
+
+    @property
+    def log_std(self):
+        return math.sqrt(self.log_m2 / (self.intervals - 1)) if self.intervals > 1 else 0.0
+
+    # Upper bound (s) of the histogram bucket holding the given percentile of the intervals
+    def interval_percentile(self, percent):
+        target = self.intervals * percent / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= target:
+                return (1 << bucket) / 1000.0
+        return 0.0
+
+
+def print_alert(alert):
+    print(f"ANOMALY {alert.signal}: {alert.kind} (value {alert.value}, {alert.detail})")
+
+
+class AnomalyDetector:
+    def __init__(self, rules=None, default_rule=None, alpha=0.1, on_alert=print_alert, clock=time.monotonic):
+        self.rules = dict(rules or {})
+        self.default_rule = default_rule if default_rule is not None else SignalRule()
+        self.alpha = alpha                  # weight of the newest sample in the EWMAs
+        self.on_alert = on_alert
+        self.clock = clock
+        self.signals = {}
+        self.samples = 0
+        self.alerts = 0
+
+    def _alert(self, alerts, stats, now, signal, kind, value, detail):
+        alert = Alert(now, signal, kind, value, detail)
+        stats.alerts += 1
+        self.alerts += 1
+        if self.on_alert is not None:
+            self.on_alert(alert)
+        alerts.append(alert)
+
+    # Check and add one sample; returns the alerts it raised
+    def observe(self, signal, value, now=None):
+        stats = self.signals.get(signal)
+        if stats is None:
+            stats = self.signals[signal] = SignalStatistics(self.alpha)
+        rule = self.rules.get(signal, self.default_rule)
+        if now is None:
+            now = self.clock()
+        self.samples += 1
+        alerts = []
+
+        x = float(value)
+        if rule.values is not None and value not in rule.values:
+            self._alert(alerts, stats, now, signal, "value", value, "not an allowed value")
+        if (rule.low is not None and x < rule.low) or (rule.high is not None and x > rule.high):
+            self._alert(alerts, stats, now, signal, "range", value, f"outside [{rule.low}, {rule.high}]")
+        if rule.zscore is not None and stats.samples >= rule.warmup:
+            std = stats.std
+            if std > 0.0 and abs(x - stats.mean) > rule.zscore * std:
+                self._alert(alerts, stats, now, signal, "outlier", value, f"mean {stats.mean:.3g}, std {std:.3g}")
+        stats.add_value(x)
+
+        if stats.value is not None and value == stats.value:
+            return alerts
+
+        # the value changed: check the timing
+        if stats.changed_at is not None:
+            interval = now - stats.changed_at
+            if interval < rule.min_interval:
+                self._alert(alerts, stats, now, signal, "fast change", value,
+                            f"{interval * 1000.0:.1f} ms after the previous change")
+            if rule.interval_zscore is not None and stats.intervals >= rule.warmup:
+                log_std = stats.log_std
+                if log_std > 0.0 and stats.log_mean - math.log(max(interval, 1e-6)) > rule.interval_zscore * log_std:
+                    self._alert(alerts, stats, now, signal, "burst", value,
+                                f"{interval * 1000.0:.1f} ms, usually {math.exp(stats.log_mean) * 1000.0:.1f} ms")
+            stats.add_interval(interval)
+        if rule.min_period:
+            previous = stats.last_change_to.get(value)
+            if previous is not None and now - previous < rule.min_period:
+                self._alert(alerts, stats, now, signal, "fast cycle", value,
+                            f"again after {now - previous:.2f} s, at least {rule.min_period} s")
+            stats.last_change_to[value] = now
+        stats.value = value
+        stats.changed_at = now
+        stats.changes += 1
+        return alerts
+
+    def report(self):
+        lines = [f"anomaly detector: {self.samples} samples, {self.alerts} alerts"]
+        for signal, stats in self.signals.items():
+            line = (
+                f"  {signal}: {stats.samples} samples, {stats.changes} changes, "
+                f"mean {stats.mean:.3g}, std {stats.std:.3g}, {stats.alerts} alerts"
+            )
+            if stats.intervals:
+                line += (
+                    f", change interval ewma {stats.interval_ewma:.3f} s, "
+                    f"p50 < {stats.interval_percentile(50):.3f} s"
+                )
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,382 @@
+# Capture of the control traffic of a station to a compact binary trace
+#
+# Every Modbus word access and every OPC UA value read, written or received
+# becomes one fixed-size record:
+#
+#   time     int64    wall clock, ns since the epoch (time.time_ns, or clock=)
+#   value    float64  the value (bools and ints as numbers)
+#   seq      uint32   running number per recorder, gaps = dropped records
+#   item     uint16   index into the item names of the station
+#   station  uint8    index into the station names
+#   event    uint8    MODBUS_READ, MODBUS_WRITE, OPCUA_READ, ...
+#
+# Records are packed into a preallocated ring buffer per producing thread
+# (Recorder) and a background thread writes the filled part of the rings to
+# disk in large sequential blocks. The producer never waits: if the writer
+# falls behind and a ring is full, records are dropped and counted. Trace
+# files are rotated after file_bytes, and with max_files only the newest
+# files are kept, so a capture can run for days.
+#
+#   capture = TrafficCapture("/var/log/reflect", "gripper")
+#   recorder = capture.recorder()            # one per producing thread
+#   recorder.record(OPCUA_WRITE, "pallet_clear", 1)
+#   ...
+#   capture.close()
+#
+#   trace = load_trace("/var/log/reflect")   # NumPy arrays, see Trace
+#
+# TrafficCapture(None, ...) is a disabled capture: its recorders are None and
+# the hooks (NodeExchange, ModbusTap) skip recording.
+
+import glob
+import json
+import os
+import struct
+import threading
+import time
+
+MAGIC = b"RFLCAP1\0"
+HEADER = struct.Struct("<8sII")        # magic, record size, reserved
+RECORD = struct.Struct("<qdIHBB")
+
+MODBUS_READ = 1
+MODBUS_WRITE = 2
+OPCUA_READ = 3          # value read with a Read request
+OPCUA_WRITE = 4         # value written with a Write request
+OPCUA_RECEIVE = 5       # data change notification or value written by a client
+LABEL = 6               # start (1) and end (0) of a labelled manipulation, see reflect.scenarios
+
+EVENTS = {
+    MODBUS_READ: "modbus_read",
+    MODBUS_WRITE: "modbus_write",
+    OPCUA_READ: "opcua_read",
+    OPCUA_WRITE: "opcua_write",
+    OPCUA_RECEIVE: "opcua_receive",
+    LABEL: "label",
+}
+
+# NumPy layout of RECORD, see load_trace()
+RECORD_FIELDS = [
+    ("time", "<i8"),
+    ("value", "<f8"),
+    ("seq", "<u4"),
+    ("item", "<u2"),
+    ("station", "u1"),
+    ("event", "u1"),
+]
+
+
+# Ring buffer of records with one producing thread
+class Recorder:
+    def __init__(self, capture, capacity):
+        self.capture = capture
+        self.clock = capture.clock
+        self.station = capture.station_id
+        self.capacity = capacity
+        self.block = min(capture.block_records, capacity)   # wake the writer at this fill level
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.head = 0           # records written by the producer
+        self.tail = 0           # records taken by the writer thread
+        self.items = {}         # item name -> id, local copy of the capture table
+        self.dropped = 0
+
+    def record(self, event, name, value):
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.dropped += 1
+            return
+        item = self.items.get(name)
+        if item is None:
+            item = self.items[name] = self.capture.item_id(name)
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = float("nan")
+        RECORD.pack_into(
+            self.buffer, (head % self.capacity) * RECORD.size,
+            self.clock(), value, head & 0xFFFFFFFF, item, self.station, event,
+        )
+        self.head = head + 1
+        if head + 1 - self.tail == self.block:
+            self.capture.wakeup.set()
+
+    # Pending records as at most two contiguous memory blocks
+    def pending(self):
+        head, tail = self.head, self.tail
+        if head == tail:
+            return [], head
+        start = (tail % self.capacity) * RECORD.size
+        end = (head % self.capacity) * RECORD.size
+        view = memoryview(self.buffer)
+        if start < end:
+            return [view[start:end]], head
+        return [view[start:], view[:end]], head
+
+
+class TrafficCapture:
+    def __init__(self, directory, station, ring_records=1 << 16, block_records=4096,
+                 flush_interval=1.0, file_bytes=256 << 20, max_files=0, clock=None):
+        self.directory = directory
+        self.station = station
+        # timestamp source in ns, e.g. simulated time; looked up now, so the
+        # time.time_ns patched by the simulator (reflect.sim.runner) applies
+        self.clock = clock if clock is not None else time.time_ns
+        self.station_id = 0
+        self.ring_records = ring_records        # capacity of every recorder
+        self.block_records = block_records      # write as soon as this many records are pending
+        self.flush_interval = flush_interval    # s, write at least this often
+        self.file_bytes = file_bytes            # rotate the trace file after this size
+        self.max_files = max_files              # keep only the newest files, 0 = all
+        self.recorders = []
+        self.item_names = []
+        self.item_ids = {}
+        self.lock = threading.Lock()
+        self.names_dirty = True
+        self.file = None
+        self.file_size = 0
+        self.file_index = 0
+        self.records = 0        # records written to disk
+        self.blocks = 0         # write calls
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            # continue the numbering of an earlier capture into the same directory
+            existing = self._files()
+            if existing:
+                self.file_index = int(existing[-1].rsplit("-", 1)[1].split(".")[0])
+            self.running = True
+            self.thread = threading.Thread(target=self._writer, name=f"capture-{station}", daemon=True)
+            self.thread.start()
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    # New ring buffer for one producing thread, None if the capture is disabled
+    def recorder(self):
+        if not self.enabled:
+            return None
+        recorder = Recorder(self, self.ring_records)
+        with self.lock:
+            self.recorders.append(recorder)
+        return recorder
+
+    def item_id(self, name):
+        with self.lock:
+            item = self.item_ids.get(name)
+            if item is None:
+                item = self.item_ids[name] = len(self.item_names)
+                self.item_names.append(name)
+                self.names_dirty = True
+            return item
+
+    # --- writer thread ---
+
+    def _writer(self):
+        next_flush = time.perf_counter() + self.flush_interval
+        while self.running:
+            self.wakeup.wait(min(self.flush_interval, 0.1))
+            self.wakeup.clear()
+            now = time.perf_counter()
+            if now >= next_flush:
+                self.flush()
+                next_flush = now + self.flush_interval
+            else:
+                self.flush(self.block_records)
+        self.flush()
+
+    # Write the pending records of every recorder that has at least `minimum`
+    def flush(self, minimum=1):
+        with self.lock:
+            recorders = list(self.recorders)
+        for recorder in recorders:
+            if recorder.head - recorder.tail < minimum:
+                continue
+            blocks, head = recorder.pending()
+            for block in blocks:
+                self._write(block)
+            recorder.tail = head
+        if self.file is not None:
+            self.file.flush()
+        if self.names_dirty:
+            self._write_names()
+
+    def _write(self, block):
+        if self.file is None or self.file_size + len(block) > self.file_bytes:
+            self._rotate()
+        self.file.write(block)
+        self.file_size += len(block)
+        self.records += len(block) // RECORD.size
+        self.blocks += 1
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+        self.file_index += 1
+        path = os.path.join(self.directory, f"{self.station}-{self.file_index:06d}.rcap")
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, RECORD.size, 0))
+        self.file_size = HEADER.size
+        if self.max_files:
+            for old in self._files()[:-self.max_files]:
+                os.remove(old)
+
+    def _files(self):
+        return sorted(glob.glob(os.path.join(self.directory, f"{self.station}-*.rcap")))
+
+    def _write_names(self):
+        with self.lock:
+            names = {"stations": [self.station], "items": list(self.item_names), "events": EVENTS}
+            self.names_dirty = False
+        path = os.path.join(self.directory, f"{self.station}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(names, f)
+        os.replace(path + ".tmp", path)
+
+    def close(self):
+        if not self.running:
+            return
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    @property
+    def dropped(self):
+        return sum(recorder.dropped for recorder in self.recorders)
+
+    def report(self):
+        if not self.enabled:
+            return "capture: off"
+        return (
+            f"capture: {self.records} records in {self.blocks} blocks, {self.dropped} dropped, "
+            f"{self.file_index} files in {self.directory}"
+        )
+
+
+# Records the Modbus words of a station once per cycle, as the gateway
+# transfers them: the input words as read, the output words as written
+class ModbusTap:
+    def __init__(self, recorder, io, reads=(), writes=()):
+        self.recorder = recorder
+        self.reads = [(name, io[name]) for name in reads] if recorder is not None else []
+        self.writes = [(name, io[name]) for name in writes] if recorder is not None else []
+
+    def sample(self):
+        if self.recorder is None:
+            return
+        record = self.recorder.record
+        for name, io in self.reads:
+            record(MODBUS_READ, name, io.value)
+        for name, io in self.writes:
+            record(MODBUS_WRITE, name, io.value)
+
+
+# --- reading ---
+
+# Records of one or more stations, sorted by time
+#
+# records is a NumPy structured array with the fields of RECORD_FIELDS;
+# stations and items translate the station and item indices into names.
+class Trace:
+    def __init__(self, records, stations, items):
+        self.records = records
+        self.stations = stations
+        self.items = items
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, field):
+        return self.records[field]
+
+    # Records of one station and/or item name
+    def select(self, station=None, item=None, event=None):
+        mask = self.records["time"] >= 0
+        if station is not None:
+            mask &= self.records["station"] == self.stations.index(station)
+        if item is not None:
+            mask &= self.records["item"] == self.items.index(item)
+        if event is not None:
+            mask &= self.records["event"] == event
+        return self.records[mask]
+
+
+def read_file(path):
+    import numpy as np
+
+    with open(path, "rb") as f:
+        magic, record_size, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a REFLECT capture file")
+        data = f.read()
+    # a file cut off while writing may end with a partial record
+    usable = len(data) - len(data) % RECORD.size
+    return np.frombuffer(data, dtype=np.dtype(RECORD_FIELDS), count=usable // RECORD.size)
+
+
+# Load all trace files of a capture directory (or the given files)
+def load_trace(path):
+    import numpy as np
+
+    files = sorted(glob.glob(os.path.join(path, "*.rcap"))) if os.path.isdir(path) else [path]
+    stations, items, parts = [], [], []
+    for file in files:
+        station = os.path.basename(file).rsplit("-", 1)[0]
+        with open(os.path.join(os.path.dirname(file), f"{station}.json")) as f:
+            names = json.load(f)
+        records = read_file(file).copy()
+        # map the per-station indices to the indices of the merged trace
+        station_map = np.array([_index(stations, name) for name in names["stations"]], dtype=np.uint8)
+        item_map = np.array([_index(items, name) for name in names["items"]] or [0], dtype=np.uint16)
+        records["station"] = station_map[records["station"]]
+        records["item"] = item_map[records["item"]]
+        parts.append(records)
+
+    if parts:
+        records = np.concatenate(parts)
+        records = records[np.argsort(records["time"], kind="stable")]
+    else:
+        records = np.empty(0, dtype=np.dtype(RECORD_FIELDS))
+    return Trace(records, stations, items)
+
+
+# Read the files of a capture directory (or the given file) in chunks of at
+# most `records` records, without loading the whole trace. Yields
+# (station, records) with the indices mapped to the shared lists stations and
+# items; the files of one station come in order, one station after the other.
+def iter_trace(path, records=1 << 20, stations=None, items=None):
+    import numpy as np
+
+    stations = [] if stations is None else stations
+    items = [] if items is None else items
+    files = sorted(glob.glob(os.path.join(path, "*.rcap"))) if os.path.isdir(path) else [path]
+    for file in files:
+        station = os.path.basename(file).rsplit("-", 1)[0]
+        with open(os.path.join(os.path.dirname(file), f"{station}.json")) as f:
+            names = json.load(f)
+        station_map = np.array([_index(stations, name) for name in names["stations"]], dtype=np.uint8)
+        item_map = np.array([_index(items, name) for name in names["items"]] or [0], dtype=np.uint16)
+        with open(file, "rb") as f:
+            magic, record_size, _ = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or record_size != RECORD.size:
+                raise ValueError(f"{file} is not a REFLECT capture file")
+            while True:
+                data = f.read(records * RECORD.size)
+                usable = len(data) - len(data) % RECORD.size
+                if not usable:
+                    break
+                chunk = np.frombuffer(data, dtype=np.dtype(RECORD_FIELDS), count=usable // RECORD.size).copy()
+                chunk["station"] = station_map[chunk["station"]]
+                chunk["item"] = item_map[chunk["item"]]
+                yield station, chunk
+
+
+def _index(names, name):
+    if name not in names:
+        names.append(name)
+    return names.index(name)
@@ -0,0 +1,447 @@
+# Columnar dataset of recorded runs (Arrow IPC files)
+#
+# A dataset directory holds one table per kind of data, each a directory of
+# segment files in the Arrow IPC file format:
+#
+#   <dataset>/traffic/<run>-<station>-000001.arrow   network exchanges from a
+#                                                     capture (reflect.capture)
+#   <dataset>/cycles/<station>/<run>-000001.arrow    the process image after
+#                                                     every cycle: I_*, O_*,
+#                                                     Counter_*, AnalogInput_1
+#                                                     and the states of the
+#                                                     state machines
+#
+# Columns of traffic: time, run, station, item, event, value, seq
+# Columns of cycles:  time, run, cycle, one per process image entry, and one
+#                     per state machine (current_state, task1_state, ...)
+#
+# time is a timestamp in ns; run, station, item, event and the states are
+# dictionary encoded strings. Segments are written in record batches of
+# batch_rows rows, compressed (zstd by default), and closed after
+# segment_rows rows. Appending a run adds new segments and never touches the
+# existing ones. A segment is written under a temporary name and renamed
+# when complete, together with a small <segment>.json holding its row count
+# and time range, so readers only ever see complete files.
+#
+# Dataset reads the segments memory-mapped and only the requested columns,
+# so one signal can be sliced out of weeks of runs without loading the rest:
+#
+#   dataset = Dataset("/data/reflect")
+#   times, values = dataset.column("cycles/gripper", "I_3", start="2024-05-06", end="2024-05-13")
+#   table = dataset.read("traffic", ["time", "item", "value"], runs=["shift-1"])
+#
+#   python -m reflect.dataset record modbus/gripper.py --seconds 3600 --out /data/reflect --run shift-1
+#   python -m reflect.dataset import /tmp/trace --out /data/reflect --run shift-1
+#   python -m reflect.dataset info /data/reflect
+#
+# pyarrow is only needed for this module.
+
+import argparse
+import glob
+import json
+import operator
+import os
+import sys
+import time
+
+from .capture import EVENTS, iter_trace
+from .statemachine import Machine
+
+TRAFFIC = "traffic"
+CYCLES = "cycles"
+
+
+def _arrow():
+    import pyarrow
+    import pyarrow.ipc  # noqa: F401
+
+    return pyarrow
+
+
+# Time bound as ns since the epoch: int ns, float s, datetime or ISO string
+def _ns(value):
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value * 1e9)
+    if isinstance(value, str):
+        import datetime
+
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.astimezone()
+    return int(value.timestamp() * 1_000_000) * 1000
+
+
+# State column of a state machine variable: machine -> current_state, task1_machine -> task1_state
+def state_column(name):
+    if name == "machine":
+        return "current_state"
+    if name.endswith("machine"):
+        return name[:-len("machine")] + "state"
+    return name + "_state"
+
+
+# Writer of the segments of one table and run
+class SegmentWriter:
+    def __init__(self, directory, prefix, schema, segment_rows=1 << 22, compression="zstd"):
+        self.directory = directory
+        self.prefix = prefix
+        self.schema = schema
+        self.segment_rows = segment_rows
+        self.compression = compression
+        self.segments = 0
+        self.rows = 0
+        self._writer = None
+        self._path = None
+        self._segment_rows = 0
+        self._start = None
+        self._end = None
+        os.makedirs(directory, exist_ok=True)
+        # continue the numbering of an earlier run with the same name
+        existing = glob.glob(os.path.join(directory, f"{glob.escape(prefix)}-[0-9]*.arrow"))
+        self._number = max((int(path[:-len(".arrow")].rsplit("-", 1)[1]) for path in existing), default=0)
+
+    def write(self, batch):
+        if not batch.num_rows:
+            return
+        if self._writer is None:
+            pa = _arrow()
+            self._number += 1
+            self._path = os.path.join(self.directory, f"{self.prefix}-{self._number:06d}.arrow")
+            options = pa.ipc.IpcWriteOptions(compression=self.compression)
+            self._writer = pa.ipc.new_file(self._path + ".part", self.schema, options=options)
+            self._segment_rows = 0
+            self._start = self._end = None
+        self._writer.write_batch(batch)
+        times = batch.column(0).cast("int64").to_numpy()
+        start, end = int(times.min()), int(times.max())
+        self._start = start if self._start is None else min(self._start, start)
+        self._end = end if self._end is None else max(self._end, end)
+        self._segment_rows += batch.num_rows
+        self.rows += batch.num_rows
+        if self._segment_rows >= self.segment_rows:
+            self.close()
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        with open(self._path[:-len(".arrow")] + ".json", "w") as f:
+            json.dump({"rows": self._segment_rows, "start": self._start, "end": self._end}, f)
+        os.replace(self._path + ".part", self._path)
+        self.segments += 1
+
+
+# Observer of a simulated run (reflect.sim run_script(observers=...)): one row
+# per cycle with the process image and the states after the program.
+# Time is the start of the run on the wall clock plus the virtual time.
+class CycleLog:
+    def __init__(self, directory, station, run, batch_rows=1 << 16, segment_rows=1 << 22, compression="zstd",
+                 start_ns=None):
+        self.directory = os.path.join(directory, CYCLES, station)
+        self.station = station
+        self.run = run
+        self.batch_rows = batch_rows
+        self.segment_rows = segment_rows
+        self.compression = compression
+        self.start_ns = time.time_ns() if start_ns is None else start_ns
+        self.cycles = 0
+        self._names = None
+        self._get = None
+        self._machines = None
+        self._rows = []
+        self._writer = None
+
+    # Machines of the script: in cycletools.var and the script's globals
+    def _find_machines(self, cycletools):
+        machines = {}
+        main = sys.modules.get("__main__")
+        for scope in (vars(cycletools.var), vars(main) if main is not None else {}):
+            for name, value in scope.items():
+                if isinstance(value, Machine) and all(value is not known for known in machines.values()):
+                    machines[state_column(name)] = value
+        return machines
+
+    def _setup(self, rpi, cycletools):
+        pa = _arrow()
+        values = rpi.io.values
+        self._names = list(values)
+        self._get = operator.itemgetter(*self._names)
+        self._machines = self._find_machines(cycletools)
+        fields = [
+            pa.field("time", pa.timestamp("ns")),
+            pa.field("run", pa.dictionary(pa.int16(), pa.string())),
+            pa.field("cycle", pa.int64()),
+        ]
+        for name in self._names:
+            value = values[name]
+            kind = pa.bool_() if isinstance(value, bool) else pa.float64() if isinstance(value, float) else pa.int64()
+            fields.append(pa.field(name, kind))
+        for column in self._machines:
+            fields.append(pa.field(column, pa.dictionary(pa.int16(), pa.string())))
+        self.schema = pa.schema(fields, metadata={"station": self.station, "run": self.run})
+        self._dictionaries = [pa.array(machine.definition.names) for machine in self._machines.values()]
+        self._run_dictionary = pa.array([self.run])
+        self._writer = SegmentWriter(self.directory, self.run, self.schema, self.segment_rows, self.compression)
+
+    def observe(self, rpi, cycletools):
+        if self._names is None:
+            self._setup(rpi, cycletools)
+        row = self._get(rpi.io.values)
+        if len(self._names) == 1:
+            row = (row,)
+        self._rows.append((self.start_ns + round(rpi.clock.now * 1e9), self.cycles, row,
+                           tuple(machine.state for machine in self._machines.values())))
+        self.cycles += 1
+        if len(self._rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        pa = _arrow()
+        rows, self._rows = self._rows, []
+        times, cycles, values, states = zip(*rows)
+        count = len(rows)
+        arrays = [
+            pa.array(times, pa.int64()).cast(pa.timestamp("ns")),
+            pa.DictionaryArray.from_arrays(pa.array([0] * count, pa.int16()), self._run_dictionary),
+            pa.array(cycles, pa.int64()),
+        ]
+        for index, column in enumerate(zip(*values)):
+            arrays.append(pa.array(column, self.schema.field(3 + index).type))
+        for dictionary, column in zip(self._dictionaries, zip(*states) if self._machines else ()):
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(column, pa.int16()), dictionary))
+        self._writer.write(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+
+    def report(self):
+        segments = self._writer.segments if self._writer is not None else 0
+        return f"cycle log {self.station}: {self.cycles} cycles in {segments} segments, {self.directory}"
+
+
+# Append a capture directory (reflect.capture) to the traffic table
+def import_capture(path, directory, run, batch_rows=1 << 20, segment_rows=1 << 24, compression="zstd"):
+    pa = _arrow()
+    import numpy as np
+
+    table = os.path.join(directory, TRAFFIC)
+    event_names = [""] * (max(EVENTS) + 1)
+    for number, name in EVENTS.items():
+        event_names[number] = name
+    events = pa.array(event_names)
+    run_dictionary = pa.array([run])
+    writers = {}
+    rows = 0
+    stations, items = [], []
+    for station, records in iter_trace(path, batch_rows, stations, items):
+        writer = writers.get(station)
+        if writer is None:
+            schema = pa.schema([
+                pa.field("time", pa.timestamp("ns")),
+                pa.field("run", pa.dictionary(pa.int16(), pa.string())),
+                pa.field("station", pa.dictionary(pa.int16(), pa.string())),
+                pa.field("item", pa.dictionary(pa.int32(), pa.string())),
+                pa.field("event", pa.dictionary(pa.int8(), pa.string())),
+                pa.field("value", pa.float64()),
+                pa.field("seq", pa.uint32()),
+            ], metadata={"station": station, "run": run})
+            writer = writers[station] = SegmentWriter(table, f"{run}-{station}", schema, segment_rows, compression)
+            # all names of the station are known once its first chunk is read
+            writer.names = (pa.array(list(stations)), pa.array(list(items)))
+        station_names, item_names = writer.names
+        records = records[np.argsort(records["time"], kind="stable")]
+        writer.write(pa.RecordBatch.from_arrays([
+            pa.array(records["time"]).cast(pa.timestamp("ns")),
+            pa.DictionaryArray.from_arrays(pa.array(np.zeros(len(records), dtype=np.int16)), run_dictionary),
+            pa.DictionaryArray.from_arrays(pa.array(records["station"].astype(np.int16)), station_names),
+            pa.DictionaryArray.from_arrays(pa.array(records["item"].astype(np.int32)), item_names),
+            pa.DictionaryArray.from_arrays(pa.array(records["event"].astype(np.int8)), events),
+            pa.array(records["value"]),
+            pa.array(records["seq"]),
+        ], schema=writer.schema))
+        rows += len(records)
+    for writer in writers.values():
+        writer.close()
+    return rows
+
+
+# Memory-mapped reader of a dataset directory
+class Dataset:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def tables(self):
+        tables = []
+        if os.path.isdir(os.path.join(self.directory, TRAFFIC)):
+            tables.append(TRAFFIC)
+        for station in sorted(glob.glob(os.path.join(self.directory, CYCLES, "*"))):
+            tables.append(f"{CYCLES}/{os.path.basename(station)}")
+        return tables
+
+    # Complete segment files of a table as (path, info), optionally only of some runs and times
+    def segments(self, table, runs=None, start=None, end=None):
+        start, end = _ns(start), _ns(end)
+        segments = []
+        for path in sorted(glob.glob(os.path.join(self.directory, table, "*.arrow"))):
+            info_path = path[:-len(".arrow")] + ".json"
+            info = {}
+            if os.path.exists(info_path):
+                with open(info_path) as f:
+                    info = json.load(f)
+            if runs is not None and self._run(path) not in runs:
+                continue
+            if info and ((start is not None and info["end"] < start) or (end is not None and info["start"] >= end)):
+                continue
+            segments.append((path, info))
+        return segments
+
+    def _run(self, path):
+        pa = _arrow()
+        with pa.memory_map(path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+        return metadata.get(b"run", b"").decode()
+
+    def schema(self, table):
+        pa = _arrow()
+        segments = self.segments(table)
+        if not segments:
+            raise FileNotFoundError(f"no segments of table {table!r} in {self.directory}")
+        with pa.memory_map(segments[0][0]) as source:
+            return pa.ipc.open_file(source).schema
+
+    # Batches of the given columns (all if None) with start <= time < end
+    def batches(self, table, columns=None, start=None, end=None, runs=None):
+        pa = _arrow()
+        import pyarrow.compute as pc
+
+        start, end = _ns(start), _ns(end)
+        for path, _ in self.segments(table, runs, start, end):
+            with pa.memory_map(path) as source:
+                schema = pa.ipc.open_file(source).schema
+                names = schema.names if columns is None else list(columns)
+                if (start is not None or end is not None) and "time" not in names:
+                    names = ["time"] + names
+                missing = [name for name in names if name not in schema.names]
+                if missing:
+                    raise KeyError(f"{path} has no column {', '.join(missing)}")
+                options = pa.ipc.IpcReadOptions(included_fields=[schema.get_field_index(name) for name in names])
+                reader = pa.ipc.open_file(source, options=options)
+                for index in range(reader.num_record_batches):
+                    batch = reader.get_batch(index)
+                    if start is not None or end is not None:
+                        times = batch.column("time").cast("int64")
+                        mask = None
+                        if start is not None:
+                            mask = pc.greater_equal(times, start)
+                        if end is not None:
+                            below = pc.less(times, end)
+                            mask = below if mask is None else pc.and_(mask, below)
+                        batch = batch.filter(mask)
+                        if columns is not None and "time" not in columns:
+                            batch = batch.select(list(columns))
+                    if batch.num_rows:
+                        yield batch
+
+    def read(self, table, columns=None, start=None, end=None, runs=None):
+        pa = _arrow()
+        batches = list(self.batches(table, columns, start, end, runs))
+        if not batches:
+            schema = self.schema(table)
+            return schema.empty_table().select(list(columns) if columns is not None else schema.names)
+        return pa.Table.from_batches(batches)
+
+    # One signal as NumPy arrays (time in ns, values); traffic items are
+    # selected by station/item name, cycles columns by name
+    def column(self, table, name, start=None, end=None, runs=None, station=None):
+        import numpy as np
+        import pyarrow.compute as pc
+
+        if table == TRAFFIC:
+            times, values = [], []
+            for batch in self.batches(table, ["time", "station", "item", "value"], start, end, runs):
+                mask = pc.equal(batch.column("item").cast("string"), name)
+                if station is not None:
+                    mask = pc.and_(mask, pc.equal(batch.column("station").cast("string"), station))
+                batch = batch.filter(mask)
+                times.append(batch.column("time").cast("int64").to_numpy())
+                values.append(batch.column("value").to_numpy())
+        else:
+            batches = list(self.batches(table, ["time", name], start, end, runs))
+            times = [batch.column(0).cast("int64").to_numpy() for batch in batches]
+            values = [batch.column(1).to_numpy(zero_copy_only=False) for batch in batches]
+        if not times:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(times), np.concatenate(values)
+
+    def info(self):
+        lines = [f"dataset {self.directory}"]
+        for table in self.tables():
+            segments = self.segments(table)
+            rows = sum(info.get("rows", 0) for _, info in segments)
+            size = sum(os.path.getsize(path) for path, _ in segments)
+            starts = [info["start"] for _, info in segments if info]
+            ends = [info["end"] for _, info in segments if info]
+            span = ""
+            if starts:
+                span = (f", {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(min(starts) / 1e9))} .. "
+                        f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(max(ends) / 1e9))}")
+            lines.append(f"  {table}: {len(segments)} segments, {rows} rows, {size / 1e6:.1f} MB{span}")
+        return "\n".join(lines)
+
+
+# --- command line ---
+
+def record(args):
+    from .sim.runner import run_script
+
+    station = os.path.splitext(os.path.basename(args.script))[0]
+    log = CycleLog(args.out, station, args.run, compression=args.compression or None)
+    run = run_script(args.script, cycles=args.cycles, seconds=args.seconds, seed=args.seed, quiet=True,
+                     observers=[log])
+    log.close()
+    print(run.summary())
+    print(log.report())
+
+
+def import_(args):
+    rows = import_capture(args.capture, args.out, args.run, compression=args.compression or None)
+    print(f"{rows} records of {args.capture} added to {os.path.join(args.out, TRAFFIC)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar dataset of recorded REFLECT runs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rec = commands.add_parser("record", help="run a station script in the simulation and log every cycle")
+    rec.add_argument("script")
+    rec.add_argument("--out", required=True, help="dataset directory")
+    rec.add_argument("--run", required=True, help="name of the run")
+    rec.add_argument("--cycles", type=int)
+    rec.add_argument("--seconds", type=float, default=60.0, help="simulated time")
+    rec.add_argument("--seed", type=int, default=0)
+    rec.add_argument("--compression", default="zstd", help="zstd, lz4 or '' for none")
+    imp = commands.add_parser("import", help="add a capture directory to the traffic table")
+    imp.add_argument("capture")
+    imp.add_argument("--out", required=True, help="dataset directory")
+    imp.add_argument("--run", required=True, help="name of the run")
+    imp.add_argument("--compression", default="zstd", help="zstd, lz4 or '' for none")
+    inf = commands.add_parser("info", help="list the tables of a dataset")
+    inf.add_argument("dataset")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        record(args)
+    elif args.command == "import":
+        import_(args)
+    else:
+        print(Dataset(args.dataset).info())
+
+
+if __name__ == "__main__":
+    main()
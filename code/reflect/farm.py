@@ -0,0 +1,244 @@
+# Farm of virtual factories for generating traffic at scale
+#
+# A factory is one complete REFLECT line in the simulation, all its stations
+# in one process on a common clock (reflect.sim.run_line):
+#
+#   modbus  modbus/gripper.py, high_bay_warehouse.py and multi.py, talking
+#           Modbus TCP through a reflect.modbus_bridge register server
+#   opcua   opcua/gripper.py (OPC UA server), high_bay_warehouse.py,
+#           multi.py and sorting_line.py (clients)
+#
+# The launcher runs the factories in a process pool, one factory per worker
+# process at a time, so a farm scales with the cores of one machine. Every
+# factory gets its own seed and port range on the loopback interface and
+# writes its traffic captures (reflect.capture, simulated timestamps) to
+# <out>/factory-NNN; nothing else is touched:
+#
+#   factory i   seed      <seed> + i, plant of station k: (<seed> + i) * 100 + k
+#               ports     <base-port> + 10 * i + 0   Modbus register server
+#                         <base-port> + 10 * i + 1   OPC UA server
+#
+# Modbus lines run as fast as the scripts allow. OPC UA lines run in real
+# time by default: asyncua's timeouts, publishing intervals and channel
+# renewals run on time.monotonic, the simulated clock. --speed sets the pace
+# of all lines (multiples of real time, "max" for no pacing).
+#
+#   cd code
+#   python -m reflect.farm --factories 32 --seconds 3600 --lines modbus --out /data/farm
+#   python -m reflect.farm --factories 8 --seconds 300 --lines modbus,opcua --workers 8 --out /data/farm
+#
+# The launcher prints the throughput of every factory and of the farm
+# (cycles, capture records and simulated seconds per wall second, CPU time)
+# and writes it to <out>/farm.json.
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+LINES = {
+    "modbus": ("modbus/gripper.py", "modbus/high_bay_warehouse.py", "modbus/multi.py"),
+    "opcua": ("opcua/gripper.py", "opcua/high_bay_warehouse.py", "opcua/multi.py", "opcua/sorting_line.py"),
+}
+
+# pace of a line if --speed is not given, None = as fast as possible
+DEFAULT_SPEED = {"modbus": None, "opcua": 1.0}
+
+PORTS_PER_FACTORY = 10
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def factory_specs(count, lines=("modbus",), seconds=60.0, seed=0, base_port=20000, out_dir=None, speed="default"):
+    specs = []
+    for index in range(count):
+        line = lines[index % len(lines)]
+        specs.append({
+            "name": f"factory-{index:03d}",
+            "line": line,
+            "seconds": seconds,
+            "seed": seed + index,
+            "port": base_port + PORTS_PER_FACTORY * index,
+            "out": os.path.join(out_dir, f"factory-{index:03d}") if out_dir else None,
+            "speed": DEFAULT_SPEED[line] if speed == "default" else speed,
+        })
+    return specs
+
+
+# Run one factory in this process; called in a worker of the pool
+def run_factory(spec):
+    from .modbus_bridge import BridgeClient, ProcessImageLink, RegisterServer
+    from .sim.runner import LineStation, plant_for_script, run_line
+
+    line, port = spec["line"], spec["port"]
+    logging.getLogger("asyncua").setLevel(logging.ERROR)
+    if spec["out"]:
+        os.makedirs(spec["out"], exist_ok=True)
+        os.environ["REFLECT_CAPTURE"] = spec["out"]
+    else:
+        os.environ.pop("REFLECT_CAPTURE", None)
+    os.environ.pop("REFLECT_RECORD", None)
+    os.environ["REFLECT_OPCUA_ENDPOINT"] = f"opc.tcp://127.0.0.1:{port + 1}"
+    os.environ["REFLECT_OPCUA_URL"] = f"opc.tcp://127.0.0.1:{port + 1}"
+
+    server = None
+    if line == "modbus":
+        server = RegisterServer("127.0.0.1", port)
+        server.start()
+    stations = []
+    for number, script in enumerate(LINES[line]):
+        script = os.path.join(CODE_DIR, script)
+        plant = plant_for_script(script, seed=spec["seed"] * 100 + number)
+        # the neighbouring stations answer, not the plant model
+        plant.handshake = False
+        links = []
+        if server is not None:
+            station = os.path.splitext(os.path.basename(script))[0]
+            links.append(ProcessImageLink(BridgeClient(station, "127.0.0.1", port)))
+        stations.append(LineStation(script, plant, links=links))
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    try:
+        runs = run_line(stations, spec["seconds"], speed=spec["speed"])
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    result = {
+        "factory": spec,
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "simulated_seconds": max((run.clock.now for run in runs), default=0.0),
+        "stations": [],
+        "modbus_requests": server.table.requests if server is not None else 0,
+    }
+    for run, station in zip(runs, stations):
+        namespace = run.namespace or {}
+        capture = namespace.get("capture")
+        result["stations"].append({
+            "script": os.path.relpath(run.script, CODE_DIR),
+            "cycles": run.cycles,
+            "records": capture.records if capture is not None else 0,
+            "dropped": capture.dropped if capture is not None else 0,
+            "link_errors": sum(link.client.errors for link in station.links),
+            "error": f"{type(run.error).__name__}: {run.error}" if run.error is not None else None,
+        })
+    result["cycles"] = sum(station["cycles"] for station in result["stations"])
+    result["records"] = sum(station["records"] for station in result["stations"])
+    return result
+
+
+def _run_safely(spec):
+    try:
+        return run_factory(spec)
+    except Exception as error:  # one broken factory must not stop the farm
+        return {"factory": spec, "error": f"{type(error).__name__}: {error}"}
+
+
+# Run the factories in a process pool, yields the results as they finish
+def run_farm(specs, workers=None):
+    workers = workers or os.cpu_count() or 1
+    # a fresh process per factory: the OPC UA threads and ports of a line end with it
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+        futures = [pool.submit(_run_safely, spec) for spec in specs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def describe(result):
+    spec = result["factory"]
+    if "error" in result:
+        return f"{spec['name']} {spec['line']}: failed, {result['error']}"
+    wall = result["wall_seconds"]
+    errors = [station["error"] for station in result["stations"] if station["error"]]
+    link_errors = sum(station["link_errors"] for station in result["stations"])
+    text = (
+        f"{spec['name']} {spec['line']} seed {spec['seed']}: {result['cycles']} cycles, "
+        f"{result['simulated_seconds']:.0f} s simulated in {wall:.1f} s "
+        f"({result['simulated_seconds'] / wall if wall else 0.0:.0f}x), cpu {result['cpu_seconds']:.1f} s, "
+        f"{result['records']} records"
+    )
+    if link_errors:
+        text += f", {link_errors} Modbus errors"
+    if errors:
+        text += f", errors: {'; '.join(errors)}"
+    return text
+
+
+def summary(results, workers, wall):
+    done = [result for result in results if "error" not in result]
+    cycles = sum(result["cycles"] for result in done)
+    records = sum(result["records"] for result in done)
+    simulated = sum(result["simulated_seconds"] for result in done)
+    cpu = sum(result["cpu_seconds"] for result in done)
+    lines = {}
+    for result in done:
+        lines[result["factory"]["line"]] = lines.get(result["factory"]["line"], 0) + 1
+    return {
+        "factories": len(results),
+        "failed": len(results) - len(done),
+        "lines": lines,
+        "workers": workers,
+        "wall_seconds": wall,
+        "simulated_seconds": simulated,
+        "cycles": cycles,
+        "records": records,
+        "cpu_seconds": cpu,
+        "cycles_per_second": cycles / wall if wall else 0.0,
+        "records_per_second": records / wall if wall else 0.0,
+        "speedup": simulated / wall if wall else 0.0,
+        "cpu_utilisation": cpu / (wall * workers) if wall else 0.0,
+    }
+
+
+def _speed(text):
+    return None if text == "max" else float(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run many virtual REFLECT factories in a process pool")
+    parser.add_argument("--factories", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seconds", type=float, default=60.0, help="simulated time per factory")
+    parser.add_argument("--lines", default="modbus", help="comma separated line types, assigned round robin")
+    parser.add_argument("--workers", type=int, help="processes (default: number of cores)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--base-port", type=int, default=20000)
+    parser.add_argument("--speed",
+                        help="multiples of real time or 'max' (default: max for modbus, 1 for opcua)")
+    parser.add_argument("--out", help="directory for the traffic captures and farm.json")
+    args = parser.parse_args(argv)
+
+    lines = tuple(args.lines.split(","))
+    for line in lines:
+        if line not in LINES:
+            parser.error(f"unknown line {line!r}, choose from {sorted(LINES)}")
+    workers = args.workers or os.cpu_count() or 1
+    speed = "default" if args.speed is None else _speed(args.speed)
+    specs = factory_specs(args.factories, lines, args.seconds, args.seed, args.base_port, args.out, speed)
+
+    start = time.perf_counter()
+    results = []
+    for result in run_farm(specs, workers):
+        results.append(result)
+        print(describe(result), flush=True)
+    farm = summary(results, workers, time.perf_counter() - start)
+    print(
+        f"farm: {farm['factories']} factories ({farm['failed']} failed) on {workers} workers in "
+        f"{farm['wall_seconds']:.1f} s: {farm['simulated_seconds']:.0f} s simulated ({farm['speedup']:.0f}x), "
+        f"{farm['cycles_per_second']:.0f} cycles/s, {farm['records_per_second']:.0f} records/s, "
+        f"cpu {farm['cpu_seconds']:.1f} s ({100.0 * farm['cpu_utilisation']:.0f} % of the workers)"
+    )
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        results.sort(key=lambda result: result["factory"]["name"])
+        with open(os.path.join(args.out, "farm.json"), "w") as f:
+            json.dump({"farm": farm, "factories": results}, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
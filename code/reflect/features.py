@@ -0,0 +1,401 @@
+# Windowed features of captured control traffic
+#
+# FeatureExtractor turns the records of a capture (reflect.capture) into one
+# row of features per key and window. Everything is computed with NumPy on
+# whole chunks of records, never record by record:
+#
+#   key      level="node": station and item (one Modbus word / OPC UA value)
+#            level="peer": station, i.e. all traffic of one station
+#   window   `window` seconds long, one every `step` seconds
+#            (step == window: tumbling windows, smaller steps: sliding windows)
+#
+# Features of a row (times in s):
+#
+#   records, reads, writes       reads include OPC UA data change notifications
+#   write_read                   writes / reads
+#   interarrival_mean/std/min/max  time between two records of the key
+#   changes, change_rate         value changes, and per second of the window
+#   dwell_mean, dwell_max        how long a value was held, for the values
+#                                replaced within the window (state dwell time)
+#   value_mean/min/max/last      (node level only meaningful)
+#
+# The records are aggregated once into panes of `step` seconds, and a window
+# combines window / step panes. feed() takes the records in chunks and returns
+# the windows completed so far. A pane is complete once the newest record is
+# `lateness` seconds past its end, so the slightly unordered records of
+# several recorders are fine; records later than that are counted in `late`
+# and ignored. Memory is bounded by one chunk plus the open panes.
+#
+#   for station, rows in extract_features("/var/log/reflect", window=10.0, step=1.0):
+#       rows["interarrival_mean"], rows["item"], ...
+#
+#   python -m reflect.features /var/log/reflect --window 10 --step 1 --out features.csv
+
+import argparse
+import math
+import sys
+import time
+
+import numpy as np
+
+from .capture import LABEL, MODBUS_READ, MODBUS_WRITE, OPCUA_READ, OPCUA_RECEIVE, OPCUA_WRITE, iter_trace
+
+FEATURES = (
+    "records", "reads", "writes", "write_read",
+    "interarrival_mean", "interarrival_std", "interarrival_min", "interarrival_max",
+    "changes", "change_rate", "dwell_mean", "dwell_max",
+    "value_mean", "value_min", "value_max", "value_last",
+)
+
+# One row per key and window; item is PEER for rows of level="peer"
+FEATURE_FIELDS = [("start", "<i8"), ("station", "u1"), ("item", "<u2")] + [(name, "<f8") for name in FEATURES]
+
+PEER = 0xFFFF
+
+READ_EVENTS = (MODBUS_READ, OPCUA_READ, OPCUA_RECEIVE)
+WRITE_EVENTS = (MODBUS_WRITE, OPCUA_WRITE)
+
+# Read/write class of every event number
+_READ, _WRITE = 1, 2
+_KIND = np.zeros(256, dtype=np.uint8)
+_KIND[list(READ_EVENTS)] = _READ
+_KIND[list(WRITE_EVENTS)] = _WRITE
+
+_COLUMNS = ("time", "value", "station", "item", "event")
+
+# Per pane aggregates: sums, minima, maxima and the last value
+_SUMS = ("records", "reads", "writes", "changes", "dt_n", "dt_sum", "dt_sq", "dwell_n", "dwell_sum", "value_sum")
+_MINS = ("dt_min", "value_min")
+_MAXS = ("dt_max", "dwell_max", "value_max")
+
+
+# Boolean mask of the first element of every run of equal keys
+def _run_starts(keys):
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return first
+
+
+# State of the keys: looks up `values` of `queries`, fill where the key is unknown
+def _lookup(keys, values, queries, fill):
+    index = np.searchsorted(keys, queries)
+    index[index >= len(keys)] = 0
+    known = (keys[index] == queries) if len(keys) else np.zeros(len(queries), dtype=bool)
+    return np.where(known, values[index] if len(keys) else fill, fill)
+
+
+# Merge the newest per key state into the sorted state arrays
+def _merge(keys, columns, new_keys, new_columns):
+    keys = np.concatenate((keys, new_keys))
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    last = np.ones(len(keys), dtype=bool)
+    last[:-1] = keys[1:] != keys[:-1]
+    merged = [np.concatenate((old, new))[order][last] for old, new in zip(columns, new_columns)]
+    return keys[last], merged
+
+
+# Value of the preceding element of the same key, the state for the first one
+def _previous(keys, values, state_keys, state_values, fill):
+    previous = np.empty(len(values), dtype=values.dtype)
+    previous[1:] = values[:-1]
+    first = _run_starts(keys)
+    previous[first] = _lookup(state_keys, state_values, keys[first], fill)
+    return previous
+
+
+class FeatureExtractor:
+    def __init__(self, window=10.0, step=None, level="node", lateness=1.0, events=READ_EVENTS + WRITE_EVENTS):
+        step = window if step is None else step
+        panes = window / step
+        if step <= 0 or abs(panes - round(panes)) > 1e-9:
+            raise ValueError(f"window {window} s must be a multiple of the step {step} s")
+        if level not in ("node", "peer"):
+            raise ValueError(f"level must be 'node' or 'peer', not {level!r}")
+        self.window = window
+        self.step_ns = int(round(step * 1e9))
+        self.panes = int(round(panes))
+        self.level = level
+        self.lateness_ns = int(lateness * 1e9)
+        self._allowed = np.zeros(256, dtype=bool)
+        self._allowed[[event for event in events if event != LABEL]] = True
+        self.late = 0
+        self.records = 0
+        self.rows = 0
+        self._pending = None
+        self._newest = None
+        self._complete = None           # panes before this one are complete
+        self._last_window = None        # windows up to this one are emitted
+        self._open = None               # aggregates of the panes still needed
+        # per node: last value and time of the last change
+        self._nodes = np.empty(0, dtype=np.int64)
+        self._node_state = [np.empty(0), np.empty(0, dtype=np.int64)]
+        # per key: time of the last record (interarrival)
+        self._keys = np.empty(0, dtype=np.int64)
+        self._key_time = [np.empty(0, dtype=np.int64)]
+
+    # Add a chunk of records; returns the rows of the windows completed by it
+    def feed(self, records):
+        columns = {name: records[name] for name in _COLUMNS}
+        keep = self._allowed[columns["event"]]
+        if self._complete is not None:
+            late = keep & (columns["time"] < self._complete * self.step_ns)
+            self.late += int(np.count_nonzero(late))
+            keep &= ~late
+        if not keep.all():
+            columns = {name: column[keep] for name, column in columns.items()}
+        if not len(columns["time"]):
+            return self._empty()
+        self.records += len(columns["time"])
+        newest = int(columns["time"].max())
+        self._newest = newest if self._newest is None else max(self._newest, newest)
+        if self._pending is not None:
+            columns = {name: np.concatenate((self._pending[name], column)) for name, column in columns.items()}
+        self._pending = columns
+
+        complete = (self._newest - self.lateness_ns) // self.step_ns
+        if self._complete is not None and complete <= self._complete:
+            return self._empty()
+        ready = columns["time"] < complete * self.step_ns
+        if ready.all():
+            self._aggregate(columns)
+            self._pending = None
+        else:
+            self._aggregate({name: column[ready] for name, column in columns.items()})
+            self._pending = {name: column[~ready] for name, column in columns.items()}
+        self._complete = complete
+        return self._windows(complete - self.panes)
+
+    # Emit all remaining windows, including those reaching past the last record
+    def finish(self):
+        if self._pending is not None:
+            self._aggregate(self._pending)
+            self._pending = None
+        if self._open is None or not len(self._open["pane"]):
+            return self._empty()
+        self._complete = int(self._open["pane"].max()) + 1
+        return self._windows(self._complete - 1)
+
+    def _empty(self):
+        return np.empty(0, dtype=np.dtype(FEATURE_FIELDS))
+
+    # Per pane aggregates of records (columns), added to the open panes
+    def _aggregate(self, columns):
+        times = columns["time"]
+        if not len(times):
+            return
+        if np.any(times[1:] < times[:-1]):
+            order = np.argsort(times, kind="stable")
+            columns = {name: column[order] for name, column in columns.items()}
+            times = columns["time"]
+        stations, items = columns["station"], columns["item"]
+        # sort by node, stable so every node stays in time order; a compact
+        # 16 bit key lets NumPy use a radix sort
+        span = int(items.max()) + 1
+        compact = stations.astype(np.int64) * span + items
+        if compact.max() < 1 << 16:
+            compact = compact.astype(np.uint16)
+        order = np.argsort(compact, kind="stable")
+        node = (stations[order].astype(np.int64) << 16) | items[order]
+        times = times[order]
+        values = columns["value"][order]
+
+        # value changes and dwell times per node
+        last_value, last_change = self._node_state
+        previous = _previous(node, values, self._nodes, last_value, np.nan)
+        changed = (values != previous) & ~np.isnan(previous)
+        starts = np.flatnonzero(_run_starts(node))
+        run_keys = node[starts]
+        # the value replaced by a change was set at the previous change, or
+        # when the node was first seen
+        since = _lookup(self._nodes, last_change, run_keys, -1)
+        since = np.where(since < 0, times[starts], since)
+        change_nodes = node[changed]
+        change_times = times[changed]
+        previous_change = np.empty(len(change_times), dtype=np.int64)
+        previous_change[1:] = change_times[:-1]
+        first = _run_starts(change_nodes)
+        previous_change[first] = since[np.searchsorted(run_keys, change_nodes[first])]
+        dwell = np.zeros(len(times))
+        dwell[changed] = (change_times - previous_change) / 1e9
+
+        ends = np.r_[starts[1:], len(node)] - 1
+        # last change of every node in this chunk, else the state from before
+        change_index = np.maximum.accumulate(np.where(changed, np.arange(len(times)), -1))[ends]
+        last_changes = np.where(change_index >= starts, times[np.maximum(change_index, 0)], since)
+        self._nodes, self._node_state = _merge(
+            self._nodes, self._node_state, run_keys, [values[ends], last_changes])
+
+        if self.level == "peer":
+            # back to time order, then sorted by station
+            peer_order = np.argsort(stations, kind="stable")
+            inverse = np.empty(len(order), dtype=np.intp)
+            inverse[order] = np.arange(len(order))
+            changed, dwell = changed[inverse[peer_order]], dwell[inverse[peer_order]]
+            order = peer_order
+            key = (stations[order].astype(np.int64) << 16) | PEER
+            times = columns["time"][order]
+            values = columns["value"][order]
+        else:
+            key = node
+        kinds = _KIND[columns["event"][order]]
+
+        # interarrival times per key
+        previous_time = _previous(key, times, self._keys, self._key_time[0], -1)
+        has_dt = previous_time >= 0
+        dt = (times - previous_time) / 1e9
+        key_ends = np.flatnonzero(np.r_[key[1:] != key[:-1], True])
+        self._keys, self._key_time = _merge(self._keys, self._key_time, key[key_ends], [times[key_ends]])
+
+        # reduce to panes: runs of equal key and pane
+        pane = times // self.step_ns
+        bounds = np.flatnonzero(np.r_[True, (key[1:] != key[:-1]) | (pane[1:] != pane[:-1])])
+        columns = {
+            "key": key[bounds],
+            "pane": pane[bounds],
+            "records": np.diff(np.r_[bounds, len(key)]).astype(np.float64),
+            "reads": np.add.reduceat((kinds == _READ).astype(np.float64), bounds),
+            "writes": np.add.reduceat((kinds == _WRITE).astype(np.float64), bounds),
+            "changes": np.add.reduceat(changed.astype(np.float64), bounds),
+            "dt_n": np.add.reduceat(has_dt.astype(np.float64), bounds),
+            "dt_sum": np.add.reduceat(np.where(has_dt, dt, 0.0), bounds),
+            "dt_sq": np.add.reduceat(np.where(has_dt, dt * dt, 0.0), bounds),
+            "dt_min": np.minimum.reduceat(np.where(has_dt, dt, np.inf), bounds),
+            "dt_max": np.maximum.reduceat(np.where(has_dt, dt, -np.inf), bounds),
+            "dwell_n": np.add.reduceat(changed.astype(np.float64), bounds),
+            "dwell_sum": np.add.reduceat(dwell, bounds),
+            "dwell_max": np.maximum.reduceat(np.where(changed, dwell, -np.inf), bounds),
+            "value_sum": np.add.reduceat(values, bounds),
+            "value_min": np.minimum.reduceat(values, bounds),
+            "value_max": np.maximum.reduceat(values, bounds),
+            "value_last": values[np.r_[bounds[1:], len(key)] - 1],
+        }
+        if self._open is not None:
+            columns = {name: np.concatenate((self._open[name], column)) for name, column in columns.items()}
+        self._open = columns
+
+    # Rows of the windows starting at panes up to `last`; keeps the panes later windows need
+    def _windows(self, last):
+        panes = self._open
+        if panes is None or not len(panes["pane"]):
+            return self._empty()
+        # every pane contributes to the windows starting at pane - panes + 1 .. pane
+        count = len(panes["pane"])
+        source = np.repeat(np.arange(count), self.panes)
+        window = panes["pane"][source] - np.tile(np.arange(self.panes), count)
+        keep = window <= last
+        if self._last_window is not None:
+            keep &= window > self._last_window
+        source, window = source[keep], window[keep]
+        self._open = {name: column[panes["pane"] > last] for name, column in panes.items()}
+        self._last_window = last if self._last_window is None else max(self._last_window, last)
+        if not len(source):
+            return self._empty()
+
+        key = panes["key"][source]
+        order = np.lexsort((panes["pane"][source], window, key))
+        source, window, key = source[order], window[order], key[order]
+        bounds = np.flatnonzero(np.r_[True, (key[1:] != key[:-1]) | (window[1:] != window[:-1])])
+        aggregate = {}
+        for name in _SUMS:
+            aggregate[name] = np.add.reduceat(panes[name][source], bounds)
+        for name in _MINS:
+            aggregate[name] = np.minimum.reduceat(panes[name][source], bounds)
+        for name in _MAXS:
+            aggregate[name] = np.maximum.reduceat(panes[name][source], bounds)
+        last_value = panes["value_last"][source[np.r_[bounds[1:], len(source)] - 1]]
+
+        rows = np.zeros(len(bounds), dtype=np.dtype(FEATURE_FIELDS))
+        rows["start"] = window[bounds] * self.step_ns
+        rows["station"] = key[bounds] >> 16
+        rows["item"] = key[bounds] & 0xFFFF
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rows["records"] = aggregate["records"]
+            rows["reads"] = aggregate["reads"]
+            rows["writes"] = aggregate["writes"]
+            rows["write_read"] = aggregate["writes"] / np.maximum(aggregate["reads"], 1.0)
+            mean = aggregate["dt_sum"] / aggregate["dt_n"]
+            rows["interarrival_mean"] = mean
+            rows["interarrival_std"] = np.sqrt(np.maximum(aggregate["dt_sq"] / aggregate["dt_n"] - mean * mean, 0.0))
+            rows["interarrival_min"] = np.where(aggregate["dt_n"] > 0, aggregate["dt_min"], np.nan)
+            rows["interarrival_max"] = np.where(aggregate["dt_n"] > 0, aggregate["dt_max"], np.nan)
+            rows["changes"] = aggregate["changes"]
+            rows["change_rate"] = aggregate["changes"] / self.window
+            rows["dwell_mean"] = aggregate["dwell_sum"] / aggregate["dwell_n"]
+            rows["dwell_max"] = np.where(aggregate["dwell_n"] > 0, aggregate["dwell_max"], np.nan)
+            rows["value_mean"] = aggregate["value_sum"] / aggregate["records"]
+        rows["value_min"] = aggregate["value_min"]
+        rows["value_max"] = aggregate["value_max"]
+        rows["value_last"] = last_value
+        self.rows += len(rows)
+        return rows
+
+
+# Feature rows of a whole capture, read in chunks; yields (station, rows) per
+# chunk. Every station is a stream of its own with its own extractor.
+def extract_features(path, window=10.0, step=None, level="node", lateness=1.0, chunk_records=1 << 20,
+                     stations=None, items=None, stats=None):
+    extractor = None
+    current = None
+    for station, records in iter_trace(path, chunk_records, stations, items):
+        if station != current:
+            if extractor is not None:
+                yield current, extractor.finish()
+                _add_stats(stats, extractor)
+            extractor = FeatureExtractor(window, step, level, lateness)
+            current = station
+        rows = extractor.feed(records)
+        if len(rows):
+            yield station, rows
+    if extractor is not None:
+        yield current, extractor.finish()
+        _add_stats(stats, extractor)
+
+
+def _add_stats(stats, extractor):
+    if stats is not None:
+        for name in ("records", "rows", "late"):
+            stats[name] = stats.get(name, 0) + getattr(extractor, name)
+
+
+def _format(value):
+    return "" if math.isnan(value) else f"{value:.6g}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute windowed traffic features of a capture")
+    parser.add_argument("trace", help="capture directory or .rcap file")
+    parser.add_argument("--window", type=float, default=10.0, help="window length in s")
+    parser.add_argument("--step", type=float, help="window step in s (default: --window, tumbling)")
+    parser.add_argument("--level", choices=("node", "peer"), default="node")
+    parser.add_argument("--lateness", type=float, default=1.0, help="s a record may arrive out of order")
+    parser.add_argument("--chunk", type=int, default=1 << 20, help="records per chunk")
+    parser.add_argument("--out", help="write the rows to this CSV file")
+    args = parser.parse_args(argv)
+
+    stations, items, stats = [], [], {}
+    out = open(args.out, "w") if args.out else None
+    if out is not None:
+        out.write(",".join(("start", "station", "item") + FEATURES) + "\n")
+    start = time.perf_counter()
+    for _, rows in extract_features(args.trace, args.window, args.step, args.level, args.lateness,
+                                    args.chunk, stations, items, stats):
+        if out is None:
+            continue
+        for row in rows.tolist():
+            item = "" if row[2] == PEER else items[row[2]]
+            out.write(f"{row[0] / 1e9:.3f},{stations[row[1]]},{item},"
+                      + ",".join(_format(value) for value in row[3:]) + "\n")
+    elapsed = time.perf_counter() - start
+    if out is not None:
+        out.close()
+    records = stats.get("records", 0)
+    print(
+        f"{records} records, {stats.get('rows', 0)} rows, {stats.get('late', 0)} late records, "
+        f"{elapsed:.2f} s ({records / max(elapsed, 1e-9) / 1e6:.1f} M records/s)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+# Order ingest: tasks for the gripper from outside, with backpressure
+#
+# Orders come in on a server thread (OPC UA method calls, Modbus command
+# registers) and are handed to the cycle through an OrderInbox: a bounded
+# single-producer, single-consumer queue without locks. The producer appends
+# to a deque and the cycle pops from it (both atomic in CPython); the counts
+# of accepted and started orders are each written by one side only. Every
+# submit is answered at once:
+#
+#   ACCEPTED     queued, with its order id
+#   QUEUE_FULL   capacity orders are accepted and not started yet, try later
+#   REJECTED     unknown position, slot or pick-up == drop-off
+#   DUPLICATE    the same task is already accepted and not started
+#
+#   orders = OrderInbox(capacity=16, positions=ORDER_POSITIONS, slots=range(1, 10))
+#   status, order_id = orders.submit(("storage", "multi_drop_off", 4), priority=1)  # server thread
+#
+#   def cycleprogram(cycletools):                                                     # cycle thread
+#       for order in orders.drain():
+#           task_queue.put(order.task, order.priority, order.deadline, source=order)
+#       ...
+#       order = task_queue.source()  # the gripper takes a task, None unless it came from an order
+#       orders.started(order)
+#       orders.finished(order)       # and is done with it
+#
+# Only the task that came from the order starts and finishes it: the same task
+# from the demo sequence or a workload does not. orders.state(order_id) tells
+# QUEUED, RUNNING, DONE (or UNKNOWN for ids that were never given out or are
+# too old). Several producer threads must be
+# serialized by the interface: the OPC UA methods are coroutines and run on
+# the event loop of the server (asyncua runs plain functions in a thread
+# pool), the Modbus command registers under the lock of their table.
+#
+# OPC UA: add_order_methods creates the object "Orders" with the methods
+#
+#   SubmitOrder(PickUp: String, DropOff: String, Slot: UInt16, Priority: Int16, Deadline: Double)
+#       -> Status: UInt16, OrderId: UInt32            (Deadline in s, 0: none)
+#   OrderStatus(OrderId: UInt32) -> State: UInt16
+#
+# Modbus: OrderServer is a Modbus TCP server (reflect.modbus_bridge) with
+# one command block. A producer writes the command and reads the answer with
+# one Read/Write Multiple registers request (function 23, the write comes
+# first):
+#
+#   register  written by the producer       register  answer
+#   0         command: 1 submit, 2 state    8         status (submit) or state
+#   1         pick-up, index + 1 in         9         order id
+#             ORDER_POSITIONS               10        orders accepted, not started
+#   2         drop-off, same codes          11        capacity
+#   3         slot
+#   4         priority
+#   5         deadline in s, 0: none
+#   6         order id (state)
+#
+# Order ids count from 1. With max_id they wrap after max_id and skip the ids
+# whose state is still kept (if all are, the oldest done order is forgotten);
+# an OrderServer needs max_id <= 65535 (one register). OrderClient is the
+# producer side, also from the command line:
+#
+#   REFLECT_ORDER_PORT=5021 python modbus/gripper.py
+#   python -m reflect.ingest submit storage multi_drop_off 4 --priority 1 --deadline 300
+#   python -m reflect.ingest state 1
+#
+# The command exits with 0 for an accepted order or a state, 1 for any other
+# answer and 2 if no order server answers.
+
+import argparse
+import collections
+import struct
+import sys
+from array import array
+
+from .modbus_bridge import BridgeClient, RegisterServer, RegisterTable
+
+ACCEPTED = 1
+QUEUE_FULL = 2
+REJECTED = 3
+DUPLICATE = 4
+STATUS_NAMES = {ACCEPTED: "accepted", QUEUE_FULL: "queue full", REJECTED: "rejected", DUPLICATE: "duplicate"}
+
+UNKNOWN = 0
+QUEUED = 1
+RUNNING = 2
+DONE = 3
+STATE_NAMES = {UNKNOWN: "unknown", QUEUED: "queued", RUNNING: "running", DONE: "done"}
+
+# OPC UA node ids of the object and its methods in the namespace of
+# reflect/wiring.json; the methods have string ids, the server numbers their
+# argument properties after the highest numeric id
+ORDERS_OBJECT_ID = 20
+SUBMIT_METHOD_ID = "Orders.SubmitOrder"
+STATUS_METHOD_ID = "Orders.OrderStatus"
+
+SUBMIT = 1
+QUERY = 2
+COMMAND_REGISTERS = 8       # 0..7 written by the producer
+ANSWER_REGISTERS = 4        # 8..11 answer
+# (address, writing station, its word, reading station, its word), as reflect.modbus_bridge.REGISTERS
+ORDER_REGISTERS = [
+    (address, "producer", word, "gripper", word)
+    for address, word in enumerate(("command", "pick_up", "drop_off", "slot", "priority", "deadline", "order_id", "spare"))
+] + [
+    (COMMAND_REGISTERS + address, "gripper", word, "producer", word)
+    for address, word in enumerate(("answer", "answer_id", "pending", "capacity"))
+]
+ORDER_PORT = 5021
+ORDER_POSITIONS = ("storage", "multi_drop_off", "white_pick_up", "red_pick_up", "blue_pick_up")
+
+
+class Order:
+    def __init__(self, order_id, task, priority=0, deadline=None):
+        self.order_id = order_id
+        self.task = task
+        self.priority = priority
+        self.deadline = deadline
+
+
+class OrderInbox:
+    def __init__(self, capacity=16, positions=None, slots=None, history=256, max_id=None):
+        if max_id is not None and max_id <= capacity:
+            raise ValueError(f"max_id {max_id} leaves no ids for {capacity} queued orders")
+        self.capacity = capacity
+        self.positions = positions      # valid position names, None: any
+        self.slots = slots              # valid storage slots, None: any
+        self.max_id = max_id            # highest order id before they wrap, None: no limit
+        self.inbox = collections.deque()
+        self.last_id = 0
+        self.open = {}                  # task -> order id, accepted and not started
+        self.states = {}                # order id -> QUEUED / RUNNING / DONE
+        self.running = set()            # order ids
+        self.done = collections.deque(maxlen=history)
+        # producer side
+        self.accepted = 0
+        self.answers = dict.fromkeys(STATUS_NAMES, 0)
+        # cycle side
+        self.started_count = 0
+        self.dropped = 0                # accepted, but the task queue refused it
+
+    def pending(self):
+        return self.accepted - self.started_count
+
+    def valid(self, task):
+        pick_up, drop_off, slot = task
+        if pick_up == drop_off:
+            return False
+        if self.positions is not None and (pick_up not in self.positions or drop_off not in self.positions):
+            return False
+        if "storage" in (pick_up, drop_off) and self.slots is not None and slot not in self.slots:
+            return False
+        return True
+
+    # --- producer (server thread) ---
+
+    # Returns (status, order id); the order id is 0 unless accepted
+    def submit(self, task, priority=0, deadline=None):
+        task = tuple(task)
+        if len(task) != 3 or not self.valid(task):
+            status = REJECTED
+        elif task in self.open:
+            status = DUPLICATE
+        elif self.pending() >= self.capacity:
+            status = QUEUE_FULL
+        else:
+            status = ACCEPTED
+        self.answers[status] += 1
+        if status != ACCEPTED:
+            return status, 0
+        order_id = self._next_id()
+        self.open[task] = order_id
+        self.states[order_id] = QUEUED
+        self.accepted += 1
+        self.inbox.append(Order(order_id, task, priority, deadline or None))
+        return status, order_id
+
+    def state(self, order_id):
+        return self.states.get(order_id, UNKNOWN)
+
+    def _next_id(self):
+        order_id = self.last_id
+        for _ in range(self.max_id or 1):
+            order_id = order_id % self.max_id + 1 if self.max_id else order_id + 1
+            if order_id not in self.states:
+                self.last_id = order_id
+                return order_id
+        # every id is still kept: forget the oldest done order
+        self.states.pop(self.done.popleft(), None)
+        return self._next_id()
+
+    # --- consumer (cycle thread) ---
+
+    # Orders accepted since the last call, in order
+    def drain(self):
+        orders = []
+        inbox = self.inbox
+        while inbox:
+            orders.append(inbox.popleft())
+        return orders
+
+    # An order the task queue did not take: counts as started and done
+    def refused(self, order):
+        self.dropped += 1
+        self._start(order.task)
+        self._finish(order.order_id)
+
+    # The gripper takes the task of the order (None: a task of no order)
+    def started(self, order):
+        if order is not None and self.open.get(order.task) == order.order_id:
+            self.running.add(self._start(order.task))
+
+    def finished(self, order):
+        if order is not None and order.order_id in self.running:
+            self.running.remove(order.order_id)
+            self._finish(order.order_id)
+
+    def _start(self, task):
+        order_id = self.open.pop(task)
+        self.states[order_id] = RUNNING
+        self.started_count += 1
+        return order_id
+
+    def _finish(self, order_id):
+        self.states[order_id] = DONE
+        if len(self.done) == self.done.maxlen:
+            self.states.pop(self.done[0], None)
+        self.done.append(order_id)
+
+    def report(self):
+        answers = ", ".join(f"{count} {STATUS_NAMES[status]}" for status, count in self.answers.items())
+        return (
+            f"orders: {answers}, {self.pending()} of {self.capacity} waiting, "
+            f"{len(self.running)} running, {self.dropped} refused by the task queue"
+        )
+
+
+# --- OPC UA ---
+
+def _argument(name, variant_type, description):
+    from asyncua import ua
+
+    argument = ua.Argument()
+    argument.Name = name
+    argument.DataType = ua.NodeId(variant_type.value)
+    argument.ValueRank = -1
+    argument.Description = ua.LocalizedText(description)
+    return argument
+
+
+# Object "Orders" with SubmitOrder and OrderStatus in the given namespace
+async def add_order_methods(server, orders, namespace):
+    from asyncua import ua
+
+    idx = await server.get_namespace_index(namespace)
+    parent = await server.nodes.objects.add_object(ua.NodeId(ORDERS_OBJECT_ID, idx), "Orders")
+
+    async def submit_order(node, pick_up, drop_off, slot, priority, deadline):
+        status, order_id = orders.submit(
+            (pick_up.Value, drop_off.Value, slot.Value), priority.Value, deadline.Value or None
+        )
+        return [ua.Variant(status, ua.VariantType.UInt16), ua.Variant(order_id, ua.VariantType.UInt32)]
+
+    async def order_status(node, order_id):
+        return [ua.Variant(orders.state(order_id.Value), ua.VariantType.UInt16)]
+
+    await parent.add_method(
+        ua.NodeId(SUBMIT_METHOD_ID, idx), "SubmitOrder", submit_order,
+        [
+            _argument("PickUp", ua.VariantType.String, "pick-up position"),
+            _argument("DropOff", ua.VariantType.String, "drop-off position"),
+            _argument("Slot", ua.VariantType.UInt16, "storage slot"),
+            _argument("Priority", ua.VariantType.Int16, "higher goes first"),
+            _argument("Deadline", ua.VariantType.Double, "seconds from now, 0: none"),
+        ],
+        [
+            _argument("Status", ua.VariantType.UInt16, "1 accepted, 2 queue full, 3 rejected, 4 duplicate"),
+            _argument("OrderId", ua.VariantType.UInt32, "0 unless accepted"),
+        ],
+    )
+    await parent.add_method(
+        ua.NodeId(STATUS_METHOD_ID, idx), "OrderStatus", order_status,
+        [_argument("OrderId", ua.VariantType.UInt32, "id from SubmitOrder")],
+        [_argument("State", ua.VariantType.UInt16, "0 unknown, 1 queued, 2 running, 3 done")],
+    )
+    return parent
+
+
+# --- Modbus ---
+
+# Register table whose command block submits orders as it is written
+class OrderTable(RegisterTable):
+    def __init__(self, orders, positions):
+        super().__init__(len(ORDER_REGISTERS))
+        self.orders = orders
+        self.positions = tuple(positions)
+
+    def _position(self, code):
+        return self.positions[code - 1] if 1 <= code <= len(self.positions) else None
+
+    # Called under the table lock: one producer at a time
+    def _store(self, start, values):
+        super()._store(start, values)
+        if start != 0:
+            return
+        registers = self.registers
+        command, pick_up, drop_off, slot, priority, deadline, order_id = registers[:7]
+        if command == SUBMIT:
+            status, order_id = self.orders.submit(
+                (self._position(pick_up), self._position(drop_off), slot),
+                struct.unpack(">h", struct.pack(">H", priority))[0],
+                deadline or None,
+            )
+            answer = status
+        elif command == QUERY:
+            answer = self.orders.state(order_id)
+        else:
+            return
+        registers[0] = 0
+        registers[COMMAND_REGISTERS:] = array(
+            "H", (answer, order_id, min(self.orders.pending(), 0xFFFF), self.orders.capacity)
+        )
+
+
+# Modbus TCP server of the command block, start() serves in a daemon thread
+class OrderServer(RegisterServer):
+    def __init__(self, orders, positions=ORDER_POSITIONS, host="0.0.0.0", port=ORDER_PORT):
+        if orders.max_id is None or orders.max_id > 0xFFFF:
+            raise ValueError("the order ids of a Modbus OrderServer need max_id <= 65535")
+        super().__init__(host, port)
+        self.table = OrderTable(orders, positions)
+
+
+# Producer of the Modbus command block: command and answer in one request
+class OrderClient:
+    def __init__(self, host="127.0.0.1", port=ORDER_PORT, positions=ORDER_POSITIONS, timeout=1.0):
+        self.client = BridgeClient("producer", host, port, timeout, registers=ORDER_REGISTERS)
+        self.positions = tuple(positions)
+
+    def close(self):
+        self.client.close()
+
+    def _command(self, values):
+        return self.client.exchange(list(values) + [0] * (COMMAND_REGISTERS - len(values)))
+
+    # Returns (status, order id), like OrderInbox.submit
+    def submit(self, task, priority=0, deadline=None):
+        pick_up, drop_off, slot = task
+        status, order_id, _, _ = self._command([
+            SUBMIT, self.positions.index(pick_up) + 1, self.positions.index(drop_off) + 1, slot,
+            priority & 0xFFFF, int(deadline or 0),
+        ])
+        return status, order_id
+
+    def state(self, order_id):
+        return self._command([QUERY, 0, 0, 0, 0, 0, order_id])[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Submit orders to the gripper over its Modbus command registers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=ORDER_PORT)
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit_parser = commands.add_parser("submit", help="submit a task")
+    submit_parser.add_argument("pick_up", choices=ORDER_POSITIONS)
+    submit_parser.add_argument("drop_off", choices=ORDER_POSITIONS)
+    submit_parser.add_argument("slot", type=int)
+    submit_parser.add_argument("--priority", type=int, default=0)
+    submit_parser.add_argument("--deadline", type=float, help="seconds from now")
+    state_parser = commands.add_parser("state", help="state of an order")
+    state_parser.add_argument("order_id", type=int)
+    args = parser.parse_args(argv)
+
+    client = OrderClient(args.host, args.port)
+    try:
+        if args.command == "submit":
+            status, order_id = client.submit((args.pick_up, args.drop_off, args.slot), args.priority, args.deadline)
+            print(f"{STATUS_NAMES.get(status, status)}, order {order_id}" if order_id else STATUS_NAMES.get(status, status))
+            return 0 if status == ACCEPTED else 1
+        print(STATE_NAMES.get(client.state(args.order_id), "unknown"))
+        return 0
+    except OSError:
+        # gripper not running, REFLECT_ORDER_PORT not set, or no answer in time
+        print(f"no order server at {args.host}:{args.port}", file=sys.stderr)
+        return 2
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+# Cycle time instrumentation for rpi.cycleloop programs
+#
+# CycleMonitor wraps a cycle function and records for every cycle
+#   - the execution time of the function,
+#   - the period between two cycle starts,
+#   - whether the cycle overran the cycle time (execution longer than the
+#     cycle time) or started late (period longer than 1.5 cycle times).
+#
+# The last samples are kept in a preallocated ring buffer, all samples go into
+# log-linear histograms (HDR style: constant relative error over the whole
+# range), so percentiles are available at the end of a long run without
+# keeping every sample:
+#
+#   monitor = CycleMonitor(cycletime=10)
+#   rpi.cycleloop(monitor.wrap(cycleprogram), cycletime=10)
+#   ...
+#   print(monitor.report())  # in programend
+#
+# Per cycle the wrapper costs two clock reads, two histogram updates and
+# three array stores; nothing is allocated and nothing is printed.
+
+import time
+from array import array
+
+
+# Log-linear histogram of integer values (microseconds)
+#
+# Values below 2**precision are counted exactly. Above that, every power of two
+# is split into 2**(precision - 1) buckets, so the relative error stays below
+# 2**-(precision - 1) (1.6 % with the default precision of 7).
+class LatencyHistogram:
+    def __init__(self, highest=60_000_000, precision=7):
+        self.precision = precision
+        self.sub_count = 1 << precision
+        self.half = self.sub_count >> 1
+        self.max_shift = max(highest.bit_length() - precision, 0)
+        self.counts = array("q", bytes(8 * (self.sub_count + self.max_shift * self.half)))
+        self.highest = highest
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def _index(self, value):
+        if value < self.sub_count:
+            return value
+        shift = value.bit_length() - self.precision
+        if shift > self.max_shift:
+            return len(self.counts) - 1
+        return self.sub_count + (shift - 1) * self.half + (value >> shift) - self.half
+
+    # Highest value that falls into the bucket with the given index
+    def _upper(self, index):
+        if index < self.sub_count:
+            return index
+        shift = (index - self.sub_count) // self.half + 1
+        mantissa = (index - self.sub_count) % self.half + self.half
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    # Value at or below which the given percentage of samples lies
+    def percentile(self, percent):
+        if self.total == 0:
+            return 0
+        target = max(1, int(round(self.total * percent / 100.0)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._upper(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.sum / self.total if self.total else 0.0
+
+    def reset(self):
+        for index in range(len(self.counts)):
+            self.counts[index] = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+
+# Fixed size ring of the most recent cycles (start, execution time, period in us)
+class CycleRing:
+    def __init__(self, size=4096):
+        self.size = size
+        self.start = array("q", bytes(8 * size))
+        self.execution = array("q", bytes(8 * size))
+        self.period = array("q", bytes(8 * size))
+        self.count = 0
+
+    def append(self, start, execution, period):
+        slot = self.count % self.size
+        self.start[slot] = start
+        self.execution[slot] = execution
+        self.period[slot] = period
+        self.count += 1
+
+    # Samples in chronological order as (start, execution, period) tuples
+    def samples(self, last=None):
+        available = min(self.count, self.size)
+        if last is not None:
+            available = min(available, last)
+        first = self.count - available
+        return [
+            (self.start[i % self.size], self.execution[i % self.size], self.period[i % self.size])
+            for i in range(first, self.count)
+        ]
+
+
+class CycleMonitor:
+    # cycletime in milliseconds; a period above (1 + tolerance) cycle times is a late start
+    def __init__(self, cycletime, size=4096, tolerance=0.5, name="cycle"):
+        self.name = name
+        self.cycletime_us = int(cycletime * 1000)
+        self.late_limit_us = int(self.cycletime_us * (1.0 + tolerance))
+        self.ring = CycleRing(size)
+        self.execution = LatencyHistogram()
+        self.period = LatencyHistogram()
+        self.cycles = 0
+        self.overruns = 0
+        self.late_starts = 0
+        self.last_start = None
+
+    # Return a cycle function that measures func; the return value is passed through
+    def wrap(self, func):
+        monotonic = time.monotonic
+        perf_counter = time.perf_counter
+
+        def measured(cycletools):
+            start = monotonic()
+            t0 = perf_counter()
+            result = func(cycletools)
+            execution = int((perf_counter() - t0) * 1_000_000)
+            self._record(start, execution)
+            return result
+
+        measured.__name__ = getattr(func, "__name__", "measured")
+        return measured
+
+    def _record(self, start, execution):
+        start_us = int(start * 1_000_000)
+        if self.last_start is None:
+            period = 0
+        else:
+            period = start_us - self.last_start
+            self.period.record(period)
+            if period > self.late_limit_us:
+                self.late_starts += 1
+        self.last_start = start_us
+
+        self.execution.record(execution)
+        if execution > self.cycletime_us:
+            self.overruns += 1
+        self.ring.append(start_us, execution, period)
+        self.cycles += 1
+
+    def report(self, percentiles=(50, 90, 99, 99.9)):
+        def line(label, histogram):
+            parts = ", ".join(f"p{p:g} {histogram.percentile(p) / 1000.0:.3f}" for p in percentiles)
+            return (
+                f"  {label}: mean {histogram.mean() / 1000.0:.3f}, {parts}, "
+                f"max {histogram.max / 1000.0:.3f} ms"
+            )
+
+        return "\n".join([
+            f"{self.name}: {self.cycles} cycles of {self.cycletime_us / 1000.0:g} ms, "
+            f"{self.overruns} overruns, {self.late_starts} late starts",
+            line("execution", self.execution),
+            line("period", self.period),
+        ])
@@ -0,0 +1,400 @@
+# Local Modbus TCP stand-in for the RevPi virtual Modbus modules
+#
+# On the lab hardware the Modbus scripts exchange their handshakes through the
+# RevPi Modbus gateways. For running them on one Linux box a small Modbus TCP
+# server holds one holding register per handshake word, and every station
+# exchanges its words with it through a BridgeClient. The registers are
+# declared in reflect/wiring.json:
+#
+#   register  written by                     read by
+#   0         gripper Output_Word_1          high_bay_warehouse Input_1       requested slot
+#   1         gripper Output_Word_2          high_bay_warehouse Input_2       pallet clear
+#   2         high_bay_warehouse Output_1    gripper Input_Word_1             storage ready
+#   3         multi Output_1                 gripper Input_Word_1_i05         ready for drop-off
+#
+# The words a station writes and the words it reads are contiguous, so one
+# "Read/Write Multiple registers" request (function 23) per cycle carries all
+# of them. Stations that only write or only read use functions 16 and 3.
+# A client precompiles the struct of its request frame (MBAP header, PDU and
+# words) and of the words in the response, so a cycle packs and unpacks one
+# frame with one call each.
+#
+#   python -m reflect.modbus_bridge serve --port 5020
+#   python -m reflect.sim modbus/gripper.py --modbus-bridge 127.0.0.1:5020 --realtime
+#
+# or all three stations and the server at once:
+#
+#   python -m reflect.modbus_bridge run --seconds 300
+#
+# The server sees every word the stations write. With run --monitor the
+# changes are checked live against the process model of the station scripts
+# (reflect.processmodel).
+
+import argparse
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+from array import array
+
+from .wiring import WIRING, FrameCodec
+
+DEFAULT_PORT = 5020
+UNIT_ID = 1
+
+READ_HOLDING_REGISTERS = 3
+WRITE_MULTIPLE_REGISTERS = 16
+READ_WRITE_MULTIPLE_REGISTERS = 23
+
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+
+# (address, writing station, its word, reading station, its word)
+REGISTERS = WIRING.register_rows()
+
+STATIONS = WIRING.modbus_stations()
+
+MBAP = struct.Struct(">HHHB")  # transaction, protocol, length, unit
+
+# register words of every possible count, big endian
+WORDS = [struct.Struct(f">{count}H") for count in range(126)]
+
+
+class ModbusError(Exception):
+    pass
+
+
+# Contiguous register range with the station's word for every register
+class WordBlock:
+    def __init__(self, rows):
+        self.words = [word for _, word in rows]
+        self.start = rows[0][0] if rows else 0
+        addresses = [address for address, _ in rows]
+        if addresses != list(range(self.start, self.start + len(rows))):
+            raise ValueError(f"registers {addresses} are not contiguous")
+
+    def __len__(self):
+        return len(self.words)
+
+
+# Register ranges a station writes and reads
+class StationMap:
+    def __init__(self, station, registers=REGISTERS):
+        self.station = station
+        self.writes = WordBlock([(row[0], row[2]) for row in registers if row[1] == station])
+        self.reads = WordBlock([(row[0], row[4]) for row in registers if row[3] == station])
+        if not self.writes and not self.reads:
+            raise ValueError(f"station {station!r} has no Modbus words")
+
+
+# --- protocol ---
+
+def encode_request(transaction, function, payload):
+    return MBAP.pack(transaction, 0, len(payload) + 2, UNIT_ID) + bytes((function,)) + payload
+
+
+def read_frame(sock_file):
+    header = sock_file.read(MBAP.size)
+    if len(header) < MBAP.size:
+        return None
+    transaction, protocol, length, unit = MBAP.unpack(header)
+    pdu = sock_file.read(length - 1)
+    if len(pdu) < length - 1 or protocol != 0:
+        raise ModbusError("truncated or foreign frame")
+    return transaction, unit, pdu
+
+
+def pack_registers(values):
+    return WORDS[len(values)].pack(*[value & 0xFFFF for value in values])
+
+
+def unpack_registers(data, count):
+    return list(WORDS[count].unpack_from(data))
+
+
+# --- server ---
+
+class RegisterTable:
+    def __init__(self, size=len(REGISTERS), on_change=None):
+        self.registers = array("H", bytes(2 * size))
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.on_change = on_change      # called with (address, value) for every changed register
+
+    def _check(self, start, count, limit):
+        if not 1 <= count <= limit:
+            raise ModbusError(ILLEGAL_DATA_VALUE)
+        if start + count > len(self.registers):
+            raise ModbusError(ILLEGAL_DATA_ADDRESS)
+
+    # Execute one request PDU and return the response PDU
+    def handle(self, pdu):
+        function = pdu[0]
+        try:
+            with self.lock:
+                self.requests += 1
+                return bytes((function,)) + self._execute(function, pdu[1:])
+        except ModbusError as error:
+            return bytes((function | 0x80, error.args[0]))
+        except struct.error:
+            return bytes((function | 0x80, ILLEGAL_DATA_VALUE))
+
+    def _execute(self, function, data):
+        registers = self.registers
+        if function == READ_HOLDING_REGISTERS:
+            start, count = struct.unpack_from(">HH", data)
+            self._check(start, count, 125)
+            return bytes((2 * count,)) + pack_registers(registers[start:start + count])
+
+        if function == WRITE_MULTIPLE_REGISTERS:
+            start, count, size = struct.unpack_from(">HHB", data)
+            self._check(start, count, 123)
+            self._store(start, unpack_registers(data[5:5 + size], count))
+            return struct.pack(">HH", start, count)
+
+        if function == READ_WRITE_MULTIPLE_REGISTERS:
+            read_start, read_count, write_start, write_count, size = struct.unpack_from(">HHHHB", data)
+            self._check(read_start, read_count, 125)
+            self._check(write_start, write_count, 121)
+            # the write is performed before the read (Modbus specification)
+            self._store(write_start, unpack_registers(data[9:9 + size], write_count))
+            return bytes((2 * read_count,)) + pack_registers(registers[read_start:read_start + read_count])
+
+        raise ModbusError(ILLEGAL_FUNCTION)
+
+    def _store(self, start, values):
+        registers = self.registers
+        if self.on_change is not None:
+            for address, value in enumerate(values, start):
+                if registers[address] != value:
+                    self.on_change(address, value)
+        registers[start:start + len(values)] = array("H", values)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        table = self.server.table
+        while True:
+            try:
+                frame = read_frame(self.rfile)
+            except (ModbusError, ConnectionError):
+                return
+            if frame is None:
+                return
+            transaction, unit, pdu = frame
+            response = table.handle(pdu)
+            self.wfile.write(MBAP.pack(transaction, 0, len(response) + 1, unit) + response)
+
+
+class RegisterServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, size=len(REGISTERS), monitor=None):
+        self.monitor = monitor
+        self.writers = {row[0]: (row[1], row[2]) for row in REGISTERS}
+        self.table = RegisterTable(size, self._changed if monitor is not None else None)
+        super().__init__((host, port), _RequestHandler)
+
+    # Pass a changed register to the process monitor as a write of its station
+    def _changed(self, address, value):
+        writer = self.writers.get(address)
+        if writer is not None:
+            self.monitor.observe(writer[0], writer[1], value, time.monotonic())
+
+    # Serve in a daemon thread, e.g. for tests and benchmarks
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+# --- client ---
+
+class BridgeClient:
+    def __init__(self, station, host="127.0.0.1", port=DEFAULT_PORT, timeout=1.0, registers=REGISTERS):
+        self.map = StationMap(station, registers)
+        self.address = (host, port)
+        self.timeout = timeout
+        self.sock = None
+        self.sock_file = None
+        self.transaction = 0
+        self.requests = 0
+        self.errors = 0
+        self._frames()
+
+    # Request of exchange() as one struct: MBAP header and PDU up to the
+    # words are fixed except for the transaction number
+    def _frames(self):
+        reads, writes = self.map.reads, self.map.writes
+        self.read_frame = FrameCodec(reads.words, "H" * len(reads))
+        self.write_frame = FrameCodec(writes.words, "H" * len(writes))
+        count = len(writes)
+        if reads and writes:
+            self.function = READ_WRITE_MULTIPLE_REGISTERS
+            head = ">HHHBBHHHHB"
+            self.request_head = (0, 11 + 2 * count, UNIT_ID, self.function,
+                                 reads.start, len(reads), writes.start, count, 2 * count)
+        elif writes:
+            self.function = WRITE_MULTIPLE_REGISTERS
+            head = ">HHHBBHHB"
+            self.request_head = (0, 7 + 2 * count, UNIT_ID, self.function, writes.start, count, 2 * count)
+        else:
+            self.function = READ_HOLDING_REGISTERS
+            head = ">HHHBBHH"
+            self.request_head = (0, 6, UNIT_ID, self.function, reads.start, len(reads))
+        self.request_frame = struct.Struct(head + "H" * count)
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock_file = self.sock.makefile("rb")
+
+    def close(self):
+        if self.sock is not None:
+            self.sock_file.close()
+            self.sock.close()
+        self.sock = None
+        self.sock_file = None
+
+    def request(self, function, payload):
+        if self.sock is None:
+            self.connect()
+        self.transaction = (self.transaction + 1) & 0xFFFF
+        self.sock.sendall(encode_request(self.transaction, function, payload))
+        return self._response(function)
+
+    def _response(self, function):
+        frame = read_frame(self.sock_file)
+        if frame is None:
+            raise ConnectionError("Modbus server closed the connection")
+        transaction, _, pdu = frame
+        self.requests += 1
+        if transaction != self.transaction:
+            raise ModbusError(f"unexpected transaction {transaction}")
+        if pdu[0] & 0x80:
+            raise ModbusError(f"exception {pdu[1]} for function {function}")
+        return pdu
+
+    def read_registers(self, start, count):
+        pdu = self.request(READ_HOLDING_REGISTERS, struct.pack(">HH", start, count))
+        return unpack_registers(pdu[2:], count)
+
+    def write_registers(self, start, values):
+        data = pack_registers(values)
+        self.request(WRITE_MULTIPLE_REGISTERS, struct.pack(">HHB", start, len(values), len(data)) + data)
+
+    def read_write_registers(self, read_start, read_count, write_start, values):
+        data = pack_registers(values)
+        pdu = self.request(
+            READ_WRITE_MULTIPLE_REGISTERS,
+            struct.pack(">HHHHB", read_start, read_count, write_start, len(values), len(data)) + data,
+        )
+        return unpack_registers(pdu[2:], read_count)
+
+    # Send the station's output words and return its input words, one request
+    def exchange(self, outputs):
+        if self.sock is None:
+            self.connect()
+        self.transaction = (self.transaction + 1) & 0xFFFF
+        self.sock.sendall(self.request_frame.pack(
+            self.transaction, *self.request_head, *[value & 0xFFFF for value in outputs]))
+        pdu = self._response(self.function)
+        return list(self.read_frame.unpack_from(pdu, 2)) if self.read_frame else []
+
+
+# Per-cycle link between a (simulated) process image and the bridge
+class ProcessImageLink:
+    def __init__(self, client):
+        self.client = client
+
+    def exchange(self, io):
+        values = io.values
+        writes, reads = self.client.map.writes, self.client.map.reads
+        try:
+            received = self.client.exchange([int(values[word]) for word in writes.words])
+        except (OSError, ModbusError):
+            # keep the last inputs and connect again in the next cycle
+            self.client.errors += 1
+            self.client.close()
+            return
+        for word, value in zip(reads.words, received):
+            values[word] = value
+
+
+# --- command line ---
+
+def serve(args):
+    server = RegisterServer(args.host, args.port)
+    print(f"Modbus register server on {args.host}:{args.port}, {len(REGISTERS)} registers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# Start the server and the three Modbus stations in the simulation
+def run(args):
+    code_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    monitor = None
+    if args.monitor:
+        from .processmodel import ProcessMonitor, extract_models
+
+        scripts = [os.path.join(code_dir, "modbus", f"{station}.py") for station in STATIONS]
+        monitor = ProcessMonitor([model for script in scripts for model in extract_models(script)])
+    server = RegisterServer(args.host, args.port, monitor=monitor)
+    server.start()
+    processes = []
+    for station in STATIONS:
+        command = [
+            sys.executable, "-m", "reflect.sim", os.path.join("modbus", f"{station}.py"),
+            "--modbus-bridge", f"{args.host}:{args.port}", "--realtime", "--seconds", str(args.seconds),
+        ]
+        if args.quiet:
+            command.append("--quiet")
+        processes.append(subprocess.Popen(command, cwd=code_dir))
+    try:
+        for process in processes:
+            process.wait()
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        server.shutdown()
+        server.server_close()
+    print(f"Modbus register server: {server.table.requests} requests")
+    if monitor is not None:
+        print(monitor.report())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local Modbus TCP stand-in for the REFLECT stations")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("serve", help="run the register server")
+    run_parser = commands.add_parser("run", help="run the server and the three Modbus stations")
+    run_parser.add_argument("--seconds", type=float, default=120.0)
+    run_parser.add_argument("--quiet", action="store_true", help="discard the scripts' output")
+    run_parser.add_argument("--monitor", action="store_true", help="check the writes against the process model")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+# Point-to-point motion of encoder axes (gripper MOVE_TO_POS, HBW storage moves)
+#
+# An axis is an encoder counter with a forward and a backward output. It is
+# driven until it comes to rest within the tolerance of its target:
+#
+#   sequential   one axis after the other, in the order given, as the
+#                grippers did so far: a move takes the sum of the travel times
+#   coordinated  all axes at once: a move takes about the longest travel time
+#
+# Coordinated motion keeps a safe envelope around guarded positions (storage
+# and multi drop-off). While the guard axis (default: the first, the
+# rotation) is within the envelope of one of them, the vertical axis moves
+# first and alone. The other axes stop until it has reached its target height,
+# then continue together:
+#
+#   motion = AxisMotion(outputs, rpi.io, AXES, tolerance=10, mode="coordinated",
+#                       vertical=2, envelope=[(2700, 400), (1805, 400)],
+#                       stops=StopCalibration(os.environ.get("REFLECT_CALIBRATION"), "gripper"))
+#   motion.start([2700, 350, 300])       # entering MOVE_TO_POS
+#   if motion.step():                    # every cycle, True once all axes are in position
+#       ...
+#
+# envelope is a list of (center, half width) in counts of the guard axis.
+# Outputs are set through the OutputImage of the station.
+#
+# Cut-off: a motor switched off keeps moving for the rest of the cycle and
+# runs out after that, at 10 ms polling more than the tolerance. Every axis
+# has an AxisTracker that estimates its velocity from successive counter
+# readings. The axis is switched off as soon as the position it would come to
+# rest at, position + velocity * stop time, is within the tolerance, and it
+# is not driven against its own run-out. An axis is in position once it
+# stands still within the tolerance, so a move ends after the run-out of its
+# last axis and that run-out is learned as well. The stop time of every axis is
+# learned from its stops (StopCalibration): after each cut-off the tracker
+# waits until the counter stands still and takes run-out distance / velocity
+# at the cut-off. CalibrationMoves drives every axis back and forth a few
+# times to learn it before the first real move; with a directory the stop
+# times are kept in <directory>/<station>-stops.json for the next start.
+#
+# The test moves are bounded: one that takes more than max_cycles cycles (the
+# axis does not move or does not come to rest) switches the axis off and
+# aborts the calibration, aborted names the axis.
+#
+# Real moves are bounded as well: a move that has not reached its target after
+# max_cycles cycles switches all axes off and stays there until the next
+# start(), failed names the axes out of position.
+#
+# Counters are read as signed 32 bit values: a counter that runs below 0 after
+# a reset wraps to 4294967295 and would otherwise be taken as far beyond any
+# target.
+#
+# An axis that still misses the tolerance after max_corrections corrections
+# in a move is taken where it comes to rest: when the motor is fast against
+# the cycle time, the shortest correction can be longer than the tolerance
+# band and the axis would otherwise hunt around the target.
+
+import json
+import os
+import time
+
+from .settle import COUNTER_MODULO
+
+MODES = ("sequential", "coordinated")
+
+# stop time of an axis not calibrated yet: the cycle until the output is off
+DEFAULT_STOP_TIME = 0.01
+
+
+# Stop times in s per axis (counter name), learned from the stops
+class StopCalibration:
+    def __init__(self, directory=None, station="station", default=DEFAULT_STOP_TIME, rate=0.3):
+        self.path = os.path.join(directory, f"{station}-stops.json") if directory else None
+        self.default = default
+        self.rate = rate                # weight of a new stop, exponential average
+        self.stop_times = {}
+        self.samples = {}
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as f:
+                saved = json.load(f)
+            self.stop_times = {name: entry["stop_time"] for name, entry in saved.items()}
+            self.samples = {name: entry["samples"] for name, entry in saved.items()}
+
+    def stop_time(self, name):
+        return self.stop_times.get(name, self.default)
+
+    def calibrated(self, name):
+        return self.samples.get(name, 0) > 0
+
+    def learn(self, name, stop_time):
+        count = self.samples.get(name, 0)
+        if count == 0:
+            self.stop_times[name] = stop_time
+        else:
+            self.stop_times[name] += self.rate * (stop_time - self.stop_times[name])
+        self.samples[name] = count + 1
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({
+                name: {"stop_time": stop_time, "samples": self.samples.get(name, 0)}
+                for name, stop_time in self.stop_times.items()
+            }, f, indent=1)
+
+    def report(self):
+        if not self.stop_times:
+            return "stop times: not calibrated"
+        return "stop times: " + ", ".join(
+            f"{name} {1000.0 * stop_time:.1f} ms ({self.samples.get(name, 0)} stops)"
+            for name, stop_time in sorted(self.stop_times.items())
+        )
+
+
+# Velocity of one axis from its counter, and the run-out after each cut-off
+class AxisTracker:
+    def __init__(self, name, counter, stops, smoothing=0.5):
+        self.name = name
+        self.counter = counter
+        self.stops = stops
+        self.smoothing = smoothing      # weight of the newest reading
+        self.position = self.read()
+        self.velocity = 0.0             # counts per second
+        self.last = None
+        self.dt = 0.0                   # s between the last two readings
+        self.cut = None                 # (position, velocity, target) at the last cut-off
+        self.overshoot = []             # run-out beyond the point the prediction aimed at
+
+    def reset(self):
+        self.last = None
+        self.velocity = 0.0
+        self.cut = None
+
+    # Counter value as signed 32 bit: a wrap below 0 reads as negative
+    def read(self):
+        value = self.counter.value
+        return value - COUNTER_MODULO if value >= COUNTER_MODULO // 2 else value
+
+    def update(self, now=None):
+        now = time.monotonic() if now is None else now
+        position = self.read()
+        if self.last is not None:
+            last_position, last_time = self.last
+            dt = self.dt = now - last_time
+            if dt > 0:
+                raw = (position - last_position) / dt
+                self.velocity += self.smoothing * (raw - self.velocity)
+                if position == last_position:
+                    self.velocity = 0.0
+                    if self.cut is not None:
+                        self._stopped(position)
+        self.position = position
+        self.last = (position, now)
+
+    def _stopped(self, position):
+        cut_position, cut_velocity, aim = self.cut
+        self.cut = None
+        distance = (position - cut_position) * (1 if cut_velocity > 0 else -1)
+        if distance >= 0:
+            self.stops.learn(self.name, distance / abs(cut_velocity))
+            self.overshoot.append((position - aim) * (1 if cut_velocity > 0 else -1))
+
+    # Position the axis comes to rest at if it is switched off now
+    def rest_position(self):
+        return self.position + self.velocity * self.stops.stop_time(self.name)
+
+    def switched_off(self, aim):
+        if self.velocity:
+            self.cut = (self.position, self.velocity, aim)
+
+
+class AxisMotion:
+    def __init__(self, outputs, io, axes, tolerance, mode="sequential", vertical=None, envelope=(), guard=0,
+                 stops=None, max_corrections=2, max_cycles=3000):
+        if mode not in MODES:
+            raise ValueError(f"unknown motion mode {mode!r}, expected one of {MODES}")
+        self.outputs = outputs
+        self.stops = stops if stops is not None else StopCalibration()
+        self.trackers = [AxisTracker(counter, io[counter], self.stops) for counter, _, _ in axes]
+        self.drives = [(forward, backward) for _, forward, backward in axes]
+        self.commands = [0] * len(axes)
+        self.tolerance = tolerance
+        self.mode = mode
+        self.vertical = vertical        # index of the vertical axis, None: no envelope
+        self.envelope = list(envelope)
+        self.guard = guard
+        self.target = None
+        self.axis = 0                   # axis moved in sequential mode
+        self.moves = 0
+        self.held = 0                   # cycles the envelope stopped the other axes
+        self.corrections = 0            # axes driven again after their cut-off in the same move
+        self.max_corrections = max_corrections
+        self.retries = [0] * len(axes)  # corrections per axis in the current move
+        self.stopped = set()
+        self.max_cycles = max_cycles    # cycles of one move before all axes are switched off
+        self.cycles = 0                 # cycles of the current move
+        self.timeouts = 0               # moves ended by max_cycles
+        self.failed = None              # axes (counter names) out of position when the move was ended
+
+    def start(self, target):
+        self.target = list(target)
+        self.axis = 0
+        self.moves += 1
+        self.cycles = 0
+        self.failed = None
+        self.stopped.clear()
+        self.retries = [0] * len(self.trackers)
+        for tracker in self.trackers:
+            tracker.reset()
+
+    def drive(self, axis, direction):
+        if self.commands[axis] and not direction:
+            self.trackers[axis].switched_off(self.target[axis] if self.target else self.trackers[axis].position)
+            self.stopped.add(axis)
+        elif direction and not self.commands[axis] and axis in self.stopped:
+            self.corrections += 1
+            self.retries[axis] += 1
+        self.commands[axis] = direction
+        forward, backward = self.drives[axis]
+        self.outputs[forward] = 1 if direction > 0 else 0
+        self.outputs[backward] = 1 if direction < 0 else 0
+
+    # Direction to drive an axis towards its target, 0 to let it come to rest.
+    # A driven axis is switched off once it would come to rest at the target
+    # (within half a cycle of travel), a correction already when it would
+    # come to rest within the tolerance, so a wrong stop time cannot make it
+    # hunt. A stopped or coasting axis is only driven again if it would come
+    # to rest outside the tolerance.
+    def _direction(self, axis):
+        tracker = self.trackers[axis]
+        error = self.target[axis] - tracker.rest_position()
+        command = self.commands[axis]
+        if command:
+            margin = self.tolerance if axis in self.stopped else abs(tracker.velocity) * tracker.dt / 2
+            return command if error * command > margin else 0
+        if abs(error) <= self.tolerance or self._given_up(axis):
+            return 0
+        direction = 1 if error > 0 else -1
+        if tracker.velocity * direction < 0:
+            # still running out the other way, correct once it stands
+            return 0
+        return direction
+
+    def _given_up(self, axis):
+        return axis in self.stopped and self.retries[axis] >= self.max_corrections
+
+    def _in_position(self, axis):
+        tracker = self.trackers[axis]
+        if self._given_up(axis):
+            return not self.commands[axis] and tracker.velocity == 0
+        return (
+            not self.commands[axis]
+            and tracker.velocity == 0
+            and abs(self.target[axis] - tracker.position) <= self.tolerance
+        )
+
+    def inside_envelope(self, position):
+        return any(abs(position - center) <= width for center, width in self.envelope)
+
+    # Drive the axes for one cycle, True when all of them are in position.
+    # After max_cycles cycles all axes are switched off and the move stays
+    # ended (False) until the next start().
+    def step(self):
+        now = time.monotonic()
+        for tracker in self.trackers:
+            tracker.update(now)
+
+        self.cycles += 1
+        if self.failed is not None:
+            return False
+        if self.cycles > self.max_cycles:
+            self.failed = [
+                tracker.name for axis, tracker in enumerate(self.trackers) if not self._in_position(axis)
+            ]
+            for axis in range(len(self.trackers)):
+                self.drive(axis, 0)
+            self.timeouts += 1
+            return False
+
+        if self.mode == "sequential":
+            axis = self.axis
+            self.drive(axis, self._direction(axis))
+            if not self._in_position(axis):
+                return False
+            if axis < len(self.trackers) - 1:
+                self.axis = axis + 1
+                return False
+            return True
+
+        directions = [self._direction(axis) for axis in range(len(self.trackers))]
+        vertical = self.vertical
+        hold = (
+            vertical is not None
+            and not self._in_position(vertical)
+            and self.inside_envelope(self.trackers[self.guard].position)
+        )
+        if hold:
+            self.held += 1
+        for axis, direction in enumerate(directions):
+            self.drive(axis, 0 if hold and axis != vertical else direction)
+        return all(self._in_position(axis) for axis in range(len(self.trackers)))
+
+    # Mean and worst run-out beyond the target of the stops so far, in counts
+    def overshoot(self):
+        values = [abs(value) for tracker in self.trackers for value in tracker.overshoot]
+        if not values:
+            return 0.0, 0
+        return sum(values) / len(values), max(values)
+
+
+# Test moves that learn the stop time of every uncalibrated axis before the
+# first real move: the axis is driven `travel` counts forward and half of it
+# back, `trials` times, one axis after the other
+class CalibrationMoves:
+    def __init__(self, motion, travel=300, trials=2, settle_cycles=20, max_cycles=500):
+        self.motion = motion
+        self.settle_cycles = settle_cycles
+        self.max_cycles = max_cycles    # cycles of one test move before the calibration is aborted
+        self.queue = [
+            (axis, direction, travel if direction > 0 else travel // 2)
+            for axis, tracker in enumerate(motion.trackers)
+            if not motion.stops.calibrated(tracker.name)
+            for _ in range(trials)
+            for direction in (1, -1)
+        ]
+        self.start = None
+        self.settled = 0
+        self.cycles = 0
+        self.aborted = None             # axis (counter name) whose test move did not finish
+
+    def pending(self):
+        return bool(self.queue)
+
+    # One cycle of the test moves, True when all are done or the calibration
+    # was aborted
+    def step(self):
+        if not self.queue:
+            return True
+        motion = self.motion
+        axis, direction, travel = self.queue[0]
+        tracker = motion.trackers[axis]
+        tracker.update()
+        if self.start is None:
+            self.start = tracker.position
+            self.settled = None
+            self.cycles = 0
+
+        # an axis that does not move (motor, power, encoder) or does not come
+        # to rest: switch it off and keep the default stop times
+        self.cycles += 1
+        if self.cycles > self.max_cycles:
+            motion.drive(axis, 0)
+            tracker.reset()
+            self.aborted = tracker.name
+            self.queue.clear()
+            self._finish()
+            return True
+
+        if self.settled is None:
+            if abs(tracker.position - self.start) < travel:
+                motion.drive(axis, direction)
+                return False
+            motion.drive(axis, 0)
+            self.settled = 0
+            return False
+
+        # wait until the run-out is over and learned
+        self.settled += 1
+        if tracker.cut is None and self.settled >= self.settle_cycles:
+            self.queue.pop(0)
+            self.start = None
+            if not self.queue:
+                self._finish()
+                return True
+        return False
+
+    def _finish(self):
+        self.start = None
+        motion = self.motion
+        motion.stops.save()
+        # the test moves are no moves to a target, start the statistics afresh
+        motion.stopped.clear()
+        motion.corrections = 0
+        for tracker in motion.trackers:
+            tracker.overshoot.clear()
@@ -0,0 +1,274 @@
+# Exchange between a shared data object and OPC UA nodes
+#
+# The stations used to read every node with get_value() and write every node
+# with set_value() in a loop with asyncio.sleep(0.05): a handshake waited up to
+# 50 ms plus the round trips, and the network carried the same values over and
+# over. NodeExchange keeps that loop as "polling" mode and adds a
+# "subscription" mode:
+#
+#   - a client subscribes to the nodes it reads; the server pushes data
+#     changes with the configured publishing and sampling interval,
+#   - a server gets the values clients write to its nodes through a PostWrite
+#     callback, right when the write request is processed,
+#   - nodes the station writes are only written when the value in the shared
+#     object changed; the shared object is checked every write_interval.
+#
+#   exchange = NodeExchange(
+#       shared_data,
+#       reads={"target_pos_index": node_pos},      # attribute name -> node
+#       writes={"robot_ready_for_pickup": node_ready},
+#       mode="subscription", publishing_interval=10, sampling_interval=0,
+#       convert=int,
+#   )
+#   await exchange.start_client(client)           # or start_server(server)
+#   await exchange.run()                          # until is_running is False
+#
+# Values received are stored with setattr() on the shared object from the
+# asyncio thread. If the shared object is a view of reflect.snapshot.SharedData,
+# the values received together are published as one frame for the cycle, and
+# the values to write are taken from one frame published by the cycle.
+#
+# Reads and writes go through NodeGroup: all nodes of a direction are read
+# with one Read service call and all changed values are written with one
+# Write service call, instead of one round trip per node. Unchanged values
+# are not written again in polling mode either, unless skip_unchanged=False.
+#
+# With recorder= (a reflect.capture.Recorder) every value read, written and
+# received is also recorded to a traffic capture. With detector= (a
+# reflect.anomaly.AnomalyDetector) the same values are checked for anomalies
+# right in the exchange loop.
+
+import asyncio
+
+from asyncua import ua
+from asyncua.common.callback import CallbackType
+from asyncua.common.ua_utils import value_to_datavalue
+
+from .capture import OPCUA_READ, OPCUA_RECEIVE, OPCUA_WRITE
+
+MODES = ("polling", "subscription")
+
+
+# Receives data change notifications of a client subscription
+class DataChangeHandler:
+    def __init__(self, exchange):
+        self.exchange = exchange
+
+    def datachange_notification(self, node, val, data):
+        self.exchange.receive(node.nodeid, val)
+
+    def status_change_notification(self, status):
+        # the server closed or timed out the subscription
+        self.exchange.lost = f"subscription status {status.Status}"
+
+
+# Attributes of a shared object bound to nodes of one session (client or server)
+class NodeGroup:
+    def __init__(self, data_obj, nodes, convert=None, recorder=None, detector=None):
+        self.data_obj = data_obj
+        self.attrs = list(nodes)
+        self.nodes = list(nodes.values())
+        self.convert = convert
+        self.recorder = recorder
+        self.detector = detector
+        self.last_written = {}
+        self.calls = 0          # service calls sent
+        self.values = 0         # node values read or written
+
+    def __len__(self):
+        return len(self.nodes)
+
+    # Read all nodes with one Read call and store the values in the shared object
+    async def read(self):
+        if not self.nodes:
+            return
+        params = ua.ReadParameters()
+        for node in self.nodes:
+            read_value = ua.ReadValueId()
+            read_value.NodeId = node.nodeid
+            read_value.AttributeId = ua.AttributeIds.Value
+            params.NodesToRead.append(read_value)
+        results = await self.nodes[0].session.read(params)
+        self.calls += 1
+
+        for attr, result in zip(self.attrs, results):
+            result.StatusCode.check()
+            value = result.Value.Value
+            if self.convert is not None:
+                value = self.convert(value)
+            setattr(self.data_obj, attr, value)
+            if self.recorder is not None:
+                self.recorder.record(OPCUA_READ, attr, value)
+            if self.detector is not None:
+                self.detector.observe(attr, value)
+        self.values += len(results)
+
+    # Write the values of the shared object with one Write call, returns the number written
+    async def write(self, only_changed=True):
+        params = ua.WriteParameters()
+        changed = {}
+        for attr, node in zip(self.attrs, self.nodes):
+            value = getattr(self.data_obj, attr)
+            if only_changed and attr in self.last_written and self.last_written[attr] == value:
+                continue
+            write_value = ua.WriteValue()
+            write_value.NodeId = node.nodeid
+            write_value.AttributeId = ua.AttributeIds.Value
+            write_value.Value = value_to_datavalue(value)
+            params.NodesToWrite.append(write_value)
+            changed[attr] = value
+        if not changed:
+            return 0
+
+        results = await self.nodes[0].session.write(params)
+        self.calls += 1
+        for status in results:
+            status.check()
+        self.last_written.update(changed)
+        for attr, value in changed.items():
+            if self.recorder is not None:
+                self.recorder.record(OPCUA_WRITE, attr, value)
+            if self.detector is not None:
+                self.detector.observe(attr, value)
+        self.values += len(changed)
+        return len(changed)
+
+    # Forget what was written, e.g. after a reconnect
+    def reset(self):
+        self.last_written.clear()
+
+
+class NodeExchange:
+    def __init__(self, data_obj, reads=None, writes=None, mode="subscription",
+                 publishing_interval=10, sampling_interval=0, poll_interval=0.05,
+                 write_interval=0.01, probe_interval=1.0, convert=None, skip_unchanged=True,
+                 recorder=None, detector=None):
+        if mode not in MODES:
+            raise ValueError(f"unknown OPC UA exchange mode {mode!r}, expected one of {MODES}")
+        self.data_obj = data_obj
+        self.reads = dict(reads or {})
+        self.writes = dict(writes or {})
+        self.mode = mode
+        self.publishing_interval = publishing_interval   # ms, how often the server sends notifications
+        self.sampling_interval = sampling_interval       # ms, how often the server samples, 0 = fastest
+        self.poll_interval = poll_interval               # s, loop period in polling mode
+        self.write_interval = write_interval             # s, check for changed values in subscription mode
+        self.probe_interval = probe_interval             # s, connection check of a subscribing client
+        self.convert = convert
+        self.skip_unchanged = skip_unchanged             # polling mode: do not rewrite unchanged values
+
+        self.recorder = recorder
+        self.detector = detector
+        self.read_group = NodeGroup(data_obj, self.reads, convert, recorder, detector)
+        self.write_group = NodeGroup(data_obj, self.writes, recorder=recorder, detector=detector)
+        self.attr_by_nodeid = {node.nodeid: attr for attr, node in self.reads.items()}
+        # frame exchange with the cycle, present on SharedData views
+        self.publish = getattr(data_obj, "publish", None)
+        self.refresh = getattr(data_obj, "refresh", None)
+        self.publish_pending = False
+        self.subscription = None
+        self.client = None
+        self.lost = None
+        self.received = 0
+        self.written = 0
+
+    # Store a received value in the shared object
+    def store(self, attr, value):
+        if self.convert is not None:
+            value = self.convert(value)
+        setattr(self.data_obj, attr, value)
+        self.received += 1
+        if self.recorder is not None:
+            self.recorder.record(OPCUA_RECEIVE, attr, value)
+        if self.detector is not None:
+            self.detector.observe(attr, value)
+
+    def receive(self, nodeid, value):
+        attr = self.attr_by_nodeid.get(nodeid)
+        if attr is not None:
+            self.store(attr, value)
+            self._schedule_publish()
+
+    # Notifications of one publish response arrive one by one; publish them
+    # together once the event loop is through with them
+    def _schedule_publish(self):
+        if self.publish is not None and not self.publish_pending:
+            self.publish_pending = True
+            asyncio.get_running_loop().call_soon(self._publish_received)
+
+    def _publish_received(self):
+        self.publish_pending = False
+        self.publish()
+
+    async def start_client(self, client):
+        self.client = client
+        self.write_group.reset()
+        self.lost = None
+        if self.mode != "subscription" or not self.reads:
+            return
+        self.subscription = await client.create_subscription(
+            self.publishing_interval, DataChangeHandler(self)
+        )
+        await self.subscription.subscribe_data_change(
+            list(self.reads.values()), sampling_interval=self.sampling_interval
+        )
+
+    async def start_server(self, server):
+        self.write_group.reset()
+        if self.mode != "subscription" or not self.reads:
+            return
+        server.subscribe_server_callback(CallbackType.PostWrite, self._on_write)
+
+    # PostWrite callback of the server: take over values written by clients
+    def _on_write(self, event, dispatcher):
+        if not event.is_external:
+            return
+        for write_value, status in zip(event.request_params.NodesToWrite, event.response_params):
+            if write_value.AttributeId == ua.AttributeIds.Value and status.is_good():
+                self.receive(write_value.NodeId, write_value.Value.Value.Value)
+
+    async def read_all(self):
+        await self.read_group.read()
+        self.received += len(self.read_group)
+        if self.publish is not None:
+            self.publish()
+
+    # Write the values of the shared object; only_changed skips values already written
+    async def write_all(self, only_changed=False):
+        if self.refresh is not None:
+            self.refresh()
+        self.written += await self.write_group.write(only_changed)
+
+    # Service calls sent so far
+    @property
+    def calls(self):
+        return self.read_group.calls + self.write_group.calls
+
+    # Exchange values until data_obj.is_running turns False
+    async def run(self):
+        if self.mode == "polling":
+            while self.data_obj.is_running:
+                await self.read_all()
+                await self.write_all(only_changed=self.skip_unchanged)
+                await asyncio.sleep(self.poll_interval)
+            return
+
+        loop = asyncio.get_running_loop()
+        next_probe = loop.time() + self.probe_interval
+        while self.data_obj.is_running:
+            if self.lost:
+                raise ConnectionError(self.lost)
+            await self.write_all(only_changed=True)
+            if self.client is not None and loop.time() >= next_probe:
+                # a subscription that only delivers changes stays silent on a dead connection
+                await self.client.get_node(ua.ObjectIds.Server_ServerStatus_State).read_value()
+                next_probe = loop.time() + self.probe_interval
+            await asyncio.sleep(self.write_interval)
+
+    async def stop(self):
+        if self.subscription is not None:
+            try:
+                await self.subscription.delete()
+            except Exception:
+                pass
+            self.subscription = None
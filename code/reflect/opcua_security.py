@@ -0,0 +1,197 @@
+# OPC UA security modes and long-lived client sessions
+#
+# A security mode is written "<policy>:<mode>" or "none":
+#
+#   none                              no signing, no encryption (the default)
+#   Basic256Sha256:Sign               messages signed
+#   Basic256Sha256:SignAndEncrypt     messages signed and encrypted
+#   Aes128:Sign / Aes128:SignAndEncrypt   Aes128_Sha256_RsaOaep
+#   Aes256:Sign / Aes256:SignAndEncrypt   Aes256_Sha256_RsaPss
+#
+# The stations take the mode from REFLECT_OPCUA_SECURITY; the server accepts a
+# comma separated list of modes, e.g. "none,Basic256Sha256:SignAndEncrypt".
+#
+# Every station has its own RSA key and self-signed application certificate
+# in the certificate directory (REFLECT_OPCUA_CERTS, ~/.reflect/opcua by
+# default), created on first use:
+#
+#   <name>.pem   private key          <name>.der   certificate
+#
+# The certificates are not checked against a trust list, clients and server
+# accept any certificate of their peer.
+#
+# ClientSession keeps one session open for as long as possible:
+#
+#   - the secure channel is renewed by asyncua in the background after 75 %
+#     of channel_lifetime, the session stays open and the exchange goes on;
+#     the cycle only sees SharedData frames and never waits for it,
+#   - with asyncua versions that support it (auto_reconnect), a lost
+#     connection is repaired inside the client: the session is activated
+#     again on a new channel and the subscriptions are kept,
+#   - keys and certificates are loaded (RSA key checks take tens of ms) and
+#     the server certificate fetched with GetEndpoints once; new clients
+#     after a disconnect() reuse them.
+#
+#   session = ClientSession(SERVER_URL, os.environ.get("REFLECT_OPCUA_SECURITY", "none"), name="multi")
+#   client = await session.connect()
+#   ...
+#   await session.disconnect()
+
+import inspect
+import os
+import socket
+from pathlib import Path
+
+from asyncua import Client, ua
+from asyncua.crypto import security_policies
+
+POLICIES = {
+    "Basic256Sha256": (security_policies.SecurityPolicyBasic256Sha256, "Basic256Sha256"),
+    "Aes128": (security_policies.SecurityPolicyAes128Sha256RsaOaep, "Aes128Sha256RsaOaep"),
+    "Aes128Sha256RsaOaep": (security_policies.SecurityPolicyAes128Sha256RsaOaep, "Aes128Sha256RsaOaep"),
+    "Aes256": (security_policies.SecurityPolicyAes256Sha256RsaPss, "Aes256Sha256RsaPss"),
+    "Aes256Sha256RsaPss": (security_policies.SecurityPolicyAes256Sha256RsaPss, "Aes256Sha256RsaPss"),
+}
+
+MESSAGE_MODES = {
+    "Sign": ua.MessageSecurityMode.Sign,
+    "SignAndEncrypt": ua.MessageSecurityMode.SignAndEncrypt,
+}
+
+DEFAULT_CERTIFICATES = os.path.join(os.path.expanduser("~"), ".reflect", "opcua")
+
+
+class SecurityMode:
+    def __init__(self, text):
+        self.text = text.strip()
+        if self.text.lower() in ("", "none"):
+            self.policy = None
+            self.name = "none"
+            return
+        policy, _, mode = self.text.partition(":")
+        if policy not in POLICIES or mode not in MESSAGE_MODES:
+            raise ValueError(
+                f"unknown OPC UA security mode {text!r}, expected 'none' or <policy>:<mode> with "
+                f"policy one of {sorted(POLICIES)} and mode one of {sorted(MESSAGE_MODES)}"
+            )
+        self.policy, policy_name = POLICIES[policy]
+        self.mode = MESSAGE_MODES[mode]
+        self.name = f"{policy_name}:{mode}"
+        # server side: ua.SecurityPolicyType member, e.g. Basic256Sha256_SignAndEncrypt
+        self.policy_type = getattr(ua.SecurityPolicyType, f"{policy_name}_{mode}")
+
+    @property
+    def secure(self):
+        return self.policy is not None
+
+    def __repr__(self):
+        return f"SecurityMode({self.name!r})"
+
+
+def parse_modes(text):
+    return [SecurityMode(part) for part in text.split(",")]
+
+
+# Key and certificate of a station, created if missing; returns (key path, certificate path)
+async def station_certificate(name, directory=None, server=False):
+    from asyncua.crypto.cert_gen import setup_self_signed_certificate
+    from cryptography.x509.oid import ExtendedKeyUsageOID
+
+    directory = Path(directory or os.environ.get("REFLECT_OPCUA_CERTS") or DEFAULT_CERTIFICATES)
+    directory.mkdir(parents=True, exist_ok=True)
+    key_file, cert_file = directory / f"{name}.pem", directory / f"{name}.der"
+    usage = ExtendedKeyUsageOID.SERVER_AUTH if server else ExtendedKeyUsageOID.CLIENT_AUTH
+    await setup_self_signed_certificate(
+        key_file, cert_file, application_uri(name), socket.gethostname(), [usage],
+        {"commonName": f"REFLECT {name}", "organizationName": "REFLECT"},
+    )
+    return key_file, cert_file
+
+
+def application_uri(name):
+    return f"urn:reflect:{name}"
+
+
+# Offer the given modes (text or SecurityMode list) on a server
+async def configure_server(server, modes, name="server", certificates=None):
+    if isinstance(modes, str):
+        modes = parse_modes(modes)
+    server.set_security_policy(
+        [mode.policy_type if mode.secure else ua.SecurityPolicyType.NoSecurity for mode in modes]
+    )
+    if any(mode.secure for mode in modes):
+        key_file, cert_file = await station_certificate(name, certificates, server=True)
+        await server.set_application_uri(application_uri(name))
+        await server.load_certificate(str(cert_file))
+        await server.load_private_key(str(key_file))
+    return modes
+
+
+class ClientSession:
+    def __init__(self, url, security="none", name="client", certificates=None, channel_lifetime=600000,
+                 session_timeout=600000, timeout=4, auto_reconnect=True):
+        self.url = url
+        self.security = security if isinstance(security, SecurityMode) else SecurityMode(security)
+        self.name = name
+        self.certificates = certificates
+        self.channel_lifetime = channel_lifetime    # ms, secure channel token lifetime
+        self.session_timeout = session_timeout      # ms
+        self.timeout = timeout                      # s, request timeout
+        # let asyncua re-activate the session on a new channel, if it can
+        self.auto_reconnect = auto_reconnect and "auto_reconnect" in inspect.signature(Client.connect).parameters
+        self.client = None
+        self.connects = 0
+        self.policy = None                          # security policy with the loaded keys, reused
+
+    async def _create(self):
+        client = Client(url=self.url, timeout=self.timeout)
+        client.application_uri = application_uri(self.name)
+        client.name = client.description = f"REFLECT {self.name}"
+        client.secure_channel_timeout = self.channel_lifetime
+        client.session_timeout = self.session_timeout
+        if self.security.secure and self.policy is not None:
+            client.security_policy = self.policy
+            client.uaclient.set_security(self.policy)
+        elif self.security.secure:
+            key_file, cert_file = await station_certificate(self.name, self.certificates)
+            # the only unsecured round trip: GetEndpoints for the server certificate
+            endpoints = await client.connect_and_get_server_endpoints()
+            endpoint = Client.find_endpoint(endpoints, self.security.mode, self.security.policy.URI)
+            await client.set_security(
+                self.security.policy, str(cert_file), str(key_file),
+                server_certificate=endpoint.ServerCertificate, mode=self.security.mode,
+            )
+            self.policy = client.security_policy
+        return client
+
+    # Connect and return the client. Losses of the connection are repaired by
+    # asyncua itself (auto_reconnect); after disconnect() a new client is made.
+    async def connect(self):
+        if self.client is not None:
+            return self.client
+        client = await self._create()
+        try:
+            if self.auto_reconnect:
+                await client.connect(auto_reconnect=True)
+            else:
+                await client.connect()
+        except Exception:
+            # e.g. a new server certificate: load everything again next time
+            self.policy = None
+            raise
+        self.client = client
+        self.connects += 1
+        return client
+
+    # Close the session; the next connect() starts a new one
+    async def disconnect(self):
+        client, self.client = self.client, None
+        if client is None:
+            return
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+
+    def describe(self):
+        return f"{self.url}, security {self.security.name}, connect #{self.connects}"
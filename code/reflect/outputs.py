@@ -0,0 +1,78 @@
+# Buffered output image for rpi.cycleloop programs
+#
+# The station code sets the same outputs again and again, e.g. a motor
+# output on every pass through a waiting state. OutputImage collects all
+# output writes of a cycle and at the end of the cycle passes only those to
+# revpimodio2 whose value differs from what was written last:
+#
+#   outputs = OutputImage(rpi)
+#
+#   def cycleprogram(cycletools):
+#       outputs["O_8"] = 1          # instead of rpi.io.O_8.value = 1
+#       ...
+#       outputs.flush()
+#
+# With autorefresh=True revpimodio2 transfers the whole process image once per
+# cycle anyway, so deferring the writes to the end of the cycle does not change
+# when they reach the hardware. Reading an output returns the pending value.
+
+_UNSET = object()
+
+
+class OutputImage:
+    def __init__(self, rpi):
+        self.rpi = rpi
+        self.ios = {}           # name -> revpimodio2 IO object, looked up once
+        self.pending = {}       # writes of the current cycle
+        self.committed = {}     # last value passed to revpimodio2
+        self.flushes = 0
+        self.writes = 0         # values passed to revpimodio2
+        self.skipped = 0        # writes dropped because the value did not change
+
+    def __setitem__(self, name, value):
+        self.pending[name] = value
+
+    def __getitem__(self, name):
+        if name in self.pending:
+            return self.pending[name]
+        if name in self.committed:
+            return self.committed[name]
+        return self._io(name).value
+
+    def _io(self, name):
+        io = self.ios.get(name)
+        if io is None:
+            io = self.ios[name] = self.rpi.io[name]
+        return io
+
+    def update(self, values):
+        self.pending.update(values)
+
+    # Set all given outputs to 0
+    def off(self, *names):
+        for name in names:
+            self.pending[name] = 0
+
+    # Pass the changed outputs to revpimodio2, returns the number written
+    def flush(self):
+        written = 0
+        committed = self.committed
+        for name, value in self.pending.items():
+            if committed.get(name, _UNSET) == value:
+                self.skipped += 1
+                continue
+            self._io(name).value = value
+            committed[name] = value
+            written += 1
+        self.pending.clear()
+        self.flushes += 1
+        self.writes += written
+        return written
+
+    def report(self):
+        total = self.writes + self.skipped
+        saved = 100.0 * self.skipped / total if total else 0.0
+        return (
+            f"outputs: {self.writes} of {total} writes passed on in {self.flushes} cycles "
+            f"({saved:.1f} % coalesced)"
+        )
@@ -0,0 +1,457 @@
+# Process-model intrusion detection from the station state machines
+#
+# The state machines of the station scripts already say which signals a
+# station reads and writes in which state: the gripper only requests a slot
+# (Output_Word_1) when it enters WAIT_FOR_PICKUP_READY or
+# WAIT_FOR_DROP_OFF_READY, the HBW only reads Input_1 in IDLE, and so on.
+# extract_models() loads a script in the simulation for one cycle, finds its
+# StateMachine objects and scans the guards and actions of every state for
+# the monitored signals (Modbus words, OPC UA shared data fields):
+#
+#   - def functions are parsed (ast): a write is a "must" write if it is not
+#     inside an if/for/while/try and no earlier statement may return,
+#   - lambdas are scanned in their bytecode (they can only read),
+#   - module-level helper functions called from an action are followed.
+#
+# A write is attributed to the states the machine can be in right after it:
+# the state of an enter or during action (or a target of the during action),
+# the target of a transition action, the successors of an exit action.
+#
+# ProcessMonitor checks the value changes a station writes against this
+# automaton. It keeps the set of states the machine can be in as a bitmask.
+# Between two observed changes the machine may have moved silently, but only
+# into states whose must writes on entry agree with the current values. The
+# next change is legal if one of the states reached this way writes that
+# value. Successor sets come from per-byte lookup tables, so one event costs
+# a few table lookups and integer operations.
+#
+#   python -m reflect.processmodel show modbus/gripper.py
+#   python -m reflect.processmodel check /tmp/trace modbus/gripper.py modbus/high_bay_warehouse.py modbus/multi.py
+
+import argparse
+import ast
+import dis
+import inspect
+import os
+import textwrap
+import types
+
+from .anomaly import Alert, print_alert
+from .statemachine import StateMachine
+
+ANY = "*"                   # written value not known statically
+
+
+# Reads and writes of monitored signals found in one function
+class Accesses:
+    def __init__(self):
+        self.reads = set()
+        self.writes = {}        # signal -> set of values (or ANY)
+        self.must = {}          # signal -> value written unconditionally
+
+    def write(self, signal, value, must):
+        self.writes.setdefault(signal, set()).add(value)
+        if must and value != ANY:
+            self.must[signal] = value
+        elif must:
+            self.must.pop(signal, None)
+
+    def merge(self, other, must):
+        self.reads |= other.reads
+        for signal, values in other.writes.items():
+            self.writes.setdefault(signal, set()).update(values)
+        if must:
+            self.must.update(other.must)
+
+
+class FunctionScanner:
+    def __init__(self, signals):
+        self.signals = frozenset(signals)
+        self.cache = {}
+
+    def scan(self, func):
+        if func is None:
+            return Accesses()
+        func = getattr(func, "__func__", func)
+        key = getattr(func, "__code__", func)
+        if key in self.cache:
+            return self.cache[key]
+        self.cache[key] = Accesses()    # recursion guard
+        if not isinstance(func, types.FunctionType):
+            return self.cache[key]
+        try:
+            source = textwrap.dedent(inspect.getsource(func))
+            tree = ast.parse(source) if func.__name__ != "<lambda>" else None
+        except (OSError, TypeError, SyntaxError):
+            tree = None
+        node = tree.body[0] if tree is not None and tree.body else None
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            result = self._scan_tree(func, node)
+        else:
+            result = self._scan_code(func, func.__code__)
+        self.cache[key] = result
+        return result
+
+    # --- def functions ---
+
+    def _scan_tree(self, func, node):
+        result = Accesses()
+        for sub in ast.walk(node):
+            if isinstance(sub, ast.Attribute) and isinstance(sub.ctx, ast.Load) and sub.attr in self.signals:
+                result.reads.add(sub.attr)
+            elif isinstance(sub, ast.Subscript) and isinstance(sub.ctx, ast.Load):
+                name = self._constant(sub.slice)
+                if name in self.signals:
+                    result.reads.add(name)
+        self._statements(func, node.body, result, True)
+        return result
+
+    def _statements(self, func, statements, result, must):
+        for statement in statements:
+            if isinstance(statement, (ast.Assign, ast.AugAssign, ast.AnnAssign)):
+                targets = statement.targets if isinstance(statement, ast.Assign) else [statement.target]
+                value = self._constant(statement.value) if isinstance(statement, ast.Assign) else None
+                for target in targets:
+                    signal = self._written_signal(target)
+                    if signal is not None:
+                        result.write(signal, ANY if value is None else value, must)
+            elif isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Call):
+                self._call(func, statement.value, result, must)
+            elif isinstance(statement, (ast.If, ast.For, ast.While, ast.Try, ast.With)):
+                for block in ("body", "orelse", "finalbody"):
+                    self._statements(func, getattr(statement, block, []), result,
+                                     must and isinstance(statement, ast.With) and block == "body")
+                for handler in getattr(statement, "handlers", []):
+                    self._statements(func, handler.body, result, False)
+                if any(isinstance(sub, (ast.Return, ast.Raise)) for sub in ast.walk(statement)):
+                    must = False
+            # calls inside other statements (e.g. `if open_oven(var):`) may write
+            for sub in ast.walk(statement):
+                if isinstance(sub, ast.Call) and not (isinstance(statement, ast.Expr) and sub is statement.value):
+                    self._call(func, sub, result, False, follow_only=True)
+
+    def _call(self, func, call, result, must, follow_only=False):
+        target = call.func
+        # outputs.off("Output_1", ...) sets the outputs to 0
+        if not follow_only and isinstance(target, ast.Attribute) and target.attr == "off":
+            for arg in call.args:
+                name = self._constant(arg)
+                if name in self.signals:
+                    result.write(name, 0, must)
+        if isinstance(target, ast.Name):
+            callee = func.__globals__.get(target.id)
+            if isinstance(callee, types.FunctionType):
+                result.merge(self.scan(callee), must and not follow_only)
+
+    def _written_signal(self, target):
+        if isinstance(target, ast.Subscript):       # outputs["Output_Word_1"] = ...
+            name = self._constant(target.slice)
+            return name if name in self.signals else None
+        if isinstance(target, ast.Attribute):
+            if target.attr in self.signals:         # cycle_data.multi_status = ...
+                return target.attr
+            if target.attr == "value" and isinstance(target.value, ast.Attribute):
+                if target.value.attr in self.signals:   # rpi.io.Output_1.value = ...
+                    return target.value.attr
+        return None
+
+    @staticmethod
+    def _constant(node):
+        if isinstance(node, ast.Index):  # Python < 3.9
+            node = node.value
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, str)):
+            return node.value
+        return None
+
+    # --- lambdas ---
+
+    def _scan_code(self, func, code):
+        result = Accesses()
+        for instruction in dis.get_instructions(code):
+            argval = instruction.argval
+            if instruction.opname in ("LOAD_ATTR", "LOAD_METHOD", "LOAD_CONST") and argval in self.signals:
+                result.reads.add(argval)
+            elif instruction.opname == "LOAD_GLOBAL":
+                callee = func.__globals__.get(argval)
+                if isinstance(callee, types.FunctionType):
+                    result.merge(self.scan(callee), False)
+            elif isinstance(argval, types.CodeType):
+                result.merge(self._scan_code(func, argval), False)
+        return result
+
+
+# Expected behaviour of one state machine
+class MachineModel:
+    def __init__(self, station, name, states):
+        self.station = station
+        self.name = name
+        self.states = list(states)
+        self.successors = [0] * len(self.states)    # bitmask per state
+        self.reads = [set() for _ in self.states]
+        self.writes = [{} for _ in self.states]     # state -> signal -> values written on the way into it
+        self.must_entry = [{} for _ in self.states] # state -> signal -> value set on every entry
+
+    @property
+    def all_states(self):
+        return (1 << len(self.states)) - 1
+
+    @property
+    def signals(self):
+        return {signal for writes in self.writes for signal in writes}
+
+    def names(self, mask):
+        return [name for i, name in enumerate(self.states) if mask >> i & 1]
+
+    def describe(self):
+        lines = [f"{self.station}/{self.name}: {len(self.states)} states"]
+        for i, state in enumerate(self.states):
+            parts = []
+            if self.reads[i]:
+                parts.append("reads " + ", ".join(sorted(self.reads[i])))
+            writes = [
+                f"{signal}={'|'.join(str(v) for v in sorted(values, key=str))}"
+                for signal, values in sorted(self.writes[i].items())
+            ]
+            if writes:
+                parts.append("writes " + ", ".join(writes))
+            if self.must_entry[i]:
+                parts.append("sets on entry " + ", ".join(f"{s}={v}" for s, v in sorted(self.must_entry[i].items())))
+            parts.append("-> " + ", ".join(self.names(self.successors[i])))
+            lines.append(f"  {state}: " + "; ".join(parts))
+        return "\n".join(lines)
+
+
+def build_model(station, machine, signals):
+    scanner = FunctionScanner(signals)
+    count = len(machine.names)
+    model = MachineModel(station, machine.name, machine.names)
+
+    def add_writes(states, accesses):
+        for state in states:
+            for signal, values in accesses.writes.items():
+                model.writes[state].setdefault(signal, set()).update(values)
+
+    for state in range(count):
+        for successor in machine.successors(state):
+            model.successors[state] |= 1 << successor
+        enter = scanner.scan(machine.enter_actions.get(state))
+        during = scanner.scan(machine.during_actions.get(state))
+        leave = scanner.scan(machine.exit_actions.get(state))
+        model.reads[state] |= enter.reads | during.reads | leave.reads
+        model.must_entry[state] = dict(enter.must)
+        add_writes([state], enter)
+        add_writes([state, *machine.declared_targets.get(state, ())], during)
+        add_writes(machine.successors(state), leave)
+
+    for source, target, guard, action in machine.transitions:
+        model.reads[source] |= scanner.scan(guard).reads
+        accesses = scanner.scan(action)
+        model.reads[source] |= accesses.reads
+        add_writes([target], accesses)
+    return model
+
+
+# Signals of a station: its Modbus words and the fields of its OPC UA shared data
+def station_signals(station, namespace):
+    from .modbus_bridge import REGISTERS
+    from .snapshot import SharedData
+
+    signals = set()
+    for _, writer, written, reader, read in REGISTERS:
+        if writer == station:
+            signals.add(written)
+        if reader == station:
+            signals.add(read)
+    for value in namespace.values():
+        if isinstance(value, SharedData):
+            signals.update(value.received.fields)
+            signals.update(value.sent.fields)
+    return signals
+
+
+# Load a station script in the simulation and build the models of its state machines
+def extract_models(script, signals=None):
+    from .sim.runner import run_script
+
+    station = os.path.splitext(os.path.basename(script))[0]
+    run = run_script(script, cycles=1, quiet=True)
+    namespace = run.namespace
+    if signals is None:
+        signals = station_signals(station, namespace)
+    models = []
+    for value in namespace.values():
+        if isinstance(value, StateMachine):
+            model = build_model(station, value, signals)
+            if model.signals:
+                models.append(model)
+    return models
+
+
+# --- monitoring ---
+
+# Lookup tables of one machine model
+class MachineMonitor:
+    def __init__(self, model):
+        self.model = model
+        count = len(model.states)
+        self.all_states = model.all_states
+        # successor union of any state set, 8 states per table
+        self.chunks = []
+        for base in range(0, count, 8):
+            table = []
+            for byte in range(256):
+                mask = 0
+                for bit in range(8):
+                    if byte >> bit & 1 and base + bit < count:
+                        mask |= model.successors[base + bit]
+                table.append(mask)
+            self.chunks.append(table)
+        # signal -> value -> states that can write it (value ANY: states writing unknown values)
+        self.writers = {}
+        for state, writes in enumerate(model.writes):
+            for signal, values in writes.items():
+                table = self.writers.setdefault(signal, {})
+                for value in values:
+                    table[value] = table.get(value, 0) | 1 << state
+        for table in self.writers.values():
+            any_mask = table.get(ANY, 0)
+            for value in table:
+                table[value] |= any_mask
+            table[ANY] = any_mask
+        # signal -> value -> states that may be entered while the signal has that value
+        self.entry = {}
+        for state, must in enumerate(model.must_entry):
+            for signal, value in must.items():
+                self.entry.setdefault(signal, {})[value] = 0
+        for signal, table in self.entry.items():
+            free = 0
+            for state, must in enumerate(model.must_entry):
+                if signal not in must:
+                    free |= 1 << state
+                else:
+                    table[must[signal]] |= 1 << state
+            for value in list(table):
+                table[value] |= free
+            table[ANY] = free
+        self.reset()
+
+    def reset(self):
+        self.possible = self.all_states     # unknown state at the start
+        self.enterable = self.all_states
+        self.values = {}
+
+    def successors(self, mask):
+        result = 0
+        for table in self.chunks:
+            result |= table[mask & 0xFF]
+            mask >>= 8
+            if not mask:
+                break
+        return result
+
+    def _update_enterable(self):
+        enterable = self.all_states
+        for signal, table in self.entry.items():
+            if signal in self.values:
+                enterable &= table.get(self.values[signal], table[ANY])
+        self.enterable = enterable
+
+    # States reachable from the possible ones without an observable change
+    def reachable(self):
+        reached = self.possible
+        frontier = reached
+        while frontier:
+            frontier = self.successors(frontier) & self.enterable & ~reached
+            reached |= frontier
+        return reached
+
+    # A change of signal to value; returns True if the model allows it
+    def observe(self, signal, value):
+        table = self.writers[signal]
+        writers = table.get(value, table[ANY])
+        candidates = self.reachable() & writers
+        legal = candidates != 0
+        self.possible = candidates if legal else (writers or self.all_states)
+        self.values[signal] = value
+        if signal in self.entry:
+            self._update_enterable()
+        return legal
+
+
+class ProcessMonitor:
+    def __init__(self, models, on_alert=print_alert):
+        self.machines = {}          # (station, signal) -> machine monitors writing it
+        for model in models:
+            machine = MachineMonitor(model)
+            for signal in model.signals:
+                self.machines.setdefault((model.station, signal), []).append(machine)
+        self.on_alert = on_alert
+        self.last = {}
+        self.events = 0
+        self.alerts = 0
+
+    # One value written by a station; unchanged values are ignored
+    def observe(self, station, signal, value, now=0.0):
+        key = (station, signal)
+        machines = self.machines.get(key)
+        if machines is None or self.last.get(key) == value:
+            return None
+        first = key not in self.last
+        self.last[key] = value
+        self.events += 1
+        before = [machine.possible for machine in machines]
+        legal = [machine.observe(signal, value) for machine in machines]
+        if first or any(legal):
+            return None
+        self.alerts += 1
+        states = sorted({name for machine, mask in zip(machines, before) for name in machine.model.names(mask)})
+        alert = Alert(now, f"{station}.{signal}", "unexpected write", value, "possible states " + ", ".join(states))
+        if self.on_alert is not None:
+            self.on_alert(alert)
+        return alert
+
+    # Check the writes of a capture (reflect.capture.load_trace)
+    def check_trace(self, trace):
+        from .capture import MODBUS_WRITE, OPCUA_WRITE
+
+        records = trace.records
+        stations, items = trace.stations, trace.items
+        for record in records[(records["event"] == MODBUS_WRITE) | (records["event"] == OPCUA_WRITE)].tolist():
+            time_ns, value, _, item, station, _ = record
+            self.observe(stations[station], items[item], int(value), time_ns / 1e9)
+
+    def report(self):
+        return f"process model: {self.events} changes checked, {self.alerts} unexpected"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Expected-behaviour automata of the station scripts")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="print the automata extracted from station scripts")
+    show.add_argument("scripts", nargs="+")
+    check = commands.add_parser("check", help="check a traffic capture against the automata")
+    check.add_argument("trace", help="capture directory (reflect.capture)")
+    check.add_argument("scripts", nargs="+")
+    args = parser.parse_args(argv)
+
+    models = [model for script in args.scripts for model in extract_models(script)]
+    if args.command == "show":
+        for model in models:
+            print(model.describe())
+        return
+
+    import time
+
+    from .capture import load_trace
+
+    trace = load_trace(args.trace)
+    monitor = ProcessMonitor(models)
+    start = time.perf_counter()
+    monitor.check_trace(trace)
+    elapsed = time.perf_counter() - start
+    print(monitor.report())
+    print(f"{len(trace)} records in {elapsed:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
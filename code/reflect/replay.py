@@ -0,0 +1,452 @@
+# Record the inputs of a station every cycle and replay them into the script
+#
+# InputRecorder wraps the cycle function of a station script and stores per
+# cycle what the program saw and what it produced:
+#
+#   input     process image inputs (I_*, Input_Word_*, AnalogInput_*, ...)
+#   counter   encoder counters
+#   received  fields of the SharedData frame taken from the OPC UA thread
+#   output    process image outputs after the program
+#   sent      fields the program published to the OPC UA thread
+#
+# Only changes are stored: a cycle is its start time as the difference to the
+# previous cycle in microseconds, the number of changed signals and for every
+# change the signal index and the difference to its last value, all as
+# varints. A quiet cycle takes 3 bytes before compression. A background
+# thread compresses the blocks (zlib, flushed about once per second) and
+# writes them, so a recording cut off by a crash is readable up to the last
+# second.
+#
+#   recorder = InputRecorder(os.environ.get("REFLECT_RECORD"), "gripper", rpi)
+#   rpi.cycleloop(monitor.wrap(recorder.wrap(cycleprogram)), cycletime=rpi.cycletime)
+#   ...
+#   recorder.close()                        # in programend
+#
+# While recording, time.monotonic() returns the start of the cycle for every
+# call the program makes during the cycle, as on a PLC that samples the time
+# once per scan. The timers of the scripts (StateMachine, CycleScheduler,
+# start_time variables) therefore see exactly the recorded times again.
+#
+# Replay runs the unchanged script in the simulation (reflect.sim) with a
+# plant that sets the recorded inputs, received frames and cycle start times
+# and compares the outputs and sent fields after every cycle with the
+# recorded ones, as fast as the script runs:
+#
+#   cd code
+#   python -m reflect.replay modbus/gripper.py /var/log/reflect/gripper-20240506-101500.rrec
+#
+#   replay = replay_script("modbus/gripper.py", path)
+#   print(replay.report())
+#
+# InputRecorder(None, ...) is disabled and wrap() returns the function
+# unchanged. In a replay the recorder of the script never records; it only
+# tells the replay plant where the SharedData of the script is.
+
+import argparse
+import collections
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from .sim.plants import Plant
+from .sim.revpi import INP, OUT
+
+MAGIC = b"RFLREC1\0"
+HEADER = struct.Struct("<8sI")          # magic, length of the JSON header
+
+INPUT_KINDS = ("input", "counter", "received")
+OUTPUT_KINDS = ("output", "sent")
+
+
+def _put(buffer, value):
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+class InputRecorder:
+    def __init__(self, directory, station, rpi, shared=None, block_bytes=16384, flush_interval=1.0):
+        self.station = station
+        self.rpi = rpi
+        self.shared = shared
+        self.block_bytes = block_bytes
+        self.flush_interval_us = int(flush_interval * 1_000_000)
+        self.cycles = 0
+        self.bytes = 0          # encoded bytes
+        self.written = 0        # compressed bytes in the file
+        self.path = None
+        self.frozen = None
+        self.cycle_thread = None
+        self.monotonic = None
+        self.thread = None
+
+        # in a replay the plant takes over, nothing is recorded
+        plant = getattr(rpi, "plant", None)
+        if hasattr(plant, "attach_recorder"):
+            plant.attach_recorder(self)
+            directory = None
+        self.directory = directory
+        if not self.enabled:
+            return
+
+        core = {io.name for io in getattr(rpi, "core", None) or ()}
+        ios = [io for io in rpi.io if io.name not in core and isinstance(io.value, int)]
+        self.input_ios = [io for io in ios if io.type == INP]
+        self.output_ios = [io for io in ios if io.type == OUT]
+        self.received = list(shared.received.fields) if shared is not None else []
+        self.sent = list(shared.sent.fields) if shared is not None else []
+        signals = (
+            [(io.name, "counter" if hasattr(io, "reset") else "input") for io in self.input_ios]
+            + [(name, "received") for name in self.received]
+            + [(io.name, "output") for io in self.output_ios]
+            + [(name, "sent") for name in self.sent]
+        )
+        self.last = self._inputs() + self._outputs()
+        self.last_time = int(time.monotonic() * 1_000_000)
+        self.handoff_time = self.last_time
+        self.buffer = bytearray()
+
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{station}-{time.strftime('%Y%m%d-%H%M%S')}.rrec")
+        header = json.dumps({
+            "station": station,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "origin": self.last_time,
+            "signals": signals,
+            "initial": [int(value) for value in self.last],
+        }).encode()
+        self.file = open(self.path, "wb")
+        self.file.write(HEADER.pack(MAGIC, len(header)) + header)
+        self.file.flush()
+        self.blocks = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._writer, name=f"{station}-recorder", daemon=True)
+        self.thread.start()
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def _inputs(self):
+        values = [io.value for io in self.input_ios]
+        if self.shared is not None:
+            values.extend(self.shared.cycle.frame)
+        return values
+
+    def _outputs(self):
+        values = [io.value for io in self.output_ios]
+        if self.shared is not None:
+            values.extend(self.shared.sent.staging)
+        return values
+
+    # time.monotonic while recording: the cycle start inside the program
+    def _monotonic_frozen(self):
+        frozen = self.frozen
+        if frozen is not None and threading.get_ident() == self.cycle_thread:
+            return frozen
+        return self.monotonic()
+
+    # Return a cycle function that records func; the return value is passed through
+    def wrap(self, func):
+        if not self.enabled:
+            return func
+        self.monotonic = monotonic = time.monotonic
+        time.monotonic = self._monotonic_frozen
+        input_ios = self.input_ios
+
+        def recorded(cycletools):
+            start = int(monotonic() * 1_000_000)
+            self.cycle_thread = threading.get_ident()
+            self.frozen = start / 1_000_000
+            inputs = [io.value for io in input_ios]
+            try:
+                result = func(cycletools)
+            finally:
+                self.frozen = None
+            if self.shared is not None:
+                inputs.extend(self.shared.cycle.frame)
+            self._append(start, inputs + self._outputs())
+            return result
+
+        recorded.__name__ = getattr(func, "__name__", "recorded")
+        return recorded
+
+    def _append(self, start, values):
+        buffer = self.buffer
+        _put(buffer, start - self.last_time)
+        self.last_time = start
+        last = self.last
+        if values == last:
+            buffer.append(0)
+        else:
+            changed = [index for index, (value, old) in enumerate(zip(values, last)) if value != old]
+            _put(buffer, len(changed))
+            for index in changed:
+                _put(buffer, index)
+                _put(buffer, _zigzag(int(values[index]) - int(last[index])))
+            self.last = values
+        self.cycles += 1
+        if len(buffer) >= self.block_bytes or start - self.handoff_time >= self.flush_interval_us:
+            self._handoff(start)
+
+    def _handoff(self, now):
+        if self.buffer:
+            self.bytes += len(self.buffer)
+            self.blocks.put(bytes(self.buffer))
+            self.buffer.clear()
+        self.handoff_time = now
+
+    # --- writer thread ---
+
+    def _writer(self):
+        compressor = zlib.compressobj(6)
+        while True:
+            block = self.blocks.get()
+            if block is None:
+                data = compressor.flush(zlib.Z_FINISH)
+            else:
+                data = compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.file.write(data)
+            self.file.flush()
+            self.written += len(data)
+            if block is None:
+                break
+
+    def close(self):
+        if self.thread is None:
+            return
+        if self.monotonic is not None:
+            time.monotonic = self.monotonic
+        self._handoff(self.last_time)
+        self.blocks.put(None)
+        self.thread.join()
+        self.thread = None
+        self.file.close()
+
+    def report(self):
+        if not self.enabled:
+            return "recording: off"
+        per_cycle = self.written / self.cycles if self.cycles else 0.0
+        return (
+            f"recording: {self.cycles} cycles, {self.bytes} bytes encoded, {self.written} bytes written "
+            f"({per_cycle:.2f} per cycle) to {self.path}"
+        )
+
+
+class Recording:
+    def __init__(self, header, times, changes):
+        self.station = header["station"]
+        self.started = header["started"]
+        self.origin = header["origin"]
+        self.names = [name for name, kind in header["signals"]]
+        self.kinds = [kind for name, kind in header["signals"]]
+        self.initial = header["initial"]
+        self.times = times          # cycle start, monotonic us
+        self.changes = changes      # per cycle a list of (signal index, new value)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        return (self.times[-1] - self.times[0]) / 1_000_000 if self.times else 0.0
+
+    def signals(self, *kinds):
+        return [(index, name) for index, (name, kind) in enumerate(zip(self.names, self.kinds)) if kind in kinds]
+
+
+def load_recording(path):
+    with open(path, "rb") as f:
+        magic, length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an input recording")
+        header = json.loads(f.read(length))
+        # decompressobj also takes a stream cut off by a crash
+        data = zlib.decompressobj().decompress(f.read())
+
+    values = list(header["initial"])
+    now = header["origin"]
+    times = []
+    changes = []
+    position = 0
+
+    def get():
+        nonlocal position
+        result = shift = 0
+        while True:
+            byte = data[position]
+            position += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    try:
+        while position < len(data):
+            start = now + get()
+            cycle = []
+            for _ in range(get()):
+                index = get()
+                values[index] += _unzigzag(get())
+                cycle.append((index, values[index]))
+            now = start
+            times.append(start)
+            changes.append(cycle)
+    except IndexError:
+        pass    # last cycle incomplete
+    return Recording(header, times, changes)
+
+
+# Plant that plays a recording back into the simulated process image and
+# compares what the program produces with the recorded outputs
+class ReplayPlant(Plant):
+    def __init__(self, recording, keep=20):
+        super().__init__()
+        self.recording = recording
+        self.inputs = tuple(name for index, name in recording.signals("input"))
+        self.counters = tuple(name for index, name in recording.signals("counter"))
+        self.outputs = tuple(name for index, name in recording.signals("output"))
+        self.image_inputs = recording.signals("input", "counter")
+        self.image_outputs = recording.signals("output")
+        self.received = recording.signals("received")
+        self.sent = []
+        self.shared = None
+        self.image = list(recording.initial)
+        self.cycle = 0
+        self.keep = keep                    # mismatches kept for the report
+        self.mismatches = []                # (cycle, name, recorded, replayed)
+        self.mismatch_cycles = 0
+        self.mismatch_signals = collections.Counter()
+
+    def attach(self, rpi):
+        super().attach(rpi)
+        rpi.clock.now = self.recording.origin / 1_000_000
+        for index, name in self.image_inputs + self.image_outputs:
+            rpi.io.values[name] = self.image[index]
+
+    # Called by the InputRecorder of the replayed script
+    def attach_recorder(self, recorder):
+        self.shared = recorder.shared
+        if self.shared is not None:
+            channel = self.shared.sent
+            self.sent = [
+                (index, name, channel.index[name]) for index, name in self.recording.signals("sent")
+                if name in channel.index
+            ]
+            self._publish_received()
+
+    def _publish_received(self):
+        view = self.shared.opcua
+        for index, name in self.received:
+            setattr(view, name, self.image[index])
+        view.publish()
+
+    def step(self, io, dt, now):
+        recording = self.recording
+        cycle = self.cycle
+        self.rpi.clock.now = recording.times[cycle] / 1_000_000
+        image = self.image
+        for index, value in recording.changes[cycle]:
+            image[index] = value
+        values = io.values
+        # all of them: a counter reset by the program has to be undone
+        for index, name in self.image_inputs:
+            values[name] = image[index]
+        if self.shared is not None and self.received:
+            self._publish_received()
+
+    def observe(self, rpi, cycletools):
+        image = self.image
+        values = rpi.io.values
+        wrong = [(name, image[index], values[name]) for index, name in self.image_outputs
+                 if values[name] != image[index]]
+        if self.sent:
+            staging = self.shared.sent.staging
+            wrong.extend((name, image[index], staging[slot]) for index, name, slot in self.sent
+                         if staging[slot] != image[index])
+        if wrong:
+            self.mismatch_cycles += 1
+            for name, recorded, replayed in wrong:
+                self.mismatch_signals[name] += 1
+                if len(self.mismatches) < self.keep:
+                    self.mismatches.append((self.cycle, name, recorded, replayed))
+        self.cycle += 1
+
+    @property
+    def first_mismatch(self):
+        return self.mismatches[0][0] if self.mismatches else None
+
+
+class Replay:
+    def __init__(self, script, path, recording, plant, run):
+        self.script = script
+        self.path = path
+        self.recording = recording
+        self.plant = plant
+        self.run = run
+
+    @property
+    def ok(self):
+        return self.plant.mismatch_cycles == 0
+
+    def report(self):
+        recording, plant = self.recording, self.plant
+        wall = self.run.wall_seconds
+        speedup = recording.duration / wall if wall > 0 else 0.0
+        lines = [
+            f"{os.path.basename(self.path)}: {plant.cycle} of {len(recording)} cycles, "
+            f"{recording.duration:.1f} s recorded, replayed in {wall:.2f} s ({speedup:.0f}x real time)",
+            f"outputs: {plant.mismatch_cycles} cycles differ",
+        ]
+        if recording.signals("received") and plant.shared is None:
+            lines.append("  received fields not replayed: the script has no InputRecorder with shared=")
+        first = recording.times[0] if recording.times else 0
+        for cycle, name, recorded, replayed in plant.mismatches:
+            seconds = (recording.times[cycle] - first) / 1_000_000
+            lines.append(f"  cycle {cycle} ({seconds:.3f} s): {name} recorded {recorded}, replayed {replayed}")
+        if plant.mismatch_cycles > len(plant.mismatches):
+            counts = ", ".join(f"{name} {count}" for name, count in plant.mismatch_signals.most_common())
+            lines.append(f"  cycles per signal: {counts}")
+        return "\n".join(lines)
+
+
+# Run a station script against a recording of its inputs
+def replay_script(script, path, quiet=True, keep=20):
+    from .sim.runner import run_script
+
+    recording = load_recording(path)
+    if not len(recording):
+        raise ValueError(f"{path} holds no complete cycle")
+    plant = ReplayPlant(recording, keep=keep)
+    run = run_script(script, plant=plant, cycles=len(recording), quiet=quiet, observers=[plant])
+    return Replay(script, path, recording, plant, run)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recording of the inputs into a station script")
+    parser.add_argument("script", help="station script, e.g. modbus/gripper.py")
+    parser.add_argument("recording", help="recording written by InputRecorder (.rrec)")
+    parser.add_argument("--show", type=int, default=20, help="differing outputs listed")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the script")
+    args = parser.parse_args(argv)
+
+    replay = replay_script(args.script, args.recording, quiet=not args.verbose, keep=args.show)
+    print(replay.report())
+    return 0 if replay.ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+# Labelled attack and fault scenarios against the simulated plant
+#
+# A scenario runs one station script in the simulation with a proxy between
+# the station and its neighbours (the plant model answers the handshakes)
+# and manipulates signals at exact cycles:
+#
+#   {"name": "slot_tamper", "script": "modbus/gripper.py", "seconds": 120, "seed": 3,
+#    "manipulations": [
+#        {"kind": "tamper", "signal": "Input_Word_1", "cycle": 1500, "cycles": 200, "value": 0},
+#        {"kind": "replay", "signal": "Output_Word_1", "cycle": 6000, "cycles": 400, "source_cycle": 2000}]}
+#
+# Manipulation kinds, active for `cycles` cycles from `cycle`:
+#
+#   tamper   the other side sees `value`                        (attack)
+#   replay   it sees the values from `source_cycle` on again    (attack)
+#   delay    it sees the values from `delay` cycles earlier     (fault)
+#   freeze   it sees the value from the start of the window     (fault)
+#   set      changes the true value once at `cycle`, e.g. an OPC UA value a
+#            neighbour would send; not labelled
+#
+# Signals are the station's Modbus words (process image, both directions)
+# and the fields of its OPC UA shared data (reflect.snapshot.SharedData).
+# Every change of a signal as it appears on the wire is recorded with
+# reflect.capture in simulated time, and LABEL records mark the start and
+# end of every window. scenario.json next to the trace holds the scenario,
+# the windows with times and the run summary.
+#
+#   python -m reflect.scenarios generate --count 1000 --seconds 120 > scenarios.jsonl
+#   python -m reflect.scenarios run scenarios.jsonl --out /tmp/dataset --workers 8
+#
+# run_scenarios() spreads the runs over a process pool; every run is
+# independent and deterministic for its seed.
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .capture import LABEL, MODBUS_READ, MODBUS_WRITE, OPCUA_RECEIVE, OPCUA_WRITE, TrafficCapture
+
+KINDS = {"tamper": "attack", "replay": "attack", "delay": "fault", "freeze": "fault", "set": None}
+
+SCRIPTS = ("modbus/gripper.py", "modbus/high_bay_warehouse.py", "modbus/multi.py")
+
+
+class ScenarioError(Exception):
+    pass
+
+
+class Manipulation:
+    def __init__(self, kind, signal, cycle, cycles=1, value=None, delay=None, source_cycle=None):
+        if kind not in KINDS:
+            raise ScenarioError(f"unknown manipulation kind {kind!r}, expected one of {sorted(KINDS)}")
+        self.kind = kind
+        self.signal = signal
+        self.cycle = cycle
+        self.cycles = cycles if kind != "set" else 1
+        self.value = value
+        self.delay = delay
+        self.source_cycle = source_cycle
+        self.label_class = KINDS[kind]
+        self.label = f"{kind}:{signal}"
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(**spec)
+
+    @property
+    def end(self):
+        return self.cycle + self.cycles
+
+    # Value the other side sees in cycle k, given the true values so far
+    def apply(self, k, history):
+        if self.kind == "tamper":
+            return self.value
+        if self.kind == "freeze":
+            return history[min(self.cycle, len(history) - 1)]
+        if self.kind == "delay":
+            return history[max(k - self.delay, 0)]
+        if self.kind == "replay":
+            return history[min(self.source_cycle + k - self.cycle, len(history) - 1)]
+        return history[-1]
+
+
+# One signal between the station and its neighbours
+class ProxySignal:
+    def __init__(self, name, direction, event):
+        self.name = name
+        self.direction = direction          # "input", "output", "opcua_in", "opcua_out"
+        self.event = event
+        self.history = []                   # true value per cycle
+        self.manipulations = []
+        self.wire = None                    # last value on the wire, recorded on change
+
+
+# Interposed between the station script and the plant model (its neighbours)
+class ScenarioProxy:
+    def __init__(self, plant, manipulations, recorder=None):
+        self.plant = plant
+        self.manipulations = manipulations
+        self.recorder = recorder
+        self.inputs = plant.inputs
+        self.outputs = plant.outputs
+        self.counters = plant.counters
+        self.signals = None
+        self.shared = None
+        self.cycle = 0
+        self.now_ns = 0
+        self.windows = []                   # (manipulation, start time, end time)
+
+    def attach(self, rpi):
+        self.plant.attach(rpi)
+
+    # Signals known once the script's module level code has run
+    def _setup(self):
+        from .snapshot import SharedData
+
+        # runpy keeps the globals of the running script in sys.modules["__main__"]
+        namespace = vars(sys.modules["__main__"])
+        shared = [value for value in namespace.values() if isinstance(value, SharedData)]
+        self.shared = shared[0] if shared else None
+
+        signals = {}
+        for name in self.plant.inputs:
+            if name.startswith("Input_"):
+                signals[name] = ProxySignal(name, "input", MODBUS_READ)
+        for name in self.plant.outputs:
+            if name.startswith("Output_"):
+                signals[name] = ProxySignal(name, "output", MODBUS_WRITE)
+        if self.shared is not None:
+            for name in self.shared.received.fields:
+                signals[name] = ProxySignal(name, "opcua_in", OPCUA_RECEIVE)
+            for name in self.shared.sent.fields:
+                signals[name] = ProxySignal(name, "opcua_out", OPCUA_WRITE)
+        for manipulation in self.manipulations:
+            if manipulation.signal in signals:
+                pass
+            elif manipulation.signal in self.plant.inputs:
+                signals[manipulation.signal] = ProxySignal(manipulation.signal, "input", MODBUS_READ)
+            elif manipulation.signal in self.plant.outputs:
+                signals[manipulation.signal] = ProxySignal(manipulation.signal, "output", MODBUS_WRITE)
+            else:
+                raise ScenarioError(f"signal {manipulation.signal!r} not found in the station")
+            signals[manipulation.signal].manipulations.append(manipulation)
+        self.signals = list(signals.values())
+
+    def _wire_value(self, signal, true_value):
+        signal.history.append(true_value)
+        k = self.cycle
+        value = true_value
+        for manipulation in signal.manipulations:
+            if manipulation.kind == "set":
+                if k == manipulation.cycle:
+                    signal.history[-1] = value = manipulation.value
+            elif manipulation.cycle <= k < manipulation.end:
+                value = manipulation.apply(k, signal.history)
+        if value != signal.wire:
+            signal.wire = value
+            if self.recorder is not None:
+                self.recorder.record(signal.event, signal.name, value)
+        return value
+
+    def _labels(self):
+        k = self.cycle
+        for manipulation in self.manipulations:
+            if manipulation.label_class is None:
+                continue
+            if k == manipulation.cycle:
+                self.windows.append([manipulation, self.now_ns, None])
+                if self.recorder is not None:
+                    self.recorder.record(LABEL, manipulation.label, 1)
+            elif k == manipulation.end:
+                for window in self.windows:
+                    if window[0] is manipulation:
+                        window[2] = self.now_ns
+                if self.recorder is not None:
+                    self.recorder.record(LABEL, manipulation.label, 0)
+
+    def step(self, io, dt, now):
+        if self.signals is None:
+            self._setup()
+        self.now_ns = int(round(now * 1e9))
+        self._labels()
+        values = io.values
+        true_outputs = {}
+
+        # station -> neighbours: the plant sees the outputs as they come over the wire
+        for signal in self.signals:
+            if signal.direction == "output":
+                true_outputs[signal.name] = values[signal.name]
+                values[signal.name] = self._wire_value(signal, values[signal.name])
+            elif signal.direction == "input" and signal.history:
+                values[signal.name] = signal.history[-1]   # the plant keeps its own state
+            elif signal.direction == "opcua_out":
+                self._wire_value(signal, self.shared.sent.staged(signal.name))
+
+        self.plant.step(io, dt, now)
+
+        # neighbours -> station
+        publish = False
+        for signal in self.signals:
+            if signal.direction == "output":
+                values[signal.name] = true_outputs[signal.name]
+            elif signal.direction == "input":
+                values[signal.name] = self._wire_value(signal, values[signal.name])
+            elif signal.direction == "opcua_in":
+                # nobody sends these in the simulation: the true value only changes with "set"
+                true_value = signal.history[-1] if signal.history else self.shared.received.staged(signal.name)
+                value = self._wire_value(signal, true_value)
+                if value != self.shared.received.staged(signal.name):
+                    self.shared.received.set(signal.name, value)
+                    publish = True
+        if publish:
+            self.shared.received.publish()
+        self.cycle += 1
+
+
+# Run one scenario and write its labelled trace to out_dir/<name>
+def run_scenario(spec, out_dir):
+    from .sim.runner import plant_for_script, run_script
+
+    name = spec["name"]
+    directory = os.path.join(out_dir, name)
+    os.makedirs(directory, exist_ok=True)
+    manipulations = [Manipulation.from_dict(item) for item in spec.get("manipulations", ())]
+    station = os.path.splitext(os.path.basename(spec["script"]))[0]
+
+    proxy = None
+    capture = TrafficCapture(directory, station, clock=lambda: proxy.now_ns)
+    plant = plant_for_script(spec["script"], seed=spec.get("seed", 0), **spec.get("plant", {}))
+    proxy = ScenarioProxy(plant, manipulations, capture.recorder())
+
+    start = time.perf_counter()
+    os.environ.pop("REFLECT_CAPTURE", None)     # the proxy records, not the script
+    run = run_script(spec["script"], plant=proxy, seconds=spec.get("seconds", 60.0), seed=spec.get("seed", 0),
+                     quiet=True)
+    capture.close()
+
+    result = {
+        "scenario": spec,
+        "station": station,
+        "cycles": run.cycles,
+        "simulated_seconds": run.clock.now,
+        "wall_seconds": time.perf_counter() - start,
+        "records": capture.records,
+        "windows": [
+            {
+                "label": manipulation.label,
+                "class": manipulation.label_class,
+                "start_cycle": manipulation.cycle,
+                "end_cycle": manipulation.end,
+                "start_ns": start_ns,
+                "end_ns": end_ns if end_ns is not None else proxy.now_ns,
+            }
+            for manipulation, start_ns, end_ns in proxy.windows
+        ],
+    }
+    with open(os.path.join(directory, "scenario.json"), "w") as f:
+        json.dump(result, f, indent=1)
+    return result
+
+
+def _run_safely(spec, out_dir):
+    try:
+        return run_scenario(spec, out_dir)
+    except Exception as error:  # one broken scenario must not stop the batch
+        return {"scenario": spec, "error": f"{type(error).__name__}: {error}"}
+
+
+# Run scenarios in a process pool, yields the results as they finish
+def run_scenarios(specs, out_dir, workers=None):
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=50) as pool:
+        futures = [pool.submit(_run_safely, spec, out_dir) for spec in specs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+# Per-record labels of a scenario trace: index into windows + 1, 0 = normal
+def label_records(trace, windows):
+    import numpy as np
+
+    labels = np.zeros(len(trace), dtype=np.int16)
+    times = trace["time"]
+    for index, window in enumerate(windows):
+        inside = (times >= window["start_ns"]) & (times < window["end_ns"])
+        labels[inside] = index + 1
+    return labels
+
+
+# Signals a random scenario may manipulate: (signal, plausible values)
+MANIPULABLE = {
+    "gripper": (("Input_Word_1", (0, 1)), ("Input_Word_1_i05", (0, 1)),
+                ("Output_Word_1", tuple(range(10))), ("Output_Word_2", (0, 1))),
+    "high_bay_warehouse": (("Input_1", tuple(range(10))), ("Input_2", (0, 1)), ("Output_1", (0, 1))),
+    "multi": (("Output_1", (0, 1)),),
+}
+
+
+def random_scenario(rng, index, script, seconds, normal_share=0.2):
+    station = os.path.splitext(os.path.basename(script))[0]
+    cycles = int(seconds * 100)
+    spec = {"name": f"{index:06d}_{station}", "script": script, "seconds": seconds,
+            "seed": rng.randrange(1 << 30), "manipulations": []}
+    if rng.random() < normal_share:
+        return spec
+    for _ in range(rng.randint(1, 3)):
+        signal, values = rng.choice(MANIPULABLE[station])
+        kind = rng.choice(("tamper", "replay", "delay", "freeze"))
+        length = rng.randint(10, min(3000, cycles // 4))
+        start = rng.randint(cycles // 10, cycles - length)
+        item = {"kind": kind, "signal": signal, "cycle": start, "cycles": length}
+        if kind == "tamper":
+            item["value"] = rng.choice(values)
+        elif kind == "delay":
+            item["delay"] = rng.randint(5, 500)
+        elif kind == "replay":
+            item["source_cycle"] = rng.randint(0, start - 1)
+        spec["manipulations"].append(item)
+    return spec
+
+
+def generate(count, seconds, seed=0, scripts=SCRIPTS, normal_share=0.2):
+    rng = random.Random(seed)
+    return [random_scenario(rng, i, scripts[i % len(scripts)], seconds, normal_share) for i in range(count)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Labelled attack and fault scenarios in the simulation")
+    commands = parser.add_subparsers(dest="command", required=True)
+    gen = commands.add_parser("generate", help="print random scenarios as JSON lines")
+    gen.add_argument("--count", type=int, default=100)
+    gen.add_argument("--seconds", type=float, default=120.0, help="simulated time per run")
+    gen.add_argument("--seed", type=int, default=0)
+    gen.add_argument("--normal-share", type=float, default=0.2, help="share of runs without manipulation")
+    run = commands.add_parser("run", help="run scenarios from a JSON lines file ('-' = stdin)")
+    run.add_argument("scenarios")
+    run.add_argument("--out", required=True, help="output directory, one subdirectory per run")
+    run.add_argument("--workers", type=int, help="processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        for spec in generate(args.count, args.seconds, args.seed, normal_share=args.normal_share):
+            print(json.dumps(spec))
+        return
+
+    source = sys.stdin if args.scenarios == "-" else open(args.scenarios)
+    with source:
+        specs = [json.loads(line) for line in source if line.strip()]
+    start = time.perf_counter()
+    done = failed = 0
+    for result in run_scenarios(specs, args.out, args.workers):
+        if "error" in result:
+            failed += 1
+            print(f"{result['scenario']['name']}: {result['error']}", file=sys.stderr)
+        else:
+            done += 1
+    elapsed = time.perf_counter() - start
+    print(f"{done} runs ({failed} failed) in {elapsed:.1f} s, {3600.0 * done / elapsed:.0f} runs per hour")
+
+
+if __name__ == "__main__":
+    main()
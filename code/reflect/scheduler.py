@@ -0,0 +1,88 @@
+# Cooperative task scheduler for rpi.cycleloop programs
+#
+# All station tasks run one after another inside the cycle function, in the
+# order they were added. A task with period N runs every N-th cycle, shifted
+# by its phase, so slow tasks can be spread over different cycles:
+#
+#   scheduler = CycleScheduler(cycletime=10)
+#   scheduler.add("task1", task1_machine.step)
+#   scheduler.add("task2", task2_machine.step, period=2, phase=1)
+#
+#   def main_cycle(cycletools):
+#       scheduler.run_cycle()
+#
+# The gap between two calls is compared with the cycle time. A late call
+# means the cycle loop skipped cycles; those are counted per task as misses.
+
+import time
+
+
+class ScheduledTask:
+    def __init__(self, name, func, period=1, phase=0):
+        if period < 1 or not 0 <= phase < period:
+            raise ValueError(f"task {name}: need period >= 1 and 0 <= phase < period")
+        self.name = name
+        self.func = func
+        self.period = period
+        self.phase = phase
+        self.runs = 0
+        self.missed = 0
+
+
+class CycleScheduler:
+    # cycletime in milliseconds; a gap longer than (1 + tolerance) cycles is a miss
+    def __init__(self, cycletime, tolerance=0.5):
+        self.cycletime = cycletime / 1000.0
+        self.tolerance = tolerance
+        self.tasks = []
+        self.cycle = 0
+        self.missed_cycles = 0
+        self.late_calls = 0
+        self.max_gap = 0.0
+        self.last_start = None
+
+    def add(self, name, func, period=1, phase=0):
+        task = ScheduledTask(name, func, period, phase)
+        self.tasks.append(task)
+        return task
+
+    def _account_gap(self, now):
+        gap = now - self.last_start
+        if gap > self.max_gap:
+            self.max_gap = gap
+        if gap > self.cycletime * (1.0 + self.tolerance):
+            skipped = int(round(gap / self.cycletime)) - 1
+            if skipped > 0:
+                self.late_calls += 1
+                self.missed_cycles += skipped
+                for task in self.tasks:
+                    # number of due slots of this task among the skipped cycles
+                    first = self.cycle - task.phase
+                    due = (first + skipped - 1) // task.period - (first - 1) // task.period
+                    task.missed += due
+                self.cycle += skipped
+
+    # Run all tasks due in this cycle
+    def run_cycle(self):
+        now = time.monotonic()
+        if self.last_start is not None:
+            self._account_gap(now)
+        self.last_start = now
+
+        cycle = self.cycle
+        for task in self.tasks:
+            if (cycle - task.phase) % task.period == 0:
+                task.func()
+                task.runs += 1
+        self.cycle = cycle + 1
+
+    def report(self):
+        lines = [
+            f"scheduler: {self.cycle} cycles, {self.missed_cycles} missed in {self.late_calls} late calls, "
+            f"max gap {self.max_gap * 1000.0:.1f} ms"
+        ]
+        for task in self.tasks:
+            lines.append(
+                f"  {task.name}: period {task.period}, phase {task.phase}, {task.runs} runs, {task.missed} missed"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,104 @@
+# Settle detection: wait until the axes and switches are at rest
+#
+# The station scripts waited a fixed number of cycles (delay_counter, 50 or
+# 100 cycles = 0.5 or 1 s) after homing, around every counter reset, after
+# extending and retracting and before gripping. A SettleDetector ends such a
+# wait as soon as the watched counters and switches have not changed for
+# window cycles. A wait after a counter reset also needs the reset counters to
+# read near 0 (within near counts), so a value read before the reset took
+# effect does not count as settled. The fixed wait it replaces stays as the
+# timeout: a wait never takes longer than before.
+#
+#   settle = SettleDetector(rpi.io, ("Counter_5", "Counter_7", "I_1", "I_4"), window=10,
+#                           cycletime=rpi.cycletime, mode=os.environ.get("REFLECT_SETTLE", "sensor"))
+#
+#   if settle.wait("home", timeout=50):                   # every cycle, True once at rest
+#       ...
+#   if settle.wait("reset", timeout=100, zero=("Counter_5", "Counter_7")):
+#       ...
+#
+# A site names the wait in the statistics: per site the waits, the mean wait,
+# the waits ended by the timeout and the time saved against the fixed wait.
+# count_task() counts the tasks of the station for the time saved per task.
+# Mode "fixed" always waits the full timeout, as the scripts did before.
+
+MODES = ("sensor", "fixed")
+
+COUNTER_MODULO = 4294967296  # RevPi counters are 32 bit unsigned
+
+
+class SettleDetector:
+    def __init__(self, io, signals, window=10, cycletime=10, mode="sensor", near=10, name="settle"):
+        if mode not in MODES:
+            raise ValueError(f"unknown settle mode {mode!r}, expected one of {MODES}")
+        self.io = io
+        self.signals = tuple(signals)
+        self.window = window            # cycles without a change
+        self.cycletime = cycletime      # ms
+        self.mode = mode
+        self.near = near                # counts from 0 that count as reset
+        self.name = name
+        self.site = None                # site of the running wait
+        self.cycles = 0                 # cycles of the running wait
+        self.stable = 0                 # cycles the values did not change
+        self.values = None
+        self.stats = {}                 # site -> [waits, cycles, timeout cycles, ended by the timeout]
+        self.tasks = 0
+
+    def _read(self):
+        return tuple(getattr(self.io, name).value for name in self.signals)
+
+    def _reset_done(self, zero):
+        for name in zero:
+            value = getattr(self.io, name).value % COUNTER_MODULO
+            if self.near < value < COUNTER_MODULO - self.near:
+                return False
+        return True
+
+    # One cycle of the wait at site, True when it is over
+    def wait(self, site, timeout, zero=()):
+        if self.site != site:
+            self.site = site
+            self.cycles = 0
+            self.stable = 0
+            self.values = None
+        self.cycles += 1
+        if self.mode == "fixed":
+            settled = False
+        else:
+            values = self._read()
+            if values == self.values and self._reset_done(zero):
+                self.stable += 1
+            else:
+                self.stable = 0
+                self.values = values
+            settled = self.stable >= self.window
+        if not settled and self.cycles < timeout:
+            return False
+        stats = self.stats.setdefault(site, [0, 0, 0, 0])
+        stats[0] += 1
+        stats[1] += self.cycles
+        stats[2] += timeout
+        stats[3] += not settled and self.mode == "sensor"
+        self.site = None
+        return True
+
+    def count_task(self):
+        self.tasks += 1
+
+    def saved(self):
+        return sum(timeout - cycles for _, cycles, timeout, _ in self.stats.values()) * self.cycletime / 1000.0
+
+    def report(self):
+        if not self.stats:
+            return f"{self.name} settle ({self.mode}): no waits"
+        lines = [f"{self.name} settle ({self.mode}, window {self.window} cycles):"]
+        for site, (waits, cycles, timeout, timeouts) in self.stats.items():
+            lines.append(
+                f"  {site:12s} {waits:5d} waits, mean {cycles / waits * self.cycletime:6.0f} ms "
+                f"of {timeout / waits * self.cycletime:5.0f} ms, {timeouts} ended by the timeout"
+            )
+        saved = self.saved()
+        per_task = f", {saved / self.tasks:.2f} s per task" if self.tasks else ""
+        lines.append(f"  saved {saved:.1f} s against the fixed waits{per_task} ({self.tasks} tasks)")
+        return "\n".join(lines)
@@ -0,0 +1,19 @@
+# Simulated RevPi process image with a virtual clock and plant models
+
+from .plants import PLANTS, GripperPlant, HighBayWarehousePlant, MultiPlant, SortingLinePlant
+from .revpi import LockstepClock, SimRevPiModIO, VirtualClock
+from .runner import LineStation, run_line, run_script
+
+__all__ = [
+    "PLANTS",
+    "GripperPlant",
+    "HighBayWarehousePlant",
+    "LineStation",
+    "LockstepClock",
+    "MultiPlant",
+    "SortingLinePlant",
+    "SimRevPiModIO",
+    "VirtualClock",
+    "run_line",
+    "run_script",
+]
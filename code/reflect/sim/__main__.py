@@ -0,0 +1,55 @@
+# Command line entry point:
+#   cd code && python -m reflect.sim modbus/gripper.py --seconds 600 --quiet
+
+import argparse
+import os
+
+from .plants import PLANTS
+from .runner import plant_for_script, run_script
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a REFLECT station script against a plant model")
+    parser.add_argument("script", help="station script, e.g. modbus/gripper.py")
+    parser.add_argument("--plant", choices=sorted(PLANTS), help="plant model (default: from script name)")
+    parser.add_argument("--cycles", type=int, help="stop after this many cycles")
+    parser.add_argument("--seconds", type=float, help="stop after this much simulated time")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the plant model")
+    parser.add_argument("--quiet", action="store_true", help="discard the script's output")
+    parser.add_argument("--realtime", action="store_true", help="run the cycles at wall-clock speed")
+    parser.add_argument(
+        "--modbus-bridge", metavar="HOST:PORT",
+        help="exchange the Modbus words through reflect.modbus_bridge instead of the plant handshake",
+    )
+    args = parser.parse_args(argv)
+
+    if args.cycles is None and args.seconds is None:
+        args.seconds = 60.0
+
+    if args.plant:
+        plant = PLANTS[args.plant](seed=args.seed)
+    else:
+        plant = plant_for_script(args.script, seed=args.seed)
+
+    links = []
+    if args.modbus_bridge:
+        from ..modbus_bridge import BridgeClient, ProcessImageLink
+
+        host, _, port = args.modbus_bridge.rpartition(":")
+        station = os.path.splitext(os.path.basename(args.script))[0]
+        client = BridgeClient(station, host or "127.0.0.1", int(port))
+        links.append(ProcessImageLink(client))
+        # the neighbouring stations answer now, not the plant model
+        plant.handshake = False
+
+    run = run_script(
+        args.script, plant=plant, cycles=args.cycles, seconds=args.seconds, quiet=args.quiet,
+        realtime=args.realtime, links=links,
+    )
+    print(run.summary())
+    for link in links:
+        print(f"Modbus bridge: {link.client.requests} requests, {link.client.errors} errors")
+
+
+if __name__ == "__main__":
+    main()
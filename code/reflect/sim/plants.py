@@ -0,0 +1,296 @@
+# Plant models for the simulated RevPi
+#
+# Every plant reads the outputs written by a station script and updates the
+# inputs (switches, light barriers, encoder counters, analog values) for the
+# next cycle. The models are deliberately coarse: they reproduce the signal
+# sequences the station code waits for, not the exact mechanics.
+
+import random
+
+
+# Motor driven axis with a reference switch at position 0
+class Axis:
+    def __init__(self, forward, backward, speed, length, position=0.0, coast_time=0.0):
+        self.forward = forward          # output name driving towards +length
+        self.backward = backward        # output name driving towards 0
+        self.speed = speed              # units per second while driven
+        self.length = length            # travel range [0, length]
+        self.position = position
+        self.velocity = 0.0
+        self.coast_time = coast_time    # time constant of the run-out after switching off
+
+    def step(self, values, dt):
+        command = (1 if values[self.forward] else 0) - (1 if values[self.backward] else 0)
+        if command:
+            self.velocity = command * self.speed
+        elif self.coast_time > 0.0:
+            # first order run-out, the motor keeps turning for a moment
+            self.velocity *= self.coast_time / (self.coast_time + dt)
+            if abs(self.velocity) < 0.01 * self.speed:
+                self.velocity = 0.0
+        else:
+            self.velocity = 0.0
+
+        self.position += self.velocity * dt
+        if self.position <= 0.0:
+            self.position = 0.0
+            self.velocity = 0.0
+        elif self.position >= self.length:
+            self.position = self.length
+            self.velocity = 0.0
+
+    def at_start(self, window=1.0):
+        return self.position <= window
+
+    def at_end(self, window=1.0):
+        return self.position >= self.length - window
+
+    def near(self, target, window):
+        return abs(self.position - target) <= window
+
+
+class Plant:
+    inputs = ()
+    outputs = ()
+    counters = ()
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.rpi = None
+
+    def attach(self, rpi):
+        self.rpi = rpi
+
+    def step(self, io, dt, now):
+        pass
+
+
+# Gripper robot: three encoder axes with home switches, compressor and magnet
+class GripperPlant(Plant):
+    inputs = ("I_1", "I_2", "I_3", "Input_Word_1", "Input_Word_1_i05")
+    outputs = ("O_7", "O_8", "O_9", "O_10", "O_11", "O_12", "O_13", "O_14",
+               "Output_Word_1", "Output_Word_2")
+    counters = ("Counter_5", "Counter_7", "Counter_9")
+
+    # handshake=True answers the Modbus requests like HBW and multistation would
+    def __init__(self, seed=0, handshake=True, speed=800.0, coast_time=0.01):
+        super().__init__(seed)
+        self.handshake = handshake
+        # axis 3 (vertical), axis 2 (reach), axis 1 (rotation), in encoder counts
+        self.vertical = Axis("O_8", "O_7", speed, 2000.0, 150.0, coast_time)
+        self.reach = Axis("O_10", "O_9", speed, 2000.0, 250.0, coast_time)
+        self.rotation = Axis("O_12", "O_11", speed, 3000.0, 400.0, coast_time)
+        self.request_since = None
+
+    def step(self, io, dt, now):
+        values = io.values
+        for axis in (self.vertical, self.reach, self.rotation):
+            axis.step(values, dt)
+
+        values["I_1"] = 1 if self.vertical.at_start() else 0
+        values["I_2"] = 1 if self.reach.at_start() else 0
+        values["I_3"] = 1 if self.rotation.at_start() else 0
+        io["Counter_5"].update(self.vertical.position)
+        io["Counter_7"].update(self.reach.position)
+        io["Counter_9"].update(self.rotation.position)
+
+        if self.handshake:
+            # storage confirms a request one second after it was sent
+            if values["Output_Word_1"]:
+                if self.request_since is None:
+                    self.request_since = now
+                values["Input_Word_1"] = 1 if now - self.request_since >= 1.0 else 0
+            else:
+                self.request_since = None
+                values["Input_Word_1"] = 0
+            values["Input_Word_1_i05"] = 1
+
+
+# High-bay warehouse: x/y encoder axes, cantilever arm and pallet belt
+class HighBayWarehousePlant(Plant):
+    inputs = ("I_1", "I_2", "I_3", "I_4", "I_9", "I_10", "Input_1", "Input_2")
+    outputs = ("O_1", "O_2", "O_3", "O_4", "O_5", "O_6", "O_7", "O_8", "Output_1")
+    counters = ("Counter_5", "Counter_7")
+
+    # handshake=True plays the gripper side: request a slot, pick up, release
+    def __init__(self, seed=0, handshake=True, speed=800.0, coast_time=0.01):
+        super().__init__(seed)
+        self.handshake = handshake
+        self.x = Axis("O_3", "O_4", speed, 4000.0, 300.0, coast_time)
+        self.y = Axis("O_5", "O_6", speed, 2000.0, 200.0, coast_time)
+        self.arm = Axis("O_7", "O_8", 1.0, 1.5, 0.0)          # seconds of travel
+        self.belt = Axis("O_1", "O_2", 0.25, 1.0, 0.0)        # pallet position
+        self.next_slot = 1
+        self.phase = 0
+        self.phase_since = 0.0
+
+    def step(self, io, dt, now):
+        values = io.values
+        for axis in (self.x, self.y, self.arm, self.belt):
+            axis.step(values, dt)
+
+        values["I_1"] = 1 if self.x.at_start() else 0
+        values["I_4"] = 1 if self.y.at_start() else 0
+        values["I_10"] = 1 if self.arm.at_start(0.01) else 0
+        values["I_9"] = 1 if self.arm.at_end(0.01) else 0
+        # light barriers are active low
+        values["I_2"] = 0 if self.belt.at_start(0.05) else 1
+        values["I_3"] = 0 if self.belt.at_end(0.05) else 1
+        io["Counter_5"].update(self.x.position)
+        io["Counter_7"].update(self.y.position)
+
+        if self.handshake:
+            self._gripper(values, now)
+
+    def _gripper(self, values, now):
+        if self.phase == 0 and now - self.phase_since >= 1.0:
+            # request the next slot
+            values["Input_1"] = self.next_slot
+            values["Input_2"] = 0
+            self.next_slot = self.next_slot % 9 + 1
+            self.phase, self.phase_since = 1, now
+        elif self.phase == 1 and values["Output_1"] == 1:
+            self.phase, self.phase_since = 2, now
+        elif self.phase == 2 and now - self.phase_since >= 3.0:
+            # pallet taken, request reset
+            values["Input_1"] = 0
+            self.phase, self.phase_since = 3, now
+        elif self.phase == 3 and now - self.phase_since >= 2.0:
+            # release the pallet
+            values["Input_2"] = 1
+            self.phase, self.phase_since = 4, now
+        elif self.phase == 4 and values["Output_1"] == 0 and now - self.phase_since >= 1.0:
+            self.phase, self.phase_since = 0, now
+
+
+# Multi-processing station: oven with slider, vacuum gripper, turntable, saw and belt
+class MultiPlant(Plant):
+    inputs = ("I_1", "I_2", "I_3", "I_4", "I_5", "I_6", "I_7", "I_8", "I_9")
+    outputs = ("O_1", "O_2", "O_3", "O_4", "O_5", "O_6", "O_7", "O_8", "O_9",
+               "O_10", "O_11", "O_12", "O_13", "O_14", "Output_1")
+
+    # feed=True places a workpiece on the open oven slider like the gripper does
+    def __init__(self, seed=0, feed=True, feed_delay=2.0):
+        super().__init__(seed)
+        self.feed = feed
+        self.feed_delay = feed_delay
+        self.slider = Axis("O_6", "O_5", 0.5, 1.0, 0.0)
+        self.vacuum = Axis("O_7", "O_8", 0.5, 1.0, 0.0)
+        self.table = Axis("O_1", "O_2", 0.5, 2.0, 0.0)
+        self.on_slider = False
+        self.on_vacuum = False
+        self.on_table = False
+        self.belt_position = None
+        self.ready_since = None
+
+    def step(self, io, dt, now):
+        values = io.values
+        for axis in (self.slider, self.vacuum, self.table):
+            axis.step(values, dt)
+
+        slider_out = self.slider.at_end(0.02)
+        vacuum_at_oven = self.vacuum.at_end(0.02)
+        vacuum_at_table = self.vacuum.at_start(0.02)
+        table_at_vacuum = self.table.at_start(0.02)
+        table_at_belt = self.table.at_end(0.02)
+
+        # gripper drops a workpiece onto the open slider once the vacuum gripper is gone
+        free = not (self.on_slider or self.on_vacuum or vacuum_at_oven)
+        if self.feed and slider_out and values["O_13"] and free:
+            if self.ready_since is None:
+                self.ready_since = now
+            elif now - self.ready_since >= self.feed_delay:
+                self.on_slider = True
+        else:
+            self.ready_since = None
+
+        # vacuum gripper picks up and releases
+        lowered = values["O_12"] == 1
+        if lowered and values["O_11"] and vacuum_at_oven and slider_out and self.on_slider:
+            self.on_slider = False
+            self.on_vacuum = True
+        elif lowered and not values["O_11"] and self.on_vacuum and vacuum_at_table:
+            self.on_vacuum = False
+            self.on_table = table_at_vacuum
+
+        # ejector pushes the workpiece onto the belt
+        if values["O_14"] and self.on_table and table_at_belt:
+            self.on_table = False
+            self.belt_position = 0.0
+        if self.belt_position is not None and values["O_3"]:
+            self.belt_position += 0.5 * dt
+            if self.belt_position >= 1.3:
+                self.belt_position = None
+
+        values["I_1"] = 1 if table_at_vacuum else 0
+        values["I_4"] = 1 if self.table.near(1.0, 0.02) else 0
+        values["I_2"] = 1 if table_at_belt else 0
+        values["I_3"] = 0 if self.belt_position is not None and self.belt_position >= 1.0 else 1
+        values["I_5"] = 1 if vacuum_at_table else 0
+        values["I_8"] = 1 if vacuum_at_oven else 0
+        values["I_6"] = 1 if self.slider.at_start(0.02) else 0
+        values["I_7"] = 1 if slider_out else 0
+        values["I_9"] = 0 if self.on_slider and slider_out else 1
+
+
+# Sorting line: conveyor with color sensor, light barrier and three ejectors
+class SortingLinePlant(Plant):
+    inputs = ("I_1", "I_2", "I_3", "I_4", "I_5", "I_6", "AnalogInput_1")
+    outputs = ("O_1", "O_2", "O_3", "O_4", "O_5")
+
+    # belt positions in seconds of travel at full speed
+    COLOR_SENSOR = (0.95, 1.25)
+    LIGHT_BARRIER = 1.5
+    EJECTORS = {"O_3": (2.1, "I_4"), "O_4": (3.0, "I_5"), "O_5": (4.0, "I_6")}
+    BELT_END = 5.0
+    COLORS = {"white": 3500, "red": 6000, "blue": 6700}
+    BACKGROUND = 7500
+
+    def __init__(self, seed=0, feed=True, feed_interval=(8.0, 15.0), noise=40.0):
+        super().__init__(seed)
+        self.feed = feed
+        self.feed_interval = feed_interval
+        self.noise = noise
+        self.pieces = []            # [position, color value]
+        self.bin_until = {"I_4": 0.0, "I_5": 0.0, "I_6": 0.0}
+        self.next_feed = 0.0
+
+    def step(self, io, dt, now):
+        values = io.values
+        if values["O_1"]:
+            for piece in self.pieces:
+                piece[0] += dt
+        self.pieces = [piece for piece in self.pieces if piece[0] < self.BELT_END]
+
+        for output, (position, bin_input) in self.EJECTORS.items():
+            if values[output]:
+                for piece in self.pieces:
+                    if abs(piece[0] - position) <= 0.15:
+                        self.pieces.remove(piece)
+                        self.bin_until[bin_input] = now + 0.5
+                        break
+
+        if self.feed and now >= self.next_feed and not any(p[0] < 0.2 for p in self.pieces):
+            color = self.rng.choice(list(self.COLORS.values()))
+            self.pieces.append([0.0, color])
+            self.next_feed = now + self.rng.uniform(*self.feed_interval)
+
+        color = self.BACKGROUND
+        for position, value in self.pieces:
+            if self.COLOR_SENSOR[0] <= position <= self.COLOR_SENSOR[1]:
+                color = value
+        values["AnalogInput_1"] = int(color + self.rng.gauss(0.0, self.noise))
+
+        values["I_1"] = 1
+        values["I_2"] = 0 if any(p[0] < 0.05 for p in self.pieces) else 1
+        values["I_3"] = 0 if any(abs(p[0] - self.LIGHT_BARRIER) <= 0.05 for p in self.pieces) else 1
+        for bin_input, until in self.bin_until.items():
+            values[bin_input] = 0 if now < until else 1
+
+
+PLANTS = {
+    "gripper": GripperPlant,
+    "high_bay_warehouse": HighBayWarehousePlant,
+    "multi": MultiPlant,
+    "sorting_line": SortingLinePlant,
+}
@@ -0,0 +1,242 @@
+# Simulated RevPiModIO
+#
+# Drop-in replacement for the parts of revpimodio2 used by the station scripts:
+# rpi.io.<name>.value, Counter_X.reset(), rpi.cycletime, rpi.cycleloop(),
+# rpi.handlesignalend() and rpi.exit(). Instead of a wall-clock cycle the loop
+# advances a virtual clock by one cycle time per call and lets a plant model
+# update the inputs from the outputs written by the program.
+
+import threading
+import time
+import types
+
+COUNTER_MODULO = 4294967296  # RevPi counters are 32 bit unsigned
+
+# IO types (same values as revpimodio2.INP / revpimodio2.OUT)
+INP = 300
+OUT = 301
+
+
+# Virtual time base, advanced by the cycle loop
+class VirtualClock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+# Virtual time base shared by the stations of a line, one thread each
+#
+# Every station calls advance() at the end of its cycle and waits there until
+# all stations have finished the cycle; the last one moves the clock on. So
+# all stations see the same time in every cycle, as on a line of RevPis with
+# the same cycle time. A station whose script ended leaves the lockstep.
+# speed=None runs as fast as possible, otherwise the ticks are paced to
+# speed times the wall clock.
+class LockstepClock(VirtualClock):
+    def __init__(self, parties, start=0.0, speed=None):
+        super().__init__(start)
+        self.parties = parties
+        self.speed = speed
+        self.arrived = 0
+        self.step = None                # dt of the current tick
+        self.ticks = 0
+        self.condition = threading.Condition()
+        self._wall_start = None
+
+    def advance(self, seconds):
+        with self.condition:
+            if self.step is None:
+                self.step = seconds
+            elif abs(seconds - self.step) > 1e-9:
+                raise ValueError(f"the stations of a line need one cycle time, got {self.step} and {seconds} s")
+            self.arrived += 1
+            if self.arrived >= self.parties:
+                self._tick()
+                return
+            ticks = self.ticks
+            while ticks == self.ticks:
+                self.condition.wait()
+
+    def leave(self):
+        with self.condition:
+            self.parties -= 1
+            if self.parties and self.arrived >= self.parties:
+                self._tick()
+
+    def _tick(self):
+        self.now += self.step
+        self.step = None
+        self.arrived = 0
+        self.ticks += 1
+        if self.speed is not None:
+            if self._wall_start is None:
+                self._wall_start = time.perf_counter() - self.now / self.speed
+            delay = self._wall_start + self.now / self.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self.condition.notify_all()
+
+
+# One entry of the process image
+class SimIO:
+    def __init__(self, image, name, iotype, value=0):
+        self._image = image
+        self.name = name
+        self.type = iotype
+        image.values[name] = value
+
+    @property
+    def value(self):
+        return self._image.values[self.name]
+
+    @value.setter
+    def value(self, value):
+        self._image.values[self.name] = value
+
+    def get_value(self):
+        return self._image.values[self.name]
+
+    def set_value(self, value):
+        self._image.values[self.name] = value
+
+    def __repr__(self):
+        return f"<SimIO {self.name}={self.value}>"
+
+
+# Encoder input: reading returns the position since the last reset, wrapped to 32 bit
+class SimCounter(SimIO):
+    def __init__(self, image, name, value=0):
+        super().__init__(image, name, INP, value)
+        self.offset = 0
+
+    def reset(self):
+        self.offset = self._image.raw.get(self.name, 0)
+        self._image.values[self.name] = 0
+
+    def update(self, raw):
+        self._image.raw[self.name] = raw
+        self._image.values[self.name] = int(round(raw - self.offset)) % COUNTER_MODULO
+
+
+# Container behind rpi.io (attribute access, iteration and lookup by name)
+class SimIOList:
+    def __init__(self):
+        object.__setattr__(self, "values", {})
+        object.__setattr__(self, "raw", {})
+        object.__setattr__(self, "_ios", {})
+
+    def add(self, io):
+        self._ios[io.name] = io
+        return io
+
+    def __getattr__(self, name):
+        try:
+            return self._ios[name]
+        except KeyError:
+            raise AttributeError(f"Can not find IO '{name}' in simulated process image") from None
+
+    def __getitem__(self, name):
+        return self._ios[name]
+
+    def __contains__(self, name):
+        return name in self._ios
+
+    def __iter__(self):
+        return iter(self._ios.values())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("direct assignment is not supported, use .value")
+
+
+# Object handed to the cycle function, mirrors revpimodio2.helper.Cycletools
+class SimCycletools:
+    def __init__(self, cycletime_ms):
+        self.first = True
+        self.last = False
+        self.var = types.SimpleNamespace()
+        self.cycletime = cycletime_ms
+
+
+class SimRevPiModIO:
+    def __init__(self, plant, clock=None, max_cycles=None, max_seconds=None, autorefresh=True,
+                 realtime=False, **kwargs):
+        self.plant = plant
+        self.clock = clock if clock is not None else VirtualClock()
+        self.max_cycles = max_cycles
+        self.max_seconds = max_seconds
+        self.autorefresh = autorefresh
+        self.realtime = realtime        # pace the virtual clock to the wall clock
+        self.links = []                 # objects with exchange(io), called every cycle before the program
+        self.observers = []             # objects with observe(rpi, cycletools), called after the program
+        self._wall_start = None
+        self.cycletime = 20  # revpimodio2 default
+        self.cycles = 0
+        self.io = SimIOList()
+        self._exit = False
+        self._signal_handler = None
+
+        for name in plant.inputs:
+            self.io.add(SimIO(self.io, name, INP))
+        for name in plant.outputs:
+            self.io.add(SimIO(self.io, name, OUT))
+        for name in plant.counters:
+            self.io.add(SimCounter(self.io, name))
+        plant.attach(self)
+
+    def handlesignalend(self, cleanupfunc=None):
+        self._signal_handler = cleanupfunc
+
+    def exit(self, full=True):
+        self._exit = True
+
+    def _limit_reached(self):
+        if self.max_cycles is not None and self.cycles >= self.max_cycles:
+            return True
+        if self.max_seconds is not None and self.clock.now >= self.max_seconds - 1e-9:
+            return True
+        return False
+
+    # Run one cycle: plant update (inputs), links, program call (outputs), observers, advance clock
+    def step(self, func, cycletools):
+        dt = cycletools.cycletime / 1000.0
+        self.plant.step(self.io, dt, self.clock.now)
+        for link in self.links:
+            link.exchange(self.io)
+        result = func(cycletools)
+        for observer in self.observers:
+            observer.observe(self, cycletools)
+        cycletools.first = False
+        self.cycles += 1
+        self.clock.advance(dt)
+        if self.realtime:
+            self._pace()
+        return result
+
+    # Sleep until the wall clock has caught up with the virtual clock
+    def _pace(self):
+        if self._wall_start is None:
+            self._wall_start = time.perf_counter() - self.clock.now
+        delay = self._wall_start + self.clock.now - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def cycleloop(self, func, cycletime=50, blocking=True):
+        cycletools = SimCycletools(cycletime)
+        result = None
+        while not self._exit:
+            if self._limit_reached():
+                break
+            result = self.step(func, cycletools)
+            if result is not None:
+                break
+
+        # End of a simulated run behaves like SIGINT/SIGTERM on the RevPi
+        if self._signal_handler is not None and not self._exit:
+            self._signal_handler()
+        self._exit = True
+        return result
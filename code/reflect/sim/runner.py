@@ -0,0 +1,187 @@
+# Run an unchanged station script against the simulated RevPi
+#
+# A stand-in "revpimodio2" module is placed in sys.modules and time.monotonic
+# is bound to the virtual clock, so timers in the scripts follow simulated
+# time. time.time_ns starts at the wall clock and then follows the virtual
+# clock too, so traffic captures carry simulated timestamps. The run ends after the given number of cycles or virtual seconds and
+# then calls the handler registered with rpi.handlesignalend(), as a SIGTERM
+# would on the device.
+
+import contextlib
+import os
+import runpy
+import sys
+import threading
+import time
+import types
+
+from .plants import PLANTS
+from .revpi import INP, OUT, LockstepClock, SimRevPiModIO, VirtualClock
+
+
+class SimRun:
+    def __init__(self, script, plant, clock):
+        self.script = script
+        self.plant = plant
+        self.clock = clock
+        self.instances = []
+        self.namespace = None
+        self.wall_seconds = 0.0
+        self.error = None
+
+    @property
+    def rpi(self):
+        return self.instances[-1] if self.instances else None
+
+    @property
+    def cycles(self):
+        return sum(rpi.cycles for rpi in self.instances)
+
+    def summary(self):
+        cycles = self.cycles
+        rate = cycles / self.wall_seconds if self.wall_seconds > 0 else 0.0
+        speedup = self.clock.now / self.wall_seconds if self.wall_seconds > 0 else 0.0
+        return (
+            f"{os.path.basename(self.script)}: {cycles} cycles, "
+            f"{self.clock.now:.1f} s simulated in {self.wall_seconds:.2f} s "
+            f"({rate:.0f} cycles/s, {speedup:.0f}x real time)"
+        )
+
+
+# Build the module object that replaces revpimodio2 for one run
+def make_revpimodio2(run, max_cycles=None, max_seconds=None, realtime=False, links=(), observers=()):
+    module = types.ModuleType("revpimodio2")
+    module.INP = INP
+    module.OUT = OUT
+
+    def RevPiModIO(*args, **kwargs):
+        rpi = SimRevPiModIO(
+            run.plant, run.clock, max_cycles=max_cycles, max_seconds=max_seconds, realtime=realtime, **kwargs
+        )
+        rpi.links.extend(links)
+        rpi.observers.extend(observers)
+        run.instances.append(rpi)
+        return rpi
+
+    module.RevPiModIO = RevPiModIO
+    return module
+
+
+def plant_for_script(script, seed=0, **options):
+    name = os.path.splitext(os.path.basename(script))[0]
+    if name not in PLANTS:
+        raise ValueError(f"No plant model for '{name}', choose one of {sorted(PLANTS)}")
+    return PLANTS[name](seed=seed, **options)
+
+
+@contextlib.contextmanager
+def simulated_revpi(module, clock):
+    saved_module = sys.modules.get("revpimodio2")
+    saved_monotonic = time.monotonic
+    saved_time_ns = time.time_ns
+    epoch_ns = time.time_ns()
+    sys.modules["revpimodio2"] = module
+    time.monotonic = clock.monotonic
+    time.time_ns = lambda: epoch_ns + int(clock.now * 1e9)
+    try:
+        yield
+    finally:
+        time.monotonic = saved_monotonic
+        time.time_ns = saved_time_ns
+        if saved_module is None:
+            sys.modules.pop("revpimodio2", None)
+        else:
+            sys.modules["revpimodio2"] = saved_module
+
+
+# Execute a station script as __main__ against a plant model
+#
+# realtime=True paces the virtual clock to the wall clock, links are called
+# every cycle with the process image (e.g. reflect.modbus_bridge.ProcessImageLink)
+# and observers after the program (e.g. reflect.dataset.CycleLog).
+def run_script(script, plant=None, cycles=None, seconds=None, seed=0, quiet=False, realtime=False, links=(),
+               observers=()):
+    if cycles is None and seconds is None:
+        raise ValueError("Limit the run with cycles or seconds")
+
+    clock = VirtualClock()
+    if plant is None:
+        plant = plant_for_script(script, seed=seed)
+    run = SimRun(script, plant, clock)
+    module = make_revpimodio2(
+        run, max_cycles=cycles, max_seconds=seconds, realtime=realtime, links=links, observers=observers
+    )
+
+    output = open(os.devnull, "w") if quiet else contextlib.nullcontext(sys.stdout)
+    with output as stream, contextlib.redirect_stdout(stream), simulated_revpi(module, clock):
+        start = time.perf_counter()
+        run.namespace = runpy.run_path(script, run_name="__main__")
+        run.wall_seconds = time.perf_counter() - start
+    return run
+
+
+# One station of a line: script, plant (default: from the script name) and
+# the links and observers of its process image
+class LineStation:
+    def __init__(self, script, plant=None, seed=0, links=(), observers=()):
+        self.script = script
+        self.plant = plant if plant is not None else plant_for_script(script, seed=seed)
+        self.links = list(links)
+        self.observers = list(observers)
+
+
+# Execute the station scripts of a line together, each in its own thread,
+# cycle by cycle on one LockstepClock
+#
+# The scripts share the process: one stand-in revpimodio2 module hands every
+# script the process image of its own plant, time.monotonic follows the
+# common clock and time.time_ns starts at the wall clock and then follows the
+# common clock too, so traffic captures carry simulated timestamps. speed=None
+# runs as fast as possible, 1.0 in real time (e.g. for OPC UA, whose timeouts
+# run on time.monotonic as well). Returns one SimRun per station.
+def run_line(stations, seconds, speed=None, quiet=True):
+    clock = LockstepClock(len(stations), speed=speed)
+    runs = [SimRun(station.script, station.plant, clock) for station in stations]
+    current = threading.local()
+
+    module = types.ModuleType("revpimodio2")
+    module.INP = INP
+    module.OUT = OUT
+
+    def RevPiModIO(*args, **kwargs):
+        run, station = current.run, current.station
+        rpi = SimRevPiModIO(run.plant, clock, max_seconds=seconds, **kwargs)
+        rpi.links.extend(station.links)
+        rpi.observers.extend(station.observers)
+        run.instances.append(rpi)
+        return rpi
+
+    module.RevPiModIO = RevPiModIO
+
+    def execute(run, station):
+        current.run, current.station = run, station
+        path = os.path.abspath(run.script)
+        start = time.perf_counter()
+        try:
+            with open(path) as f:
+                code = compile(f.read(), path, "exec")
+            # not runpy: it swaps sys.modules["__main__"] and sys.argv, which the threads share
+            run.namespace = {"__name__": "__main__", "__file__": path}
+            exec(code, run.namespace)
+        except BaseException as error:
+            run.error = error
+        finally:
+            run.wall_seconds = time.perf_counter() - start
+            clock.leave()
+
+    output = open(os.devnull, "w") if quiet else contextlib.nullcontext(sys.stdout)
+    with output as stream, contextlib.redirect_stdout(stream), simulated_revpi(module, clock):
+        threads = [
+            threading.Thread(target=execute, args=(run, station), name=os.path.basename(run.script), daemon=True)
+            for run, station in zip(runs, stations)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return runs
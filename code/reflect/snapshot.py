@@ -0,0 +1,134 @@
+# Consistent snapshots between the OPC UA thread and the cycle loop
+#
+# The shared data objects used to be plain objects written field by field from
+# the asyncio thread and read from the cycle thread, so a cycle could see one
+# field already updated and the other one still stale. Here every direction is
+# a SnapshotChannel with exactly one writer:
+#
+#   - the writer sets fields in a private staging array and publishes them as
+#     a whole frame,
+#   - the reader copies one complete frame, typically once per cycle.
+#
+# A channel keeps two buffers and a sequence number (a seqlock). publish()
+# fills the buffer the readers are not using and then switches over by
+# increasing the sequence number, so readers never wait for the writer. A
+# reader only copies again if the writer published twice during its copy.
+# No locks are taken on either side.
+#
+# SharedData combines a channel towards the cycle and one from the cycle and
+# gives each side an attribute view:
+#
+#   shared_data = SharedData(received={"target_pos_index": 0}, sent={"ready": 0})
+#
+#   # cycle thread
+#   cycle_data = shared_data.cycle
+#   cycle_data.refresh()                   # take the latest frame
+#   if cycle_data.target_pos_index != 0:
+#       cycle_data.ready = 1               # staged ...
+#   cycle_data.publish()                   # ... and published with the frame
+#
+#   # OPC UA thread: shared_data.opcua, the same with the directions swapped
+
+from array import array
+from collections import namedtuple
+
+
+class SnapshotChannel:
+    def __init__(self, fields, typecode="q"):
+        self.fields = tuple(fields)
+        self.index = {name: i for i, name in enumerate(self.fields)}
+        self.frame_type = namedtuple("Frame", self.fields)
+        initial = [fields[name] for name in self.fields] if isinstance(fields, dict) else [0] * len(self.fields)
+        self.buffers = (array(typecode, initial), array(typecode, initial))
+        self.staging = array(typecode, initial)
+        self.seq = 0            # even: buffers[seq // 2 % 2] is the current frame, odd: publishing
+        self.dirty = False
+        self.retries = 0        # reader copies repeated because the writer overtook them
+
+    # --- writer side ---
+
+    def set(self, name, value):
+        slot = self.index[name]
+        if self.staging[slot] != value:
+            self.staging[slot] = value
+            self.dirty = True
+
+    def staged(self, name):
+        return self.staging[self.index[name]]
+
+    # Make the staged fields the current frame; returns the frame number
+    def publish(self, force=False):
+        seq = self.seq
+        if not (self.dirty or force):
+            return seq // 2
+        back = self.buffers[(seq // 2 + 1) % 2]
+        self.seq = seq + 1
+        back[:] = self.staging
+        self.seq = seq + 2
+        self.dirty = False
+        return (seq + 2) // 2
+
+    # --- reader side ---
+
+    # Copy of the current frame as a named tuple
+    def read(self):
+        while True:
+            base = self.seq & ~1
+            values = self.buffers[base // 2 % 2].tolist()
+            # the buffer just copied is only reused by the second publish after base
+            if self.seq - base < 3:
+                return self.frame_type._make(values)
+            self.retries += 1
+
+    @property
+    def frame_number(self):
+        return self.seq // 2
+
+
+# Attribute access for one side: fields of the incoming channel come from the
+# last refreshed frame, fields of the outgoing channel are staged for publish()
+class SharedView:
+    def __init__(self, owner, incoming, outgoing):
+        object.__setattr__(self, "_owner", owner)
+        object.__setattr__(self, "_incoming", incoming)
+        object.__setattr__(self, "_outgoing", outgoing)
+        object.__setattr__(self, "_frame", incoming.read())
+
+    def __getattr__(self, name):
+        if name in self._outgoing.index:
+            return self._outgoing.staged(name)
+        if name in self._incoming.index:
+            return getattr(self._frame, name)
+        return getattr(self._owner, name)
+
+    def __setattr__(self, name, value):
+        if name in self._outgoing.index:
+            self._outgoing.set(name, value)
+        elif name in self._incoming.index:
+            raise AttributeError(f"{name} is written by the other side")
+        else:
+            setattr(self._owner, name, value)
+
+    # Frame taken by the last refresh()
+    @property
+    def frame(self):
+        return self._frame
+
+    # Take the latest frame of the incoming channel
+    def refresh(self):
+        object.__setattr__(self, "_frame", self._incoming.read())
+        return self._frame
+
+    # Publish the staged fields if any of them changed
+    def publish(self):
+        return self._outgoing.publish()
+
+
+class SharedData:
+    # received: fields written by the OPC UA thread, sent: fields written by the cycle
+    def __init__(self, received, sent, typecode="q"):
+        self.received = SnapshotChannel(received, typecode)
+        self.sent = SnapshotChannel(sent, typecode)
+        self.is_running = True
+        self.cycle = SharedView(self, self.received, self.sent)
+        self.opcua = SharedView(self, self.sent, self.received)
@@ -0,0 +1,169 @@
+# Declarative state machines for the station cycle programs
+#
+# States are declared once and get a small integer index. compile() turns the
+# declaration into flat lists indexed by state number (guarded transitions,
+# during/entry/exit actions), so one cycle costs a list lookup plus the work
+# of the active state, independent of how many states the station has.
+#
+#   sm = StateMachine("gripper")
+#   IDLE = sm.state("IDLE")
+#   MOVE = sm.state("MOVE")
+#   sm.transition(IDLE, MOVE, guard=lambda m: rpi.io.I_1.value == 1)
+#   sm.after(MOVE, IDLE, cycles=50)
+#
+#   machine = sm.compile(cycletools.var, initial=IDLE)
+#   machine.step()          # once per cycle
+
+import time
+
+
+class StateMachineError(Exception):
+    pass
+
+
+class StateMachine:
+    def __init__(self, name):
+        self.name = name
+        self.names = []
+        self.index = {}
+        self.transitions = []       # (source, target, guard, action)
+        self.during_actions = {}
+        self.enter_actions = {}
+        self.exit_actions = {}
+        self.declared_targets = {}  # successors a during action may return
+        self._tables = None
+
+    # Declare a state and return its index
+    def state(self, name, on_enter=None, on_exit=None):
+        if name in self.index:
+            raise StateMachineError(f"{self.name}: state '{name}' declared twice")
+        number = len(self.names)
+        self.names.append(name)
+        self.index[name] = number
+        if on_enter is not None:
+            self.enter_actions[number] = on_enter
+        if on_exit is not None:
+            self.exit_actions[number] = on_exit
+        self._tables = None
+        return number
+
+    # Guarded transition, checked in declaration order before the during action
+    def transition(self, source, target, guard=None, action=None):
+        self.transitions.append((source, target, guard or (lambda m: True), action))
+        self._tables = None
+
+    # Timer transition after a number of cycles or seconds spent in the state
+    def after(self, source, target, cycles=None, seconds=None, action=None):
+        if (cycles is None) == (seconds is None):
+            raise StateMachineError(f"{self.name}: give either cycles or seconds")
+        if cycles is not None:
+            guard = lambda m: m.ticks >= cycles
+        else:
+            guard = lambda m: m.elapsed() >= seconds
+        self.transition(source, target, guard, action)
+
+    # Decorator: action run every cycle while the state is active. It may
+    # return the index of the next state; targets lists those for tooling.
+    def during(self, state, targets=()):
+        def register(func):
+            self.during_actions[state] = func
+            self.declared_targets[state] = tuple(targets)
+            self._tables = None
+            return func
+
+        return register
+
+    def on_enter(self, state):
+        def register(func):
+            self.enter_actions[state] = func
+            self._tables = None
+            return func
+
+        return register
+
+    def on_exit(self, state):
+        def register(func):
+            self.exit_actions[state] = func
+            self._tables = None
+            return func
+
+        return register
+
+    # All states that can follow the given state
+    def successors(self, state):
+        targets = set(self.declared_targets.get(state, ()))
+        targets.update(target for source, target, _, _ in self.transitions if source == state)
+        return sorted(targets)
+
+    def tables(self):
+        if self._tables is None:
+            count = len(self.names)
+            for source, target, _, _ in self.transitions:
+                if not (0 <= source < count and 0 <= target < count):
+                    raise StateMachineError(f"{self.name}: transition {source} -> {target} unknown")
+            transitions = [[] for _ in range(count)]
+            for source, target, guard, action in self.transitions:
+                transitions[source].append((guard, action, target))
+            self._tables = (
+                tuple(self.names),
+                tuple(tuple(entries) for entries in transitions),
+                tuple(self.during_actions.get(i) for i in range(count)),
+                tuple(self.enter_actions.get(i) for i in range(count)),
+                tuple(self.exit_actions.get(i) for i in range(count)),
+            )
+        return self._tables
+
+    def compile(self, var=None, initial=0):
+        return Machine(self, var, initial)
+
+
+# Running instance of a compiled state machine
+class Machine:
+    def __init__(self, definition, var, initial):
+        self.definition = definition
+        self.var = var
+        (self._names, self._transitions, self._during, self._enter, self._exit) = definition.tables()
+        self.state = initial
+        self.previous = initial
+        self.ticks = 0
+        self.entered = time.monotonic()
+        enter = self._enter[initial]
+        if enter is not None:
+            enter(self)
+
+    @property
+    def state_name(self):
+        return self._names[self.state]
+
+    # Time spent in the active state (follows the virtual clock in simulation)
+    def elapsed(self):
+        return time.monotonic() - self.entered
+
+    def goto(self, target):
+        leave = self._exit[self.state]
+        if leave is not None:
+            leave(self)
+        self.previous = self.state
+        self.state = target
+        self.ticks = 0
+        self.entered = time.monotonic()
+        enter = self._enter[target]
+        if enter is not None:
+            enter(self)
+
+    # Execute one cycle of the active state
+    def step(self):
+        state = self.state
+        for guard, action, target in self._transitions[state]:
+            if guard(self):
+                if action is not None:
+                    action(self)
+                self.goto(target)
+                return
+        during = self._during[state]
+        if during is not None:
+            target = during(self)
+            if target is not None:
+                self.goto(target)
+                return
+        self.ticks += 1
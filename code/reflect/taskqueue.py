@@ -0,0 +1,258 @@
+# Task queue of the gripper: which (pick_up, drop_off, slot) task runs next
+#
+# Replaces the queue.Queue and the set of queued tasks. A task is added once;
+# adding it again while it is pending does nothing. The policy selects the
+# next task among the pending ones:
+#
+#   fifo     in the order they were added, as before
+#   travel   the one with the shortest expected duration (TaskModel): arm
+#            travel from where it is through pick-up and drop-off, plus the
+#            waits at the stations learned from the tasks done so far.
+#            Short tasks first minimize the total time tasks wait.
+#
+# Both keep the precedence of the line. A task waits for every earlier
+# pending task that uses the same storage slot (a slot must be emptied before
+# it is filled again) and for every earlier drop-off that feeds its pick-up
+# position (feeds: the multi-station delivers the workpieces the sorting line
+# sorts to the colour pick-ups).
+#
+# travel also honours priorities and deadlines: the highest priority goes
+# first, and a task that would miss its deadline if any other went first is
+# taken before the shortest one (earliest deadline first). A task waiting for
+# longer than max_wait seconds is taken next regardless of its duration, so
+# long tasks are not starved.
+#
+#   task_queue = TaskQueue("travel", feeds={"multi_drop_off": ("white_pick_up", "red_pick_up", "blue_pick_up")})
+#   task_queue.model = TaskModel(positions)
+#   task_queue.put(("storage", "multi_drop_off", 4), priority=1, deadline=300)
+#   task = task_queue.get()         # entering a task, None if none is pending
+#   task_queue.done(task)           # task finished, learns its duration
+#
+# put(..., source=) keeps where a task came from (an order of reflect.ingest),
+# source() returns it for the task taken last. A task with a source added
+# while the same task is pending without one takes that entry over, with the
+# higher priority and the earlier deadline of both.
+#
+# Times are time.monotonic(); deadlines are given in seconds from now. The
+# arrivals are kept and can be saved as a workload (Workload) to replay them.
+
+import json
+import os
+import time
+
+POLICIES = ("fifo", "travel")
+
+
+class PendingTask:
+    def __init__(self, task, seq, added, priority=0, deadline=None, source=None):
+        self.task = task
+        self.seq = seq
+        self.added = added
+        self.priority = priority
+        self.deadline = deadline    # absolute time, None: no deadline
+        self.source = source
+
+
+# Expected duration of a task in seconds: arm travel (counts / speed, the
+# longest axis in coordinated motion, the sum in sequential), replaced by the
+# learned duration once the task (or another with the same route) was done
+class TaskModel:
+    def __init__(self, positions, speed=800.0, mode="coordinated", home=None, rate=0.3):
+        self.positions = positions
+        self.speed = speed          # counts per second of every axis
+        self.mode = mode
+        self.home = list(home) if home is not None else [0] * len(next(iter(positions.values())))
+        self.rate = rate            # weight of a new duration, exponential average
+        self.durations = {}         # task and (pick_up, drop_off) -> seconds from home to home
+
+    def move_time(self, start, end):
+        times = [abs(b - a) / self.speed for a, b in zip(start, end)]
+        return max(times) if self.mode == "coordinated" else sum(times)
+
+    def travel_time(self, task, start=None):
+        pick_up, drop_off = self.positions[task[0]], self.positions[task[1]]
+        return (
+            self.move_time(start or self.home, pick_up)
+            + self.move_time(pick_up, drop_off)
+            + self.move_time(drop_off, self.home)
+        )
+
+    def duration(self, task, start=None):
+        learned = self.durations.get(task, self.durations.get(task[:2]))
+        if learned is None:
+            return self.travel_time(task, start)
+        if start is None:
+            return learned
+        pick_up = self.positions[task[0]]
+        return learned + self.move_time(start, pick_up) - self.move_time(self.home, pick_up)
+
+    def learn(self, task, seconds):
+        for key in (task, task[:2]):
+            if key in self.durations:
+                self.durations[key] += self.rate * (seconds - self.durations[key])
+            else:
+                self.durations[key] = seconds
+
+
+class TaskQueue:
+    def __init__(self, policy="fifo", model=None, feeds=None, max_wait=600.0):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown task policy {policy!r}, expected one of {POLICIES}")
+        self.policy = policy
+        self.model = model
+        self.feeds = feeds or {}
+        self.max_wait = max_wait
+        self.start = time.monotonic()
+        self.pending = []
+        self.seq = 0
+        self.arrivals = []          # (seconds after start, task, priority, deadline in s) for Workload
+        self.current = None         # (PendingTask, time taken)
+        self.duplicates = 0         # tasks added again while pending, not added
+        self.taken = 0
+        self.reordered = 0          # tasks taken before an earlier eligible one
+        self.completed = 0
+        self.missed = 0             # tasks done after their deadline
+        self.waited = 0.0           # seconds from adding to taking, all taken tasks
+        self.latency = 0.0          # seconds from adding to done, all completed tasks
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, task):
+        return any(entry.task == task for entry in self.pending)
+
+    def empty(self):
+        return not self.pending
+
+    # Add a task, False if it is already pending (and not taken over by source)
+    def put(self, task, priority=0, deadline=None, now=None, source=None):
+        task = tuple(task)
+        now = time.monotonic() if now is None else now
+        deadline_at = now + deadline if deadline is not None else None
+        for entry in self.pending:
+            if entry.task != task:
+                continue
+            if source is None or entry.source is not None:
+                self.duplicates += 1
+                return False
+            entry.source = source
+            entry.priority = max(entry.priority, priority)
+            if deadline_at is not None and (entry.deadline is None or deadline_at < entry.deadline):
+                entry.deadline = deadline_at
+            return True
+        self.pending.append(PendingTask(task, self.seq, now, priority, deadline_at, source))
+        self.seq += 1
+        self.arrivals.append((now - self.start, task, priority, deadline))
+        return True
+
+    def _depends(self, later, earlier):
+        if "storage" in later[:2] and "storage" in earlier[:2] and later[2] == earlier[2]:
+            return True
+        return later[0] in self.feeds.get(earlier[1], ())
+
+    # Pending tasks no earlier pending task has to go before
+    def eligible(self):
+        ready = []
+        for index, entry in enumerate(self.pending):
+            if not any(self._depends(entry.task, earlier.task) for earlier in self.pending[:index]):
+                ready.append(entry)
+        return ready
+
+    def _select(self, candidates, position, now):
+        if self.policy == "fifo" or self.model is None:
+            return candidates[0]
+        if self.max_wait is not None:
+            overdue = [entry for entry in candidates if now - entry.added > self.max_wait]
+            if overdue:
+                return overdue[0]
+        top = max(entry.priority for entry in candidates)
+        candidates = [entry for entry in candidates if entry.priority == top]
+        durations = {entry.seq: self.model.duration(entry.task, position) for entry in candidates}
+        urgent = []
+        for entry in candidates:
+            if entry.deadline is None:
+                continue
+            others = [durations[other.seq] for other in candidates if other is not entry]
+            if others and now + min(others) + durations[entry.seq] > entry.deadline:
+                urgent.append(entry)
+        if urgent:
+            return min(urgent, key=lambda entry: (entry.deadline, entry.seq))
+        return min(candidates, key=lambda entry: (durations[entry.seq], entry.seq))
+
+    # Next task to run, removed from the queue; None if none is pending.
+    # position: axis counts of the arm, default its home position.
+    def get(self, position=None, now=None):
+        candidates = self.eligible()
+        if not candidates:
+            return None
+        now = time.monotonic() if now is None else now
+        entry = self._select(candidates, position, now)
+        if entry is not candidates[0]:
+            self.reordered += 1
+        self.pending.remove(entry)
+        self.taken += 1
+        self.waited += now - entry.added
+        self.current = (entry, now)
+        return entry.task
+
+    # Source of the task taken last (put(..., source=)), None if it has none
+    def source(self):
+        return self.current[0].source if self.current is not None else None
+
+    # The task taken last is finished: learn its duration, count a missed deadline
+    def done(self, task, now=None):
+        if self.current is None or self.current[0].task != tuple(task):
+            return
+        now = time.monotonic() if now is None else now
+        entry, taken = self.current
+        self.current = None
+        self.completed += 1
+        self.latency += now - entry.added
+        if entry.deadline is not None and now > entry.deadline:
+            self.missed += 1
+        if self.model is not None:
+            self.model.learn(entry.task, now - taken)
+
+    # Arrivals so far as a workload file, for replaying them (Workload)
+    def save_arrivals(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump([
+                {"at": round(at, 3), "task": list(task), "priority": priority, "deadline": deadline}
+                for at, task, priority, deadline in self.arrivals
+            ], f, indent=1)
+
+    def report(self):
+        wait = self.waited / self.taken if self.taken else 0.0
+        latency = self.latency / self.completed if self.completed else 0.0
+        return (
+            f"tasks ({self.policy}): {self.completed} done, {self.reordered} of {self.taken} reordered, "
+            f"mean wait in queue {wait:.1f} s, mean time to done {latency:.1f} s, "
+            f"{self.missed} deadlines missed, {self.duplicates} duplicates not added, {len(self.pending)} pending"
+        )
+
+
+# Tasks arriving over time, loaded from a workload file:
+#
+#   [{"at": 12.5, "task": ["storage", "multi_drop_off", 4], "priority": 1, "deadline": 300}, ...]
+#
+# at in seconds after the start, deadline in seconds after the arrival
+# (optional, like priority). TaskQueue.save_arrivals writes this format.
+class Workload:
+    def __init__(self, path):
+        with open(path) as f:
+            entries = json.load(f)
+        self.entries = sorted(entries, key=lambda entry: entry["at"])
+        self.start = time.monotonic()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Entries whose time has come, removed from the workload
+    def due(self, now=None):
+        elapsed = (time.monotonic() if now is None else now) - self.start
+        count = 0
+        while count < len(self.entries) and self.entries[count]["at"] <= elapsed:
+            count += 1
+        due, self.entries = self.entries[:count], self.entries[count:]
+        return due
@@ -0,0 +1,224 @@
+# Wiring between the stations, declared once in wiring.json
+#
+# Every signal one station sends to another is listed once, with the station
+# and field that write it and the stations and fields that read it
+# ("<station>.<field>"):
+#
+#   opcua.nodes        variables of the gripper's OPC UA server: browse name,
+#                      numeric id in the namespace, variant type
+#   modbus.registers   handshake words of the Modbus stations: register
+#                      address on the bridge, process image words
+#
+# From it come the OPC UA address space of the server, the node bindings of
+# the clients, the Modbus register layout of reflect.modbus_bridge and the
+# Modbus words of each station:
+#
+#   from reflect.wiring import WIRING
+#
+#   reads, writes = await WIRING.server_nodes(server, data_obj)        # gripper
+#   reads, writes = await WIRING.client_nodes(client, "high_bay_warehouse")
+#   exchange = NodeExchange(data_obj, reads=reads, writes=writes, ...)
+#
+#   reads, writes = WIRING.modbus_words("gripper")
+#   # ("Input_Word_1", "Input_Word_1_i05"), ("Output_Word_1", "Output_Word_2")
+#
+# The node ids are fixed in the file instead of following from the order of
+# add_variable calls, and clients look up the namespace index by its URI.
+#
+# A FrameCodec is a precompiled struct.Struct for the fields of one station
+# frame, so a whole frame is packed or unpacked in one call:
+#
+#   codec = WIRING.modbus_frame("gripper", "writes")      # >HH
+#   data = codec.pack([3, 0])
+#
+# asyncua is only needed for the OPC UA methods.
+
+import json
+import os
+import struct
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wiring.json")
+
+# struct codes of the OPC UA variant types a frame can carry
+FORMATS = {
+    "Boolean": "?",
+    "SByte": "b",
+    "Byte": "B",
+    "Int16": "h",
+    "UInt16": "H",
+    "Int32": "i",
+    "UInt32": "I",
+    "Int64": "q",
+    "UInt64": "Q",
+    "Float": "f",
+    "Double": "d",
+}
+
+
+def _reference(text):
+    station, _, field = text.partition(".")
+    if not station or not field:
+        raise ValueError(f"expected <station>.<field>, got {text!r}")
+    return station, field
+
+
+# One signal: written by one station field, read by one or more
+class Signal:
+    def __init__(self, name, writer, readers, type="UInt16", id=None, address=None, meaning=None):
+        if type not in FORMATS:
+            raise ValueError(f"signal {name}: unknown type {type!r}, expected one of {sorted(FORMATS)}")
+        self.name = name
+        self.writer = _reference(writer)
+        self.readers = [_reference(reader) for reader in readers]
+        self.type = type
+        self.id = id                # OPC UA numeric node id
+        self.address = address      # Modbus register
+        self.meaning = meaning
+
+    def stations(self):
+        return [self.writer[0]] + [station for station, _ in self.readers]
+
+    # (reads, writes) of a station: field names, empty if it does not take part
+    def fields(self, station):
+        reads = [field for reader, field in self.readers if reader == station]
+        writes = [self.writer[1]] if self.writer[0] == station else []
+        return reads, writes
+
+    def __repr__(self):
+        return f"Signal({self.name!r}, {'.'.join(self.writer)} -> {', '.join('.'.join(r) for r in self.readers)})"
+
+
+# Precompiled struct for the fields of one frame
+class FrameCodec:
+    def __init__(self, fields, formats, byteorder=">"):
+        self.fields = tuple(fields)
+        self.struct = struct.Struct(byteorder + "".join(formats))
+        self.size = self.struct.size
+
+    def __len__(self):
+        return len(self.fields)
+
+    def pack(self, values):
+        return self.struct.pack(*values)
+
+    def pack_into(self, buffer, offset, values):
+        self.struct.pack_into(buffer, offset, *values)
+
+    def unpack(self, data):
+        return self.struct.unpack(data)
+
+    def unpack_from(self, data, offset=0):
+        return self.struct.unpack_from(data, offset)
+
+    def as_dict(self, data, offset=0):
+        return dict(zip(self.fields, self.struct.unpack_from(data, offset)))
+
+
+class Wiring:
+    def __init__(self, spec):
+        opcua = spec.get("opcua", {})
+        self.server = opcua.get("server")
+        self.namespace = opcua.get("namespace")
+        self.object_name = opcua.get("object", {}).get("name", "Control")
+        self.object_id = opcua.get("object", {}).get("id")
+        self.nodes = [Signal(**node) for node in opcua.get("nodes", ())]
+        self.registers = sorted(
+            (Signal(f"register_{row['address']}", **row) for row in spec.get("modbus", {}).get("registers", ())),
+            key=lambda signal: signal.address,
+        )
+        self._check(self.nodes, "id")
+        self._check(self.registers, "address")
+
+    @staticmethod
+    def _check(signals, key):
+        seen = set()
+        for signal in signals:
+            value = getattr(signal, key)
+            if value is None or value in seen:
+                raise ValueError(f"{signal.name}: missing or duplicate {key} {value!r}")
+            seen.add(value)
+
+    @staticmethod
+    def _fields(signals, station):
+        reads, writes = [], []
+        for signal in signals:
+            signal_reads, signal_writes = signal.fields(station)
+            reads.extend((field, signal) for field in signal_reads)
+            writes.extend((field, signal) for field in signal_writes)
+        return reads, writes
+
+    # --- OPC UA ---
+
+    def opcua_stations(self):
+        return list(dict.fromkeys(station for signal in self.nodes for station in signal.stations()))
+
+    # (reads, writes) of a station as {field: browse name}
+    def node_names(self, station):
+        reads, writes = self._fields(self.nodes, station)
+        return {field: signal.name for field, signal in reads}, {field: signal.name for field, signal in writes}
+
+    def _bind(self, station, nodes):
+        reads, writes = self._fields(self.nodes, station)
+        return (
+            {field: nodes[signal.name] for field, signal in reads},
+            {field: nodes[signal.name] for field, signal in writes},
+        )
+
+    # Create the namespace, object and variables on the server; returns the
+    # (reads, writes) nodes of the server station. Initial values come from
+    # the fields of data_obj where it has them, otherwise 0.
+    async def server_nodes(self, server, data_obj=None, station=None):
+        from asyncua import ua
+
+        station = station or self.server
+        idx = await server.register_namespace(self.namespace)
+        obj = await server.nodes.objects.add_object(ua.NodeId(self.object_id, idx), self.object_name)
+        nodes = {}
+        for signal in self.nodes:
+            reads, writes = signal.fields(station)
+            fields = reads + writes
+            initial = getattr(data_obj, fields[0], 0) if fields and data_obj is not None else 0
+            variant_type = getattr(ua.VariantType, signal.type)
+            node = await obj.add_variable(ua.NodeId(signal.id, idx), signal.name, ua.Variant(initial, variant_type))
+            await node.set_writable()
+            nodes[signal.name] = node
+        return self._bind(station, nodes)
+
+    # Nodes of a client station, (reads, writes) as {field: Node}
+    async def client_nodes(self, client, station):
+        from asyncua import ua
+
+        idx = await client.get_namespace_index(self.namespace)
+        nodes = {signal.name: client.get_node(ua.NodeId(signal.id, idx)) for signal in self.nodes}
+        return self._bind(station, nodes)
+
+    # --- Modbus ---
+
+    def modbus_stations(self):
+        return tuple(dict.fromkeys(station for signal in self.registers for station in signal.stations()))
+
+    # Rows of reflect.modbus_bridge: (address, writer, its word, reader, its word)
+    def register_rows(self):
+        return tuple(
+            (signal.address, signal.writer[0], signal.writer[1], reader, word)
+            for signal in self.registers for reader, word in signal.readers
+        )
+
+    # (reads, writes) process image words of a station, in register order
+    def modbus_words(self, station):
+        reads, writes = self._fields(self.registers, station)
+        return tuple(field for field, _ in reads), tuple(field for field, _ in writes)
+
+    # Codec of the words a station reads or writes ("reads" / "writes"), big endian
+    def modbus_frame(self, station, direction):
+        reads, writes = self._fields(self.registers, station)
+        rows = reads if direction == "reads" else writes
+        return FrameCodec([field for field, _ in rows], [FORMATS[signal.type] for _, signal in rows])
+
+
+def load_wiring(path=None):
+    with open(path or os.environ.get("REFLECT_WIRING") or DEFAULT_PATH) as f:
+        return Wiring(json.load(f))
+
+
+WIRING = load_wiring()
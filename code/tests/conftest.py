@@ -0,0 +1,5 @@
+# The tests import reflect from the code directory, as the benchmarks do
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,21 @@
+import os
+
+from reflect.capture import load_trace
+from reflect.sim.runner import run_script
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+# A capture of a simulated run carries simulated timestamps: it spans the
+# simulated seconds, not the wall-clock time the run took
+def test_simulated_capture_spans_simulated_time(tmp_path, monkeypatch):
+    monkeypatch.setenv("REFLECT_CAPTURE", str(tmp_path))
+    for name in ("REFLECT_RECORD", "REFLECT_ORDER_PORT", "REFLECT_GRIPPER_WORKLOAD"):
+        monkeypatch.delenv(name, raising=False)
+    run = run_script(os.path.join(CODE_DIR, "modbus", "gripper.py"), seconds=20, quiet=True)
+
+    times = load_trace(str(tmp_path))["time"]
+    assert len(times) > 0
+    span = (times.max() - times.min()) / 1e9
+    assert 19.0 <= span <= run.clock.now
+    assert run.wall_seconds < span
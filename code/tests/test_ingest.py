@@ -0,0 +1,120 @@
+import socket
+
+import pytest
+
+from reflect.ingest import (
+    ACCEPTED, DONE, DUPLICATE, ORDER_POSITIONS, QUEUE_FULL, QUEUED, REJECTED, RUNNING, UNKNOWN, OrderInbox,
+    OrderServer, main,
+)
+from reflect.taskqueue import TaskQueue
+
+
+def inbox(**options):
+    options.setdefault("positions", ORDER_POSITIONS)
+    options.setdefault("slots", range(1, 10))
+    return OrderInbox(**options)
+
+
+def test_submit_answers():
+    orders = inbox(capacity=2)
+    assert orders.submit(("storage", "multi_drop_off", 4)) == (ACCEPTED, 1)
+    assert orders.submit(("storage", "multi_drop_off", 4)) == (DUPLICATE, 0)
+    assert orders.submit(("storage", "multi_drop_off", 10)) == (REJECTED, 0)       # no such slot
+    assert orders.submit(("storage", "storage", 4)) == (REJECTED, 0)               # pick-up == drop-off
+    assert orders.submit(("hall", "multi_drop_off", 4)) == (REJECTED, 0)           # unknown position
+    assert orders.submit(("white_pick_up", "storage", 5)) == (ACCEPTED, 2)
+    assert orders.submit(("red_pick_up", "storage", 6)) == (QUEUE_FULL, 0)
+    assert orders.pending() == 2
+    assert orders.answers == {ACCEPTED: 2, QUEUE_FULL: 1, REJECTED: 3, DUPLICATE: 1}
+    assert [order.order_id for order in orders.drain()] == [1, 2]
+    assert orders.drain() == []
+
+
+def test_order_states():
+    orders = inbox()
+    _, order_id = orders.submit(("storage", "multi_drop_off", 4))
+    assert orders.state(order_id) == QUEUED
+    order, = orders.drain()
+    orders.started(order)
+    assert orders.state(order_id) == RUNNING
+    assert orders.pending() == 0
+    # the same task can be ordered again once it runs
+    assert orders.submit(("storage", "multi_drop_off", 4))[0] == ACCEPTED
+    orders.finished(order)
+    assert orders.state(order_id) == DONE
+    assert orders.state(99) == UNKNOWN
+
+
+def test_refused_order_is_done():
+    orders = inbox()
+    _, order_id = orders.submit(("storage", "multi_drop_off", 4))
+    order, = orders.drain()
+    orders.refused(order)
+    assert orders.state(order_id) == DONE
+    assert orders.dropped == 1
+    assert orders.pending() == 0
+    assert orders.submit(("storage", "multi_drop_off", 4))[0] == ACCEPTED
+
+
+# Ids wrap after max_id and skip the ids whose state is still kept
+def test_order_ids_wrap_and_skip_kept_ids():
+    orders = inbox(capacity=2, max_id=3, history=1)
+    a, b, c, d, e = (("storage", "multi_drop_off", slot) for slot in range(1, 6))
+    assert [orders.submit(task)[1] for task in (a, b)] == [1, 2]
+    first, second = orders.drain()
+    orders.started(first)
+    orders.finished(first)
+    orders.started(second)                           # 2 stays running
+    assert orders.submit(c) == (ACCEPTED, 3)
+    third, = orders.drain()
+    orders.started(third)
+    orders.finished(third)                           # history of 1: 1 is forgotten
+    assert orders.state(1) == UNKNOWN
+    assert orders.submit(d) == (ACCEPTED, 1)         # wrapped after 3
+    assert orders.submit(e) == (ACCEPTED, 3)         # 2 running, 1 queued: the done 3 is forgotten
+    assert (orders.state(1), orders.state(2), orders.state(3)) == (QUEUED, RUNNING, QUEUED)
+
+
+def test_max_id_leaves_room_for_the_queue():
+    with pytest.raises(ValueError):
+        OrderInbox(capacity=16, max_id=16)
+
+
+def test_order_server_needs_16_bit_ids():
+    with pytest.raises(ValueError):
+        OrderServer(inbox(), port=0)
+    with pytest.raises(ValueError):
+        OrderServer(inbox(max_id=0x10000), port=0)
+
+
+# Only the task that came from the order starts and finishes it
+def test_order_started_by_its_own_task_only():
+    orders = inbox()
+    tasks = TaskQueue()
+    task = ("storage", "multi_drop_off", 4)
+    tasks.put(task)                                  # the same task from the demo sequence
+    _, order_id = orders.submit(task)
+    order, = orders.drain()
+    assert tasks.put(order.task, order.priority, order.deadline, source=order)
+    assert len(tasks) == 1
+    assert tasks.get() == task
+    assert tasks.source() is order
+    orders.started(tasks.source())
+    assert orders.state(order_id) == RUNNING
+
+    tasks.put(task)                                  # the demo sequence again, no order
+    tasks.done(task)
+    assert tasks.get() == task
+    orders.started(tasks.source())
+    orders.finished(tasks.source())
+    assert orders.state(order_id) == RUNNING
+    orders.finished(order)
+    assert orders.state(order_id) == DONE
+
+
+def test_command_line_without_order_server(capsys):
+    with socket.socket() as free:
+        free.bind(("127.0.0.1", 0))
+        port = free.getsockname()[1]
+    assert main(["--port", str(port), "state", "1"]) == 2
+    assert capsys.readouterr().err.strip() == f"no order server at 127.0.0.1:{port}"
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from reflect.motion import AxisMotion
+from reflect.outputs import OutputImage
+from reflect.sim.plants import HighBayWarehousePlant
+from reflect.sim.revpi import COUNTER_MODULO, SimRevPiModIO, VirtualClock
+
+STORAGE_AXES = (("Counter_5", "O_3", "O_4"), ("Counter_7", "O_5", "O_6"))
+CYCLE = 0.01
+
+
+# HBW plant with the storage axes of the scripts, cycled by hand
+@pytest.fixture
+def station(monkeypatch):
+    def make(coast_time=0.02, **options):
+        clock = VirtualClock()
+        monkeypatch.setattr(time, "monotonic", clock.monotonic)
+        plant = HighBayWarehousePlant(handshake=False, coast_time=coast_time)
+        rpi = SimRevPiModIO(plant, clock)
+        outputs = OutputImage(rpi)
+        # counters at the plant position, then reset as the scripts do before a storage move
+        plant.step(rpi.io, CYCLE, clock.now)
+        rpi.io.Counter_5.reset()
+        rpi.io.Counter_7.reset()
+        motion = AxisMotion(outputs, rpi.io, STORAGE_AXES, 10, "coordinated", **options)
+        return plant, rpi, outputs, motion, clock
+
+    return make
+
+
+def cycle(plant, rpi, outputs, clock):
+    outputs.flush()
+    plant.step(rpi.io, CYCLE, clock.now)
+    clock.advance(CYCLE)
+
+
+def run_move(station, target, cycles=2000):
+    plant, rpi, outputs, motion, clock = station
+    motion.start(target)
+    for count in range(cycles):
+        plant.step(rpi.io, CYCLE, clock.now)
+        done = motion.step()
+        outputs.flush()
+        clock.advance(CYCLE)
+        if done:
+            return count
+    return None
+
+
+def test_moves_come_to_rest_on_target_with_run_out(station):
+    plant, rpi, outputs, motion, clock = parts = station(coast_time=0.02)
+    for target in ([1500, 900], [600, 300], [2500, 1200]):
+        assert run_move(parts, target) is not None
+        for _ in range(50):
+            cycle(plant, rpi, outputs, clock)
+        assert abs(rpi.io.Counter_5.value - target[0]) <= 10
+        assert abs(rpi.io.Counter_7.value - target[1]) <= 10
+    assert outputs["O_3"] == outputs["O_4"] == outputs["O_5"] == outputs["O_6"] == 0
+    assert motion.corrections == 0
+    # the run-out of both axes is learned, about the coast time of the plant
+    assert motion.stops.calibrated("Counter_5") and motion.stops.calibrated("Counter_7")
+    assert 0.01 < motion.stops.stop_time("Counter_5") < 0.04
+
+
+# A counter that ran below 0 after the reset wraps to 4294967295 and below;
+# it is a few counts under the target 0, not 4.29e9 counts beyond it
+def test_counter_wrapped_below_zero_is_read_signed(station):
+    plant, rpi, outputs, motion, clock = parts = station(coast_time=0.02)
+    plant.y.position -= 8
+    plant.step(rpi.io, CYCLE, clock.now)
+    assert rpi.io.Counter_7.value == COUNTER_MODULO - 8
+
+    assert run_move(parts, [0, 0], cycles=100) is not None
+    assert motion.failed is None
+    assert abs(plant.y.position - 200.0) <= 10
+    assert outputs["O_6"] == 0
+
+
+def test_move_that_does_not_finish_switches_the_axes_off(station):
+    plant, rpi, outputs, motion, clock = parts = station(coast_time=0.02, max_cycles=200)
+    plant.x.speed = 0.0  # x does not move
+    assert run_move(parts, [1500, 300], cycles=300) is None
+    assert motion.failed == ["Counter_5"]
+    assert motion.timeouts == 1
+    assert outputs["O_3"] == outputs["O_4"] == outputs["O_5"] == outputs["O_6"] == 0
+    # y reached its target and is not named
+    assert motion.trackers[1].velocity == 0 and rpi.io.Counter_7.value > 250
@@ -0,0 +1,103 @@
+from reflect.taskqueue import TaskModel, TaskQueue
+
+FEEDS = {"multi_drop_off": ("white_pick_up", "red_pick_up", "blue_pick_up")}
+
+# Arm positions on one axis, home at 0: near and far pick-up / drop-off
+POSITIONS = {"near_a": [100], "near_b": [200], "far_a": [3000], "far_b": [3100]}
+SHORT = ("near_a", "near_b", 0)     # 0.5 s of travel at 800 counts/s
+LONG = ("far_a", "far_b", 0)        # 7.75 s
+
+
+def travel_queue():
+    return TaskQueue("travel", model=TaskModel(POSITIONS))
+
+
+def test_duplicate_not_added():
+    tasks = TaskQueue()
+    assert tasks.put(("storage", "multi_drop_off", 4))
+    assert not tasks.put(("storage", "multi_drop_off", 4))
+    assert len(tasks) == 1
+    assert tasks.duplicates == 1
+
+
+# A slot is emptied before it is filled again, also if another task is shorter
+def test_storage_slot_precedence():
+    tasks = travel_queue()
+    tasks.model = TaskModel({"storage": [3000], "multi_drop_off": [3100], "white_pick_up": [100]})
+    tasks.put(("storage", "multi_drop_off", 4), now=0)
+    tasks.put(("white_pick_up", "storage", 4), now=0)
+    tasks.put(("white_pick_up", "storage", 5), now=0)
+    assert [entry.task for entry in tasks.eligible()] == [("storage", "multi_drop_off", 4), ("white_pick_up", "storage", 5)]
+    assert tasks.get(now=0) == ("white_pick_up", "storage", 5)
+    assert tasks.get(now=0) == ("storage", "multi_drop_off", 4)
+    assert tasks.get(now=0) == ("white_pick_up", "storage", 4)
+
+
+# A pick-up waits for the earlier drop-offs that feed it
+def test_feeds_precedence():
+    tasks = TaskQueue(feeds=FEEDS)
+    tasks.put(("storage", "multi_drop_off", 1))
+    tasks.put(("red_pick_up", "storage", 2))
+    tasks.put(("storage", "multi_drop_off", 3))
+    assert [entry.task for entry in tasks.eligible()] == [("storage", "multi_drop_off", 1), ("storage", "multi_drop_off", 3)]
+    tasks.get()
+    assert ("red_pick_up", "storage", 2) in [entry.task for entry in tasks.eligible()]
+
+
+def test_travel_takes_the_shortest_task():
+    tasks = travel_queue()
+    tasks.put(LONG, now=0)
+    tasks.put(SHORT, now=0)
+    assert tasks.get(now=0) == SHORT
+    assert tasks.reordered == 1
+    fifo = TaskQueue("fifo", model=TaskModel(POSITIONS))
+    fifo.put(LONG, now=0)
+    fifo.put(SHORT, now=0)
+    assert fifo.get(now=0) == LONG
+
+
+def test_priority_goes_first():
+    tasks = travel_queue()
+    tasks.put(SHORT, now=0)
+    tasks.put(LONG, priority=1, now=0)
+    assert tasks.get(now=0) == LONG
+
+
+# LONG would miss its deadline if SHORT went first (0.5 + 7.75 s > 8 s)
+def test_deadline_goes_before_the_shortest():
+    tasks = travel_queue()
+    tasks.put(SHORT, now=0)
+    tasks.put(LONG, deadline=8, now=0)
+    assert tasks.get(now=0) == LONG
+    tasks.done(LONG, now=7.75)
+    assert tasks.missed == 0
+
+    tasks = travel_queue()
+    tasks.put(SHORT, now=0)
+    tasks.put(LONG, deadline=9, now=0)               # still met after SHORT
+    assert tasks.get(now=0) == SHORT
+
+
+def test_long_waiting_task_is_not_starved():
+    tasks = travel_queue()
+    tasks.max_wait = 60
+    tasks.put(LONG, now=0)
+    tasks.put(SHORT, now=61)
+    assert tasks.get(now=61) == LONG
+
+
+# An order for a task pending from the demo sequence takes that entry over
+def test_source_takes_over_a_pending_task():
+    tasks = travel_queue()
+    order, other = object(), object()
+    assert tasks.put(LONG, now=0)
+    assert tasks.put(SHORT, now=0)
+    assert tasks.put(LONG, priority=2, deadline=30, now=0, source=order)
+    assert len(tasks) == 2 and tasks.duplicates == 0
+    assert not tasks.put(LONG, now=0, source=other)  # already has a source
+    assert not tasks.put(LONG, now=0)
+    assert tasks.duplicates == 2
+    assert tasks.get(now=0) == LONG                  # with the priority of the order
+    assert tasks.source() is order
+    assert tasks.get(now=0) == SHORT
+    assert tasks.source() is None